@@ -10,19 +10,23 @@ import jwt
 from pydantic import BaseModel
 import tempfile
 import os
+import re
 
 from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
 from services import redis
+from services import run_responses
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access
 from utils.logger import logger, structlog
 from services.billing import check_billing_status, can_use_model
 from utils.config import config
 from sandbox.sandbox import create_sandbox, delete_sandbox, get_or_start_sandbox
+from sandbox.sandbox_io import run_sandbox_io
 from services.llm import make_llm_api_call
 from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
 from utils.constants import MODEL_NAME_ALIASES
 from flags.flags import is_enabled
+from agent.runtime_config import get_agent_config, invalidate_agent_configs
 
 # Initialize shared resources
 router = APIRouter()
@@ -32,6 +36,10 @@ instance_id = None # Global instance ID for this backend instance
 # TTL for Redis response lists (24 hours)
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
 
+# How long a stream viewer blocks in XREAD before checking control signals (ms)
+STREAM_READ_BLOCK_MS = 1000
+STREAM_ENTRY_ID_PATTERN = re.compile(r"^\d+(-\d+)?$")
+
 
 class AgentStartRequest(BaseModel):
     model_name: Optional[str] = None  # Will be set from config.MODEL_TO_USE in the endpoint
@@ -188,11 +196,9 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     final_status = "failed" if error_message else "stopped"
 
     # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
     all_responses = []
     try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        all_responses = run_responses.compact_responses(await run_responses.get_all_responses(agent_run_id))
         logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
     except Exception as e:
         logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
@@ -426,60 +432,27 @@ async def start_agent(
     
     if effective_agent_id:
         # Get agent with current version
-        agent_result = await client.table('agents').select('*, agent_versions!current_version_id(*)').eq('agent_id', effective_agent_id).eq('account_id', account_id).execute()
-        if not agent_result.data:
+        agent_config = await get_agent_config(client, account_id, effective_agent_id)
+        if not agent_config:
             if body.agent_id:
                 raise HTTPException(status_code=404, detail="Agent not found or access denied")
             else:
                 logger.warning(f"Stored agent_id {effective_agent_id} not found, falling back to default")
                 effective_agent_id = None
         else:
-            agent_data = agent_result.data[0]
-            # Use version data if available, otherwise fall back to agent data (for backward compatibility)
-            if agent_data.get('agent_versions'):
-                version_data = agent_data['agent_versions']
-                agent_config = {
-                    'agent_id': agent_data['agent_id'],
-                    'name': agent_data['name'],
-                    'description': agent_data.get('description'),
-                    'system_prompt': version_data['system_prompt'],
-                    'configured_mcps': version_data.get('configured_mcps', []),
-                    'custom_mcps': version_data.get('custom_mcps', []),
-                    'agentpress_tools': version_data.get('agentpress_tools', {}),
-                    'is_default': agent_data.get('is_default', False),
-                    'current_version_id': agent_data.get('current_version_id'),
-                    'version_name': version_data.get('version_name', 'v1')
-                }
+            if agent_config.get('version_name'):
                 logger.info(f"Using agent {agent_config['name']} ({effective_agent_id}) version {agent_config['version_name']}")
             else:
-                # Backward compatibility - use agent data directly
-                agent_config = agent_data
                 logger.info(f"Using agent {agent_config['name']} ({effective_agent_id}) - no version data")
             source = "request" if body.agent_id else "thread"
     
     # If no agent found yet, try to get default agent for the account
     if not agent_config:
-        default_agent_result = await client.table('agents').select('*, agent_versions!current_version_id(*)').eq('account_id', account_id).eq('is_default', True).execute()
-        if default_agent_result.data:
-            agent_data = default_agent_result.data[0]
-            # Use version data if available
-            if agent_data.get('agent_versions'):
-                version_data = agent_data['agent_versions']
-                agent_config = {
-                    'agent_id': agent_data['agent_id'],
-                    'name': agent_data['name'],
-                    'description': agent_data.get('description'),
-                    'system_prompt': version_data['system_prompt'],
-                    'configured_mcps': version_data.get('configured_mcps', []),
-                    'custom_mcps': version_data.get('custom_mcps', []),
-                    'agentpress_tools': version_data.get('agentpress_tools', {}),
-                    'is_default': agent_data.get('is_default', False),
-                    'current_version_id': agent_data.get('current_version_id'),
-                    'version_name': version_data.get('version_name', 'v1')
-                }
+        agent_config = await get_agent_config(client, account_id)
+        if agent_config:
+            if agent_config.get('version_name'):
                 logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']}) version {agent_config['version_name']}")
             else:
-                agent_config = agent_data
                 logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']}) - no version data")
     
     # Check if thread is associated with a workflow and override system prompt
@@ -559,7 +532,9 @@ async def start_agent(
             raise HTTPException(status_code=404, detail="No sandbox found for this project")
             
         sandbox_id = sandbox_info['id']
-        sandbox = await get_or_start_sandbox(sandbox_id)
+        # Start it before the run is queued: the worker relies on the sandbox and
+        # its supervisord being up, and a failed start is reported to the caller
+        await get_or_start_sandbox(sandbox_id)
         logger.info(f"Successfully started sandbox {sandbox_id} for project {project_id}")
     except Exception as e:
         logger.error(f"Failed to start sandbox for project {project_id}: {str(e)}")
@@ -768,7 +743,12 @@ async def stream_agent_run(
     token: Optional[str] = None,
     request: Request = None
 ):
-    """Stream the responses of an agent run using Redis Lists and Pub/Sub."""
+    """Stream the responses of an agent run using Redis Lists and Pub/Sub, or a Redis Stream.
+
+    With the stream transport every event carries its entry ID, and clients can
+    resume after a reconnect by sending it back as Last-Event-ID (header or
+    `last_event_id` query parameter).
+    """
     logger.info(f"Starting stream for agent run: {agent_run_id}")
     client = await db.client
 
@@ -780,10 +760,87 @@ async def stream_agent_run(
         user_id=user_id,
     )
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
+    response_list_key = run_responses.response_list_key(agent_run_id)
+    response_channel = run_responses.response_channel(agent_run_id)
     control_channel = f"agent_run:{agent_run_id}:control" # Global control channel
 
+    transport = await run_responses.detect_transport(agent_run_id)
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id") if request else None
+    if not last_event_id or not STREAM_ENTRY_ID_PATTERN.match(last_event_id):
+        last_event_id = "0"
+
+    async def stream_entries_generator():
+        logger.debug(f"Streaming responses for {agent_run_id} from Redis stream {run_responses.response_stream_key(agent_run_id)} after {last_event_id}")
+        last_id = last_event_id
+        pubsub_control = None
+        initial_yield_complete = False
+
+        def format_event(entry_id: str, response: Dict[str, Any]) -> str:
+            return f"id: {entry_id}\ndata: {json.dumps(response)}\n\n"
+
+        try:
+            # 1. Replay everything after the last entry the client has seen
+            for entry_id, response in await run_responses.read_stream_entries(agent_run_id, last_id):
+                yield format_event(entry_id, response)
+                last_id = entry_id
+            initial_yield_complete = True
+
+            # 2. Check run status *after* yielding initial data
+            run_status = await client.table('agent_runs').select('status', 'thread_id').eq("id", agent_run_id).maybe_single().execute()
+            current_status = run_status.data.get('status') if run_status.data else None
+
+            if current_status != 'running':
+                logger.info(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
+                yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
+                return
+
+            structlog.contextvars.bind_contextvars(
+                thread_id=run_status.data.get('thread_id'),
+            )
+
+            # 3. Only control signals need Pub/Sub; new responses arrive through blocking XREADs
+            pubsub_control = await redis.create_pubsub()
+            await pubsub_control.subscribe(control_channel)
+            logger.debug(f"Subscribed to control channel: {control_channel}")
+
+            while True:
+                entries = await run_responses.read_stream_entries(agent_run_id, last_id, block=STREAM_READ_BLOCK_MS)
+                for entry_id, response in entries:
+                    yield format_event(entry_id, response)
+                    last_id = entry_id
+                    if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
+                        logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
+                        return
+
+                message = await pubsub_control.get_message(ignore_subscribe_messages=True, timeout=0)
+                if message and message.get("type") == "message":
+                    data = message.get("data")
+                    if isinstance(data, bytes): data = data.decode('utf-8')
+                    if data in ["STOP", "END_STREAM", "ERROR"]:
+                        logger.info(f"Received control signal '{data}' for {agent_run_id}")
+                        # Deliver whatever was added before the signal
+                        for entry_id, response in await run_responses.read_stream_entries(agent_run_id, last_id):
+                            yield format_event(entry_id, response)
+                        yield f"data: {json.dumps({'type': 'status', 'status': data})}\n\n"
+                        return
+
+        except asyncio.CancelledError:
+            logger.info(f"Stream generator cancelled for {agent_run_id}")
+        except Exception as e:
+            logger.error(f"Error streaming agent run {agent_run_id} from Redis stream: {e}", exc_info=True)
+            if not initial_yield_complete:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+            else:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {e}'})}\n\n"
+        finally:
+            if pubsub_control:
+                try:
+                    await pubsub_control.unsubscribe(control_channel)
+                    await pubsub_control.close()
+                except Exception as e:
+                    logger.debug(f"Error closing control pubsub for {agent_run_id}: {e}")
+            logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
+
     async def stream_generator():
         logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
         last_processed_index = -1
@@ -948,7 +1005,8 @@ async def stream_agent_run(
             await asyncio.sleep(0.1)
             logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream", headers={
+    generator = stream_entries_generator() if transport == run_responses.TRANSPORT_STREAM else stream_generator()
+    return StreamingResponse(generator, media_type="text/event-stream", headers={
         "Cache-Control": "no-cache, no-transform", "Connection": "keep-alive",
         "X-Accel-Buffering": "no", "Content-Type": "text/event-stream",
         "Access-Control-Allow-Origin": "*"
@@ -1039,16 +1097,14 @@ async def initiate_agent_with_files(
     # Load agent configuration if agent_id is provided
     agent_config = None
     if agent_id:
-        agent_result = await client.table('agents').select('*').eq('agent_id', agent_id).eq('account_id', account_id).execute()
-        if not agent_result.data:
+        agent_config = await get_agent_config(client, account_id, agent_id)
+        if not agent_config:
             raise HTTPException(status_code=404, detail="Agent not found or access denied")
-        agent_config = agent_result.data[0]
         logger.info(f"Using custom agent: {agent_config['name']} ({agent_id})")
     else:
         # Try to get default agent for the account
-        default_agent_result = await client.table('agents').select('*').eq('account_id', account_id).eq('is_default', True).execute()
-        if default_agent_result.data:
-            agent_config = default_agent_result.data[0]
+        agent_config = await get_agent_config(client, account_id)
+        if agent_config:
             logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']})")
     
     can_use, model_message, allowed_models = await can_use_model(client, account_id, model_name)
@@ -1073,13 +1129,13 @@ async def initiate_agent_with_files(
         sandbox_id = None
         try:
           sandbox_pass = str(uuid.uuid4())
-          sandbox = create_sandbox(sandbox_pass, project_id)
+          sandbox = await run_sandbox_io(None, create_sandbox, sandbox_pass, project_id)
           sandbox_id = sandbox.id
           logger.info(f"Created new sandbox {sandbox_id} for project {project_id}")
           
           # Get preview links
-          vnc_link = sandbox.get_preview_link(6080)
-          website_link = sandbox.get_preview_link(8080)
+          vnc_link = await run_sandbox_io(sandbox.id, sandbox.get_preview_link, 6080)
+          website_link = await run_sandbox_io(sandbox.id, sandbox.get_preview_link, 8080)
           vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
           website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
           token = None
@@ -1170,7 +1226,7 @@ async def initiate_agent_with_files(
                                 if inspect.iscoroutinefunction(sandbox.fs.upload_file):
                                     await sandbox.fs.upload_file(content, target_path)
                                 else:
-                                    sandbox.fs.upload_file(content, target_path)
+                                    await run_sandbox_io(sandbox_id, sandbox.fs.upload_file, content, target_path)
                                 logger.debug(f"Called sandbox.fs.upload_file for {target_path}")
                                 upload_successful = True
                             else:
@@ -1182,7 +1238,7 @@ async def initiate_agent_with_files(
                             try:
                                 await asyncio.sleep(0.2)
                                 parent_dir = os.path.dirname(target_path)
-                                files_in_dir = sandbox.fs.list_files(parent_dir)
+                                files_in_dir = await run_sandbox_io(sandbox_id, sandbox.fs.list_files, parent_dir)
                                 file_names_in_dir = [f.name for f in files_in_dir]
                                 if safe_filename in file_names_in_dir:
                                     successful_uploads.append(target_path)
@@ -1263,6 +1319,10 @@ async def initiate_agent_with_files(
 
 # Custom agents
 
+def _postgres_text_array(values: List[str]) -> str:
+    """Postgres array literal for a PostgREST filter, quoting each element."""
+    quoted = ('"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"' for value in values)
+    return "{" + ",".join(quoted) + "}"
 
 
 @router.get("/agents", response_model=AgentsResponse)
@@ -1299,31 +1359,31 @@ async def get_agents(
             search_term = f"%{search}%"
             query = query.or_(f"name.ilike.{search_term},description.ilike.{search_term}")
         
-        # Apply filters
+        # Apply filters. Tool filters use the tool summary columns that a trigger
+        # keeps in sync with configured_mcps and agentpress_tools
         if has_default is not None:
             query = query.eq("is_default", has_default)
-        
-        # For MCP and AgentPress tools filtering, we'll need to do post-processing
-        # since Supabase doesn't have great JSON array/object filtering
+        if has_mcp_tools is not None:
+            query = query.eq("has_mcp_tools", has_mcp_tools)
+        if has_agentpress_tools is not None:
+            query = query.eq("has_agentpress_tools", has_agentpress_tools)
+        if tools:
+            tools_filter = [tool.strip() for tool in tools.split(',') if tool.strip()]
+            if tools_filter:
+                # Agents with any of the requested tools
+                query = query.ov("tool_keys", _postgres_text_array(tools_filter))
         
         # Apply sorting
-        if sort_by == "name":
-            query = query.order("name", desc=(sort_order == "desc"))
-        elif sort_by == "updated_at":
-            query = query.order("updated_at", desc=(sort_order == "desc"))
-        elif sort_by == "created_at":
-            query = query.order("created_at", desc=(sort_order == "desc"))
-        else:
-            # Default to created_at
-            query = query.order("created_at", desc=(sort_order == "desc"))
-        
-        # Execute query to get total count first
-        count_result = await query.execute()
-        total_count = count_result.count
+        sort_column = sort_by if sort_by in ("name", "updated_at", "created_at", "tools_count") else "created_at"
+        query = query.order(sort_column, desc=(sort_order == "desc"))
+        if sort_column == "tools_count":
+            # Many agents share a tool count; keep pages stable
+            query = query.order("created_at", desc=True)
         
-        # Now get the actual data with pagination
+        # One query returns both the page and the total
         query = query.range(offset, offset + limit - 1)
         agents_result = await query.execute()
+        total_count = agents_result.count or 0
         
         if not agents_result.data:
             logger.info(f"No agents found for user: {user_id}")
@@ -1332,76 +1392,13 @@ async def get_agents(
                 "pagination": {
                     "page": page,
                     "limit": limit,
-                    "total": 0,
-                    "pages": 0
+                    "total": total_count,
+                    "pages": (total_count + limit - 1) // limit
                 }
             }
         
-        # Post-process for tool filtering and tools_count sorting
         agents_data = agents_result.data
         
-        # Apply tool-based filters
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools:
-            filtered_agents = []
-            tools_filter = []
-            if tools:
-                tools_filter = [tool.strip() for tool in tools.split(',') if tool.strip()]
-            
-            for agent in agents_data:
-                # Check MCP tools filter
-                if has_mcp_tools is not None:
-                    has_mcp = bool(agent.get('configured_mcps') and len(agent.get('configured_mcps', [])) > 0)
-                    if has_mcp_tools != has_mcp:
-                        continue
-                
-                # Check AgentPress tools filter
-                if has_agentpress_tools is not None:
-                    agentpress_tools = agent.get('agentpress_tools', {})
-                    has_enabled_tools = any(
-                        tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                        for tool_data in agentpress_tools.values()
-                    )
-                    if has_agentpress_tools != has_enabled_tools:
-                        continue
-                
-                # Check specific tools filter
-                if tools_filter:
-                    agent_tools = set()
-                    # Add MCP tools
-                    for mcp in agent.get('configured_mcps', []):
-                        if isinstance(mcp, dict) and 'name' in mcp:
-                            agent_tools.add(f"mcp:{mcp['name']}")
-                    
-                    # Add enabled AgentPress tools
-                    for tool_name, tool_data in agent.get('agentpress_tools', {}).items():
-                        if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False):
-                            agent_tools.add(f"agentpress:{tool_name}")
-                    
-                    # Check if any of the requested tools are present
-                    if not any(tool in agent_tools for tool in tools_filter):
-                        continue
-                
-                filtered_agents.append(agent)
-            
-            agents_data = filtered_agents
-        
-        # Handle tools_count sorting (post-processing required)
-        if sort_by == "tools_count":
-            def get_tools_count(agent):
-                mcp_count = len(agent.get('configured_mcps', []))
-                agentpress_count = sum(
-                    1 for tool_data in agent.get('agentpress_tools', {}).values()
-                    if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                )
-                return mcp_count + agentpress_count
-            
-            agents_data.sort(key=get_tools_count, reverse=(sort_order == "desc"))
-        
-        # Apply pagination to filtered results if we did post-processing
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools or sort_by == "tools_count":
-            total_count = len(agents_data)
-            agents_data = agents_data[offset:offset + limit]
-        
         # Format the response
         agent_list = []
         for agent in agents_data:
@@ -1611,6 +1608,9 @@ async def create_agent(
             agent['current_version_id'] = version['version_id']
             agent['current_version'] = version
         
+        if agent.get('is_default'):
+            # The account's default agent changed
+            await invalidate_agent_configs(user_id)
         logger.info(f"Created agent {agent['agent_id']} with v1 for user: {user_id}")
         
         return AgentResponse(
@@ -1831,6 +1831,8 @@ async def update_agent(
                 logger.error(f"Error updating agent {agent_id}: {str(e)}")
                 raise HTTPException(status_code=500, detail=f"Failed to update agent: {str(e)}")
         
+        await invalidate_agent_configs(user_id)
+        
         # Fetch the updated agent data with version info
         updated_agent = await client.table('agents').select('*, agent_versions!current_version_id(*)').eq("agent_id", agent_id).eq("account_id", user_id).maybe_single().execute()
         
@@ -1916,6 +1918,7 @@ async def delete_agent(agent_id: str, user_id: str = Depends(get_current_user_id
         
         # Delete the agent
         await client.table('agents').delete().eq('agent_id', agent_id).execute()
+        await invalidate_agent_configs(user_id)
         
         logger.info(f"Successfully deleted agent: {agent_id}")
         return {"message": "Agent deleted successfully"}
@@ -2333,6 +2336,7 @@ async def create_agent_version(
         "current_version_id": version['version_id'],
         "version_count": next_version_number
     }).eq("agent_id", agent_id).execute()
+    await invalidate_agent_configs(user_id)
     
     # Add version history entry
     await client.table('agent_version_history').insert({
@@ -2370,6 +2374,7 @@ async def activate_agent_version(
     await client.table('agents').update({
         "current_version_id": version_id
     }).eq("agent_id", agent_id).execute()
+    await invalidate_agent_configs(user_id)
     
     # Add version history entry
     await client.table('agent_version_history').insert({
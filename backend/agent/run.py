@@ -1,6 +1,8 @@
 import os
 import json
 import re
+import time
+from functools import lru_cache
 from uuid import uuid4
 from typing import Optional
 
@@ -30,10 +32,28 @@ from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
 from agent.gemini_prompt import get_gemini_system_prompt
 from agent.tools.mcp_tool_wrapper import MCPToolWrapper
+from sandbox.sandbox import warm_sandbox, sandbox_cache_stats
 from agentpress.tool import SchemaType
 
 load_dotenv()
 
+@lru_cache(maxsize=32)
+def _default_system_prompt(model_name: str) -> str:
+    """Default system prompt for a model, assembled once per process."""
+    if "gemini-2.5-flash" in model_name and "gemini-2.5-pro" not in model_name:
+        default_system_content = get_gemini_system_prompt()
+    else:
+        # Use the original prompt - the LLM can only use tools that are registered
+        default_system_content = get_system_prompt()
+        
+    # Add sample response for non-anthropic models
+    if "anthropic" not in model_name:
+        sample_response_path = os.path.join(os.path.dirname(__file__), 'sample_responses/1.txt')
+        with open(sample_response_path, 'r') as file:
+            sample_response = file.read()
+        default_system_content = default_system_content + "\n\n <sample_assistant_response>" + sample_response + "</sample_assistant_response>"
+    return default_system_content
+
 async def run_agent(
     thread_id: str,
     project_id: str,
@@ -75,6 +95,8 @@ async def run_agent(
     sandbox_info = project_data.get('sandbox', {})
     if not sandbox_info.get('id'):
         raise ValueError(f"No sandbox found for project {project_id}")
+    # Look the sandbox up (and start it if needed) while the tools are being set up
+    warm_sandbox(sandbox_info['id'])
 
     # Initialize tools with project_id instead of sandbox object
     # This ensures each tool independently verifies it's operating on the correct project
@@ -171,15 +193,15 @@ async def run_agent(
                     logger.info("MCP tools initialized successfully")
                     updated_schemas = mcp_wrapper_instance.get_schemas()
                     logger.info(f"MCP wrapper has {len(updated_schemas)} schemas available")
-                    for method_name, schema_list in updated_schemas.items():
-                        if method_name != 'call_mcp_tool':
-                            for schema in schema_list:
-                                if schema.schema_type == SchemaType.OPENAPI:
-                                    thread_manager.tool_registry.tools[method_name] = {
-                                        "instance": mcp_wrapper_instance,
-                                        "schema": schema
-                                    }
-                                    logger.info(f"Registered dynamic MCP tool: {method_name}")
+                    dynamic_schemas = {
+                        method_name: [schema for schema in schema_list if schema.schema_type == SchemaType.OPENAPI]
+                        for method_name, schema_list in updated_schemas.items()
+                        if method_name != 'call_mcp_tool'
+                    }
+                    thread_manager.tool_registry.register_schemas(mcp_wrapper_instance, dynamic_schemas)
+                    for method_name, schema_list in dynamic_schemas.items():
+                        if schema_list:
+                            logger.info(f"Registered dynamic MCP tool: {method_name}")
                     
                     # Log all registered tools for debugging
                     all_tools = list(thread_manager.tool_registry.tools.keys())
@@ -193,18 +215,7 @@ async def run_agent(
 
     # Prepare system prompt
     # First, get the default system prompt
-    if "gemini-2.5-flash" in model_name.lower() and "gemini-2.5-pro" not in model_name.lower():
-        default_system_content = get_gemini_system_prompt()
-    else:
-        # Use the original prompt - the LLM can only use tools that are registered
-        default_system_content = get_system_prompt()
-        
-    # Add sample response for non-anthropic models
-    if "anthropic" not in model_name.lower():
-        sample_response_path = os.path.join(os.path.dirname(__file__), 'sample_responses/1.txt')
-        with open(sample_response_path, 'r') as file:
-            sample_response = file.read()
-        default_system_content = default_system_content + "\n\n <sample_assistant_response>" + sample_response + "</sample_assistant_response>"
+    default_system_content = _default_system_prompt(model_name.lower())
     
     # Handle custom agent system prompt
     if agent_config and agent_config.get('system_prompt'):
@@ -309,273 +320,274 @@ async def run_agent(
     iteration_count = 0
     continue_execution = True
 
-    latest_user_message = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'user').order('created_at', desc=True).limit(1).execute()
-    if latest_user_message.data and len(latest_user_message.data) > 0:
-        data = latest_user_message.data[0]['content']
-        if isinstance(data, str):
-            data = json.loads(data)
-        trace.update(input=data['content'])
-
-    while continue_execution and iteration_count < max_iterations:
-        iteration_count += 1
-        logger.info(f"🔄 Running iteration {iteration_count} of {max_iterations}...")
-
-        # Billing check on each iteration - still needed within the iterations
-        can_run, message, subscription = await check_billing_status(client, account_id)
-        if not can_run:
-            error_msg = f"Billing limit reached: {message}"
-            trace.event(name="billing_limit_reached", level="ERROR", status_message=(f"{error_msg}"))
-            # Yield a special message to indicate billing limit reached
-            yield {
-                "type": "status",
-                "status": "stopped",
-                "message": error_msg
-            }
-            break
-        # Check if last message is from assistant using direct Supabase query
-        latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()
-        if latest_message.data and len(latest_message.data) > 0:
-            message_type = latest_message.data[0].get('type')
-            if message_type == 'assistant':
+    # One query for the thread state; from here on tools and add_message keep it current
+    run_state = await thread_manager.load_run_state(thread_id)
+    if run_state.latest_user_message:
+        trace.update(input=run_state.latest_user_message.get('content'))
+
+    try:
+        while continue_execution and iteration_count < max_iterations:
+            iteration_count += 1
+            logger.info(f"🔄 Running iteration {iteration_count} of {max_iterations}...")
+            iteration_started = time.perf_counter()
+
+            # Billing check on each iteration - still needed within the iterations
+            can_run, message, subscription = await check_billing_status(client, account_id)
+            billing_ms = (time.perf_counter() - iteration_started) * 1000
+            if not can_run:
+                error_msg = f"Billing limit reached: {message}"
+                trace.event(name="billing_limit_reached", level="ERROR", status_message=(f"{error_msg}"))
+                # Yield a special message to indicate billing limit reached
+                yield {
+                    "type": "status",
+                    "status": "stopped",
+                    "message": error_msg
+                }
+                break
+            # Check if last message is from assistant
+            if run_state.latest_message_type == 'assistant':
                 logger.info(f"Last message was from assistant, stopping execution")
                 trace.event(name="last_message_from_assistant", level="DEFAULT", status_message=(f"Last message was from assistant, stopping execution"))
                 continue_execution = False
                 break
 
-        # ---- Temporary Message Handling (Browser State & Image Context) ----
-        temporary_message = None
-        temp_message_content_list = [] # List to hold text/image blocks
+            # ---- Temporary Message Handling (Browser State & Image Context) ----
+            temporary_message = None
+            temp_message_content_list = [] # List to hold text/image blocks
 
-        # Get the latest browser_state message
-        latest_browser_state_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
-            try:
-                browser_content = latest_browser_state_msg.data[0]["content"]
-                if isinstance(browser_content, str):
-                    browser_content = json.loads(browser_content)
-                screenshot_base64 = browser_content.get("screenshot_base64")
-                screenshot_url = browser_content.get("image_url")
+            # Latest browser state, handed over by the browser tool
+            if run_state.browser_state:
+                try:
+                    browser_content = run_state.browser_state
+                    screenshot_url = browser_content.get("image_url")
                 
-                # Create a copy of the browser state without screenshot data
-                browser_state_text = browser_content.copy()
-                browser_state_text.pop('screenshot_base64', None)
-                browser_state_text.pop('image_url', None)
-
-                if browser_state_text:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
-                    })
+                    # The prompt gets the screenshot URL, never image data
+                    browser_state_text = browser_content.copy()
+                    for key in ('screenshot_base64', 'screenshot_path', 'screenshot_sha256', 'image_url'):
+                        browser_state_text.pop(key, None)
+
+                    if browser_state_text:
+                        temp_message_content_list.append({
+                            "type": "text",
+                            "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
+                        })
                 
-                # Only add screenshot if model is not Gemini, Anthropic, or OpenAI
-                if 'gemini' in model_name.lower() or 'anthropic' in model_name.lower() or 'openai' in model_name.lower():
-                    # Prioritize screenshot_url if available
-                    if screenshot_url:
+                    # Only add screenshot if model is not Gemini, Anthropic, or OpenAI
+                    if 'gemini' in model_name.lower() or 'anthropic' in model_name.lower() or 'openai' in model_name.lower():
+                        if screenshot_url:
+                            temp_message_content_list.append({
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": screenshot_url,
+                                    "format": "image/jpeg"
+                                }
+                            })
+                            trace.event(name="screenshot_url_added_to_temporary_message", level="DEFAULT", status_message=(f"Screenshot URL added to temporary message."))
+                        else:
+                            logger.warning("Browser state found but no screenshot URL.")
+                            trace.event(name="browser_state_found_but_no_screenshot_data", level="WARNING", status_message=(f"Browser state found but no screenshot URL."))
+                    else:
+                        logger.warning("Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message.")
+                        trace.event(name="model_is_gemini_anthropic_or_openai", level="WARNING", status_message=(f"Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message."))
+
+                except Exception as e:
+                    logger.error(f"Error parsing browser state: {e}")
+                    trace.event(name="error_parsing_browser_state", level="ERROR", status_message=(f"{e}"))
+
+            # Images requested by the vision tool, shown once
+            for image_context_content in run_state.take_image_contexts():
+                try:
+                    base64_image = image_context_content.get("base64")
+                    mime_type = image_context_content.get("mime_type")
+                    file_path = image_context_content.get("file_path", "unknown file")
+
+                    if base64_image and mime_type:
                         temp_message_content_list.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": screenshot_url,
-                                "format": "image/jpeg"
-                            }
+                            "type": "text",
+                            "text": f"Here is the image you requested to see: '{file_path}'"
                         })
-                        trace.event(name="screenshot_url_added_to_temporary_message", level="DEFAULT", status_message=(f"Screenshot URL added to temporary message."))
-                    elif screenshot_base64:
-                        # Fallback to base64 if URL not available
                         temp_message_content_list.append({
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{screenshot_base64}",
+                                "url": f"data:{mime_type};base64,{base64_image}",
                             }
                         })
-                        trace.event(name="screenshot_base64_added_to_temporary_message", level="WARNING", status_message=(f"Screenshot base64 added to temporary message. Prefer screenshot_url if available."))
                     else:
-                        logger.warning("Browser state found but no screenshot data.")
-                        trace.event(name="browser_state_found_but_no_screenshot_data", level="WARNING", status_message=(f"Browser state found but no screenshot data."))
-                else:
-                    logger.warning("Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message.")
-                    trace.event(name="model_is_gemini_anthropic_or_openai", level="WARNING", status_message=(f"Model is Gemini, Anthropic, or OpenAI, so not adding screenshot to temporary message."))
-
-            except Exception as e:
-                logger.error(f"Error parsing browser state: {e}")
-                trace.event(name="error_parsing_browser_state", level="ERROR", status_message=(f"{e}"))
-
-        # Get the latest image_context message (NEW)
-        latest_image_context_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
-            try:
-                image_context_content = latest_image_context_msg.data[0]["content"] if isinstance(latest_image_context_msg.data[0]["content"], dict) else json.loads(latest_image_context_msg.data[0]["content"])
-                base64_image = image_context_content.get("base64")
-                mime_type = image_context_content.get("mime_type")
-                file_path = image_context_content.get("file_path", "unknown file")
-
-                if base64_image and mime_type:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"Here is the image you requested to see: '{file_path}'"
-                    })
-                    temp_message_content_list.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}",
-                        }
-                    })
-                else:
-                    logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
-
-                await client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
-            except Exception as e:
-                logger.error(f"Error parsing image context: {e}")
-                trace.event(name="error_parsing_image_context", level="ERROR", status_message=(f"{e}"))
-
-        # If we have any content, construct the temporary_message
-        if temp_message_content_list:
-            temporary_message = {"role": "user", "content": temp_message_content_list}
-            # logger.debug(f"Constructed temporary message with {len(temp_message_content_list)} content blocks.")
-        # ---- End Temporary Message Handling ----
-
-        # Set max_tokens based on model
-        max_tokens = None
-        if "sonnet" in model_name.lower():
-            # Claude 3.5 Sonnet has a limit of 8192 tokens
-            max_tokens = 8192
-        elif "gpt-4" in model_name.lower():
-            max_tokens = 4096
-        elif "gemini-2.5-pro" in model_name.lower():
-            # Gemini 2.5 Pro has 64k max output tokens
-            max_tokens = 64000
+                        logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
+                except Exception as e:
+                    logger.error(f"Error parsing image context: {e}")
+                    trace.event(name="error_parsing_image_context", level="ERROR", status_message=(f"{e}"))
+
+            # If we have any content, construct the temporary_message
+            if temp_message_content_list:
+                temporary_message = {"role": "user", "content": temp_message_content_list}
+                # logger.debug(f"Constructed temporary message with {len(temp_message_content_list)} content blocks.")
+            # ---- End Temporary Message Handling ----
+
+            # Set max_tokens based on model
+            max_tokens = None
+            if "sonnet" in model_name.lower():
+                # Claude 3.5 Sonnet has a limit of 8192 tokens
+                max_tokens = 8192
+            elif "gpt-4" in model_name.lower():
+                max_tokens = 4096
+            elif "gemini-2.5-pro" in model_name.lower():
+                # Gemini 2.5 Pro has 64k max output tokens
+                max_tokens = 64000
+
+            overhead_ms = (time.perf_counter() - iteration_started) * 1000
+            trace.event(name="iteration_overhead", level="DEFAULT", metadata={
+                "iteration": iteration_count,
+                "billing_ms": round(billing_ms, 1),
+                "state_ms": round(overhead_ms - billing_ms, 1),
+                "total_ms": round(overhead_ms, 1),
+            })
             
-        generation = trace.generation(name="thread_manager.run_thread")
-        try:
-            # Make the LLM call and process the response
-            response = await thread_manager.run_thread(
-                thread_id=thread_id,
-                system_prompt=system_message,
-                stream=stream,
-                llm_model=model_name,
-                llm_temperature=0,
-                llm_max_tokens=max_tokens,
-                tool_choice="auto",
-                max_xml_tool_calls=1,
-                temporary_message=temporary_message,
-                processor_config=ProcessorConfig(
-                    xml_tool_calling=True,
-                    native_tool_calling=False,
-                    execute_tools=True,
-                    execute_on_stream=True,
-                    tool_execution_strategy="parallel",
-                    xml_adding_strategy="user_message"
-                ),
-                native_max_auto_continues=native_max_auto_continues,
-                include_xml_examples=True,
-                enable_thinking=enable_thinking,
-                reasoning_effort=reasoning_effort,
-                enable_context_manager=enable_context_manager,
-                generation=generation
-            )
-
-            if isinstance(response, dict) and "status" in response and response["status"] == "error":
-                logger.error(f"Error response from run_thread: {response.get('message', 'Unknown error')}")
-                trace.event(name="error_response_from_run_thread", level="ERROR", status_message=(f"{response.get('message', 'Unknown error')}"))
-                yield response
-                break
+            generation = trace.generation(name="thread_manager.run_thread")
+            try:
+                # Make the LLM call and process the response
+                response = await thread_manager.run_thread(
+                    thread_id=thread_id,
+                    system_prompt=system_message,
+                    stream=stream,
+                    llm_model=model_name,
+                    llm_temperature=0,
+                    llm_max_tokens=max_tokens,
+                    tool_choice="auto",
+                    max_xml_tool_calls=1,
+                    temporary_message=temporary_message,
+                    processor_config=ProcessorConfig(
+                        xml_tool_calling=True,
+                        native_tool_calling=False,
+                        execute_tools=True,
+                        execute_on_stream=True,
+                        tool_execution_strategy="parallel",
+                        xml_adding_strategy="user_message"
+                    ),
+                    native_max_auto_continues=native_max_auto_continues,
+                    include_xml_examples=True,
+                    enable_thinking=enable_thinking,
+                    reasoning_effort=reasoning_effort,
+                    enable_context_manager=enable_context_manager,
+                    generation=generation
+                )
+
+                if isinstance(response, dict) and "status" in response and response["status"] == "error":
+                    logger.error(f"Error response from run_thread: {response.get('message', 'Unknown error')}")
+                    trace.event(name="error_response_from_run_thread", level="ERROR", status_message=(f"{response.get('message', 'Unknown error')}"))
+                    yield response
+                    break
 
-            # Track if we see ask, complete, or web-browser-takeover tool calls
-            last_tool_call = None
-            agent_should_terminate = False
+                # Track if we see ask, complete, or web-browser-takeover tool calls
+                last_tool_call = None
+                agent_should_terminate = False
 
-            # Process the response
-            error_detected = False
-            try:
-                full_response = ""
-                async for chunk in response:
-                    # If we receive an error chunk, we should stop after this iteration
-                    if isinstance(chunk, dict) and chunk.get('type') == 'status' and chunk.get('status') == 'error':
-                        logger.error(f"Error chunk detected: {chunk.get('message', 'Unknown error')}")
-                        trace.event(name="error_chunk_detected", level="ERROR", status_message=(f"{chunk.get('message', 'Unknown error')}"))
-                        error_detected = True
-                        yield chunk  # Forward the error chunk
-                        continue     # Continue processing other chunks but don't break yet
+                # Process the response
+                error_detected = False
+                try:
+                    full_response = ""
+                    async for chunk in response:
+                        # If we receive an error chunk, we should stop after this iteration
+                        if isinstance(chunk, dict) and chunk.get('type') == 'status' and chunk.get('status') == 'error':
+                            logger.error(f"Error chunk detected: {chunk.get('message', 'Unknown error')}")
+                            trace.event(name="error_chunk_detected", level="ERROR", status_message=(f"{chunk.get('message', 'Unknown error')}"))
+                            error_detected = True
+                            yield chunk  # Forward the error chunk
+                            continue     # Continue processing other chunks but don't break yet
                     
-                    # Check for termination signal in status messages
-                    if chunk.get('type') == 'status':
-                        try:
-                            # Parse the metadata to check for termination signal
-                            metadata = chunk.get('metadata', {})
-                            if isinstance(metadata, str):
-                                metadata = json.loads(metadata)
+                        # Check for termination signal in status messages
+                        if chunk.get('type') == 'status':
+                            try:
+                                # Parse the metadata to check for termination signal
+                                metadata = chunk.get('metadata', {})
+                                if isinstance(metadata, str):
+                                    metadata = json.loads(metadata)
                             
-                            if metadata.get('agent_should_terminate'):
-                                agent_should_terminate = True
-                                logger.info("Agent termination signal detected in status message")
-                                trace.event(name="agent_termination_signal_detected", level="DEFAULT", status_message="Agent termination signal detected in status message")
+                                if metadata.get('agent_should_terminate'):
+                                    agent_should_terminate = True
+                                    logger.info("Agent termination signal detected in status message")
+                                    trace.event(name="agent_termination_signal_detected", level="DEFAULT", status_message="Agent termination signal detected in status message")
                                 
-                                # Extract the tool name from the status content if available
-                                content = chunk.get('content', {})
-                                if isinstance(content, str):
-                                    content = json.loads(content)
+                                    # Extract the tool name from the status content if available
+                                    content = chunk.get('content', {})
+                                    if isinstance(content, str):
+                                        content = json.loads(content)
                                 
-                                if content.get('function_name'):
-                                    last_tool_call = content['function_name']
-                                elif content.get('xml_tag_name'):
-                                    last_tool_call = content['xml_tag_name']
+                                    if content.get('function_name'):
+                                        last_tool_call = content['function_name']
+                                    elif content.get('xml_tag_name'):
+                                        last_tool_call = content['xml_tag_name']
                                     
-                        except Exception as e:
-                            logger.debug(f"Error parsing status message for termination check: {e}")
+                            except Exception as e:
+                                logger.debug(f"Error parsing status message for termination check: {e}")
                         
-                    # Check for XML versions like <ask>, <complete>, or <web-browser-takeover> in assistant content chunks
-                    if chunk.get('type') == 'assistant' and 'content' in chunk:
-                        try:
-                            # The content field might be a JSON string or object
-                            content = chunk.get('content', '{}')
-                            if isinstance(content, str):
-                                assistant_content_json = json.loads(content)
-                            else:
-                                assistant_content_json = content
-
-                            # The actual text content is nested within
-                            assistant_text = assistant_content_json.get('content', '')
-                            full_response += assistant_text
-                            if isinstance(assistant_text, str):
-                                if '</ask>' in assistant_text or '</complete>' in assistant_text or '</web-browser-takeover>' in assistant_text:
-                                   if '</ask>' in assistant_text:
-                                       xml_tool = 'ask'
-                                   elif '</complete>' in assistant_text:
-                                       xml_tool = 'complete'
-                                   elif '</web-browser-takeover>' in assistant_text:
-                                       xml_tool = 'web-browser-takeover'
-
-                                   last_tool_call = xml_tool
-                                   logger.info(f"Agent used XML tool: {xml_tool}")
-                                   trace.event(name="agent_used_xml_tool", level="DEFAULT", status_message=(f"Agent used XML tool: {xml_tool}"))
-                        except json.JSONDecodeError:
-                            # Handle cases where content might not be valid JSON
-                            logger.warning(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}")
-                            trace.event(name="warning_could_not_parse_assistant_content_json", level="WARNING", status_message=(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}"))
-                        except Exception as e:
-                            logger.error(f"Error processing assistant chunk: {e}")
-                            trace.event(name="error_processing_assistant_chunk", level="ERROR", status_message=(f"Error processing assistant chunk: {e}"))
-
-                    yield chunk
-
-                # Check if we should stop based on the last tool call or error
-                if error_detected:
-                    logger.info(f"Stopping due to error detected in response")
-                    trace.event(name="stopping_due_to_error_detected_in_response", level="DEFAULT", status_message=(f"Stopping due to error detected in response"))
-                    generation.end(output=full_response, status_message="error_detected", level="ERROR")
-                    break
+                        # Check for XML versions like <ask>, <complete>, or <web-browser-takeover> in assistant content chunks
+                        if chunk.get('type') == 'assistant' and 'content' in chunk:
+                            try:
+                                # The content field might be a JSON string or object
+                                content = chunk.get('content', '{}')
+                                if isinstance(content, str):
+                                    assistant_content_json = json.loads(content)
+                                else:
+                                    assistant_content_json = content
+
+                                # The actual text content is nested within
+                                assistant_text = assistant_content_json.get('content', '')
+                                full_response += assistant_text
+                                if isinstance(assistant_text, str):
+                                    if '</ask>' in assistant_text or '</complete>' in assistant_text or '</web-browser-takeover>' in assistant_text:
+                                       if '</ask>' in assistant_text:
+                                           xml_tool = 'ask'
+                                       elif '</complete>' in assistant_text:
+                                           xml_tool = 'complete'
+                                       elif '</web-browser-takeover>' in assistant_text:
+                                           xml_tool = 'web-browser-takeover'
+
+                                       last_tool_call = xml_tool
+                                       logger.info(f"Agent used XML tool: {xml_tool}")
+                                       trace.event(name="agent_used_xml_tool", level="DEFAULT", status_message=(f"Agent used XML tool: {xml_tool}"))
+                            except json.JSONDecodeError:
+                                # Handle cases where content might not be valid JSON
+                                logger.warning(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}")
+                                trace.event(name="warning_could_not_parse_assistant_content_json", level="WARNING", status_message=(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}"))
+                            except Exception as e:
+                                logger.error(f"Error processing assistant chunk: {e}")
+                                trace.event(name="error_processing_assistant_chunk", level="ERROR", status_message=(f"Error processing assistant chunk: {e}"))
+
+                        yield chunk
+
+                    # Check if we should stop based on the last tool call or error
+                    if error_detected:
+                        logger.info(f"Stopping due to error detected in response")
+                        trace.event(name="stopping_due_to_error_detected_in_response", level="DEFAULT", status_message=(f"Stopping due to error detected in response"))
+                        generation.end(output=full_response, status_message="error_detected", level="ERROR")
+                        break
                     
-                if agent_should_terminate or last_tool_call in ['ask', 'complete', 'web-browser-takeover']:
-                    logger.info(f"Agent decided to stop with tool: {last_tool_call}")
-                    trace.event(name="agent_decided_to_stop_with_tool", level="DEFAULT", status_message=(f"Agent decided to stop with tool: {last_tool_call}"))
-                    generation.end(output=full_response, status_message="agent_stopped")
-                    continue_execution = False
+                    if agent_should_terminate or last_tool_call in ['ask', 'complete', 'web-browser-takeover']:
+                        logger.info(f"Agent decided to stop with tool: {last_tool_call}")
+                        trace.event(name="agent_decided_to_stop_with_tool", level="DEFAULT", status_message=(f"Agent decided to stop with tool: {last_tool_call}"))
+                        generation.end(output=full_response, status_message="agent_stopped")
+                        continue_execution = False
 
+                except Exception as e:
+                    # Just log the error and re-raise to stop all iterations
+                    error_msg = f"Error during response streaming: {str(e)}"
+                    logger.error(f"Error: {error_msg}")
+                    trace.event(name="error_during_response_streaming", level="ERROR", status_message=(f"Error during response streaming: {str(e)}"))
+                    generation.end(output=full_response, status_message=error_msg, level="ERROR")
+                    yield {
+                        "type": "status",
+                        "status": "error",
+                        "message": error_msg
+                    }
+                    # Stop execution immediately on any error
+                    break
+                
             except Exception as e:
                 # Just log the error and re-raise to stop all iterations
-                error_msg = f"Error during response streaming: {str(e)}"
+                error_msg = f"Error running thread: {str(e)}"
                 logger.error(f"Error: {error_msg}")
-                trace.event(name="error_during_response_streaming", level="ERROR", status_message=(f"Error during response streaming: {str(e)}"))
-                generation.end(output=full_response, status_message=error_msg, level="ERROR")
+                trace.event(name="error_running_thread", level="ERROR", status_message=(f"Error running thread: {str(e)}"))
                 yield {
                     "type": "status",
                     "status": "error",
@@ -583,22 +595,17 @@ async def run_agent(
                 }
                 # Stop execution immediately on any error
                 break
-                
-        except Exception as e:
-            # Just log the error and re-raise to stop all iterations
-            error_msg = f"Error running thread: {str(e)}"
-            logger.error(f"Error: {error_msg}")
-            trace.event(name="error_running_thread", level="ERROR", status_message=(f"Error running thread: {str(e)}"))
-            yield {
-                "type": "status",
-                "status": "error",
-                "message": error_msg
-            }
-            # Stop execution immediately on any error
-            break
-        generation.end(output=full_response)
-
-    langfuse.flush() # Flush Langfuse events at the end of the run
+            generation.end(output=full_response)
+    finally:
+        # Runs on stop and on error too; the caller closes this generator when it stops consuming it
+        try:
+            await thread_manager.flush_messages() # Make sure no queued messages outlive the run
+        finally:
+            if mcp_wrapper_instance:
+                pool_stats = await mcp_wrapper_instance.release_sessions()
+                trace.event(name="mcp_session_pool_stats", level="DEFAULT", metadata=pool_stats)
+            trace.event(name="sandbox_cache_stats", level="DEFAULT", metadata=sandbox_cache_stats())
+            langfuse.flush() # Flush Langfuse events at the end of the run
   
 
 
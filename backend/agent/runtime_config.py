@@ -0,0 +1,103 @@
+"""
+Resolved agent configurations for run start, cached in Redis.
+
+Starting a run resolves the agent (the requested one, or the account's
+default) together with its current version into the config run_agent works
+from: system prompt, agentpress tools and MCP servers. That config is cached
+per agent, stamped with the version it was compiled from and the account's
+config revision at the time. A run start reads it together with the current
+revision in one round trip and only goes to the database when it is missing
+or stale.
+
+The revision is a per-account counter bumped by invalidate_agent_configs(),
+which agent updates, version creation and activation, default-agent changes
+and credential or profile changes call. Because the revision is read before
+the database, a config compiled while a change lands is already stale when
+it is stored. AGENT_CONFIG_CACHE_TTL bounds how long writes made outside
+these paths go unnoticed.
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+from services import redis
+from utils.logger import logger
+
+AGENT_CONFIG_CACHE_TTL = int(os.getenv("AGENT_CONFIG_CACHE_TTL", "600"))
+KEY_PREFIX = "agent_runtime_config:"
+
+
+def _config_key(account_id: str, agent_id: Optional[str]) -> str:
+    return f"{KEY_PREFIX}{account_id}:{agent_id or 'default'}"
+
+
+def _revision_key(account_id: str) -> str:
+    return f"{KEY_PREFIX}revision:{account_id}"
+
+
+def compile_agent_config(agent_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the runtime config from an agents row joined with its current version."""
+    version_data = agent_data.get('agent_versions')
+    if not version_data:
+        # Backward compatibility - use agent data directly
+        return agent_data
+    return {
+        'agent_id': agent_data['agent_id'],
+        'name': agent_data['name'],
+        'description': agent_data.get('description'),
+        'system_prompt': version_data['system_prompt'],
+        'configured_mcps': version_data.get('configured_mcps', []),
+        'custom_mcps': version_data.get('custom_mcps', []),
+        'agentpress_tools': version_data.get('agentpress_tools', {}),
+        'is_default': agent_data.get('is_default', False),
+        'current_version_id': agent_data.get('current_version_id'),
+        'version_name': version_data.get('version_name', 'v1')
+    }
+
+
+async def get_agent_config(client, account_id: str, agent_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Resolved config of an agent of the account, or of its default agent when
+    agent_id is None. Returns None if there is no such agent.
+    """
+    key = _config_key(account_id, agent_id)
+    revision = None
+    try:
+        redis_client = await redis.get_client()
+        cached, revision = await redis_client.mget(key, _revision_key(account_id))
+        revision = int(revision or 0)
+        if cached:
+            artifact = json.loads(cached)
+            if artifact.get('revision') == revision:
+                return artifact['config']
+    except Exception as e:
+        logger.warning(f"Failed to read cached agent config {key}: {e}")
+
+    query = client.table('agents').select('*, agent_versions!current_version_id(*)').eq('account_id', account_id)
+    query = query.eq('agent_id', agent_id) if agent_id else query.eq('is_default', True)
+    result = await query.execute()
+    if not result.data:
+        return None
+    config = compile_agent_config(result.data[0])
+
+    if revision is not None and AGENT_CONFIG_CACHE_TTL > 0:
+        artifact = {
+            'revision': revision,
+            'version_id': config.get('current_version_id'),
+            'config': config,
+        }
+        try:
+            await redis.set(key, json.dumps(artifact, default=str), ex=AGENT_CONFIG_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to cache agent config {key}: {e}")
+    return config
+
+
+async def invalidate_agent_configs(account_id: str) -> None:
+    """Make every cached agent config of the account stale."""
+    try:
+        redis_client = await redis.get_client()
+        await redis_client.incr(_revision_key(account_id))
+    except Exception as e:
+        logger.error(f"Failed to invalidate agent configs of account {account_id}: {e}")
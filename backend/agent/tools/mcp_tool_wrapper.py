@@ -9,12 +9,12 @@ import json
 from typing import Any, Dict, List, Optional
 from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, ToolSchema, SchemaType
 from mcp_local.client import MCPManager
+from mcp_local.session_pool import get_session_pool, TRANSPORT_HTTP, TRANSPORT_SSE
+from mcp_local.tool_catalog import catalog_key, connect_concurrently, get_tool_catalog
 from utils.logger import logger
 import inspect
 from mcp import ClientSession
-from mcp.client.sse import sse_client
 from mcp.client.stdio import stdio_client
-from mcp.client.streamable_http import streamablehttp_client
 from mcp import StdioServerParameters
 import asyncio
 
@@ -52,270 +52,89 @@ class MCPToolWrapper(Tool):
             standard_configs = [cfg for cfg in self.mcp_configs if not cfg.get('isCustom', False)]
             custom_configs = [cfg for cfg in self.mcp_configs if cfg.get('isCustom', False)]
             
-            # Initialize standard MCPs through MCPManager
-            if standard_configs:
-                for config in standard_configs:
-                    try:
-                        logger.info(f"Attempting to connect to MCP server: {config['qualifiedName']}")
-                        await self.mcp_manager.connect_server(config)
-                        logger.info(f"Successfully connected to MCP server: {config['qualifiedName']}")
-                    except Exception as e:
-                        logger.error(f"Failed to connect to MCP server {config['qualifiedName']}: {e}")
-                        import traceback
-                        logger.error(f"Full traceback: {traceback.format_exc()}")
-            
-            # Initialize custom MCPs directly
-            if custom_configs:
-                await self._initialize_custom_mcps(custom_configs)
+            # Bring up standard MCPs through MCPManager and custom MCPs directly, all at once
+            await asyncio.gather(
+                self.mcp_manager.connect_all(standard_configs),
+                self._initialize_custom_mcps(custom_configs),
+            )
             
             # Create dynamic tools for all connected servers
             await self._create_dynamic_tools()
             self._initialized = True
     
-    async def _connect_sse_server(self, server_name, server_config, all_tools, timeout):
-        url = server_config["url"]
-        headers = server_config.get("headers", {})
-        
-        async with asyncio.timeout(timeout):
-            try:
-                async with sse_client(url, headers=headers) as (read, write):
-                    async with ClientSession(read, write) as session:
-                        await session.initialize()
-                        tools_result = await session.list_tools()
-                        tools_info = []
-                        for tool in tools_result.tools:
-                            tool_info = {
-                                "name": tool.name,
-                                "description": tool.description,
-                                "input_schema": tool.inputSchema
-                            }
-                            tools_info.append(tool_info)
-                        
-                        all_tools[server_name] = {
-                            "status": "connected",
-                            "transport": "sse",
-                            "url": url,
-                            "tools": tools_info
-                        }
-                        
-                        logger.info(f"  {server_name}: Connected via SSE ({len(tools_info)} tools)")
-            except TypeError as e:
-                if "unexpected keyword argument" in str(e):
-                    async with sse_client(url) as (read, write):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            tools_result = await session.list_tools()
-                            tools_info = []
-                            for tool in tools_result.tools:
-                                tool_info = {
-                                    "name": tool.name,
-                                    "description": tool.description,
-                                    "input_schema": tool.inputSchema
-                                }
-                                tools_info.append(tool_info)
-                            
-                            all_tools[server_name] = {
-                                "status": "connected",
-                                "transport": "sse",
-                                "url": url,
-                                "tools": tools_info
-                            }
-                            logger.info(f"  {server_name}: Connected via SSE ({len(tools_info)} tools)")
-                else:
-                    raise
-    
-    async def _connect_streamable_http_server(self, url):
-        async with streamablehttp_client(url) as (
-            read_stream,
-            write_stream,
-            _,
-        ):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                tool_result = await session.list_tools()
-                print(f"Connected via HTTP ({len(tool_result.tools)} tools)")
-                
-                tools_info = []
-                for tool in tool_result.tools:
-                    tool_info = {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "inputSchema": tool.inputSchema
-                    }
-                    tools_info.append(tool_info)
-                
-                return tools_info
-        
-    async def _connect_stdio_server(self, server_name, server_config, all_tools, timeout):
-        """Connect to a stdio-based MCP server."""
+    async def _list_stdio_tools(self, server_config):
+        """Start a stdio-based MCP server just long enough to list its tools."""
         server_params = StdioServerParameters(
             command=server_config["command"],
             args=server_config.get("args", []),
             env=server_config.get("env", {})
         )
         
-        async with asyncio.timeout(timeout):
-            async with stdio_client(server_params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tools_info = []
-                    for tool in tools_result.tools:
-                        tool_info = {
-                            "name": tool.name,
-                            "description": tool.description,
-                            "input_schema": tool.inputSchema
-                        }
-                        tools_info.append(tool_info)
-                    
-                    all_tools[server_name] = {
-                        "status": "connected",
-                        "transport": "stdio",
-                        "tools": tools_info
-                    }
-                    
-                    logger.info(f"  {server_name}: Connected via stdio ({len(tools_info)} tools)")
+        async with stdio_client(server_params) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                tools_result = await session.list_tools()
+                return tools_result.tools
 
     async def _initialize_custom_mcps(self, custom_configs):
-        """Initialize custom MCP servers."""
-        for config in custom_configs:
-            try:
-                logger.info(f"Initializing custom MCP: {config}")
-                custom_type = config.get('customType', 'sse')
-                server_config = config.get('config', {})
-                enabled_tools = config.get('enabledTools', [])
-                server_name = config.get('name', 'Unknown')
-                
-                logger.info(f"Initializing custom MCP: {server_name} (type: {custom_type})")
-                
-                if custom_type == 'sse':
-                    if 'url' not in server_config:
-                        logger.error(f"Custom MCP {server_name}: Missing 'url' in config")
-                        continue
-                        
-                    url = server_config['url']
-                    logger.info(f"Initializing custom MCP {url} with SSE type")
-                    
-                    try:
-                        # Use the working connect_sse_server method
-                        all_tools = {}
-                        await self._connect_sse_server(server_name, server_config, all_tools, 15)
-                        
-                        # Process the results
-                        if server_name in all_tools and all_tools[server_name].get('status') == 'connected':
-                            tools_info = all_tools[server_name].get('tools', [])
-                            tools_registered = 0
-                            
-                            for tool_info in tools_info:
-                                tool_name_from_server = tool_info['name']
-                                if not enabled_tools or tool_name_from_server in enabled_tools:
-                                    tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool_name_from_server}"
-                                    self._custom_tools[tool_name] = {
-                                        'name': tool_name,
-                                        'description': tool_info['description'],
-                                        'parameters': tool_info['input_schema'],
-                                        'server': server_name,
-                                        'original_name': tool_name_from_server,
-                                        'is_custom': True,
-                                        'custom_type': custom_type,
-                                        'custom_config': server_config
-                                    }
-                                    tools_registered += 1
-                                    logger.debug(f"Registered custom tool: {tool_name}")
-                            
-                            logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
-                        else:
-                            logger.error(f"Failed to connect to custom MCP {server_name}")
-                            
-                    except Exception as e:
-                        logger.error(f"Custom MCP {server_name}: Connection failed - {str(e)}")
-                        continue
-                
-                elif custom_type == 'http':
-                    if 'url' not in server_config:
-                        logger.error(f"Custom MCP {server_name}: Missing 'url' in config")
-                        continue
-                        
-                    url = server_config['url']
-                    logger.info(f"Initializing custom MCP {url} with HTTP type")
-                    
-                    try:
+        """Initialize custom MCP servers concurrently, skipping the ones that fail."""
+        await connect_concurrently(
+            custom_configs, self._initialize_custom_mcp, lambda config: config.get('name', 'Unknown')
+        )
 
-                        tools_info = await self._connect_streamable_http_server(url)
-                        tools_registered = 0
-                        
-                        for tool_info in tools_info:
-                            tool_name_from_server = tool_info['name']
-                            if not enabled_tools or tool_name_from_server in enabled_tools:
-                                tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool_name_from_server}"
-                                self._custom_tools[tool_name] = {
-                                    'name': tool_name,
-                                    'description': tool_info['description'],
-                                    'parameters': tool_info['inputSchema'],
-                                    'server': server_name,
-                                    'original_name': tool_name_from_server,
-                                    'is_custom': True,
-                                    'custom_type': custom_type,
-                                    'custom_config': server_config
-                                }
-                                tools_registered += 1
-                                logger.debug(f"Registered custom tool: {tool_name}")
-                        
-                        logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
-                            
-                    except Exception as e:
-                        logger.error(f"Custom MCP {server_name}: Connection failed - {str(e)}")
-                        continue
-                        
-                elif custom_type == 'json':
-                    if 'command' not in server_config:
-                        logger.error(f"Custom MCP {server_name}: Missing 'command' in config")
-                        continue
-                        
-                    logger.info(f"Initializing custom MCP {server_name} with JSON/stdio type")
-                    
-                    try:
-                        # Use the stdio connection method
-                        all_tools = {}
-                        await self._connect_stdio_server(server_name, server_config, all_tools, 15)
-                        
-                        # Process the results
-                        if server_name in all_tools and all_tools[server_name].get('status') == 'connected':
-                            tools_info = all_tools[server_name].get('tools', [])
-                            tools_registered = 0
-                            
-                            for tool_info in tools_info:
-                                tool_name_from_server = tool_info['name']
-                                if not enabled_tools or tool_name_from_server in enabled_tools:
-                                    tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool_name_from_server}"
-                                    self._custom_tools[tool_name] = {
-                                        'name': tool_name,
-                                        'description': tool_info['description'],
-                                        'parameters': tool_info['input_schema'],
-                                        'server': server_name,
-                                        'original_name': tool_name_from_server,
-                                        'is_custom': True,
-                                        'custom_type': custom_type,
-                                        'custom_config': server_config
-                                    }
-                                    tools_registered += 1
-                                    logger.debug(f"Registered custom tool: {tool_name}")
-                            
-                            logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
-                        else:
-                            logger.error(f"Failed to connect to custom MCP {server_name}")
-                            
-                    except Exception as e:
-                        logger.error(f"Custom MCP {server_name}: Connection failed - {str(e)}")
-                        continue
-                        
-                else:
-                    logger.error(f"Custom MCP {server_name}: Unsupported type '{custom_type}', supported types are 'sse', 'http' and 'json'")
-                    continue
-                    
-            except Exception as e:
-                logger.error(f"Failed to initialize custom MCP {config.get('name', 'Unknown')}: {e}")
-                continue
+    async def _initialize_custom_mcp(self, config):
+        """Discover (or load from the catalog cache) one custom MCP's tools and register them."""
+        custom_type = config.get('customType', 'sse')
+        server_config = config.get('config', {})
+        enabled_tools = config.get('enabledTools', [])
+        server_name = config.get('name', 'Unknown')
+        
+        logger.info(f"Initializing custom MCP: {server_name} (type: {custom_type})")
+        
+        if custom_type in ('sse', 'http'):
+            if 'url' not in server_config:
+                logger.error(f"Custom MCP {server_name}: Missing 'url' in config")
+                return
+            url = server_config['url']
+            # List the tools on the pooled session (same key as the tool calls), so it is already open for them
+            headers = server_config.get('headers', {}) if custom_type == 'sse' else None
+            transport = TRANSPORT_SSE if custom_type == 'sse' else TRANSPORT_HTTP
+            server = url
+            discover = lambda: get_session_pool().list_tools(
+                transport, url, headers=headers, scope=self.mcp_manager.session_scope
+            )
+        elif custom_type == 'json':
+            if 'command' not in server_config:
+                logger.error(f"Custom MCP {server_name}: Missing 'command' in config")
+                return
+            server = server_config['command']
+            discover = lambda: self._list_stdio_tools(server_config)
+        else:
+            logger.error(f"Custom MCP {server_name}: Unsupported type '{custom_type}', supported types are 'sse', 'http' and 'json'")
+            return
+        
+        tools = await get_tool_catalog().get_or_discover(
+            catalog_key(f"custom_{custom_type}", server, server_config), discover
+        )
+        
+        tools_registered = 0
+        for tool in tools:
+            if not enabled_tools or tool.name in enabled_tools:
+                tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool.name}"
+                self._custom_tools[tool_name] = {
+                    'name': tool_name,
+                    'description': tool.description,
+                    'parameters': tool.inputSchema,
+                    'server': server_name,
+                    'original_name': tool.name,
+                    'is_custom': True,
+                    'custom_type': custom_type,
+                    'custom_config': server_config
+                }
+                tools_registered += 1
+                logger.debug(f"Registered custom tool: {tool_name}")
+        
+        logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
     
     async def initialize_and_register_tools(self, tool_registry=None):
         """Initialize MCP tools and optionally update the tool registry.
@@ -514,104 +333,41 @@ class MCPToolWrapper(Tool):
             custom_config = tool_info['custom_config']
             original_tool_name = tool_info['original_name']
             
-            if custom_type == 'sse':
-                # Execute SSE-based custom MCP using the same pattern as _connect_sse_server
-                url = custom_config['url']
-                headers = custom_config.get('headers', {})
-                
-                async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    try:
-                        # Try with headers first (same pattern as _connect_sse_server)
-                        async with sse_client(url, headers=headers) as (read, write):
-                            async with ClientSession(read, write) as session:
-                                await session.initialize()
-                                result = await session.call_tool(original_tool_name, arguments)
-                                
-                                # Handle the result properly
-                                if hasattr(result, 'content'):
-                                    content = result.content
-                                    if isinstance(content, list):
-                                        # Extract text from content list
-                                        text_parts = []
-                                        for item in content:
-                                            if hasattr(item, 'text'):
-                                                text_parts.append(item.text)
-                                            else:
-                                                text_parts.append(str(item))
-                                        content_str = "\n".join(text_parts)
-                                    elif hasattr(content, 'text'):
-                                        content_str = content.text
-                                    else:
-                                        content_str = str(content)
-                                    
-                                    return self.success_response(content_str)
-                                else:
-                                    return self.success_response(str(result))
-                                    
-                    except TypeError as e:
-                        if "unexpected keyword argument" in str(e):
-                            # Fallback: try without headers (exact pattern from _connect_sse_server)
-                            async with sse_client(url) as (read, write):
-                                async with ClientSession(read, write) as session:
-                                    await session.initialize()
-                                    result = await session.call_tool(original_tool_name, arguments)
-                                    
-                                    # Handle the result properly
-                                    if hasattr(result, 'content'):
-                                        content = result.content
-                                        if isinstance(content, list):
-                                            # Extract text from content list
-                                            text_parts = []
-                                            for item in content:
-                                                if hasattr(item, 'text'):
-                                                    text_parts.append(item.text)
-                                                else:
-                                                    text_parts.append(str(item))
-                                            content_str = "\n".join(text_parts)
-                                        elif hasattr(content, 'text'):
-                                            content_str = content.text
-                                        else:
-                                            content_str = str(content)
-                                        
-                                        return self.success_response(content_str)
-                                    else:
-                                        return self.success_response(str(result))
-                        else:
-                            raise
-            
-            elif custom_type == 'http':
-                # Execute HTTP-based custom MCP
+            if custom_type in ('sse', 'http'):
+                # SSE and HTTP custom MCPs reuse pooled sessions, keyed by URL and headers
                 url = custom_config['url']
+                headers = custom_config.get('headers', {}) if custom_type == 'sse' else None
+                transport = TRANSPORT_SSE if custom_type == 'sse' else TRANSPORT_HTTP
                 
                 async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    async with streamablehttp_client(url) as (read, write, _):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            result = await session.call_tool(original_tool_name, arguments)
-                            
-                            # Handle the result properly
-                            if hasattr(result, 'content'):
-                                content = result.content
-                                if isinstance(content, list):
-                                    # Extract text from content list
-                                    text_parts = []
-                                    for item in content:
-                                        if hasattr(item, 'text'):
-                                            text_parts.append(item.text)
-                                        else:
-                                            text_parts.append(str(item))
-                                    content_str = "\n".join(text_parts)
-                                elif hasattr(content, 'text'):
-                                    content_str = content.text
-                                else:
-                                    content_str = str(content)
-                                
-                                return self.success_response(content_str)
+                    result = await get_session_pool().call_tool(
+                        transport, url, original_tool_name, arguments,
+                        headers=headers, scope=self.mcp_manager.session_scope
+                    )
+                    
+                # Handle the result properly
+                if hasattr(result, 'content'):
+                    content = result.content
+                    if isinstance(content, list):
+                        # Extract text from content list
+                        text_parts = []
+                        for item in content:
+                            if hasattr(item, 'text'):
+                                text_parts.append(item.text)
                             else:
-                                return self.success_response(str(result))
+                                text_parts.append(str(item))
+                        content_str = "\n".join(text_parts)
+                    elif hasattr(content, 'text'):
+                        content_str = content.text
+                    else:
+                        content_str = str(content)
+                    
+                    return self.success_response(content_str)
+                else:
+                    return self.success_response(str(result))
                                 
             elif custom_type == 'json':
-                # Execute stdio-based custom MCP using the same pattern as _connect_stdio_server
+                # Execute stdio-based custom MCP using the same pattern as _list_stdio_tools
                 server_params = StdioServerParameters(
                     command=custom_config["command"],
                     args=custom_config.get("args", []),
@@ -704,6 +460,11 @@ class MCPToolWrapper(Tool):
         """
         return await self._execute_mcp_tool(tool_name, arguments)
             
+    async def release_sessions(self):
+        """Close the pooled MCP sessions used by this run and return the pool stats."""
+        await self.mcp_manager.release_sessions()
+        return get_session_pool().stats()
+            
     async def cleanup(self):
         """Disconnect all MCP servers."""
         if self._initialized:
@@ -1,6 +1,7 @@
 import traceback
 import json
 import base64
+import hashlib
 import io
 from PIL import Image
 
@@ -8,7 +9,8 @@ from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
 from sandbox.tool_base import SandboxToolsBase
 from utils.logger import logger
-from utils.s3_upload_utils import upload_base64_image
+from utils.s3_upload_utils import upload_image_bytes
+from sandbox.browser_client import get_browser_api_client
 
 
 class SandboxBrowserTool(SandboxToolsBase):
@@ -17,6 +19,9 @@ class SandboxBrowserTool(SandboxToolsBase):
     def __init__(self, project_id: str, thread_id: str, thread_manager: ThreadManager):
         super().__init__(project_id, thread_manager)
         self.thread_id = thread_id
+        # Last uploaded screenshot, reused when the page hasn't changed
+        self._last_screenshot_sha256 = None
+        self._last_screenshot_url = None
 
     def _validate_base64_image(self, base64_string: str, max_size_mb: int = 10) -> tuple[bool, str]:
         """
@@ -103,6 +108,50 @@ class SandboxBrowserTool(SandboxToolsBase):
             logger.error(f"Unexpected error during base64 image validation: {e}")
             return False, f"Validation error: {str(e)}"
 
+    async def _offload_screenshot(self, result: dict) -> None:
+        """Replace the screenshot in a browser API result with a storage URL.
+
+        The browser API writes each screenshot to a file named by its SHA-256.
+        The file is downloaded and uploaded once under that hash, and a
+        screenshot identical to the previous one reuses its URL without being
+        downloaded. Sandboxes built from older images still return
+        screenshot_base64, which goes through the same upload. Either way the
+        result keeps only the URL, hash and dimensions, never image data.
+        """
+        screenshot_path = result.pop("screenshot_path", None)
+        screenshot_base64 = result.pop("screenshot_base64", None)
+        digest = result.get("screenshot_sha256")
+
+        try:
+            if digest and digest == self._last_screenshot_sha256:
+                result["image_url"] = self._last_screenshot_url
+                return
+
+            if screenshot_path and digest:
+                image_data = await self._sandbox_call(self.sandbox.fs.download_file, screenshot_path)
+            elif screenshot_base64:
+                is_valid, validation_message = self._validate_base64_image(screenshot_base64)
+                if not is_valid:
+                    logger.warning(f"Screenshot validation failed: {validation_message}")
+                    result["image_validation_error"] = validation_message
+                    return
+                image_data = base64.b64decode(screenshot_base64.split(',')[-1])
+                digest = hashlib.sha256(image_data).hexdigest()
+                with Image.open(io.BytesIO(image_data)) as img:
+                    result["screenshot_width"], result["screenshot_height"] = img.size
+                result["screenshot_sha256"] = digest
+            else:
+                return
+
+            image_url = await upload_image_bytes(image_data, sha256=digest)
+            result["image_url"] = image_url
+            self._last_screenshot_sha256 = digest
+            self._last_screenshot_url = image_url
+            logger.debug(f"Uploaded screenshot to {image_url}")
+        except Exception as e:
+            logger.error(f"Failed to process screenshot: {e}")
+            result["image_upload_error"] = str(e)
+
     async def _execute_browser_action(self, endpoint: str, params: dict = None, method: str = "POST") -> ToolResult:
         """Execute a browser automation action through the API
         
@@ -118,100 +167,58 @@ class SandboxBrowserTool(SandboxToolsBase):
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
-            # Build the curl command
-            url = f"http://localhost:8003/api/automation/{endpoint}"
-            
-            if method == "GET" and params:
-                query_params = "&".join([f"{k}={v}" for k, v in params.items()])
-                url = f"{url}?{query_params}"
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-            else:
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-                if params:
-                    json_data = json.dumps(params)
-                    curl_cmd += f" -d '{json_data}'"
-            
-            logger.debug("\033[95mExecuting curl command:\033[0m")
-            logger.debug(f"{curl_cmd}")
-            
-            response = self.sandbox.process.exec(curl_cmd, timeout=30)
-            
-            if response.exit_code == 0:
-                try:
-                    result = json.loads(response.result)
+            # Direct HTTP to the sandbox's browser API, falling back to curl via exec
+            result = await get_browser_api_client().request(
+                self.sandbox, self.sandbox_id, endpoint, params, method
+            )
 
-                    if not "content" in result:
-                        result["content"] = ""
-                    
-                    if not "role" in result:
-                        result["role"] = "assistant"
-
-                    logger.info("Browser automation request completed successfully")
+            if not "content" in result:
+                result["content"] = ""
+            
+            if not "role" in result:
+                result["role"] = "assistant"
 
-                    if "screenshot_base64" in result:
-                        try:
-                            # Comprehensive validation of the base64 image data
-                            screenshot_data = result["screenshot_base64"]
-                            is_valid, validation_message = self._validate_base64_image(screenshot_data)
-                            
-                            if is_valid:
-                                logger.debug(f"Screenshot validation passed: {validation_message}")
-                                image_url = await upload_base64_image(screenshot_data)
-                                result["image_url"] = image_url
-                                logger.debug(f"Uploaded screenshot to {image_url}")
-                            else:
-                                logger.warning(f"Screenshot validation failed: {validation_message}")
-                                result["image_validation_error"] = validation_message
-                                
-                            # Remove base64 data from result to keep it clean
-                            del result["screenshot_base64"]
-                            
-                        except Exception as e:
-                            logger.error(f"Failed to process screenshot: {e}")
-                            result["image_upload_error"] = str(e)
+            logger.info("Browser automation request completed successfully")
 
-                    added_message = await self.thread_manager.add_message(
-                        thread_id=self.thread_id,
-                        type="browser_state",
-                        content=result,
-                        is_llm_message=False
-                    )
+            await self._offload_screenshot(result)
 
-                    success_response = {}
+            added_message = await self.thread_manager.add_message(
+                thread_id=self.thread_id,
+                type="browser_state",
+                content=result,
+                is_llm_message=False
+            )
+            # The agent loop picks the state up from here on its next iteration
+            self.thread_manager.get_run_state(self.thread_id).browser_state = result
 
-                    if result.get("success"):
-                        success_response["success"] = result["success"]
-                        success_response["message"] = result.get("message", "Browser action completed successfully")
-                    else:
-                        success_response["success"] = False
-                        success_response["message"] = result.get("message", "Browser action failed")
+            success_response = {}
 
-                    if added_message and 'message_id' in added_message:
-                        success_response['message_id'] = added_message['message_id']
-                    if result.get("url"):
-                        success_response["url"] = result["url"]
-                    if result.get("title"):
-                        success_response["title"] = result["title"]
-                    if result.get("element_count"):
-                        success_response["elements_found"] = result["element_count"]
-                    if result.get("pixels_below"):
-                        success_response["scrollable_content"] = result["pixels_below"] > 0
-                    if result.get("ocr_text"):
-                        success_response["ocr_text"] = result["ocr_text"]
-                    if result.get("image_url"):
-                        success_response["image_url"] = result["image_url"]
+            if result.get("success"):
+                success_response["success"] = result["success"]
+                success_response["message"] = result.get("message", "Browser action completed successfully")
+            else:
+                success_response["success"] = False
+                success_response["message"] = result.get("message", "Browser action failed")
 
-                    if success_response.get("success"):
-                        return self.success_response(success_response)
-                    else:
-                        return self.fail_response(success_response)
+            if added_message and 'message_id' in added_message:
+                success_response['message_id'] = added_message['message_id']
+            if result.get("url"):
+                success_response["url"] = result["url"]
+            if result.get("title"):
+                success_response["title"] = result["title"]
+            if result.get("element_count"):
+                success_response["elements_found"] = result["element_count"]
+            if result.get("pixels_below"):
+                success_response["scrollable_content"] = result["pixels_below"] > 0
+            if result.get("ocr_text"):
+                success_response["ocr_text"] = result["ocr_text"]
+            if result.get("image_url"):
+                success_response["image_url"] = result["image_url"]
 
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse response JSON: {response.result} {e}")
-                    return self.fail_response(f"Failed to parse response JSON: {response.result} {e}")
+            if success_response.get("success"):
+                return self.success_response(success_response)
             else:
-                logger.error(f"Browser automation request failed 2: {response}")
-                return self.fail_response(f"Browser automation request failed 2: {response}")
+                return self.fail_response(success_response)
 
         except Exception as e:
             logger.error(f"Error executing browser action: {e}")
@@ -198,7 +198,7 @@ class SandboxVisionTool(SandboxToolsBase):
 
                 # Check if file exists and get info
                 try:
-                    file_info = self.sandbox.fs.get_file_info(full_path)
+                    file_info = await self._sandbox_call(self.sandbox.fs.get_file_info, full_path)
                     if file_info.is_dir:
                         return self.fail_response(f"Path '{cleaned_path}' is a directory, not an image file.")
                 except Exception as e:
@@ -210,7 +210,7 @@ class SandboxVisionTool(SandboxToolsBase):
 
                 # Read image file content
                 try:
-                    image_bytes = self.sandbox.fs.download_file(full_path)
+                    image_bytes = await self._sandbox_call(self.sandbox.fs.download_file, full_path)
                 except Exception as e:
                     return self.fail_response(f"Could not read image file: {cleaned_path}")
 
@@ -248,14 +248,9 @@ class SandboxVisionTool(SandboxToolsBase):
                 "compressed_size": len(compressed_bytes)
             }
 
-            # Add the temporary message using the thread_manager callback
-            # Use a distinct type like 'image_context'
-            await self.thread_manager.add_message(
-                thread_id=self.thread_id,
-                type="image_context", # Use a specific type for this
-                content=image_context_data, # Store the dict directly
-                is_llm_message=False # This is context generated by a tool
-            )
+            # Hand the image to the agent loop in process; it is shown once on the
+            # next turn, so it doesn't need to go through the messages table
+            self.thread_manager.get_run_state(self.thread_id).image_contexts.append(image_context_data)
 
             # Inform the agent the image will be available next turn
             return self.success_response(f"Successfully loaded and compressed the image '{cleaned_path}' (reduced from {original_size / 1024:.1f}KB to {len(compressed_bytes) / 1024:.1f}KB).")
@@ -3,6 +3,7 @@ import httpx
 from typing import Optional, Dict, Any, List
 from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
+from agent.runtime_config import invalidate_agent_configs
 
 class UpdateAgentTool(Tool):
     """Tool for updating agent configuration.
@@ -164,6 +165,7 @@ class UpdateAgentTool(Tool):
             
             if not result.data:
                 return self.fail_response("Failed to update agent")
+            await invalidate_agent_configs(result.data[0]['account_id'])
 
             return self.success_response({
                 "message": "Agent updated successfully",
@@ -664,6 +666,7 @@ class UpdateAgentTool(Tool):
             
             if not update_result.data:
                 return self.fail_response("Failed to save MCP configuration")
+            await invalidate_agent_configs(update_result.data[0]['account_id'])
             
             return self.success_response({
                 "message": f"Successfully {action} MCP server '{display_name}' with {len(enabled_tools)} tools",
@@ -0,0 +1,158 @@
+"""
+Write-behind message persistence for AgentPress threads.
+
+Status events and tool results used to be inserted one at a time, with the
+stream waiting on every round-trip. MessageWriteBehind assigns message IDs and
+timestamps client-side, returns the row immediately and flushes queued rows to
+the messages table in bulk inserts, either on a short timer, when the batch is
+full, or when the caller asks for it (run end, failure, stop).
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from services.supabase import DBConnection
+from utils.logger import logger
+
+DEFAULT_FLUSH_INTERVAL = 0.1   # seconds between a first queued row and its flush
+DEFAULT_MAX_BATCH_SIZE = 50    # rows per bulk insert
+DEFAULT_MAX_RETRIES = 3        # failed flush attempts before giving up on a batch
+
+
+class MessageWriteBehind:
+    """Queues message rows and writes them to the database in ordered batches."""
+
+    def __init__(
+        self,
+        db: DBConnection,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        on_persisted: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+    ):
+        self.db = db
+        # Called with the rows of every successful insert, once the flush lock is released
+        self.on_persisted = on_persisted
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self._queue: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        # Flushes started when a batch fills up; the loop only keeps weak references to tasks
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self._last_created_at: Optional[datetime] = None
+        self._failed_attempts = 0
+
+    def _next_timestamp(self) -> datetime:
+        """Strictly increasing timestamps keep rows ordered however they are flushed."""
+        now = datetime.now(timezone.utc)
+        if self._last_created_at is not None and now <= self._last_created_at:
+            now = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = now
+        return now
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def enqueue(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a row for insertion and return it as it will be stored.
+
+        Args:
+            data: Column values for the messages table, without message_id or timestamps.
+
+        Returns:
+            The full row, including the client-assigned message_id and created_at.
+        """
+        timestamp = self._next_timestamp().isoformat()
+        row = {
+            'message_id': str(uuid.uuid4()),
+            **data,
+            'created_at': timestamp,
+            'updated_at': timestamp,
+        }
+        self._queue.append(row)
+
+        if len(self._queue) >= self.max_batch_size:
+            task = asyncio.create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_done)
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_after_interval())
+        return row
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background message flush failed: {task.exception()}")
+
+    async def _flush_after_interval(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def _insert(self, client, rows: List[Dict[str, Any]]) -> None:
+        await client.table('messages').insert(rows, returning='minimal', default_to_null=False).execute()
+
+    async def flush(self, final: bool = False) -> None:
+        """Write all queued rows, in order. Safe to call concurrently and repeatedly.
+
+        Args:
+            final: Don't defer failed batches to a later retry; fall back to
+                row-by-row inserts right away so nothing stays queued.
+        """
+        persisted: List[Dict[str, Any]] = []
+        try:
+            async with self._flush_lock:
+                while self._queue:
+                    batch = self._queue[:self.max_batch_size]
+                    try:
+                        client = await self.db.client
+                        await self._insert(client, batch)
+                        persisted.extend(batch)
+                    except Exception as e:
+                        self._failed_attempts += 1
+                        if not final and self._failed_attempts < self.max_retries:
+                            logger.warning(f"Failed to flush {len(batch)} messages (attempt {self._failed_attempts}/{self.max_retries}): {str(e)}")
+                            # Leave the batch at the head of the queue so ordering is preserved
+                            self._schedule_retry()
+                            return
+                        logger.error(f"Giving up on bulk insert of {len(batch)} messages, inserting one by one: {str(e)}")
+                        persisted.extend(await self._insert_individually(batch))
+                    del self._queue[:len(batch)]
+                    self._failed_attempts = 0
+                    logger.debug(f"Flushed {len(batch)} messages")
+        finally:
+            if persisted and self.on_persisted:
+                try:
+                    await self.on_persisted(persisted)
+                except Exception as e:
+                    logger.error(f"Failed to process {len(persisted)} persisted messages: {str(e)}")
+
+    def _schedule_retry(self) -> None:
+        if self._timer is None or self._timer.done() or self._timer is asyncio.current_task():
+            self._timer = asyncio.create_task(self._flush_after_interval())
+
+    async def _insert_individually(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert rows one at a time, dropping the ones that still fail; returns the inserted rows."""
+        inserted = []
+        for row in rows:
+            try:
+                client = await self.db.client
+                await self._insert(client, [row])
+                inserted.append(row)
+            except Exception as e:
+                logger.error(f"Dropping message {row.get('message_id')} of type '{row.get('type')}' in thread {row.get('thread_id')}: {str(e)}", exc_info=True)
+        return inserted
+
+    async def close(self) -> None:
+        """Flush everything that is still queued, retrying failed batches row by row."""
+        await self.flush(final=True)
+        pending = [task for task in self._flush_tasks if task is not asyncio.current_task()]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        # Nothing left to write, so a pending timer has no work to do
+        if not self._queue and self._timer and not self._timer.done() and self._timer is not asyncio.current_task():
+            self._timer.cancel()
@@ -17,10 +17,12 @@ from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple, Union, Call
 from dataclasses import dataclass
 from utils.logger import logger
 from agentpress.tool import ToolResult
-from agentpress.tool_registry import ToolRegistry
+from agentpress.tool_registry import ToolRegistry, validate_arguments
 from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.xml_stream_scanner import StreamingXMLScanner
 from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
+from services.prompt_cache import cache_usage, record_cache_usage
 from agentpress.utils.json_helpers import (
     ensure_dict, ensure_list, safe_json_parse, 
     to_json_string, format_for_yield
@@ -86,7 +88,7 @@ class ProcessorConfig:
 class ResponseProcessor:
     """Processes LLM responses, extracting and executing tool calls."""
     
-    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None):
+    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None, flush_messages_callback: Optional[Callable] = None):
         """Initialize the ResponseProcessor.
         
         Args:
@@ -94,9 +96,12 @@ class ResponseProcessor:
             add_message_callback: Callback function to add messages to the thread.
                 MUST return the full saved message object (dict) or None.
             agent_config: Optional agent configuration with version information
+            flush_messages_callback: Optional coroutine function that persists any
+                messages queued by add_message_callback. Awaited when a response ends.
         """
         self.tool_registry = tool_registry
         self.add_message = add_message_callback
+        self.flush_messages = flush_messages_callback
         self.trace = trace
         if not self.trace:
             self.trace = langfuse.trace(name="anonymous:response_processor")
@@ -106,6 +111,16 @@ class ResponseProcessor:
         self.target_agent_id = target_agent_id
         self.agent_config = agent_config
 
+    async def _flush_messages(self) -> None:
+        """Persist queued messages, logging rather than raising on failure."""
+        if not self.flush_messages:
+            return
+        try:
+            await self.flush_messages()
+        except Exception as e:
+            logger.error(f"Failed to flush queued messages: {str(e)}", exc_info=True)
+            self.trace.event(name="failed_to_flush_queued_messages", level="ERROR", status_message=(f"Failed to flush queued messages: {str(e)}"))
+
     async def _yield_message(self, message_obj: Optional[Dict[str, Any]]) -> Dict[str, Any]:
         """Helper to yield a message with proper formatting.
         
@@ -162,7 +177,8 @@ class ResponseProcessor:
         """
         accumulated_content = ""
         tool_calls_buffer = {}
-        current_xml_content = ""
+        xml_scanner = StreamingXMLScanner(self.tool_registry.xml_tools.keys())
+        unprocessed_xml_chunks = [] # Complete XML chunks found after the tool call limit was hit
         xml_chunks_buffer = []
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
@@ -233,6 +249,9 @@ class ResponseProcessor:
                         streaming_metadata["usage"]["completion_tokens"] = chunk.usage.completion_tokens
                     if hasattr(chunk.usage, 'total_tokens') and chunk.usage.total_tokens is not None:
                         streaming_metadata["usage"]["total_tokens"] = chunk.usage.total_tokens
+                    for name, value in cache_usage(chunk.usage).items():
+                        if value:
+                            streaming_metadata["usage"][name] = value
 
                 if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'finish_reason') and chunk.choices[0].finish_reason:
                     finish_reason = chunk.choices[0].finish_reason
@@ -255,7 +274,6 @@ class ResponseProcessor:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
                         accumulated_content += chunk_content
-                        current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
@@ -274,10 +292,12 @@ class ResponseProcessor:
                             self.trace.event(name="xml_tool_call_limit_reached", level="DEFAULT", status_message=(f"XML tool call limit reached - not yielding more content chunks"))
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
-                        if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
-                            for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+                        if config.xml_tool_calling:
+                            xml_chunks = xml_scanner.feed(chunk_content)
+                            for chunk_pos, xml_chunk in enumerate(xml_chunks):
+                                if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls:
+                                    unprocessed_xml_chunks.extend(xml_chunks[chunk_pos:])
+                                    break
                                 xml_chunks_buffer.append(xml_chunk)
                                 result = self._parse_xml_tool_call(xml_chunk)
                                 if result:
@@ -304,6 +324,7 @@ class ResponseProcessor:
                                     if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls:
                                         logger.debug(f"Reached XML tool call limit ({config.max_xml_tool_calls})")
                                         finish_reason = "xml_tool_limit_reached"
+                                        unprocessed_xml_chunks.extend(xml_chunks[chunk_pos + 1:])
                                         break # Stop processing more XML chunks in this delta
 
                     # --- Process Native Tool Call Chunks ---
@@ -412,6 +433,8 @@ class ResponseProcessor:
                     self.trace.event(name="failed_to_calculate_usage", level="WARNING", status_message=(f"Failed to calculate usage: {str(e)}"))
 
 
+            record_cache_usage(streaming_metadata["usage"], llm_model, self.trace)
+
             # Wait for pending tool executions from streaming phase
             tool_results_buffer = [] # Stores (tool_call, result, tool_index, context)
             if pending_tool_executions:
@@ -559,9 +582,8 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
+                    # Add complete chunks the stream loop skipped (only after the tool call limit was hit)
+                    xml_chunks_buffer.extend(unprocessed_xml_chunks)
                     # Process only chunks not already handled in the stream loop
                     remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
@@ -819,6 +841,8 @@ class ResponseProcessor:
                     thread_id=thread_id, type="status", content=end_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
                 )
+                # Persist everything queued during this response before handing control back
+                await self._flush_messages()
                 if end_msg_obj: yield format_for_yield(end_msg_obj)
             except Exception as final_e:
                 logger.error(f"Error in finally block: {str(final_e)}", exc_info=True)
@@ -862,6 +886,8 @@ class ResponseProcessor:
             )
             if start_msg_obj: yield format_for_yield(start_msg_obj)
 
+            record_cache_usage(getattr(llm_response, 'usage', None), llm_model, self.trace)
+
             # Extract finish_reason, content, tool calls
             if hasattr(llm_response, 'choices') and llm_response.choices:
                  if hasattr(llm_response.choices[0], 'finish_reason'):
@@ -1017,6 +1043,8 @@ class ResponseProcessor:
                 thread_id=thread_id, type="status", content=end_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
+            # Persist everything queued during this response before handing control back
+            await self._flush_messages()
             if end_msg_obj: yield format_for_yield(end_msg_obj)
 
     # XML parsing methods
@@ -1358,18 +1386,22 @@ class ResponseProcessor:
                 except json.JSONDecodeError:
                     arguments = {"text": arguments}
             
-            # Get available functions from tool registry
-            available_functions = self.tool_registry.get_available_functions()
-            
-            # Look up the function by name
-            tool_fn = available_functions.get(function_name)
-            if not tool_fn:
+            # Look up the function in the registry's dispatch table
+            tool_function = self.tool_registry.get_function(function_name)
+            if not tool_function:
                 logger.error(f"Tool function '{function_name}' not found in registry")
                 span.end(status_message="tool_not_found", level="ERROR")
                 return ToolResult(success=False, output=f"Tool function '{function_name}' not found")
+
+            # XML tool calls carry every value as a string, so only their names are checked
+            errors = validate_arguments(tool_function, arguments, check_types="xml_tag_name" not in tool_call)
+            if errors:
+                logger.warning(f"Invalid arguments for tool {function_name}: {errors}")
+                span.end(status_message="invalid_arguments", output=errors, level="ERROR")
+                return ToolResult(success=False, output=f"Invalid arguments for tool '{function_name}': {'; '.join(errors)}")
             
             logger.debug(f"Found tool function for '{function_name}', executing...")
-            result = await tool_fn(**arguments)
+            result = await tool_function.function(**arguments)
             logger.info(f"Tool execution complete: {function_name} -> {result}")
             span.end(status_message="tool_executed", output=result)
             return result
@@ -11,25 +11,113 @@ This module provides comprehensive conversation management, including:
 """
 
 import json
-from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, Set, Tuple
 from services.llm import make_llm_api_call
+from services.prompt_cache import history_boundary, is_cacheable_model
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
 from agentpress.context_manager import ContextManager
+from agentpress.token_cache import message_token_cache
+from agentpress.message_writer import MessageWriteBehind
 from agentpress.response_processor import (
     ResponseProcessor,
     ProcessorConfig
 )
 from services.supabase import DBConnection
+from services.billing import record_usage
 from utils.logger import logger
 from langfuse.client import StatefulGenerationClient, StatefulTraceClient
 from services.langfuse import langfuse
 import datetime
-from litellm import token_counter
+import os
+
+# Rows changed up to this long before the newest one already read are read
+# again, for rows whose transaction committed after a later one
+MESSAGE_WINDOW_OVERLAP = datetime.timedelta(seconds=float(os.getenv("MESSAGE_WINDOW_OVERLAP", "10")))
 
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
 
+def _parse_json_content(content: Any) -> Any:
+    """Message content is JSONB, but older rows hold it as a JSON string."""
+    if isinstance(content, str):
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            return None
+    return content
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    return datetime.datetime.fromisoformat(value) if value else None
+
+@dataclass
+class MessageWindow:
+    """In-memory window of a thread's LLM messages for the duration of a run.
+
+    Loaded once from the database and then extended with the rows changed since
+    the last read, plus messages added through add_message. The read watermark
+    only advances from rows read back from the database; messages added in
+    process just record their version, so they are recognised when read back.
+    """
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    message_ids: Set[str] = field(default_factory=set)
+    # updated_at of every persisted message seen, including unparseable ones
+    versions: Dict[str, Optional[datetime.datetime]] = field(default_factory=dict)
+    last_created_at: Optional[datetime.datetime] = None
+    watermark: Optional[datetime.datetime] = None
+
+    def append(self, message: Dict[str, Any], created_at: Optional[str], updated_at: Optional[str] = None) -> None:
+        message_id = message.get('message_id')
+        if message_id in self.message_ids:
+            return
+        if message_id:
+            self.message_ids.add(message_id)
+            self.versions[message_id] = _parse_timestamp(updated_at or created_at)
+        self.messages.append(message)
+        created = _parse_timestamp(created_at)
+        if created and (self.last_created_at is None or created > self.last_created_at):
+            self.last_created_at = created
+
+    def observe(self, row: Dict[str, Any]) -> None:
+        """Advance the watermark past a row read from the database."""
+        updated = _parse_timestamp(row.get('updated_at') or row.get('created_at'))
+        if updated and (self.watermark is None or updated > self.watermark):
+            self.watermark = updated
+
+    def is_stale(self, row: Dict[str, Any]) -> bool:
+        """Whether a row read back means the window no longer matches the database.
+
+        That is the case when a known message was updated, or a new one sorts
+        before messages already in the window (it committed late).
+        """
+        message_id = row['message_id']
+        if message_id in self.versions:
+            known = self.versions[message_id]
+            updated = _parse_timestamp(row.get('updated_at'))
+            return known is not None and updated is not None and updated > known
+        created = _parse_timestamp(row.get('created_at'))
+        return created is not None and self.last_created_at is not None and created < self.last_created_at
+
+@dataclass
+class RunState:
+    """In-process state of a thread that the agent loop checks every iteration.
+
+    Seeded once from the database when a run starts and then kept current in
+    process: add_message records the latest message type, and tools hand the
+    browser state and image context over directly instead of the loop reading
+    them back from the messages table.
+    """
+    latest_message_type: Optional[str] = None
+    latest_user_message: Optional[Dict[str, Any]] = None
+    browser_state: Optional[Dict[str, Any]] = None
+    # Images requested with see_image, shown to the model once on the next turn
+    image_contexts: List[Dict[str, Any]] = field(default_factory=list)
+
+    def take_image_contexts(self) -> List[Dict[str, Any]]:
+        image_contexts, self.image_contexts = self.image_contexts, []
+        return image_contexts
+
 class ThreadManager:
     """Manages conversation threads with LLM models and tool execution.
 
@@ -38,7 +126,7 @@ class ThreadManager:
     XML-based tool execution patterns.
     """
 
-    def __init__(self, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None):
+    def __init__(self, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None, write_behind: bool = True):
         """Initialize ThreadManager.
 
         Args:
@@ -46,8 +134,11 @@ class ThreadManager:
             is_agent_builder: Whether this is an agent builder session
             target_agent_id: ID of the agent being built (if in agent builder mode)
             agent_config: Optional agent configuration with version information
+            write_behind: Queue new messages and insert them in batches instead of
+                          one synchronous insert per message
         """
         self.db = DBConnection()
+        self.message_writer = MessageWriteBehind(self.db, on_persisted=self._record_persisted_usage) if write_behind else None
         self.tool_registry = ToolRegistry()
         self.trace = trace
         self.is_agent_builder = is_agent_builder
@@ -58,12 +149,21 @@ class ThreadManager:
         self.response_processor = ResponseProcessor(
             tool_registry=self.tool_registry,
             add_message_callback=self.add_message,
+            flush_messages_callback=self.flush_messages,
             trace=self.trace,
             is_agent_builder=self.is_agent_builder,
             target_agent_id=self.target_agent_id,
             agent_config=self.agent_config
         )
         self.context_manager = ContextManager()
+        self.token_cache = message_token_cache
+        # Model used for token counting, set once run_thread knows it
+        self.token_count_model: Optional[str] = None
+        # LLM message windows per thread, so each turn only loads new rows
+        self.message_windows: Dict[str, MessageWindow] = {}
+        self.run_states: Dict[str, RunState] = {}
+        # Compressed content of cached prefix messages by message_id, with the content it was compressed from
+        self.compressed_prefix: Dict[str, Tuple[Any, Any]] = {}
 
     def _is_tool_result_message(self, msg: Dict[str, Any]) -> bool:
         if not ("content" in msg and msg['content']):
@@ -126,16 +226,16 @@ class ThreadManager:
             else:
                 return msg_content
   
-    def _compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
+    def _compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000, protected: int = 0) -> List[Dict[str, Any]]:
         """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.token_cache.count_messages(messages, llm_model)
 
         if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
             _i = 0 # Count the number of ToolResult messages
-            for msg in reversed(messages): # Start from the end and work backwards
+            for msg in reversed(messages[protected:]): # Start from the end and work backwards, skipping the cached prefix
                 if self._is_tool_result_message(msg): # Only compress ToolResult messages
                     _i += 1 # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
+                    msg_token_count = self.token_cache.count_message(msg, llm_model) # Count the number of tokens in the message
                     if msg_token_count > token_threshold: # If the message is too long
                         if _i > 1: # If this is not the most recent ToolResult message
                             message_id = msg.get('message_id') # Get the message_id
@@ -147,16 +247,16 @@ class ThreadManager:
                             msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
         return messages
 
-    def _compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
+    def _compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000, protected: int = 0) -> List[Dict[str, Any]]:
         """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.token_cache.count_messages(messages, llm_model)
 
         if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
             _i = 0 # Count the number of User messages
-            for msg in reversed(messages): # Start from the end and work backwards
+            for msg in reversed(messages[protected:]): # Start from the end and work backwards, skipping the cached prefix
                 if msg.get('role') == 'user': # Only compress User messages
                     _i += 1 # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
+                    msg_token_count = self.token_cache.count_message(msg, llm_model) # Count the number of tokens in the message
                     if msg_token_count > token_threshold: # If the message is too long
                         if _i > 1: # If this is not the most recent User message
                             message_id = msg.get('message_id') # Get the message_id
@@ -168,15 +268,15 @@ class ThreadManager:
                             msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
         return messages
 
-    def _compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
+    def _compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000, protected: int = 0) -> List[Dict[str, Any]]:
         """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.token_cache.count_messages(messages, llm_model)
         if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
             _i = 0 # Count the number of Assistant messages
-            for msg in reversed(messages): # Start from the end and work backwards
+            for msg in reversed(messages[protected:]): # Start from the end and work backwards, skipping the cached prefix
                 if msg.get('role') == 'assistant': # Only compress Assistant messages
                     _i += 1 # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
+                    msg_token_count = self.token_cache.count_message(msg, llm_model) # Count the number of tokens in the message
                     if msg_token_count > token_threshold: # If the message is too long
                         if _i > 1: # If this is not the most recent Assistant message
                             message_id = msg.get('message_id') # Get the message_id
@@ -212,12 +312,18 @@ class ThreadManager:
                 new_msg["content"] = json.dumps(msg_content_copy)
                 result.append(new_msg)
             else:
-                result.append(msg)
+                # Copy so that compression never mutates the caller's messages
+                result.append(msg.copy())
         return result
 
     def _compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = 41000, token_threshold: Optional[int] = 4096, max_iterations: int = 5) -> List[Dict[str, Any]]:
         """Compress the messages.
             token_threshold: must be a power of 2
+
+        For models with prompt caching, a message before the last cache breakpoint
+        keeps the form it was first compressed to on later calls, so the cached
+        prefix stays byte-identical. It is only compressed further when the
+        messages don't fit otherwise.
         """
 
         if 'sonnet' in llm_model.lower():
@@ -234,15 +340,30 @@ class ThreadManager:
         result = messages
         result = self._remove_meta_messages(result)
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=result)
+        uncompressed_total_token_count = self.token_cache.count_messages(result, llm_model)
+
+        # Messages before the last prompt cache breakpoint must stay byte-identical between calls
+        prefix = result[:history_boundary(result)] if is_cacheable_model(llm_model) else []
+        originals = [msg.get('content') for msg in prefix]
+        # Prefix messages compressed on an earlier call are sent exactly as they were then
+        for msg in prefix:
+            frozen = self.compressed_prefix.get(msg.get('message_id'))
+            if frozen and frozen[0] == msg.get('content'):
+                msg['content'] = frozen[1]
 
-        result = self._compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
-        result = self._compress_user_messages(result, llm_model, max_tokens, token_threshold)
-        result = self._compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
+        # Compress the messages after the prefix first, and the prefix only if that is not enough
+        for protected in ([len(prefix), 0] if prefix else [0]):
+            result = self._compress_tool_result_messages(result, llm_model, max_tokens, token_threshold, protected)
+            result = self._compress_user_messages(result, llm_model, max_tokens, token_threshold, protected)
+            result = self._compress_assistant_messages(result, llm_model, max_tokens, token_threshold, protected)
 
-        compressed_token_count = token_counter(model=llm_model, messages=result)
+        for msg, original in zip(prefix, originals):
+            if msg.get('content') is not original and msg.get('message_id'):
+                self.compressed_prefix[msg['message_id']] = (original, msg['content'])
 
-        logger.info(f"_compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}") # Log the token compression for debugging later
+        compressed_token_count = self.token_cache.count_messages(result, llm_model)
+
+        logger.info(f"_compress_messages: {uncompressed_total_token_count} -> {compressed_token_count} (token cache: {self.token_cache.stats()})") # Log the token compression for debugging later
 
         if max_iterations <= 0:
             logger.warning(f"_compress_messages: Max iterations reached, omitting messages")
@@ -279,7 +400,7 @@ class ThreadManager:
         result = self._remove_meta_messages(result)
 
         # Early exit if no compression needed
-        initial_token_count = token_counter(model=llm_model, messages=result)
+        initial_token_count = self.token_cache.count_messages(result, llm_model)
         max_allowed_tokens = max_tokens or (100 * 1000)
         
         if initial_token_count <= max_allowed_tokens:
@@ -304,38 +425,45 @@ class ThreadManager:
                 # Remove from middle, keeping recent and early context
                 middle_start = len(conversation_messages) // 2 - (removal_batch_size // 2)
                 middle_end = middle_start + removal_batch_size
+                removed_messages = conversation_messages[middle_start:middle_end]
                 conversation_messages = conversation_messages[:middle_start] + conversation_messages[middle_end:]
             else:
                 # Remove from earlier messages, preserving recent context
                 messages_to_remove = min(removal_batch_size, len(conversation_messages) // 2)
                 if messages_to_remove > 0:
+                    removed_messages = conversation_messages[:messages_to_remove]
                     conversation_messages = conversation_messages[messages_to_remove:]
                 else:
                     # Can't remove any more messages
                     break
 
-            # Recalculate token count
-            messages_to_count = ([system_message] + conversation_messages) if system_message else conversation_messages
-            current_token_count = token_counter(model=llm_model, messages=messages_to_count)
+            # Update the token count from the cached counts of the removed messages
+            current_token_count -= self.token_cache.count_messages(removed_messages, llm_model)
 
         # Prepare final result
         final_messages = ([system_message] + conversation_messages) if system_message else conversation_messages
-        final_token_count = token_counter(model=llm_model, messages=final_messages)
+        final_token_count = self.token_cache.count_messages(final_messages, llm_model)
         
         logger.info(f"_compress_messages_by_omitting_messages: {initial_token_count} -> {final_token_count} tokens ({len(messages)} -> {len(final_messages)} messages)")
             
         return final_messages
     
     def _middle_out_messages(self, messages: List[Dict[str, Any]], max_messages: int = 320) -> List[Dict[str, Any]]:
-        """Remove messages from the middle of the list, keeping max_messages total."""
+        """Remove messages from the middle of the list, keeping at most max_messages total.
+
+        The removed range grows in steps of a quarter of max_messages rather than
+        by one message per turn, so the kept messages (and a cached prompt prefix
+        over them) stay the same between consecutive calls.
+        """
         if len(messages) <= max_messages:
             return messages
         
-        # Keep half from the beginning and half from the end
+        # Keep half from the beginning and the rest from the end
         keep_start = max_messages // 2
-        keep_end = max_messages - keep_start
+        step = max(1, max_messages // 4)
+        removed = -(-(len(messages) - max_messages) // step) * step
         
-        return messages[:keep_start] + messages[-keep_end:]
+        return messages[:keep_start] + messages[keep_start + removed:]
 
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
@@ -354,6 +482,9 @@ class ThreadManager:
     ):
         """Add a message to the thread in the database.
 
+        With write-behind enabled the message gets a client-side ID and timestamp
+        and is returned immediately; the insert happens with the next batch flush.
+
         Args:
             thread_id: The ID of the thread to add the message to.
             type: The type of the message (e.g., 'text', 'image_url', 'tool_call', 'tool', 'user', 'assistant').
@@ -367,7 +498,6 @@ class ThreadManager:
             agent_version_id: Optional ID of the specific agent version used.
         """
         logger.debug(f"Adding message of type '{type}' to thread {thread_id} (agent: {agent_id}, version: {agent_version_id})")
-        client = await self.db.client
 
         # Prepare data for insertion
         data_to_insert = {
@@ -384,12 +514,29 @@ class ThreadManager:
         if agent_version_id:
             data_to_insert['agent_version_id'] = agent_version_id
 
+        # Persist the token count of LLM messages so compression never has to re-tokenize them
+        if is_llm_message and self.token_count_model and isinstance(content, dict):
+            try:
+                llm_view = self._remove_meta_messages([content])[0]
+                data_to_insert['token_counts'] = self.token_cache.build_persisted(llm_view, self.token_count_model)
+            except Exception as e:
+                logger.warning(f"Failed to count tokens for new message in thread {thread_id}: {str(e)}")
+
+        if self.message_writer:
+            # Write-behind: the row gets its ID now and is inserted with the next batch
+            saved_message = self.message_writer.enqueue(data_to_insert)
+            self._on_message_saved(saved_message, data_to_insert)
+            return saved_message
+
         try:
+            client = await self.db.client
             # Add returning='representation' to get the inserted row data including the id
             result = await client.table('messages').insert(data_to_insert, returning='representation').execute()
             logger.info(f"Successfully added message to thread {thread_id}")
 
             if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
+                self._on_message_saved(result.data[0], data_to_insert)
+                await self._record_persisted_usage([result.data[0]])
                 return result.data[0]
             else:
                 logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
@@ -398,11 +545,94 @@ class ThreadManager:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
             raise
 
+    async def _record_persisted_usage(self, rows: List[Dict[str, Any]]) -> None:
+        """Add the token usage of persisted assistant_response_end rows to the monthly usage rollup.
+
+        Runs once the rows are in the database (from the write-behind flush),
+        so the rollup never counts a message that was dropped, and streaming
+        never waits on it.
+        """
+        for row in rows:
+            if row.get('type') != 'assistant_response_end' or not isinstance(row.get('content'), dict):
+                continue
+            try:
+                client = await self.db.client
+                await record_usage(client, row['thread_id'], row['content'])
+            except Exception as e:
+                logger.error(f"Failed to record usage for thread {row['thread_id']}: {str(e)}")
+
+    def _on_message_saved(self, saved_message: Dict[str, Any], data_to_insert: Dict[str, Any]) -> None:
+        """Update the token cache, message window and run state for a newly saved message."""
+        if 'token_counts' in data_to_insert:
+            self.token_cache.seed(saved_message['message_id'], data_to_insert['token_counts'])
+        if data_to_insert['type'] in ('assistant', 'tool', 'user'):
+            self.get_run_state(data_to_insert['thread_id']).latest_message_type = data_to_insert['type']
+        # Put new LLM messages straight into the run's window, no reload needed
+        window = self.message_windows.get(saved_message['thread_id'])
+        if saved_message.get('is_llm_message') and window is not None:
+            parsed = self._parse_llm_message_row(saved_message)
+            if parsed is not None:
+                window.append(parsed, saved_message.get('created_at'), saved_message.get('updated_at'))
+
+    async def flush_messages(self) -> None:
+        """Write all queued messages to the database. No-op without write-behind."""
+        if self.message_writer:
+            await self.message_writer.close()
+
+    def _parse_llm_message_row(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Turn a messages row into an LLM message dict carrying its message_id."""
+        if isinstance(item['content'], str):
+            try:
+                parsed_item = json.loads(item['content'])
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse message: {item['content']}")
+                return None
+        else:
+            parsed_item = dict(item['content'])
+        parsed_item['message_id'] = item['message_id']
+        return parsed_item
+
+    def get_run_state(self, thread_id: str) -> RunState:
+        """Get the in-process run state of a thread, creating an empty one if needed."""
+        state = self.run_states.get(thread_id)
+        if state is None:
+            state = self.run_states[thread_id] = RunState()
+        return state
+
+    async def load_run_state(self, thread_id: str) -> RunState:
+        """Seed the run state of a thread from the database with a single query.
+
+        Image contexts left over from an earlier run are deleted once loaded,
+        since they are only shown to the model once.
+        """
+        client = await self.db.client
+        result = await client.rpc('get_thread_run_state', {'p_thread_id': thread_id}).execute()
+        row = result.data or {}
+
+        state = self.get_run_state(thread_id)
+        state.latest_message_type = row.get('latest_message_type')
+        state.latest_user_message = _parse_json_content(row.get('latest_user_message'))
+        state.browser_state = _parse_json_content(row.get('browser_state'))
+        state.image_contexts = [_parse_json_content(item['content']) for item in row.get('image_contexts') or []]
+
+        image_context_ids = [item['message_id'] for item in row.get('image_contexts') or []]
+        if image_context_ids:
+            await client.table('messages').delete().in_('message_id', image_context_ids).execute()
+        return state
+
+    def reset_message_window(self, thread_id: str) -> None:
+        """Drop the cached message window so the next get_llm_messages reloads the thread."""
+        self.message_windows.pop(thread_id, None)
+
     async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
 
-        This method uses the SQL function which handles context truncation
-        by considering summary messages.
+        The first call loads the whole thread into an in-memory window; later
+        calls only fetch rows updated since shortly before the last one read, so
+        per-turn database load is proportional to new messages rather than to
+        thread length. Each delta also counts the thread's LLM messages, and the
+        window is reloaded in full when a message was updated or deleted, or a
+        row turns up that the delta missed or that sorts before the window's end.
 
         Args:
             thread_id: The ID of the thread to get messages for.
@@ -413,16 +643,25 @@ class ThreadManager:
         logger.debug(f"Getting messages for thread {thread_id}")
         client = await self.db.client
 
+        window = self.message_windows.get(thread_id)
+        is_delta = window is not None
+
+        if self.message_writer and self.message_writer.pending:
+            # Both loads read from the database, so queued rows must be there first
+            await self.message_writer.flush()
+
         try:
-            # result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
-            
             # Fetch messages in batches of 1000 to avoid overloading the database
             all_messages = []
             batch_size = 1000
             offset = 0
             
             while True:
-                result = await client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').range(offset, offset + batch_size - 1).execute()
+                query = client.table('messages').select('message_id, content, token_counts, created_at, updated_at').eq('thread_id', thread_id).eq('is_llm_message', True)
+                if is_delta and window.watermark:
+                    # Rows already in the window are re-read and deduplicated by message_id
+                    query = query.gte('updated_at', (window.watermark - MESSAGE_WINDOW_OVERLAP).isoformat())
+                result = await query.order('created_at').range(offset, offset + batch_size - 1).execute()
                 
                 if not result.data or len(result.data) == 0:
                     break
@@ -434,33 +673,50 @@ class ThreadManager:
                     break
                     
                 offset += batch_size
-            
-            # Use all_messages instead of result.data in the rest of the method
-            result_data = all_messages
-
-            # Parse the returned data which might be stringified JSON
-            if not result_data:
-                return []
 
-            # Return properly parsed JSON objects
-            messages = []
-            for item in result_data:
-                if isinstance(item['content'], str):
-                    try:
-                        parsed_item = json.loads(item['content'])
-                        parsed_item['message_id'] = item['message_id']
-                        messages.append(parsed_item)
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse message: {item['content']}")
-                else:
-                    content = item['content']
-                    content['message_id'] = item['message_id']
-                    messages.append(content)
-
-            return messages
+            if is_delta:
+                stale = any(window.is_stale(item) for item in all_messages)
+                if not stale and not (self.message_writer and self.message_writer.pending):
+                    # A count that differs means rows were deleted or missed by the delta
+                    known = set(window.versions).union(item['message_id'] for item in all_messages)
+                    count = await client.table('messages').select('message_id', count='exact', head=True).eq('thread_id', thread_id).eq('is_llm_message', True).execute()
+                    stale = count.count is not None and count.count != len(known)
+                if stale:
+                    logger.info(f"Message window for thread {thread_id} is out of date, reloading")
+                    self.reset_message_window(thread_id)
+                    messages = await self.get_llm_messages(thread_id)
+                    if thread_id not in self.message_windows:
+                        # The reload failed, keep what we had
+                        self.message_windows[thread_id] = window
+                        return list(window.messages)
+                    return messages
+            else:
+                window = MessageWindow()
+
+            new_count = 0
+            for item in all_messages:
+                window.observe(item)
+                if item['message_id'] in window.message_ids:
+                    continue
+                parsed_item = self._parse_llm_message_row(item)
+                if parsed_item is None:
+                    window.versions[item['message_id']] = _parse_timestamp(item.get('updated_at'))
+                    continue
+                self.token_cache.seed(item['message_id'], item.get('token_counts'))
+                window.append(parsed_item, item.get('created_at'), item.get('updated_at'))
+                new_count += 1
+
+            self.message_windows[thread_id] = window
+            logger.debug(f"Message window for thread {thread_id}: {new_count} new, {len(window.messages)} total ({'delta' if is_delta else 'full'} load)")
+
+            # Return a copy so callers can't reorder the window
+            return list(window.messages)
 
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
+            if is_delta:
+                # Fall back to the last known window rather than an empty history
+                return list(window.messages)
             return []
 
     async def run_thread(
@@ -514,6 +770,7 @@ class ThreadManager:
 
         # Log model info
         logger.info(f"🤖 Thread {thread_id}: Using model {llm_model}")
+        self.token_count_model = llm_model
 
         # Apply max_xml_tool_calls if specified and not already set in config
         if max_xml_tool_calls > 0 and not processor_config.max_xml_tool_calls:
@@ -582,7 +839,7 @@ Here are the XML tools available with examples:
                 token_count = 0
                 try:
                     # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
+                    token_count = self.token_cache.count_messages([working_system_prompt] + messages, llm_model)
                     token_threshold = self.context_manager.token_threshold
                     logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
 
@@ -0,0 +1,141 @@
+"""
+Per-message token count cache for AgentPress threads.
+
+Counting tokens with litellm over a whole thread is expensive, and message
+compression used to do it several times per LLM call. This module caches the
+token count of every message, keyed by its message_id and a fingerprint of the
+exact content that was counted, so only new or changed messages get tokenized.
+
+Counts for stored messages are also persisted in the `token_counts` column of
+the messages table together with a SHA-1 of the counted content, allowing
+other workers and later runs to reuse them.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+from litellm import token_counter
+
+# Maximum number of cached counts kept in memory per process
+DEFAULT_MAX_ENTRIES = 50000
+
+CacheKey = Tuple[str, int, str]
+
+
+def message_content_hash(message: Dict[str, Any]) -> str:
+    """Stable hash of a message, ignoring its message_id. Used for persisted counts."""
+    payload = {k: v for k, v in message.items() if k != 'message_id'}
+    serialized = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def _fingerprint(message: Dict[str, Any]) -> int:
+    """Cheap in-process fingerprint of a message, ignoring its message_id.
+
+    Python caches the hash of str objects, so fingerprinting a message whose
+    content string was already seen is effectively free.
+    """
+    parts = []
+    for key, value in message.items():
+        if key == 'message_id':
+            continue
+        if isinstance(value, str):
+            parts.append((key, hash(value)))
+        else:
+            parts.append((key, json.dumps(value, sort_keys=True, default=str)))
+    return hash(frozenset(parts))
+
+
+class MessageTokenCache:
+    """LRU cache of per-message token counts.
+
+    Entries are keyed by (message_id, content fingerprint, model). Messages
+    without a message_id (system prompt, temporary messages) are keyed by their
+    fingerprint alone, which is still stable across turns.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[CacheKey, int]" = OrderedDict()
+        # Counts loaded from the database, keyed by (message_id, model) -> (content hash, count)
+        self._persisted: "OrderedDict[Tuple[str, str], Tuple[str, int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(message: Dict[str, Any], model: str) -> CacheKey:
+        return (str(message.get('message_id') or ''), _fingerprint(message), model or '')
+
+    @staticmethod
+    def _store(cache: OrderedDict, key: Any, value: Any, max_entries: int) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_entries:
+            cache.popitem(last=False)
+
+    def _from_persisted(self, message: Dict[str, Any], model: str) -> Optional[int]:
+        message_id = message.get('message_id')
+        if not message_id:
+            return None
+        persisted = self._persisted.get((str(message_id), model))
+        if persisted is None:
+            return None
+        content_hash, count = persisted
+        return count if content_hash == message_content_hash(message) else None
+
+    def count_message(self, message: Dict[str, Any], model: str) -> int:
+        """Return the token count of a single message, tokenizing only on a miss."""
+        key = self._key(message, model)
+        count = self._counts.get(key)
+        if count is not None:
+            self.hits += 1
+            self._counts.move_to_end(key)
+            return count
+
+        count = self._from_persisted(message, model)
+        if count is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            count = token_counter(model=model, messages=[message])
+        self._store(self._counts, key, count, self.max_entries)
+        return count
+
+    def count_messages(self, messages: List[Dict[str, Any]], model: str) -> int:
+        """Return the token count of a message list as the sum of cached per-message counts.
+
+        For tokenizers that add per-message framing tokens this is a slight
+        overestimate compared to counting the list in one call, which keeps
+        compression thresholds on the safe side.
+        """
+        return sum(self.count_message(msg, model) for msg in messages)
+
+    def seed(self, message_id: str, token_counts: Optional[Dict[str, Any]]) -> None:
+        """Load persisted counts for a message fetched from the database.
+
+        Args:
+            message_id: ID of the message row
+            token_counts: Value of the `token_counts` column for that row
+        """
+        if not message_id or not isinstance(token_counts, dict):
+            return
+        content_hash = token_counts.get('hash')
+        counts = token_counts.get('counts')
+        if not content_hash or not isinstance(counts, dict):
+            return
+        for model, count in counts.items():
+            if isinstance(count, int):
+                self._store(self._persisted, (str(message_id), model), (content_hash, count), self.max_entries)
+
+    def build_persisted(self, message: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """Count a message and return the value to persist in the `token_counts` column."""
+        return {'hash': message_content_hash(message), 'counts': {model: self.count_message(message, model)}}
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._counts), 'hits': self.hits, 'misses': self.misses}
+
+
+# Process-wide cache shared by all ThreadManager instances
+message_token_cache = MessageTokenCache()
@@ -1,20 +1,96 @@
-from typing import Dict, Type, Any, List, Optional, Callable
-from agentpress.tool import Tool, SchemaType
+import inspect
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Type, Any, List, Optional, Callable, Mapping
+from agentpress.tool import Tool, SchemaType, ToolSchema
 from utils.logger import logger
 
+_JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list, tuple),
+    "object": (dict,),
+    "null": (type(None),),
+}
+
+
+@dataclass(frozen=True)
+class ToolFunction:
+    """A dispatchable tool function and the JSON schema of its arguments."""
+    name: str
+    function: Callable
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    accepts_any_arguments: bool = False
+
+
+def _is_json_type(value: Any, json_type: Any) -> bool:
+    types = json_type if isinstance(json_type, list) else [json_type]
+    for name in types:
+        python_types = _JSON_TYPES.get(name)
+        if python_types is None:
+            return True
+        # bool is an int in Python but not a JSON integer or number
+        if isinstance(value, bool) and name in ("integer", "number"):
+            continue
+        if isinstance(value, python_types):
+            return True
+    return False
+
+
+def validate_arguments(tool_function: ToolFunction, arguments: Any, check_types: bool = True) -> List[str]:
+    """Check tool call arguments against the function's parameter schema.
+
+    Args:
+        tool_function: The function being called
+        arguments: Arguments of the call
+        check_types: Whether to check value types; XML tool calls carry every value as a string
+
+    Returns:
+        List of problems, empty if the arguments are valid
+    """
+    if not isinstance(arguments, dict):
+        return [f"arguments must be an object, got {type(arguments).__name__}"]
+
+    schema = tool_function.parameters
+    properties = schema.get("properties") or {}
+    errors = [f"missing required argument '{name}'" for name in schema.get("required", []) if name not in arguments]
+
+    for name, value in arguments.items():
+        prop = properties.get(name)
+        if prop is None:
+            if properties and not tool_function.accepts_any_arguments:
+                errors.append(f"unexpected argument '{name}'")
+            continue
+        if not check_types or value is None or "type" not in prop:
+            continue
+        if not _is_json_type(value, prop["type"]):
+            errors.append(f"argument '{name}' must be of type {prop['type']}, got {type(value).__name__}")
+        elif "enum" in prop and value not in prop["enum"]:
+            errors.append(f"argument '{name}' must be one of {prop['enum']}")
+    return errors
+
 
 class ToolRegistry:
     """Registry for managing and accessing tools.
     
     Maintains a collection of tool instances and their schemas, allowing for
     selective registration of tool functions and easy access to tool capabilities.
+
+    Everything needed per LLM call and per tool call (the dispatch table, the
+    OpenAPI schemas and the XML examples) is built once when tools are
+    registered, and exposed read-only. `version` is bumped on every rebuild.
     
     Attributes:
         tools (Dict[str, Dict[str, Any]]): OpenAPI-style tools and schemas
         xml_tools (Dict[str, Dict[str, Any]]): XML-style tools and schemas
+        version (int): Number of times the dispatch table has been built
         
     Methods:
         register_tool: Register a tool with optional function filtering
+        register_schemas: Register further functions of an already registered tool instance
+        get_function: Get the dispatch entry of a function
         get_tool: Get a specific tool by name
         get_xml_tool: Get a tool by XML tag name
         get_openapi_schemas: Get OpenAPI schemas for function calling
@@ -25,6 +101,10 @@ class ToolRegistry:
         """Initialize a new ToolRegistry instance."""
         self.tools = {}
         self.xml_tools = {}
+        self.version = 0
+        self._functions: Mapping[str, ToolFunction] = MappingProxyType({})
+        self._openapi_schemas: List[Dict[str, Any]] = []
+        self._xml_examples: Mapping[str, str] = MappingProxyType({})
         logger.debug("Initialized new ToolRegistry instance")
     
     def register_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
@@ -44,7 +124,20 @@ class ToolRegistry:
         schemas = tool_instance.get_schemas()
         
         logger.debug(f"Available schemas for {tool_class.__name__}: {list(schemas.keys())}")
-        
+        self.register_schemas(tool_instance, schemas, function_names)
+
+    def register_schemas(self, tool_instance: Tool, schemas: Dict[str, List[ToolSchema]], function_names: Optional[List[str]] = None):
+        """Register functions of a tool instance from its schemas and rebuild the dispatch table.
+
+        Used directly for tools that add functions after registration, such as
+        the MCP wrapper once its servers are connected.
+
+        Args:
+            tool_instance: The tool instance providing the functions
+            schemas: Function name -> schemas, as returned by get_schemas()
+            function_names: Optional list of specific functions to register
+        """
+        tool_class_name = tool_instance.__class__.__name__
         registered_openapi = 0
         registered_xml = 0
         
@@ -57,7 +150,7 @@ class ToolRegistry:
                             "schema": schema
                         }
                         registered_openapi += 1
-                        logger.debug(f"Registered OpenAPI function {func_name} from {tool_class.__name__}")
+                        logger.debug(f"Registered OpenAPI function {func_name} from {tool_class_name}")
                     
                     if schema.schema_type == SchemaType.XML and schema.xml_schema:
                         self.xml_tools[schema.xml_schema.tag_name] = {
@@ -66,34 +159,64 @@ class ToolRegistry:
                             "schema": schema
                         }
                         registered_xml += 1
-                        logger.debug(f"Registered XML tag {schema.xml_schema.tag_name} -> {func_name} from {tool_class.__name__}")
+                        logger.debug(f"Registered XML tag {schema.xml_schema.tag_name} -> {func_name} from {tool_class_name}")
         
-        logger.debug(f"Tool registration complete for {tool_class.__name__}: {registered_openapi} OpenAPI functions, {registered_xml} XML tags")
+        self._rebuild()
+        logger.debug(f"Tool registration complete for {tool_class_name}: {registered_openapi} OpenAPI functions, {registered_xml} XML tags (registry version {self.version})")
+
+    def _rebuild(self) -> None:
+        """Build the dispatch table, OpenAPI schemas and XML examples from the registered tools."""
+        functions: Dict[str, ToolFunction] = {}
 
-    def get_available_functions(self) -> Dict[str, Callable]:
+        def add(function_name: str, tool_instance: Tool, openapi_schema: Optional[ToolSchema]) -> None:
+            function = getattr(tool_instance, function_name, None)
+            if function is None:
+                logger.error(f"Registered function {function_name} not found on {tool_instance.__class__.__name__}")
+                return
+            parameters = {}
+            if openapi_schema is not None:
+                parameters = openapi_schema.schema.get("function", {}).get("parameters") or {}
+            try:
+                accepts_any = any(
+                    p.kind == inspect.Parameter.VAR_KEYWORD
+                    for p in inspect.signature(function).parameters.values()
+                )
+            except (TypeError, ValueError):
+                accepts_any = True
+            functions[function_name] = ToolFunction(function_name, function, parameters, accepts_any)
+
+        for tool_name, tool_info in self.tools.items():
+            add(tool_name, tool_info['instance'], tool_info['schema'])
+
+        for tool_info in self.xml_tools.values():
+            method_name = tool_info['method']
+            openapi_info = self.tools.get(method_name)
+            add(method_name, tool_info['instance'], openapi_info['schema'] if openapi_info else None)
+
+        self._functions = MappingProxyType(functions)
+        self._openapi_schemas = [
+            tool_info['schema'].schema
+            for tool_info in self.tools.values()
+            if tool_info['schema'].schema_type == SchemaType.OPENAPI
+        ]
+        self._xml_examples = MappingProxyType({
+            tool_info['schema'].xml_schema.tag_name: tool_info['schema'].xml_schema.example
+            for tool_info in self.xml_tools.values()
+            if tool_info['schema'].xml_schema and tool_info['schema'].xml_schema.example
+        })
+        self.version += 1
+
+    def get_function(self, function_name: str) -> Optional[ToolFunction]:
+        """Get the dispatch entry of a function, or None if it isn't registered."""
+        return self._functions.get(function_name)
+
+    def get_available_functions(self) -> Mapping[str, Callable]:
         """Get all available tool functions.
         
         Returns:
-            Dict mapping function names to their implementations
+            Read-only mapping of function names to their implementations
         """
-        available_functions = {}
-        
-        # Get OpenAPI tool functions
-        for tool_name, tool_info in self.tools.items():
-            tool_instance = tool_info['instance']
-            function_name = tool_name
-            function = getattr(tool_instance, function_name)
-            available_functions[function_name] = function
-            
-        # Get XML tool functions
-        for tag_name, tool_info in self.xml_tools.items():
-            tool_instance = tool_info['instance']
-            method_name = tool_info['method']
-            function = getattr(tool_instance, method_name)
-            available_functions[method_name] = function
-            
-        logger.debug(f"Retrieved {len(available_functions)} available functions")
-        return available_functions
+        return MappingProxyType({name: entry.function for name, entry in self._functions.items()})
 
     def get_tool(self, tool_name: str) -> Dict[str, Any]:
         """Get a specific tool by name.
@@ -129,24 +252,12 @@ class ToolRegistry:
         Returns:
             List of OpenAPI-compatible schema definitions
         """
-        schemas = [
-            tool_info['schema'].schema 
-            for tool_info in self.tools.values()
-            if tool_info['schema'].schema_type == SchemaType.OPENAPI
-        ]
-        logger.debug(f"Retrieved {len(schemas)} OpenAPI schemas")
-        return schemas
+        return list(self._openapi_schemas)
 
-    def get_xml_examples(self) -> Dict[str, str]:
+    def get_xml_examples(self) -> Mapping[str, str]:
         """Get all XML tag examples.
         
         Returns:
-            Dict mapping tag names to their example usage
+            Read-only mapping of tag names to their example usage
         """
-        examples = {}
-        for tool_info in self.xml_tools.values():
-            schema = tool_info['schema']
-            if schema.xml_schema and schema.xml_schema.example:
-                examples[schema.xml_schema.tag_name] = schema.xml_schema.example
-        logger.debug(f"Retrieved {len(examples)} XML examples")
-        return examples
+        return self._xml_examples
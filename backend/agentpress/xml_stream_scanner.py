@@ -0,0 +1,121 @@
+"""
+Incremental XML tool call scanner for streamed LLM responses.
+
+ResponseProcessor used to re-run `_extract_xml_chunks` over the whole
+accumulated content for every delta, which made tool call detection quadratic
+in the response length. StreamingXMLScanner is fed one delta at a time and
+keeps its scan offset and open-block state between deltas, so every character
+is examined a bounded number of times. All registered tag names are matched
+with a single compiled alternation.
+
+It emits each complete `<function_calls>` block, or legacy `<tag-name ...>`
+block, exactly once, in the same form `_extract_xml_chunks` returns it.
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, List, Optional, Pattern, Tuple
+
+FUNCTION_CALLS_OPEN = '<function_calls>'
+FUNCTION_CALLS_CLOSE = '</function_calls>'
+
+# Once this much already-scanned text sits outside any block, drop it from the buffer
+_TRIM_THRESHOLD = 4096
+
+
+@lru_cache(maxsize=32)
+def _compile_open_pattern(tag_names: Tuple[str, ...]) -> Pattern:
+    """One alternation matching `<function_calls>` or the opening of any registered tag."""
+    alternatives = [re.escape(FUNCTION_CALLS_OPEN)]
+    if tag_names:
+        # Longest names first, so a tag that is a prefix of another never shadows it
+        names = sorted(tag_names, key=len, reverse=True)
+        alternatives.append(r'<(?P<tag>' + '|'.join(re.escape(n) for n in names) + r')(?=[\s/>])')
+    return re.compile('|'.join(alternatives))
+
+
+@lru_cache(maxsize=256)
+def _compile_tag_pattern(tag_name: str) -> Pattern:
+    """Matches a nested opening (`<tag`) or a closing tag (`</tag>`) of a legacy tool."""
+    name = re.escape(tag_name)
+    return re.compile(r'<(?P<close>/)?' + name + r'(?(close)>|(?=[\s/>]))')
+
+
+class StreamingXMLScanner:
+    """Finds complete XML tool call blocks in content that arrives in pieces."""
+
+    def __init__(self, tag_names: Iterable[str]):
+        self._tag_names = tuple(tag_names)
+        self._open_pattern = _compile_open_pattern(self._tag_names)
+        # Longest token that can straddle two deltas, e.g. a split `</function_calls>`
+        self._lookbehind = max([len(FUNCTION_CALLS_CLOSE)] + [len(n) + 3 for n in self._tag_names])
+        self._buffer = ""
+        self._pos = 0                       # Everything before this offset has been scanned
+        self._block_start: Optional[int] = None
+        self._block_tag: Optional[str] = None  # None for a <function_calls> block
+        self._depth = 0
+
+    def feed(self, delta: str) -> List[str]:
+        """Add the next piece of content and return the blocks it completed, in order."""
+        if not delta:
+            return []
+        self._buffer += delta
+        blocks = []
+        while True:
+            if self._block_start is None:
+                if not self._find_block_start():
+                    break
+            block = self._find_block_end()
+            if block is None:
+                break
+            blocks.append(block)
+        self._trim()
+        return blocks
+
+    def _resume_offset(self) -> int:
+        """Where the next scan may start: tokens cut off at the end of the buffer get rescanned."""
+        return max(self._pos, len(self._buffer) - self._lookbehind)
+
+    def _find_block_start(self) -> bool:
+        match = self._open_pattern.search(self._buffer, self._pos)
+        if match is None:
+            self._pos = self._resume_offset()
+            return False
+        self._block_start = match.start()
+        self._block_tag = match.group('tag') if self._tag_names else None
+        self._depth = 1
+        self._pos = match.end()
+        return True
+
+    def _find_block_end(self) -> Optional[str]:
+        if self._block_tag is None:
+            end = self._buffer.find(FUNCTION_CALLS_CLOSE, self._pos)
+            if end == -1:
+                self._pos = self._resume_offset()
+                return None
+            return self._close_block(end + len(FUNCTION_CALLS_CLOSE))
+
+        pattern = _compile_tag_pattern(self._block_tag)
+        for match in pattern.finditer(self._buffer, self._pos):
+            self._pos = match.end()
+            if match.group('close'):
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._close_block(match.end())
+            else:
+                self._depth += 1
+        self._pos = self._resume_offset()
+        return None
+
+    def _close_block(self, end: int) -> str:
+        block = self._buffer[self._block_start:end]
+        self._block_start = None
+        self._block_tag = None
+        self._depth = 0
+        self._pos = end
+        return block
+
+    def _trim(self) -> None:
+        if self._block_start is None and self._pos > _TRIM_THRESHOLD:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
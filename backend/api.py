@@ -21,6 +21,8 @@ from agent import api as agent_api
 from sandbox import api as sandbox_api
 from services import billing as billing_api
 from flags import api as feature_flags_api
+from flags import flags as feature_flags
+from mcp_local.credential_manager import credential_manager
 from services import transcription as transcription_api
 from services.mcp_custom import discover_custom_tools
 import sys
@@ -58,6 +60,7 @@ async def lifespan(app: FastAPI):
         try:
             await redis.initialize_async()
             logger.info("Redis connection initialized successfully")
+            await feature_flags.start()
         except Exception as e:
             logger.error(f"Failed to initialize Redis connection: {e}")
             # Continue without Redis - the application will handle Redis failures gracefully
@@ -71,6 +74,9 @@ async def lifespan(app: FastAPI):
         logger.info("Cleaning up agent resources")
         await agent_api.cleanup()
         
+        await feature_flags.stop()
+        await credential_manager.flush_last_used()
+        
         # Clean up Redis connection
         try:
             logger.info("Closing Redis connection")
@@ -1,19 +1,32 @@
+import asyncio
 import json
 import logging
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 from typing import Dict, List, Optional
 import sys
 from services import redis
 
 logger = logging.getLogger(__name__)
 
+# set_flag/delete_flag publish the flag key here so every process reloads its snapshot
+FLAG_INVALIDATION_CHANNEL = "feature_flags:invalidate"
+# Upper bound on how stale a snapshot gets when an invalidation message is missed
+FLAG_REFRESH_INTERVAL = float(os.getenv("FEATURE_FLAG_REFRESH_INTERVAL", "30"))
+
+
 class FeatureFlagManager:
     def __init__(self):
         """Initialize with existing Redis service"""
         self.flag_prefix = "feature_flag:"
         self.flag_list_key = "feature_flags:list"
-    
+        # Last known value of every flag; is_enabled answers from here
+        self._snapshot: Optional[Dict[str, bool]] = None
+        self._loaded_at = 0.0
+        self._load_lock: Optional[asyncio.Lock] = None
+        self._listener: Optional[asyncio.Task] = None
+
     async def set_flag(self, key: str, enabled: bool, description: str = "") -> bool:
         """Set a feature flag to enabled or disabled"""
         try:
@@ -21,32 +34,101 @@ class FeatureFlagManager:
             flag_data = {
                 'enabled': str(enabled).lower(),
                 'description': description,
-                'updated_at': datetime.utcnow().isoformat()
+                'updated_at': datetime.now(timezone.utc).isoformat()
             }
-            
-            # Use the existing Redis service
-            redis_client = await redis.get_client()
-            await redis_client.hset(flag_key, mapping=flag_data)
-            await redis_client.sadd(self.flag_list_key, key)
-            
+
+            pipe = await redis.pipeline(transaction=True)
+            pipe.hset(flag_key, mapping=flag_data)
+            pipe.sadd(self.flag_list_key, key)
+            pipe.publish(FLAG_INVALIDATION_CHANNEL, key)
+            await pipe.execute()
+            if self._snapshot is not None:
+                self._snapshot[key] = enabled
+
             logger.info(f"Set feature flag {key} to {enabled}")
             return True
         except Exception as e:
             logger.error(f"Failed to set feature flag {key}: {e}")
             return False
-    
-    async def is_enabled(self, key: str) -> bool:
-        """Check if a feature flag is enabled"""
+
+    async def load(self) -> Dict[str, bool]:
+        """Read every flag from Redis in one round trip and replace the snapshot"""
+        redis_client = await redis.get_client()
+        keys = sorted(await redis_client.smembers(self.flag_list_key))
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(f"{self.flag_prefix}{key}", 'enabled')
+        values = await pipe.execute() if keys else []
+        self._snapshot = {key: value == 'true' for key, value in zip(keys, values)}
+        self._loaded_at = time.monotonic()
+        return dict(self._snapshot)
+
+    def _ensure_listener(self):
+        if self._listener is None or self._listener.done() or self._listener.get_loop() is not asyncio.get_running_loop():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        """Reload the snapshot on invalidation messages, and at least every FLAG_REFRESH_INTERVAL"""
+        backoff = 1.0
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis.create_pubsub()
+                await pubsub.subscribe(FLAG_INVALIDATION_CHANNEL)
+                # Flags may have changed while we weren't subscribed
+                await self.load()
+                backoff = 1.0
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message or time.monotonic() - self._loaded_at >= FLAG_REFRESH_INTERVAL:
+                        await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep serving the last known values until Redis is back
+                logger.warning(f"Feature flag listener failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, FLAG_REFRESH_INTERVAL)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
+
+    async def start(self):
+        """Load the flag snapshot and start listening for changes"""
         try:
-            flag_key = f"{self.flag_prefix}{key}"
-            redis_client = await redis.get_client()
-            enabled = await redis_client.hget(flag_key, 'enabled')
-            return enabled == 'true' if enabled else False
+            await self.load()
         except Exception as e:
-            logger.error(f"Failed to check feature flag {key}: {e}")
-            # Return False by default if Redis is unavailable
-            return False
-    
+            logger.error(f"Failed to load feature flags: {e}")
+        self._ensure_listener()
+
+    async def stop(self):
+        if self._listener is not None and not self._listener.done():
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._listener = None
+
+    async def is_enabled(self, key: str) -> bool:
+        """Check if a feature flag is enabled"""
+        self._ensure_listener()
+        if self._snapshot is None:
+            if self._load_lock is None:
+                self._load_lock = asyncio.Lock()
+            async with self._load_lock:
+                if self._snapshot is None:
+                    try:
+                        await self.load()
+                    except Exception as e:
+                        logger.error(f"Failed to check feature flag {key}: {e}")
+                        # Return False by default if Redis is unavailable
+                        return False
+        return self._snapshot.get(key, False)
+
     async def get_flag(self, key: str) -> Optional[Dict[str, str]]:
         """Get feature flag details"""
         try:
@@ -57,50 +139,44 @@ class FeatureFlagManager:
         except Exception as e:
             logger.error(f"Failed to get feature flag {key}: {e}")
             return None
-    
+
     async def delete_flag(self, key: str) -> bool:
         """Delete a feature flag"""
         try:
             flag_key = f"{self.flag_prefix}{key}"
-            redis_client = await redis.get_client()
-            deleted = await redis_client.delete(flag_key)
+            pipe = await redis.pipeline(transaction=True)
+            pipe.delete(flag_key)
+            pipe.srem(self.flag_list_key, key)
+            pipe.publish(FLAG_INVALIDATION_CHANNEL, key)
+            deleted, _, _ = await pipe.execute()
+            if self._snapshot is not None:
+                self._snapshot.pop(key, None)
             if deleted:
-                await redis_client.srem(self.flag_list_key, key)
                 logger.info(f"Deleted feature flag: {key}")
                 return True
             return False
         except Exception as e:
             logger.error(f"Failed to delete feature flag {key}: {e}")
             return False
-    
+
     async def list_flags(self) -> Dict[str, bool]:
         """List all feature flags with their status"""
         try:
-            redis_client = await redis.get_client()
-            flag_keys = await redis_client.smembers(self.flag_list_key)
-            flags = {}
-            
-            for key in flag_keys:
-                flags[key] = await self.is_enabled(key)
-            
-            return flags
+            return await self.load()
         except Exception as e:
             logger.error(f"Failed to list feature flags: {e}")
-            return {}
-    
+            return dict(self._snapshot or {})
+
     async def get_all_flags_details(self) -> Dict[str, Dict[str, str]]:
         """Get all feature flags with detailed information"""
         try:
             redis_client = await redis.get_client()
-            flag_keys = await redis_client.smembers(self.flag_list_key)
-            flags = {}
-            
+            flag_keys = sorted(await redis_client.smembers(self.flag_list_key))
+            pipe = redis_client.pipeline(transaction=False)
             for key in flag_keys:
-                flag_data = await self.get_flag(key)
-                if flag_data:
-                    flags[key] = flag_data
-            
-            return flags
+                pipe.hgetall(f"{self.flag_prefix}{key}")
+            details = await pipe.execute() if flag_keys else []
+            return {key: flag_data for key, flag_data in zip(flag_keys, details) if flag_data}
         except Exception as e:
             logger.error(f"Failed to get all flags details: {e}")
             return {}
@@ -118,6 +194,15 @@ def get_flag_manager() -> FeatureFlagManager:
 
 
 # Async convenience functions
+async def start() -> None:
+    """Load flags at startup; call once Redis is initialized."""
+    await get_flag_manager().start()
+
+
+async def stop() -> None:
+    await get_flag_manager().stop()
+
+
 async def set_flag(key: str, enabled: bool, description: str = "") -> bool:
     return await get_flag_manager().set_flag(key, enabled, description)
 
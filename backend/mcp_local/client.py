@@ -42,6 +42,8 @@ except ImportError:
         ToolResult = Any
 
 from utils.logger import logger
+from mcp_local.session_pool import get_session_pool, SHARE_ACROSS_RUNS, TRANSPORT_HTTP
+from mcp_local.tool_catalog import catalog_key, connect_concurrently, get_tool_catalog
 import os
 
 # Get Smithery API key from environment
@@ -64,6 +66,8 @@ class MCPManager:
     def __init__(self):
         self.connections: Dict[str, MCPConnection] = {}
         self._sessions: Dict[str, Tuple[Any, Any, Any]] = {}  # Store streams for cleanup
+        # Pooled sessions are private to this manager unless shared across runs
+        self.session_scope: Optional[str] = None if SHARE_ACROSS_RUNS else f"mcp-manager-{id(self)}"
         
     async def connect_server(self, mcp_config: Dict[str, Any]) -> MCPConnection:
         """
@@ -102,16 +106,12 @@ class MCPManager:
             # Create server URL
             url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
             
-            # Test connection and get available tools
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    logger.info(f"MCP session initialized for {qualified_name}")
-                    
-                    # List available tools
-                    tools_result = await session.list_tools()
-            tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+            # Use the cached catalog if there is one; otherwise list the tools on the
+            # pooled session this run's tool calls will reuse
+            tools = await get_tool_catalog().get_or_discover(
+                catalog_key("smithery", qualified_name, mcp_config["config"]),
+                lambda: get_session_pool().list_tools(TRANSPORT_HTTP, url, scope=self.session_scope),
+            )
             
             logger.info(f"Available tools from {qualified_name}: {[t.name for t in tools]}")
             
@@ -132,14 +132,14 @@ class MCPManager:
             logger.error(f"Failed to connect to MCP server {qualified_name}: {str(e)}")
             raise
             
-    async def connect_all(self, mcp_configs: List[Dict[str, Any]]) -> None:
-        """Connect to all MCP servers in the configuration"""
-        for config in mcp_configs:
-            try:
-                await self.connect_server(config)
-            except Exception as e:
-                logger.error(f"Failed to connect to {config['qualifiedName']}: {str(e)}")
-                # Continue with other servers even if one fails
+    async def connect_all(self, mcp_configs: List[Dict[str, Any]]) -> Dict[str, BaseException]:
+        """
+        Connect to all MCP servers in the configuration concurrently
+        
+        Each server gets MCP_SERVER_STARTUP_TIMEOUT seconds; the ones that fail are
+        skipped and returned by qualified name, the rest stay connected.
+        """
+        return await connect_concurrently(mcp_configs, self.connect_server, lambda config: config['qualifiedName'])
                 
     def get_all_tools_openapi(self) -> List[Dict[str, Any]]:
         """
@@ -211,52 +211,47 @@ class MCPManager:
             raise ValueError("SMITHERY_API_KEY environment variable is not set")
         
         try:
-            # Create fresh connection for this tool call
             config_json = json.dumps(conn.config)
             config_b64 = base64.b64encode(config_json.encode()).decode()
             url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
             
-            # Use the documented pattern with proper context management
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    
-                    # Call the tool
-                    result = await session.call_tool(original_tool_name, arguments)
+            # Reuse an initialized session for this server if one is open
+            result = await get_session_pool().call_tool(
+                TRANSPORT_HTTP, url, original_tool_name, arguments, scope=self.session_scope
+            )
             
-                    # Convert result to dict - handle MCP response properly
-                    if hasattr(result, 'content'):
-                        # Handle content which might be a list of TextContent objects
-                        content = result.content
-                        if isinstance(content, list):
-                            # Extract text from TextContent objects
-                            text_parts = []
-                            for item in content:
-                                if hasattr(item, 'text'):
-                                    text_parts.append(item.text)
-                                elif hasattr(item, 'content'):
-                                    text_parts.append(str(item.content))
-                                else:
-                                    text_parts.append(str(item))
-                            content_str = "\n".join(text_parts)
-                        elif hasattr(content, 'text'):
-                            # Single TextContent object
-                            content_str = content.text
-                        elif hasattr(content, 'content'):
-                            content_str = str(content.content)
+            # Convert result to dict - handle MCP response properly
+            if hasattr(result, 'content'):
+                # Handle content which might be a list of TextContent objects
+                content = result.content
+                if isinstance(content, list):
+                    # Extract text from TextContent objects
+                    text_parts = []
+                    for item in content:
+                        if hasattr(item, 'text'):
+                            text_parts.append(item.text)
+                        elif hasattr(item, 'content'):
+                            text_parts.append(str(item.content))
                         else:
-                            content_str = str(content)
-                        
-                        is_error = getattr(result, 'isError', False)
-                    else:
-                        content_str = str(result)
-                        is_error = False
-                        
-                return {
-                        "content": content_str,
-                        "isError": is_error
-                }
+                            text_parts.append(str(item))
+                    content_str = "\n".join(text_parts)
+                elif hasattr(content, 'text'):
+                    # Single TextContent object
+                    content_str = content.text
+                elif hasattr(content, 'content'):
+                    content_str = str(content.content)
+                else:
+                    content_str = str(content)
+                
+                is_error = getattr(result, 'isError', False)
+            else:
+                content_str = str(result)
+                is_error = False
+                
+            return {
+                "content": content_str,
+                "isError": is_error
+            }
                 
         except Exception as e:
             logger.error(f"Error executing MCP tool {tool_name}: {str(e)}")
@@ -276,6 +271,16 @@ class MCPManager:
                 
         # Clear sessions dict
         self._sessions.clear()
+        await self.release_sessions()
+
+    async def release_sessions(self):
+        """Close the pooled sessions opened by this manager (no-op when sessions are shared across runs)"""
+        if self.session_scope is None:
+            return
+        try:
+            await get_session_pool().close_scope(self.session_scope)
+        except Exception as e:
+            logger.error(f"Error closing pooled MCP sessions: {str(e)}")
                 
     def get_tool_info(self, tool_name: str) -> Optional[Dict[str, Any]]:
         """Get information about a specific tool"""
@@ -8,12 +8,15 @@ This module handles:
 4. Auditing credential usage
 """
 
+import asyncio
+import copy
 import os
 import json
 import hashlib
 import base64
+import time
 from typing import Dict, List, Any, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
 
 from cryptography.fernet import Fernet
@@ -21,10 +24,21 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 from utils.logger import logger
+from services import redis
 from services.supabase import DBConnection
+from agent.runtime_config import invalidate_agent_configs
 
 db = DBConnection()
 
+# Seconds a decrypted credential or profile is served from memory. Changes made
+# through this manager bump the account's credential revision in Redis, which
+# every process checks on read; the TTL bounds how long a change made elsewhere,
+# or while Redis is unreachable, goes unnoticed.
+CREDENTIAL_CACHE_TTL = float(os.getenv("MCP_CREDENTIAL_CACHE_TTL", "60"))
+CREDENTIAL_REVISION_PREFIX = "mcp_credentials:revision:"
+# last_used_at is written for every credential used in this window in one update
+LAST_USED_FLUSH_INTERVAL = float(os.getenv("MCP_CREDENTIAL_LAST_USED_FLUSH_INTERVAL", "30"))
+
 
 @dataclass
 class MCPCredential:
@@ -72,6 +86,13 @@ class CredentialManager:
     def __init__(self):
         self.encryption_key = self._get_or_create_encryption_key()
         self.cipher = Fernet(self.encryption_key)
+        # (account_id, mcp_qualified_name) -> (expires_at, revision, credential)
+        self._credential_cache: Dict[Tuple[str, str], Tuple[float, Optional[int], MCPCredential]] = {}
+        # profile_id -> (expires_at, revision, profile)
+        self._profile_cache: Dict[str, Tuple[float, Optional[int], MCPCredentialProfile]] = {}
+        # (table, id column) -> {row id: last used at}, written by the flusher
+        self._pending_last_used: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self._flusher: Optional[asyncio.Task] = None
     
     def _get_or_create_encryption_key(self) -> bytes:
         """Get or create encryption key for credentials"""
@@ -122,6 +143,126 @@ class CredentialManager:
             logger.error(f"Failed to decrypt credential: {e}")
             raise ValueError("Failed to decrypt credential")
     
+    def _decrypt_row_config(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Decrypt the config of a credential or profile row (handles both storage formats)"""
+        encrypted_config = row['encrypted_config']
+        if isinstance(encrypted_config, str):
+            # New format: base64 encoded string
+            encrypted_config_bytes = base64.b64decode(encrypted_config.encode('utf-8'))
+        else:
+            # Old format: raw bytes (backward compatibility)
+            encrypted_config_bytes = encrypted_config
+        return self._decrypt_config(encrypted_config_bytes, row['config_hash'])
+    
+    def _credential_from_row(self, cred_data: Dict[str, Any]) -> MCPCredential:
+        return MCPCredential(
+            credential_id=cred_data['credential_id'],
+            account_id=cred_data['account_id'],
+            mcp_qualified_name=cred_data['mcp_qualified_name'],
+            display_name=cred_data['display_name'],
+            config=self._decrypt_row_config(cred_data),
+            is_active=cred_data['is_active'],
+            last_used_at=cred_data.get('last_used_at'),
+            created_at=cred_data.get('created_at'),
+            updated_at=cred_data.get('updated_at')
+        )
+    
+    def _profile_from_row(self, profile_data: Dict[str, Any]) -> MCPCredentialProfile:
+        return MCPCredentialProfile(
+            profile_id=profile_data['profile_id'],
+            account_id=profile_data['account_id'],
+            mcp_qualified_name=profile_data['mcp_qualified_name'],
+            profile_name=profile_data['profile_name'],
+            display_name=profile_data['display_name'],
+            config=self._decrypt_row_config(profile_data),
+            is_active=profile_data['is_active'],
+            is_default=profile_data['is_default'],
+            last_used_at=profile_data.get('last_used_at'),
+            created_at=profile_data.get('created_at'),
+            updated_at=profile_data.get('updated_at')
+        )
+    
+    async def _revision(self, account_id: str) -> Optional[int]:
+        """The account's credential revision, or None if Redis can't be reached"""
+        if CREDENTIAL_CACHE_TTL <= 0:
+            return None
+        try:
+            return int(await redis.get(f"{CREDENTIAL_REVISION_PREFIX}{account_id}") or 0)
+        except Exception as e:
+            logger.warning(f"Failed to read credential revision of account {account_id}: {e}")
+            return None
+    
+    def _cached(self, cache: Dict[Any, Tuple[float, Optional[int], Any]], key: Any, revision: Optional[int]) -> Optional[Any]:
+        """Return a copy of a live cache entry, so callers can't modify the cached config"""
+        entry = cache.get(key)
+        if not entry:
+            return None
+        expires_at, cached_revision, value = entry
+        # Without a revision to compare against, only the TTL applies
+        if expires_at <= time.monotonic() or (revision is not None and cached_revision != revision):
+            del cache[key]
+            return None
+        return replace(value, config=copy.deepcopy(value.config))
+    
+    def _cache_credential(self, credential: MCPCredential, revision: Optional[int]) -> None:
+        if CREDENTIAL_CACHE_TTL > 0:
+            key = (credential.account_id, credential.mcp_qualified_name)
+            self._credential_cache[key] = (time.monotonic() + CREDENTIAL_CACHE_TTL, revision, credential)
+    
+    def _cache_profile(self, profile: MCPCredentialProfile, revision: Optional[int]) -> None:
+        if CREDENTIAL_CACHE_TTL > 0:
+            self._profile_cache[profile.profile_id] = (time.monotonic() + CREDENTIAL_CACHE_TTL, revision, profile)
+    
+    def invalidate(self, account_id: str, mcp_qualified_name: Optional[str] = None) -> None:
+        """Drop cached credentials and profiles of an account in this process, optionally only for one MCP server"""
+        for key in list(self._credential_cache):
+            if key[0] == account_id and mcp_qualified_name in (None, key[1]):
+                del self._credential_cache[key]
+        for profile_id, (_, _, profile) in list(self._profile_cache.items()):
+            if profile.account_id == account_id and mcp_qualified_name in (None, profile.mcp_qualified_name):
+                del self._profile_cache[profile_id]
+    
+    async def _credentials_changed(self, account_id: str, mcp_qualified_name: str) -> None:
+        """Drop the cached entries in every process and make the account's cached agent configs stale"""
+        self.invalidate(account_id, mcp_qualified_name)
+        try:
+            redis_client = await redis.get_client()
+            await redis_client.incr(f"{CREDENTIAL_REVISION_PREFIX}{account_id}")
+        except Exception as e:
+            logger.error(f"Failed to invalidate cached credentials of account {account_id}: {e}")
+        await invalidate_agent_configs(account_id)
+    
+    def _mark_used(self, table: str, id_column: str, row_id: str) -> None:
+        """Queue a last_used_at update for the background flusher"""
+        self._pending_last_used.setdefault((table, id_column), {})[row_id] = datetime.now(timezone.utc).isoformat()
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not asyncio.get_running_loop():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+    
+    async def _flush_periodically(self):
+        while self._pending_last_used:
+            await asyncio.sleep(LAST_USED_FLUSH_INTERVAL)
+            await self.flush_last_used()
+    
+    async def flush_last_used(self) -> None:
+        """Write the queued last_used_at updates, one update per table"""
+        pending, self._pending_last_used = self._pending_last_used, {}
+        if not pending:
+            return
+        try:
+            client = await db.client
+        except Exception as e:
+            logger.error(f"Failed to update credential last_used_at: {e}")
+            return
+        for (table, id_column), used in pending.items():
+            try:
+                # Rows used within one flush window share its latest timestamp
+                await client.table(table)\
+                    .update({'last_used_at': max(used.values())})\
+                    .in_(id_column, list(used))\
+                    .execute()
+            except Exception as e:
+                logger.error(f"Failed to update last_used_at of {len(used)} rows in {table}: {e}")
+    
     async def store_credential(
         self, 
         account_id: str, 
@@ -167,6 +308,7 @@ class CredentialManager:
                 raise ValueError("Failed to store credential")
             
             credential_id = result.data[0]['credential_id']
+            await self._credentials_changed(account_id, mcp_qualified_name)
             logger.info(f"Successfully stored credential {credential_id} for {mcp_qualified_name}")
             
             return credential_id
@@ -186,62 +328,61 @@ class CredentialManager:
         Returns:
             MCPCredential object or None if not found
         """
-        try:
-            client = await db.client
-            
-            result = await client.table('user_mcp_credentials').select('*')\
-                .eq('account_id', account_id)\
-                .eq('mcp_qualified_name', mcp_qualified_name)\
-                .eq('is_active', True)\
-                .execute()
-            
-            if not result.data:
-                return None
-            
-            cred_data = result.data[0]
-            
-            # Decrypt the configuration (handle both old and new formats)
-            encrypted_config = cred_data['encrypted_config']
-            logger.debug(f"Retrieved config type: {type(encrypted_config)}, length: {len(encrypted_config) if encrypted_config else 0}")
+        credentials = await self.get_credentials(account_id, [mcp_qualified_name])
+        return credentials.get(mcp_qualified_name)
+    
+    async def get_credentials(self, account_id: str, mcp_qualified_names: List[str]) -> Dict[str, MCPCredential]:
+        """
+        Retrieve and decrypt the credentials of several MCP servers at once
+        
+        Credentials cached within MCP_CREDENTIAL_CACHE_TTL are served from memory
+        and the rest are fetched in a single query.
+        
+        Args:
+            account_id: User's account ID
+            mcp_qualified_names: MCP server qualified names
             
-            if isinstance(encrypted_config, str):
-                # New format: base64 encoded string
-                logger.debug(f"Decoding base64 string of length {len(encrypted_config)}")
-                try:
-                    encrypted_config_bytes = base64.b64decode(encrypted_config.encode('utf-8'))
-                except Exception as e:
-                    logger.error(f"Failed to decode base64 credential: {e}, string: {encrypted_config[:50]}...")
-                    return None
+        Returns:
+            MCPCredential objects by qualified name; servers without an active
+            credential are left out
+        """
+        credentials: Dict[str, MCPCredential] = {}
+        missing = []
+        # Read before the database, so a credential fetched while a change lands is already stale
+        revision = await self._revision(account_id)
+        for name in dict.fromkeys(mcp_qualified_names):
+            credential = self._cached(self._credential_cache, (account_id, name), revision)
+            if credential:
+                credentials[name] = credential
             else:
-                # Old format: raw bytes (backward compatibility)
-                encrypted_config_bytes = encrypted_config
-            
-            config = self._decrypt_config(
-                encrypted_config_bytes, 
-                cred_data['config_hash']
-            )
-            
-            # Update last used timestamp
-            await client.table('user_mcp_credentials')\
-                .update({'last_used_at': datetime.now(timezone.utc).isoformat()})\
-                .eq('credential_id', cred_data['credential_id'])\
-                .execute()
-            
-            return MCPCredential(
-                credential_id=cred_data['credential_id'],
-                account_id=cred_data['account_id'],
-                mcp_qualified_name=cred_data['mcp_qualified_name'],
-                display_name=cred_data['display_name'],
-                config=config,
-                is_active=cred_data['is_active'],
-                last_used_at=cred_data.get('last_used_at'),
-                created_at=cred_data.get('created_at'),
-                updated_at=cred_data.get('updated_at')
-            )
-            
-        except Exception as e:
-            logger.error(f"Error retrieving credential for {mcp_qualified_name}: {str(e)}")
-            return None
+                missing.append(name)
+        
+        if missing:
+            try:
+                client = await db.client
+                
+                result = await client.table('user_mcp_credentials').select('*')\
+                    .eq('account_id', account_id)\
+                    .in_('mcp_qualified_name', missing)\
+                    .eq('is_active', True)\
+                    .execute()
+                
+                for cred_data in result.data or []:
+                    try:
+                        credential = self._credential_from_row(cred_data)
+                    except Exception as e:
+                        logger.error(f"Failed to decrypt credential for {cred_data['mcp_qualified_name']}: {e}")
+                        continue
+                    self._cache_credential(credential, revision)
+                    credentials[credential.mcp_qualified_name] = replace(credential, config=copy.deepcopy(credential.config))
+                    
+            except Exception as e:
+                logger.error(f"Error retrieving credentials for {missing}: {str(e)}")
+        
+        for credential in credentials.values():
+            self._mark_used('user_mcp_credentials', 'credential_id', credential.credential_id)
+        
+        return credentials
     
     async def get_user_credentials(self, account_id: str) -> List[MCPCredential]:
         """Get all active credentials for a user"""
@@ -257,35 +398,7 @@ class CredentialManager:
             credentials = []
             for cred_data in result.data:
                 try:
-                    # Decrypt the configuration (handle both old and new formats)
-                    encrypted_config = cred_data['encrypted_config']
-                    if isinstance(encrypted_config, str):
-                        # New format: base64 encoded string
-                        try:
-                            encrypted_config_bytes = base64.b64decode(encrypted_config.encode('utf-8'))
-                        except Exception as e:
-                            logger.error(f"Failed to decode base64 credential {cred_data['credential_id']}: {e}")
-                            continue
-                    else:
-                        # Old format: raw bytes (backward compatibility)
-                        encrypted_config_bytes = encrypted_config
-                    
-                    config = self._decrypt_config(
-                        encrypted_config_bytes, 
-                        cred_data['config_hash']
-                    )
-                    
-                    credentials.append(MCPCredential(
-                        credential_id=cred_data['credential_id'],
-                        account_id=cred_data['account_id'],
-                        mcp_qualified_name=cred_data['mcp_qualified_name'],
-                        display_name=cred_data['display_name'],
-                        config=config,
-                        is_active=cred_data['is_active'],
-                        last_used_at=cred_data.get('last_used_at'),
-                        created_at=cred_data.get('created_at'),
-                        updated_at=cred_data.get('updated_at')
-                    ))
+                    credentials.append(self._credential_from_row(cred_data))
                 except Exception as e:
                     logger.error(f"Failed to decrypt credential {cred_data['credential_id']}: {e}")
                     continue
@@ -320,6 +433,7 @@ class CredentialManager:
                 .eq('mcp_qualified_name', mcp_qualified_name)\
                 .execute()
             
+            await self._credentials_changed(account_id, mcp_qualified_name)
             logger.debug(f"Update result: {len(result.data)} rows affected")
             return len(result.data) > 0
             
@@ -431,20 +545,21 @@ class CredentialManager:
         """Build credential mappings for agent instance"""
         mappings = {}
         
-        for req in requirements:
-            if req.custom_type:
-                user_credentials = await self.get_user_credentials(account_id)
-                custom_pattern = f"custom_{req.custom_type}_"
-                
-                for cred in user_credentials:
-                    if (cred.mcp_qualified_name.startswith(custom_pattern) and 
-                        req.display_name.lower().replace(' ', '_') in cred.mcp_qualified_name):
-                        mappings[req.qualified_name] = cred.credential_id
-                        break
-            else:
-                credential = await self.get_credential(account_id, req.qualified_name)
-                if credential:
-                    mappings[req.qualified_name] = credential.credential_id
+        custom_requirements = [req for req in requirements if req.custom_type]
+        user_credentials = await self.get_user_credentials(account_id) if custom_requirements else []
+        for req in custom_requirements:
+            custom_pattern = f"custom_{req.custom_type}_"
+            for cred in user_credentials:
+                if (cred.mcp_qualified_name.startswith(custom_pattern) and 
+                    req.display_name.lower().replace(' ', '_') in cred.mcp_qualified_name):
+                    mappings[req.qualified_name] = cred.credential_id
+                    break
+        
+        credentials = await self.get_credentials(
+            account_id, [req.qualified_name for req in requirements if not req.custom_type]
+        )
+        for qualified_name, credential in credentials.items():
+            mappings[qualified_name] = credential.credential_id
         
         return mappings
 
@@ -499,6 +614,7 @@ class CredentialManager:
                 raise ValueError("Failed to store credential profile")
             
             profile_id = result.data[0]['profile_id']
+            await self._credentials_changed(account_id, mcp_qualified_name)
             logger.info(f"Successfully stored credential profile {profile_id} for {mcp_qualified_name}")
             
             return profile_id
@@ -536,31 +652,7 @@ class CredentialManager:
             profiles = []
             for profile_data in result.data:
                 try:
-                    # Decrypt the configuration
-                    encrypted_config = profile_data['encrypted_config']
-                    if isinstance(encrypted_config, str):
-                        encrypted_config_bytes = base64.b64decode(encrypted_config.encode('utf-8'))
-                    else:
-                        encrypted_config_bytes = encrypted_config
-                    
-                    config = self._decrypt_config(
-                        encrypted_config_bytes, 
-                        profile_data['config_hash']
-                    )
-                    
-                    profiles.append(MCPCredentialProfile(
-                        profile_id=profile_data['profile_id'],
-                        account_id=profile_data['account_id'],
-                        mcp_qualified_name=profile_data['mcp_qualified_name'],
-                        profile_name=profile_data['profile_name'],
-                        display_name=profile_data['display_name'],
-                        config=config,
-                        is_active=profile_data['is_active'],
-                        is_default=profile_data['is_default'],
-                        last_used_at=profile_data.get('last_used_at'),
-                        created_at=profile_data.get('created_at'),
-                        updated_at=profile_data.get('updated_at')
-                    ))
+                    profiles.append(self._profile_from_row(profile_data))
                 except Exception as e:
                     logger.error(f"Failed to decrypt credential profile {profile_data['profile_id']}: {e}")
                     continue
@@ -586,6 +678,12 @@ class CredentialManager:
         Returns:
             MCPCredentialProfile object or None if not found
         """
+        revision = await self._revision(account_id)
+        profile = self._cached(self._profile_cache, profile_id, revision)
+        if profile and profile.account_id == account_id:
+            self._mark_used('user_mcp_credential_profiles', 'profile_id', profile_id)
+            return profile
+        
         try:
             client = await db.client
             
@@ -598,39 +696,11 @@ class CredentialManager:
             if not result.data:
                 return None
             
-            profile_data = result.data[0]
-            
-            # Decrypt the configuration
-            encrypted_config = profile_data['encrypted_config']
-            if isinstance(encrypted_config, str):
-                encrypted_config_bytes = base64.b64decode(encrypted_config.encode('utf-8'))
-            else:
-                encrypted_config_bytes = encrypted_config
-            
-            config = self._decrypt_config(
-                encrypted_config_bytes, 
-                profile_data['config_hash']
-            )
+            profile = self._profile_from_row(result.data[0])
+            self._cache_profile(profile, revision)
+            self._mark_used('user_mcp_credential_profiles', 'profile_id', profile_id)
             
-            # Update last used timestamp
-            await client.table('user_mcp_credential_profiles')\
-                .update({'last_used_at': datetime.now(timezone.utc).isoformat()})\
-                .eq('profile_id', profile_id)\
-                .execute()
-            
-            return MCPCredentialProfile(
-                profile_id=profile_data['profile_id'],
-                account_id=profile_data['account_id'],
-                mcp_qualified_name=profile_data['mcp_qualified_name'],
-                profile_name=profile_data['profile_name'],
-                display_name=profile_data['display_name'],
-                config=config,
-                is_active=profile_data['is_active'],
-                is_default=profile_data['is_default'],
-                last_used_at=profile_data.get('last_used_at'),
-                created_at=profile_data.get('created_at'),
-                updated_at=profile_data.get('updated_at')
-            )
+            return replace(profile, config=copy.deepcopy(profile.config))
             
         except Exception as e:
             logger.error(f"Error retrieving credential profile {profile_id}: {str(e)}")
@@ -687,6 +757,7 @@ class CredentialManager:
                 .eq('account_id', account_id)\
                 .execute()
             
+            await self._credentials_changed(account_id, profile.mcp_qualified_name)
             return len(result.data) > 0
             
         except Exception as e:
@@ -726,6 +797,7 @@ class CredentialManager:
                 .eq('account_id', account_id)\
                 .execute()
             
+            await self._credentials_changed(account_id, profile.mcp_qualified_name)
             return len(result.data) > 0
             
         except Exception as e:
@@ -748,30 +820,7 @@ class CredentialManager:
             profiles = []
             for profile_data in result.data:
                 try:
-                    encrypted_config = profile_data['encrypted_config']
-                    if isinstance(encrypted_config, str):
-                        encrypted_config_bytes = base64.b64decode(encrypted_config.encode('utf-8'))
-                    else:
-                        encrypted_config_bytes = encrypted_config
-                    
-                    config = self._decrypt_config(
-                        encrypted_config_bytes, 
-                        profile_data['config_hash']
-                    )
-                    
-                    profiles.append(MCPCredentialProfile(
-                        profile_id=profile_data['profile_id'],
-                        account_id=profile_data['account_id'],
-                        mcp_qualified_name=profile_data['mcp_qualified_name'],
-                        profile_name=profile_data['profile_name'],
-                        display_name=profile_data['display_name'],
-                        config=config,
-                        is_active=profile_data['is_active'],
-                        is_default=profile_data['is_default'],
-                        last_used_at=profile_data.get('last_used_at'),
-                        created_at=profile_data.get('created_at'),
-                        updated_at=profile_data.get('updated_at')
-                    ))
+                    profiles.append(self._profile_from_row(profile_data))
                 except Exception as e:
                     logger.error(f"Failed to decrypt credential profile {profile_data['profile_id']}: {e}")
                     continue
@@ -41,6 +41,7 @@ except ImportError:
 from utils.logger import logger
 from .credential_manager import credential_manager
 from .template_manager import template_manager
+from .tool_catalog import catalog_key, connect_concurrently, get_tool_catalog
 import os
 
 # Get Smithery API key from environment
@@ -84,13 +85,12 @@ class SecureMCPManager:
             if agent_config['account_id'] != account_id:
                 raise ValueError("Access denied: not agent owner")
             
-            # Connect to each configured MCP
-            for mcp_config in agent_config.get('configured_mcps', []):
-                try:
-                    await self._connect_secure_server(mcp_config, instance_id)
-                except Exception as e:
-                    logger.error(f"Failed to connect to {mcp_config['qualifiedName']}: {str(e)}")
-                    # Continue with other servers even if one fails
+            # Connect to the configured MCPs concurrently; the ones that fail are skipped
+            await connect_concurrently(
+                agent_config.get('configured_mcps', []),
+                lambda mcp_config: self._connect_secure_server(mcp_config, instance_id),
+                lambda mcp_config: mcp_config['qualifiedName'],
+            )
                     
         except Exception as e:
             logger.error(f"Error connecting MCP servers for instance {instance_id}: {str(e)}")
@@ -106,13 +106,12 @@ class SecureMCPManager:
         logger.info(f"Connecting to MCP servers for legacy agent {agent_config.get('agent_id')}")
         
         try:
-            # Connect to each configured MCP using the old method
-            for mcp_config in agent_config.get('configured_mcps', []):
-                try:
-                    await self._connect_legacy_server(mcp_config)
-                except Exception as e:
-                    logger.error(f"Failed to connect to {mcp_config['qualifiedName']}: {str(e)}")
-                    # Continue with other servers even if one fails
+            # Connect to the configured MCPs concurrently using the old method
+            await connect_concurrently(
+                agent_config.get('configured_mcps', []),
+                self._connect_legacy_server,
+                lambda mcp_config: mcp_config['qualifiedName'],
+            )
                     
         except Exception as e:
             logger.error(f"Error connecting MCP servers for legacy agent: {str(e)}")
@@ -144,17 +143,11 @@ class SecureMCPManager:
             # Create server URL
             url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
             
-            # Test connection and get available tools
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    logger.info(f"Secure MCP session initialized for {qualified_name}")
-                    
-                    # List available tools
-                    tools_result = await session.list_tools()
-            
-            tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+            # Use the cached catalog if there is one; otherwise connect and list the tools
+            tools = await get_tool_catalog().get_or_discover(
+                catalog_key("smithery", qualified_name, mcp_config["config"]),
+                lambda: self._list_tools(url),
+            )
             
             logger.info(f"Available tools from {qualified_name}: {[t.name for t in tools]}")
             
@@ -209,17 +202,11 @@ class SecureMCPManager:
             # Create server URL
             url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
             
-            # Test connection and get available tools
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    logger.info(f"Legacy MCP session initialized for {qualified_name}")
-                    
-                    # List available tools
-                    tools_result = await session.list_tools()
-            
-            tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+            # Use the cached catalog if there is one; otherwise connect and list the tools
+            tools = await get_tool_catalog().get_or_discover(
+                catalog_key("smithery", qualified_name, mcp_config["config"]),
+                lambda: self._list_tools(url),
+            )
             
             logger.info(f"Available tools from legacy {qualified_name}: {[t.name for t in tools]}")
             
@@ -240,6 +227,14 @@ class SecureMCPManager:
             logger.error(f"Failed to connect to legacy MCP server {qualified_name}: {str(e)}")
             raise
     
+    async def _list_tools(self, url: str) -> List[Any]:
+        """Connect to a server just long enough to list its tools"""
+        async with streamablehttp_client(url) as (read_stream, write_stream, _):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                tools_result = await session.list_tools()
+        return tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+    
     def get_all_tools_openapi(self) -> List[Dict[str, Any]]:
         """
         Convert all connected MCP tools to OpenAPI format for LLM
@@ -0,0 +1,416 @@
+"""
+Pool of initialized MCP client sessions.
+
+Opening a streamable HTTP or SSE connection and running the MCP initialize
+handshake costs several round trips, so rather than paying for it on every tool
+call, sessions are kept open and reused. They are keyed by transport, URL and
+headers, which carry the server credentials.
+
+Each pooled session is owned by a background task that holds the transport and
+ClientSession contexts open until the session is closed, because anyio requires
+those contexts to be exited from the task that entered them. Sessions are
+health-checked with a ping when they have been idle for a while, evicted once
+idle for longer than MCP_SESSION_IDLE_TTL, and reconnected transparently when a
+call on a reused session fails because the connection went away.
+
+By default sessions are scoped to the MCPManager that opened them (one agent
+run) and closed when the run ends; set MCP_SESSION_POOL_SHARED=true to reuse them
+across runs on the same worker.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import anyio
+import httpx
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from utils.logger import logger
+
+TRANSPORT_HTTP = "http"
+TRANSPORT_SSE = "sse"
+
+IDLE_TTL = float(os.getenv("MCP_SESSION_IDLE_TTL", "120"))
+HEALTH_CHECK_AFTER = float(os.getenv("MCP_SESSION_HEALTH_CHECK_AFTER", "30"))
+HEALTH_CHECK_TIMEOUT = 5.0
+CONNECT_TIMEOUT = float(os.getenv("MCP_SESSION_CONNECT_TIMEOUT", "20"))
+CLOSE_TIMEOUT = 5.0
+MAX_CONCURRENT_CALLS = int(os.getenv("MCP_SESSION_MAX_CONCURRENT_CALLS", "4"))
+SHARE_ACROSS_RUNS = os.getenv("MCP_SESSION_POOL_SHARED", "false").lower() == "true"
+
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Errors that mean the connection is gone rather than that the tool call failed
+CONNECTION_ERRORS = (
+    ConnectionError,
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    httpx.TransportError,
+)
+# Raised when writing to a session whose transport is already closed, so the
+# request never reached the server and is safe to send again
+NOT_SENT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+
+def session_key(transport: str, url: str, headers: Optional[Dict[str, Any]] = None, scope: Optional[str] = None) -> str:
+    """Pool key for a server; hashed so credentials never end up in logs or stats."""
+    material = json.dumps([transport, url, headers or {}, scope], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def _server_label(url: str) -> str:
+    """Host and path of a server URL, without the query string (which may hold credentials)."""
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+def _open_transport(transport: str, url: str, headers: Optional[Dict[str, Any]]):
+    if transport == TRANSPORT_SSE:
+        try:
+            return sse_client(url, headers=headers)
+        except TypeError as e:
+            # Older mcp versions don't accept headers
+            if "unexpected keyword argument" not in str(e):
+                raise
+            return sse_client(url)
+    if transport == TRANSPORT_HTTP:
+        return streamablehttp_client(url, headers=headers) if headers else streamablehttp_client(url)
+    raise ValueError(f"Unsupported MCP transport: {transport}")
+
+
+@dataclass
+class LatencyHistogram:
+    """Bucketed latency counts in milliseconds."""
+    buckets: Tuple[int, ...] = LATENCY_BUCKETS_MS
+    counts: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def observe(self, elapsed_ms: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given percentile."""
+        if not self.count:
+            return None
+        target = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return float(self.buckets[i]) if i < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def summary(self) -> Dict[str, Any]:
+        labels = [f"le_{b}" for b in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max_ms, 2),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+@dataclass
+class PooledSession:
+    """An initialized MCP session kept open by its owner task."""
+    key: str
+    label: str
+    transport: str
+    url: str
+    headers: Optional[Dict[str, Any]]
+    scope: Optional[str]
+    session: Optional[ClientSession] = None
+    owner: Optional[asyncio.Task] = None
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    closing: asyncio.Event = field(default_factory=asyncio.Event)
+    error: Optional[BaseException] = None
+    in_flight: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self.owner is not None and not self.owner.done() and not self.closing.is_set()
+
+
+class MCPSessionPool:
+    """Reuses initialized MCP sessions across tool calls, bound to one event loop."""
+
+    def __init__(
+        self,
+        idle_ttl: float = IDLE_TTL,
+        health_check_after: float = HEALTH_CHECK_AFTER,
+        max_concurrent_calls: int = MAX_CONCURRENT_CALLS,
+        connect_timeout: float = CONNECT_TIMEOUT,
+    ):
+        self.loop = asyncio.get_running_loop()
+        self.idle_ttl = idle_ttl
+        self.health_check_after = health_check_after
+        self.max_concurrent_calls = max_concurrent_calls
+        self.connect_timeout = connect_timeout
+        self._sessions: Dict[str, PooledSession] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._limits: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        self._cold = LatencyHistogram()
+        self._warm = LatencyHistogram()
+        self._connects = 0
+        self._reconnects = 0
+        self._health_check_failures = 0
+        self._evictions = 0
+
+    async def call_tool(
+        self,
+        transport: str,
+        url: str,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        headers: Optional[Dict[str, Any]] = None,
+        scope: Optional[str] = None,
+    ) -> Any:
+        """
+        Call a tool on a pooled session, connecting if needed.
+
+        A call on a reused session whose connection was already closed before
+        the request was sent is retried once on a fresh session. A connection
+        lost after that is raised, since the server may have run the tool, and
+        so are errors returned by the server itself.
+        """
+        return await self._run(
+            transport, url, headers, scope, tool_name,
+            lambda session: session.call_tool(tool_name, arguments),
+            record_latency=True,
+        )
+
+    async def list_tools(
+        self,
+        transport: str,
+        url: str,
+        headers: Optional[Dict[str, Any]] = None,
+        scope: Optional[str] = None,
+    ) -> List[Any]:
+        """List a server's tools on a pooled session, leaving it open for the calls that follow."""
+        result = await self._run(
+            transport, url, headers, scope, "list_tools", lambda session: session.list_tools(), idempotent=True
+        )
+        return result.tools if hasattr(result, 'tools') else result
+
+    async def _run(
+        self,
+        transport: str,
+        url: str,
+        headers: Optional[Dict[str, Any]],
+        scope: Optional[str],
+        label: str,
+        request: Callable[[ClientSession], Awaitable[Any]],
+        record_latency: bool = False,
+        idempotent: bool = False,
+    ) -> Any:
+        """Run a request on a pooled session.
+
+        Requests that are safe to repeat are retried on a fresh session after
+        any connection error on a reused one; others only when it's certain
+        the request was never sent.
+        """
+        key = session_key(transport, url, headers, scope)
+        # The concurrency limit protects the server, so runs with their own
+        # sessions to the same server still share it
+        server = session_key(transport, url, headers)
+        limit, users = self._limits.get(server) or (asyncio.Semaphore(self.max_concurrent_calls), 0)
+        self._limits[server] = (limit, users + 1)
+
+        try:
+            async with limit:
+                # Time spent waiting for the limiter isn't call latency
+                start = time.monotonic()
+                for attempt in range(2):
+                    entry, warm = await self._acquire(key, transport, url, headers, scope)
+                    entry.in_flight += 1
+                    try:
+                        result = await request(entry.session)
+                    except Exception as e:
+                        lost = isinstance(e, CONNECTION_ERRORS) or not entry.alive
+                        if lost:
+                            await self._discard(entry)
+                        if attempt == 0 and warm and lost and (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                            logger.warning(f"MCP session to {entry.label} lost before {label}, reconnecting: {e}")
+                            self._reconnects += 1
+                            continue
+                        raise
+                    finally:
+                        entry.in_flight -= 1
+                        entry.last_used = time.monotonic()
+
+                    if record_latency:
+                        elapsed_ms = (time.monotonic() - start) * 1000
+                        (self._warm if warm else self._cold).observe(elapsed_ms)
+                    return result
+        finally:
+            # Drop the limiter once no call to the server is running or waiting
+            limit, users = self._limits[server]
+            if users > 1:
+                self._limits[server] = (limit, users - 1)
+            else:
+                del self._limits[server]
+
+    async def _acquire(
+        self,
+        key: str,
+        transport: str,
+        url: str,
+        headers: Optional[Dict[str, Any]],
+        scope: Optional[str],
+    ) -> Tuple[PooledSession, bool]:
+        """Return a live session for the key and whether it was reused."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._sessions.get(key)
+            if entry and not entry.alive:
+                await self._discard(entry)
+                entry = None
+
+            if entry and entry.in_flight == 0 and time.monotonic() - entry.last_used > self.health_check_after:
+                try:
+                    async with asyncio.timeout(HEALTH_CHECK_TIMEOUT):
+                        await entry.session.send_ping()
+                except Exception as e:
+                    logger.info(f"MCP session to {entry.label} failed health check, reconnecting: {e}")
+                    self._health_check_failures += 1
+                    await self._discard(entry)
+                    entry = None
+
+            if entry:
+                return entry, True
+
+            entry = await self._connect(key, transport, url, headers, scope)
+            self._sessions[key] = entry
+            self._ensure_reaper()
+            return entry, False
+
+    async def _connect(
+        self,
+        key: str,
+        transport: str,
+        url: str,
+        headers: Optional[Dict[str, Any]],
+        scope: Optional[str],
+    ) -> PooledSession:
+        entry = PooledSession(key=key, label=_server_label(url), transport=transport, url=url, headers=headers, scope=scope)
+        entry.owner = asyncio.create_task(self._run_session(entry))
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                await entry.ready.wait()
+        except BaseException:
+            entry.owner.cancel()
+            raise
+
+        if entry.session is None:
+            raise entry.error or ConnectionError(f"MCP session to {entry.label} closed during initialization")
+
+        self._connects += 1
+        logger.info(f"Opened pooled MCP session to {entry.label} ({transport})")
+        return entry
+
+    async def _run_session(self, entry: PooledSession) -> None:
+        """Owner task: hold the transport and session open until asked to close."""
+        try:
+            async with _open_transport(entry.transport, entry.url, entry.headers) as streams:
+                async with ClientSession(streams[0], streams[1]) as session:
+                    await session.initialize()
+                    entry.session = session
+                    entry.ready.set()
+                    await entry.closing.wait()
+        except Exception as e:
+            entry.error = e
+            if entry.session is not None:
+                logger.warning(f"Pooled MCP session to {entry.label} closed: {e}")
+        finally:
+            entry.session = None
+            entry.ready.set()
+
+    async def _discard(self, entry: PooledSession) -> None:
+        if self._sessions.get(entry.key) is entry:
+            del self._sessions[entry.key]
+        entry.closing.set()
+        if entry.owner is None or entry.owner.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(entry.owner), timeout=CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            entry.owner.cancel()
+            await asyncio.gather(entry.owner, return_exceptions=True)
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def _reap_idle(self) -> None:
+        """Evict sessions that have been idle longer than the TTL or whose connection died."""
+        interval = max(1.0, min(self.idle_ttl, self.health_check_after) / 2)
+        while self._sessions:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for entry in list(self._sessions.values()):
+                if entry.in_flight:
+                    continue
+                if not entry.alive or now - entry.last_used > self.idle_ttl:
+                    logger.debug(f"Evicting idle MCP session to {entry.label}")
+                    self._evictions += 1
+                    await self._discard(entry)
+
+    async def close_scope(self, scope: str) -> None:
+        """Close every session opened under the given scope."""
+        entries = [e for e in self._sessions.values() if e.scope == scope]
+        for entry in entries:
+            await self._discard(entry)
+            lock = self._locks.get(entry.key)
+            if lock and not lock.locked():
+                del self._locks[entry.key]
+
+    async def close(self) -> None:
+        """Close every pooled session."""
+        for entry in list(self._sessions.values()):
+            await self._discard(entry)
+        if self._reaper:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open_sessions": len(self._sessions),
+            "connects": self._connects,
+            "reconnects": self._reconnects,
+            "health_check_failures": self._health_check_failures,
+            "evictions": self._evictions,
+            "cold_calls": self._cold.summary(),
+            "warm_calls": self._warm.summary(),
+        }
+
+
+_pool: Optional[MCPSessionPool] = None
+
+
+def get_session_pool() -> MCPSessionPool:
+    """Process-wide session pool for the running event loop."""
+    global _pool
+    if _pool is None or _pool.loop is not asyncio.get_running_loop():
+        _pool = MCPSessionPool()
+    return _pool
@@ -509,17 +509,20 @@ class TemplateManager:
             configured_mcps = []
             custom_mcps = []
             
+            mapped_requirements = []
             for req in template.mcp_requirements:
-                credential_id = instance.credential_mappings.get(req.qualified_name)
-                if not credential_id:
+                if not instance.credential_mappings.get(req.qualified_name):
                     logger.warning(f"No credential mapping for {req.qualified_name}")
                     continue
-                
-                # Get the credential
-                credential = await credential_manager.get_credential(
-                    instance.account_id, req.qualified_name
-                )
-                
+                mapped_requirements.append(req)
+            
+            # Get the credentials of all requirements at once
+            credentials = await credential_manager.get_credentials(
+                instance.account_id, [req.qualified_name for req in mapped_requirements]
+            )
+            
+            for req in mapped_requirements:
+                credential = credentials.get(req.qualified_name)
                 if not credential:
                     logger.warning(f"Credential not found for {req.qualified_name}")
                     continue
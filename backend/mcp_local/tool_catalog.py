@@ -0,0 +1,197 @@
+"""
+Shared cache of MCP server tool catalogs, and concurrent server bring-up.
+
+Discovering a server's tools costs a connection, the initialize handshake and
+a list_tools round trip, and agents keep running against the same servers with
+the same configuration. Catalogs are cached in Redis keyed by the server and a
+hash of its configuration (which carries the credentials, so it is never
+stored in the clear), and for MCP_TOOL_CATALOG_TTL seconds runs register their
+dynamic tools from the cached schemas without connecting at all. A copy is kept
+in process memory for the same TTL so runs on one worker don't each go to
+Redis, and concurrent discoveries of the same catalog on a worker share one
+handshake.
+
+Servers are brought up concurrently, each bounded by MCP_SERVER_STARTUP_TIMEOUT;
+a server that fails or times out is logged and skipped without holding up the
+others.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from services import redis
+from utils.logger import logger
+
+CATALOG_TTL = int(os.getenv("MCP_TOOL_CATALOG_TTL", "3600"))
+STARTUP_TIMEOUT = float(os.getenv("MCP_SERVER_STARTUP_TIMEOUT", "15"))
+CATALOG_KEY_PREFIX = "mcp_tool_catalog:"
+
+
+@dataclass(frozen=True)
+class CatalogTool:
+    """The parts of an MCP tool definition needed to register and call it."""
+    name: str
+    description: Optional[str] = None
+    inputSchema: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_tool(cls, tool: Any) -> "CatalogTool":
+        """Build from an mcp Tool or a tool dict (either schema key spelling)."""
+        if isinstance(tool, dict):
+            schema = tool.get("inputSchema", tool.get("input_schema"))
+            return cls(name=tool["name"], description=tool.get("description"), inputSchema=schema or {})
+        return cls(name=tool.name, description=tool.description, inputSchema=tool.inputSchema or {})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "description": self.description, "inputSchema": self.inputSchema}
+
+
+def catalog_key(kind: str, server: str, config: Any) -> str:
+    """Cache key for a server's catalog; hashed so credentials never reach Redis keys or logs."""
+    material = json.dumps([kind, server, config], sort_keys=True, default=str)
+    return f"{CATALOG_KEY_PREFIX}{hashlib.sha256(material.encode()).hexdigest()}"
+
+
+class ToolCatalogCache:
+    """Tool catalogs cached in process memory and Redis for a TTL."""
+
+    def __init__(self, ttl: int = CATALOG_TTL):
+        self.ttl = ttl
+        self._local: Dict[str, Tuple[float, List[CatalogTool]]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._local_hits = 0
+        self._redis_hits = 0
+        self._discoveries = 0
+        self._redis_errors = 0
+
+    async def get(self, key: str) -> Optional[List[CatalogTool]]:
+        cached = self._local.get(key)
+        if cached and cached[0] > time.monotonic():
+            self._local_hits += 1
+            return cached[1]
+        self._local.pop(key, None)
+
+        if self.ttl <= 0:
+            return None
+        try:
+            pipe = await redis.pipeline()
+            pipe.get(key)
+            pipe.ttl(key)
+            raw, ttl = await pipe.execute()
+        except Exception as e:
+            self._redis_errors += 1
+            logger.warning(f"Failed to read MCP tool catalog from Redis: {e}")
+            return None
+        if not raw:
+            return None
+        try:
+            tools = [CatalogTool.from_tool(t) for t in json.loads(raw)]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring malformed MCP tool catalog {key}: {e}")
+            return None
+        # Expire the local copy with the shared one, so an invalidation elsewhere is seen within the TTL
+        self._local[key] = (time.monotonic() + (ttl if ttl > 0 else self.ttl), tools)
+        self._redis_hits += 1
+        return tools
+
+    async def put(self, key: str, tools: List[CatalogTool]) -> None:
+        if self.ttl <= 0:
+            return
+        self._local[key] = (time.monotonic() + self.ttl, tools)
+        try:
+            await redis.set(key, json.dumps([t.to_dict() for t in tools]), ex=self.ttl)
+        except Exception as e:
+            self._redis_errors += 1
+            logger.warning(f"Failed to store MCP tool catalog in Redis: {e}")
+
+    async def invalidate(self, key: str) -> None:
+        self._local.pop(key, None)
+        try:
+            await redis.delete(key)
+        except Exception as e:
+            self._redis_errors += 1
+            logger.warning(f"Failed to invalidate MCP tool catalog: {e}")
+
+    async def get_or_discover(self, key: str, discover: Callable[[], Awaitable[Iterable[Any]]]) -> List[CatalogTool]:
+        """Return the cached catalog, or run discover() once and cache what it returns."""
+        tools = await self.get(key)
+        if tools is not None:
+            return tools
+
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._discover(key, discover))
+            self._inflight[key] = task
+
+            def forget(done: asyncio.Task) -> None:
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+            task.add_done_callback(forget)
+        # A caller timing out must not cancel a discovery other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def _discover(self, key: str, discover: Callable[[], Awaitable[Iterable[Any]]]) -> List[CatalogTool]:
+        tools = [CatalogTool.from_tool(t) for t in await discover()]
+        self._discoveries += 1
+        await self.put(key, tools)
+        return tools
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local_entries": len(self._local),
+            "local_hits": self._local_hits,
+            "redis_hits": self._redis_hits,
+            "discoveries": self._discoveries,
+            "redis_errors": self._redis_errors,
+        }
+
+
+_catalog: Optional[ToolCatalogCache] = None
+
+
+def get_tool_catalog() -> ToolCatalogCache:
+    """Process-wide tool catalog cache."""
+    global _catalog
+    if _catalog is None:
+        _catalog = ToolCatalogCache()
+    return _catalog
+
+
+async def connect_concurrently(
+    configs: List[Dict[str, Any]],
+    connect: Callable[[Dict[str, Any]], Awaitable[Any]],
+    name: Callable[[Dict[str, Any]], str],
+    timeout: float = STARTUP_TIMEOUT,
+) -> Dict[str, BaseException]:
+    """
+    Run connect(config) for every config at once, each bounded by the timeout.
+
+    Returns the failures by server name; servers that connected are unaffected
+    by the ones that didn't.
+    """
+    async def bring_up(config: Dict[str, Any]) -> None:
+        async with asyncio.timeout(timeout):
+            await connect(config)
+
+    start = time.monotonic()
+    results = await asyncio.gather(*(bring_up(config) for config in configs), return_exceptions=True)
+    failures: Dict[str, BaseException] = {}
+    for config, result in zip(configs, results):
+        if isinstance(result, BaseException):
+            server = name(config)
+            if isinstance(result, TimeoutError):
+                result = TimeoutError(f"no response within {timeout:.0f}s")
+            logger.error(f"Failed to connect to MCP server {server}: {result}")
+            failures[server] = result
+    if configs:
+        logger.info(
+            f"Brought up {len(configs) - len(failures)}/{len(configs)} MCP servers "
+            f"in {(time.monotonic() - start) * 1000:.0f}ms"
+        )
+    return failures
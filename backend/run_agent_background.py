@@ -8,9 +8,11 @@ import traceback
 from datetime import datetime, timezone
 from typing import Optional
 from services import redis
+from services import run_responses
 from agent.run import run_agent
 from utils.logger import logger, structlog
 import dramatiq
+from dramatiq.asyncio import get_event_loop_thread
 import uuid
 from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
@@ -19,15 +21,27 @@ from dramatiq.brokers.rabbitmq import RabbitmqBroker
 import os
 from services.langfuse import langfuse
 from utils.retry import retry
+from flags import flags as feature_flags
+from mcp_local.credential_manager import credential_manager
 from workflows.executor import WorkflowExecutor
 from workflows.deterministic_executor import DeterministicWorkflowExecutor
 from workflows.models import WorkflowDefinition
 import sentry_sdk
 from typing import Dict, Any
 
+class FlushOnShutdown(dramatiq.Middleware):
+    """Write state buffered in this process once the worker threads have stopped."""
+
+    def after_worker_shutdown(self, broker, worker):
+        # Runs before AsyncIO's hook (after_* hooks run in reverse), so its event loop is still up
+        try:
+            get_event_loop_thread().run_coroutine(credential_manager.flush_last_used())
+        except Exception as e:
+            logger.error(f"Failed to flush credential last_used_at on shutdown: {e}")
+
 rabbitmq_host = os.getenv('RABBITMQ_HOST', 'rabbitmq')
 rabbitmq_port = int(os.getenv('RABBITMQ_PORT', 5672))
-rabbitmq_broker = RabbitmqBroker(host=rabbitmq_host, port=rabbitmq_port, middleware=[dramatiq.middleware.AsyncIO()])
+rabbitmq_broker = RabbitmqBroker(host=rabbitmq_host, port=rabbitmq_port, middleware=[dramatiq.middleware.AsyncIO(), FlushOnShutdown()])
 dramatiq.set_broker(rabbitmq_broker)
 
 
@@ -45,6 +59,7 @@ async def initialize():
         instance_id = str(uuid.uuid4())[:8]
     await retry(lambda: redis.initialize_async())
     await db.initialize()
+    await feature_flags.start()
 
     _initialized = True
     logger.info(f"Initialized agent API with instance ID: {instance_id}")
@@ -127,11 +142,12 @@ async def run_agent_background(
     total_responses = 0
     pubsub = None
     stop_checker = None
+    agent_gen = None
     stop_signal_received = False
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
+    response_publisher = run_responses.ResponsePublisher(agent_run_id)
+    response_compactor = run_responses.ResponseCompactor()
     instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
     instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
@@ -192,8 +208,6 @@ async def run_agent_background(
         final_status = "running"
         error_message = None
 
-        pending_redis_operations = []
-
         async for response in agent_gen:
             if stop_signal_received:
                 logger.info(f"Agent run {agent_run_id} stopped by signal.")
@@ -201,10 +215,9 @@ async def run_agent_background(
                 trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
                 break
 
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+            # Store response in Redis and notify viewers (content chunks are batched)
+            await response_publisher.publish(response)
+            response_compactor.add(response)
             total_responses += 1
 
             # Check for agent-signaled completion or error
@@ -217,6 +230,10 @@ async def run_agent_background(
                          error_message = response.get('message', f"Run ended with status: {status_val}")
                      break
 
+        # Breaking out leaves the generator suspended; closing it runs its cleanup
+        # (flushing queued messages) before the run is marked finished
+        await agent_gen.aclose()
+
         # If loop finished without explicit completion/error/stop signal, mark as completed
         if final_status == "running":
              final_status = "completed"
@@ -224,12 +241,12 @@ async def run_agent_background(
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             await response_publisher.publish(completion_message)
+             response_compactor.add(completion_message)
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        # Compacted responses were built during the run, no need to read them back from Redis
+        await response_publisher.close()
+        all_responses = response_compactor.responses()
 
         # Update DB status
         await update_agent_run_status(client, agent_run_id, final_status, error=error_message, responses=all_responses)
@@ -254,19 +271,14 @@ async def run_agent_background(
         # Push error message to Redis list
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            await response_publisher.publish(error_response)
+            await response_publisher.close()
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
-        # Fetch final responses (including the error)
-        all_responses = []
-        try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
+        # Final responses (including the error)
+        response_compactor.add(error_response)
+        all_responses = response_compactor.responses()
 
         # Update DB status
         await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}", responses=all_responses)
@@ -279,6 +291,13 @@ async def run_agent_background(
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
+        # Close the agent generator if an error left it suspended
+        if agent_gen is not None:
+            try:
+                await agent_gen.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing agent generator for {agent_run_id}: {e}")
+
         # Cleanup stop checker task
         if stop_checker and not stop_checker.done():
             stop_checker.cancel()
@@ -295,6 +314,15 @@ async def run_agent_background(
             except Exception as e:
                 logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
 
+        # Write any responses still buffered, with timeout
+        try:
+            await asyncio.wait_for(response_publisher.close(), timeout=30.0)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
+        publisher_stats = response_publisher.stats()
+        logger.info(f"Response publisher stats for {agent_run_id}: {publisher_stats}")
+        trace.event(name="response_publisher_stats", level="DEFAULT", metadata=publisher_stats)
+
         # Set TTL on the response list in Redis
         await _cleanup_redis_response_list(agent_run_id)
 
@@ -304,12 +332,6 @@ async def run_agent_background(
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
 
-        # Wait for all pending redis operations to complete, with timeout
-        try:
-            await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
-
         logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
 async def _cleanup_redis_instance_key(agent_run_id: str):
@@ -336,16 +358,15 @@ async def _cleanup_redis_run_lock(agent_run_id: str):
         logger.warning(f"Failed to clean up Redis run lock key {run_lock_key}: {str(e)}")
 
 # TTL for Redis response lists (24 hours)
-REDIS_RESPONSE_LIST_TTL = 3600 * 24
+REDIS_RESPONSE_LIST_TTL = run_responses.RESPONSE_TTL
 
 async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+    """Set TTL on the Redis response list or stream."""
     try:
-        await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
-        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response list: {response_list_key}")
+        await run_responses.expire_responses(agent_run_id, REDIS_RESPONSE_LIST_TTL)
+        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on responses of agent run: {agent_run_id}")
     except Exception as e:
-        logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
+        logger.warning(f"Failed to set TTL on responses of agent run {agent_run_id}: {str(e)}")
 
 async def update_agent_run_status(
     client,
@@ -1,20 +1,30 @@
 import os
+import json
 import urllib.parse
-from typing import Optional
+from typing import Optional, Tuple
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter, Form, Depends, Request
-from fastapi.responses import Response
+from fastapi.responses import Response, FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 
+from daytona_sdk import Sandbox
 from sandbox.sandbox import get_or_start_sandbox, delete_sandbox
+from sandbox.sandbox_io import run_sandbox_io
+from sandbox.file_cache import sandbox_file_cache, stream_sandbox_file, file_etag, etag_matches, parse_range
 from utils.logger import logger
 from utils.auth_utils import get_optional_user_id
 from services.supabase import DBConnection
+from services import redis
 
 # Initialize shared resources
 router = APIRouter(tags=["sandbox"])
 db = None
 
+# How long a successful access check is reused. Membership and visibility changes
+# made outside the backend take effect within this window.
+SANDBOX_ACCESS_CACHE_TTL = int(os.getenv("SANDBOX_ACCESS_CACHE_TTL", "20"))
+
 def initialize(_db: DBConnection):
     """Initialize the sandbox API with resources from the main API."""
     global db
@@ -65,30 +75,80 @@ def normalize_path(path: str) -> str:
         logger.error(f"Error normalizing path '{path}': {str(e)}")
         return path  # Return original path if decoding fails
 
+# Project columns an access check reads, and all that is cached of the project
+ACCESS_FIELDS = ('project_id', 'account_id', 'is_public')
+
+def _access_cache_key(sandbox_id: str, user_id: Optional[str]) -> str:
+    return f"sandbox_access:{sandbox_id}:{user_id or 'anonymous'}"
+
+def _access_index_key(sandbox_id: str) -> str:
+    return f"sandbox_access_keys:{sandbox_id}"
+
+async def _get_cached_access(sandbox_id: str, user_id: Optional[str]) -> Optional[dict]:
+    try:
+        cached = await redis.get(_access_cache_key(sandbox_id, user_id))
+        return json.loads(cached) if cached else None
+    except Exception as e:
+        logger.warning(f"Failed to read cached sandbox access for {sandbox_id}: {str(e)}")
+        return None
+
+async def _cache_access(sandbox_id: str, user_id: Optional[str], project_data: dict):
+    cache_key = _access_cache_key(sandbox_id, user_id)
+    index_key = _access_index_key(sandbox_id)
+    try:
+        pipe = await redis.pipeline()
+        pipe.set(cache_key, json.dumps(project_data, default=str), ex=SANDBOX_ACCESS_CACHE_TTL)
+        pipe.sadd(index_key, cache_key)
+        pipe.expire(index_key, SANDBOX_ACCESS_CACHE_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to cache sandbox access for {sandbox_id}: {str(e)}")
+
+async def invalidate_sandbox_access(sandbox_id: str):
+    """Drop every cached access decision for a sandbox, e.g. after its project changed."""
+    index_key = _access_index_key(sandbox_id)
+    try:
+        cache_keys = await redis.smembers(index_key)
+        pipe = await redis.pipeline()
+        for cache_key in cache_keys:
+            pipe.delete(cache_key)
+        pipe.delete(index_key)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to invalidate sandbox access for {sandbox_id}: {str(e)}")
+
 async def verify_sandbox_access(client, sandbox_id: str, user_id: Optional[str] = None):
     """
     Verify that a user has access to a specific sandbox based on account membership.
     
+    Successful checks are cached per (user, sandbox) for SANDBOX_ACCESS_CACHE_TTL seconds.
+    
     Args:
         client: The Supabase client
         sandbox_id: The sandbox ID to check access for
         user_id: The user ID to check permissions for. Can be None for public resource access.
         
     Returns:
-        dict: Project data containing sandbox information
+        dict: The owning project's project_id, account_id and is_public
         
     Raises:
         HTTPException: If the user doesn't have access to the sandbox or sandbox doesn't exist
     """
-    # Find the project that owns this sandbox
-    project_result = await client.table('projects').select('*').filter('sandbox->>id', 'eq', sandbox_id).execute()
+    cached = await _get_cached_access(sandbox_id, user_id)
+    if cached is not None:
+        return cached
+    
+    # Find the project that owns this sandbox (uses idx_projects_sandbox_id)
+    project_result = await client.table('projects').select(', '.join(ACCESS_FIELDS)).filter('sandbox->>id', 'eq', sandbox_id).execute()
     
     if not project_result.data or len(project_result.data) == 0:
         raise HTTPException(status_code=404, detail="Sandbox not found")
     
-    project_data = project_result.data[0]
+    # Only what the access decision needs; the sandbox column holds its VNC password and preview token
+    project_data = {field: project_result.data[0].get(field) for field in ACCESS_FIELDS}
 
     if project_data.get('is_public'):
+        await _cache_access(sandbox_id, user_id, project_data)
         return project_data
     
     # For private projects, we must have a user_id
@@ -101,44 +161,31 @@ async def verify_sandbox_access(client, sandbox_id: str, user_id: Optional[str]
     if account_id:
         account_user_result = await client.schema('basejump').from_('account_user').select('account_role').eq('user_id', user_id).eq('account_id', account_id).execute()
         if account_user_result.data and len(account_user_result.data) > 0:
+            await _cache_access(sandbox_id, user_id, project_data)
             return project_data
     
     raise HTTPException(status_code=403, detail="Not authorized to access this sandbox")
 
-async def get_sandbox_by_id_safely(client, sandbox_id: str):
+async def resolve_sandbox(client, sandbox_id: str, user_id: Optional[str] = None) -> Tuple[dict, Sandbox]:
     """
-    Safely retrieve a sandbox object by its ID, using the project that owns it.
+    Check that the user may access a sandbox and return its project (as returned by
+    verify_sandbox_access) and sandbox handle.
     
-    Args:
-        client: The Supabase client
-        sandbox_id: The sandbox ID to retrieve
+    The access check resolves the owning project, so the sandbox is fetched (or
+    started) directly without looking the project up a second time.
     
-    Returns:
-        Sandbox: The sandbox object
-        
     Raises:
-        HTTPException: If the sandbox doesn't exist or can't be retrieved
+        HTTPException: If access is denied, the sandbox doesn't exist or can't be retrieved
     """
-    # Find the project that owns this sandbox
-    project_result = await client.table('projects').select('project_id').filter('sandbox->>id', 'eq', sandbox_id).execute()
-    
-    if not project_result.data or len(project_result.data) == 0:
-        logger.error(f"No project found for sandbox ID: {sandbox_id}")
-        raise HTTPException(status_code=404, detail="Sandbox not found - no project owns this sandbox ID")
-    
-    # project_id = project_result.data[0]['project_id']
-    # logger.debug(f"Found project {project_id} for sandbox {sandbox_id}")
+    project_data = await verify_sandbox_access(client, sandbox_id, user_id)
     
     try:
-        # Get the sandbox
         sandbox = await get_or_start_sandbox(sandbox_id)
-        # Extract just the sandbox object from the tuple (sandbox, sandbox_id, sandbox_pass)
-        # sandbox = sandbox_tuple[0]
-            
-        return sandbox
     except Exception as e:
         logger.error(f"Error retrieving sandbox {sandbox_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve sandbox: {str(e)}")
+    
+    return project_data, sandbox
 
 @router.post("/sandboxes/{sandbox_id}/files")
 async def create_file(
@@ -155,18 +202,15 @@ async def create_file(
     logger.info(f"Received file upload request for sandbox {sandbox_id}, path: {path}, user_id: {user_id}")
     client = await db.client
     
-    # Verify the user has access to this sandbox
-    await verify_sandbox_access(client, sandbox_id, user_id)
+    # Verify the user has access to this sandbox and get it
+    _, sandbox = await resolve_sandbox(client, sandbox_id, user_id)
     
     try:
-        # Get sandbox using the safer method
-        sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
-        
         # Read file content directly from the uploaded file
         content = await file.read()
         
         # Create file using raw binary content
-        sandbox.fs.upload_file(content, path)
+        await run_sandbox_io(sandbox_id, sandbox.fs.upload_file, content, path)
         logger.info(f"File created at {path} in sandbox {sandbox_id}")
         
         return {"status": "success", "created": True, "path": path}
@@ -188,15 +232,12 @@ async def list_files(
     logger.info(f"Received list files request for sandbox {sandbox_id}, path: {path}, user_id: {user_id}")
     client = await db.client
     
-    # Verify the user has access to this sandbox
-    await verify_sandbox_access(client, sandbox_id, user_id)
+    # Verify the user has access to this sandbox and get it
+    _, sandbox = await resolve_sandbox(client, sandbox_id, user_id)
     
     try:
-        # Get sandbox using the safer method
-        sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
-        
         # List files
-        files = sandbox.fs.list_files(path)
+        files = await run_sandbox_io(sandbox_id, sandbox.fs.list_files, path)
         result = []
         
         for file in files:
@@ -237,36 +278,76 @@ async def read_file(
     
     client = await db.client
     
-    # Verify the user has access to this sandbox
-    await verify_sandbox_access(client, sandbox_id, user_id)
+    # Verify the user has access to this sandbox and get it
+    _, sandbox = await resolve_sandbox(client, sandbox_id, user_id)
     
     try:
-        # Get sandbox using the safer method
-        sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
-        
-        # Read file directly - don't check existence first with a separate call
+        # Size and mtime give the ETag and decide between the disk cache and streaming
         try:
-            content = sandbox.fs.download_file(path)
-        except Exception as download_err:
-            logger.error(f"Error downloading file {path} from sandbox {sandbox_id}: {str(download_err)}")
+            file_info = await run_sandbox_io(sandbox_id, sandbox.fs.get_file_info, path)
+        except Exception as info_err:
+            logger.error(f"Error downloading file {path} from sandbox {sandbox_id}: {str(info_err)}")
             raise HTTPException(
                 status_code=404, 
-                detail=f"Failed to download file: {str(download_err)}"
+                detail=f"Failed to download file: {str(info_err)}"
             )
+        if file_info.is_dir:
+            raise HTTPException(status_code=400, detail=f"Path is a directory: {path}")
         
-        # Return a Response object with the content directly
         filename = os.path.basename(path)
-        logger.info(f"Successfully read file {filename} from sandbox {sandbox_id}")
+        etag = file_etag(file_info.size, file_info.mod_time)
         
         # Ensure proper encoding by explicitly using UTF-8 for the filename in Content-Disposition header
         # This applies RFC 5987 encoding for the filename to support non-ASCII characters
         encoded_filename = filename.encode('utf-8').decode('latin-1')
-        content_disposition = f"attachment; filename*=UTF-8''{encoded_filename}"
+        headers = {
+            "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "private, no-cache",
+        }
+        
+        if request is not None and etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        if sandbox_file_cache.cacheable(file_info.size):
+            # Served from local disk, which also handles Range requests
+            key, local_path = await sandbox_file_cache.fetch(sandbox, sandbox_id, path, etag)
+            logger.info(f"Serving file {filename} from sandbox {sandbox_id} ({file_info.size} bytes)")
+            return FileResponse(
+                local_path,
+                media_type="application/octet-stream",
+                headers=headers,
+                background=BackgroundTask(sandbox_file_cache.release, key)
+            )
         
-        return Response(
-            content=content,
+        # Too large to cache: stream straight from the sandbox
+        byte_range = None
+        if request is not None and request.headers.get("if-range", etag) == etag:
+            try:
+                byte_range = parse_range(request.headers.get("range"), file_info.size)
+            except ValueError:
+                raise HTTPException(
+                    status_code=416,
+                    detail="Requested range not satisfiable",
+                    headers={"Content-Range": f"bytes */{file_info.size}"}
+                )
+        
+        logger.info(f"Streaming file {filename} from sandbox {sandbox_id} ({file_info.size} bytes, range {byte_range})")
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_info.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                stream_sandbox_file(sandbox, sandbox_id, path, start, end),
+                status_code=206,
+                media_type="application/octet-stream",
+                headers=headers
+            )
+        return StreamingResponse(
+            stream_sandbox_file(sandbox, sandbox_id, path),
             media_type="application/octet-stream",
-            headers={"Content-Disposition": content_disposition}
+            headers=headers
         )
     except HTTPException:
         # Re-raise HTTP exceptions without wrapping
@@ -289,15 +370,12 @@ async def delete_file(
     logger.info(f"Received file delete request for sandbox {sandbox_id}, path: {path}, user_id: {user_id}")
     client = await db.client
     
-    # Verify the user has access to this sandbox
-    await verify_sandbox_access(client, sandbox_id, user_id)
+    # Verify the user has access to this sandbox and get it
+    _, sandbox = await resolve_sandbox(client, sandbox_id, user_id)
     
     try:
-        # Get sandbox using the safer method
-        sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
-        
         # Delete file
-        sandbox.fs.delete_file(path)
+        await run_sandbox_io(sandbox_id, sandbox.fs.delete_file, path)
         logger.info(f"File deleted at {path} in sandbox {sandbox_id}")
         
         return {"status": "success", "deleted": True, "path": path}
@@ -321,6 +399,7 @@ async def delete_sandbox_route(
     try:
         # Delete the sandbox using the sandbox module function
         await delete_sandbox(sandbox_id)
+        await invalidate_sandbox_access(sandbox_id)
         
         return {"status": "success", "deleted": True, "sandbox_id": sandbox_id}
     except Exception as e:
@@ -0,0 +1,176 @@
+"""
+HTTP client for the browser automation API running inside a sandbox.
+
+The browser API listens on BROWSER_API_PORT inside the sandbox. Requests go
+straight to it through the sandbox's preview link, over a pooled keep-alive
+connection. Only when the preview link can't be used is the request sent the
+old way: a curl command run inside the sandbox with process.exec, which costs a
+Daytona API round trip and a process spawn per action.
+
+A request falls back to exec only when it certainly never reached the browser
+API (the connection or the preview proxy failed). Clicks and typing are not
+idempotent, so a request that may have run is never replayed.
+"""
+
+import asyncio
+import json
+import os
+import shlex
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+from daytona_sdk import Sandbox
+
+from sandbox.sandbox_io import run_sandbox_io
+from utils.logger import logger
+
+BROWSER_API_PORT = 8003
+BROWSER_API_DIRECT = os.getenv("BROWSER_API_DIRECT", "true").lower() == "true"
+BROWSER_API_TIMEOUT = float(os.getenv("BROWSER_API_TIMEOUT", "30"))
+# How long a preview link is reused, and how long a sandbox stays on exec after direct access failed
+PREVIEW_LINK_TTL = 10 * 60
+DIRECT_RETRY_AFTER = 60
+PREVIEW_TOKEN_HEADER = "X-Daytona-Preview-Token"
+# The preview proxy answers these itself when it can't reach the sandbox port
+PROXY_ERROR_STATUSES = {502, 503}
+
+
+class BrowserAPIError(Exception):
+    """The browser API could not be reached or returned something that isn't JSON."""
+
+
+class _DirectUnavailable(Exception):
+    """The request did not reach the browser API, so it is safe to send it another way."""
+
+
+class BrowserAPIClient:
+    """Sends browser automation requests to sandboxes, reusing connections across actions."""
+
+    def __init__(self, timeout: float = BROWSER_API_TIMEOUT, direct: bool = BROWSER_API_DIRECT):
+        self.timeout = timeout
+        self.direct = direct
+        self.loop = asyncio.get_running_loop()
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+        # sandbox_id -> (base_url, headers, fetched_at)
+        self._endpoints: Dict[str, Tuple[str, Dict[str, str], float]] = {}
+        # sandbox_id -> time direct access last failed
+        self._direct_failed: Dict[str, float] = {}
+        self._stats = {"direct": 0, "exec": 0, "fallbacks": 0}
+
+    async def _endpoint(self, sandbox: Sandbox, sandbox_id: str) -> Tuple[str, Dict[str, str]]:
+        cached = self._endpoints.get(sandbox_id)
+        if cached and time.monotonic() - cached[2] < PREVIEW_LINK_TTL:
+            return cached[0], cached[1]
+
+        link = await run_sandbox_io(sandbox_id, sandbox.get_preview_link, BROWSER_API_PORT)
+        url = getattr(link, "url", None)
+        if not url:
+            raise _DirectUnavailable("No preview link for the browser API port")
+        token = getattr(link, "token", None)
+        headers = {PREVIEW_TOKEN_HEADER: token} if token else {}
+        self._endpoints[sandbox_id] = (url.rstrip("/"), headers, time.monotonic())
+        return url.rstrip("/"), headers
+
+    async def _request_direct(
+        self, sandbox: Sandbox, sandbox_id: str, endpoint: str, params: Optional[dict], method: str
+    ) -> Dict[str, Any]:
+        try:
+            base_url, headers = await self._endpoint(sandbox, sandbox_id)
+        except _DirectUnavailable:
+            raise
+        except Exception as e:
+            raise _DirectUnavailable(f"Failed to get preview link: {e}") from e
+
+        url = f"{base_url}/api/automation/{endpoint}"
+        try:
+            if method == "GET":
+                response = await self._http.get(url, params=params, headers=headers)
+            else:
+                response = await self._http.request(method, url, json=params, headers=headers)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            raise _DirectUnavailable(f"Could not connect to {url}: {e}") from e
+
+        if response.status_code in PROXY_ERROR_STATUSES:
+            raise _DirectUnavailable(f"Preview proxy returned {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise BrowserAPIError(f"Failed to parse response JSON: {response.text[:500]} {e}") from e
+
+    async def _request_exec(
+        self, sandbox: Sandbox, sandbox_id: str, endpoint: str, params: Optional[dict], method: str
+    ) -> Dict[str, Any]:
+        url = f"http://localhost:{BROWSER_API_PORT}/api/automation/{endpoint}"
+        if method == "GET" and params:
+            url = f"{url}?{urlencode(params)}"
+        curl_cmd = f"curl -s -X {method} {shlex.quote(url)} -H 'Content-Type: application/json'"
+        if method != "GET" and params:
+            curl_cmd += f" -d {shlex.quote(json.dumps(params))}"
+
+        logger.debug(f"Executing curl command: {curl_cmd}")
+        response = await run_sandbox_io(sandbox_id, sandbox.process.exec, curl_cmd, timeout=int(self.timeout))
+        if response.exit_code != 0:
+            raise BrowserAPIError(f"Browser automation request failed: {response}")
+        try:
+            return json.loads(response.result)
+        except json.JSONDecodeError as e:
+            raise BrowserAPIError(f"Failed to parse response JSON: {response.result} {e}") from e
+
+    async def request(
+        self,
+        sandbox: Sandbox,
+        sandbox_id: str,
+        endpoint: str,
+        params: Optional[dict] = None,
+        method: str = "POST",
+    ) -> Dict[str, Any]:
+        """
+        Call a browser automation endpoint and return its JSON response.
+
+        Raises:
+            BrowserAPIError: If the API can't be reached or doesn't return JSON
+        """
+        failed_at = self._direct_failed.get(sandbox_id)
+        if self.direct and (failed_at is None or time.monotonic() - failed_at > DIRECT_RETRY_AFTER):
+            try:
+                result = await self._request_direct(sandbox, sandbox_id, endpoint, params, method)
+                self._direct_failed.pop(sandbox_id, None)
+                self._stats["direct"] += 1
+                return result
+            except _DirectUnavailable as e:
+                logger.warning(f"Direct browser API access to sandbox {sandbox_id} unavailable, using exec: {e}")
+                self._direct_failed[sandbox_id] = time.monotonic()
+                self._endpoints.pop(sandbox_id, None)
+                self._stats["fallbacks"] += 1
+            except httpx.HTTPError as e:
+                raise BrowserAPIError(f"Browser automation request failed: {e}") from e
+
+        self._stats["exec"] += 1
+        return await self._request_exec(sandbox, sandbox_id, endpoint, params, method)
+
+    def forget(self, sandbox_id: str):
+        """Drop the cached preview link of a sandbox, e.g. after it was restarted."""
+        self._endpoints.pop(sandbox_id, None)
+        self._direct_failed.pop(sandbox_id, None)
+
+    async def close(self):
+        await self._http.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+
+_client: Optional[BrowserAPIClient] = None
+
+
+def get_browser_api_client() -> BrowserAPIClient:
+    """Process-wide browser API client for the running event loop."""
+    global _client
+    if _client is None or _client.loop is not asyncio.get_running_loop():
+        _client = BrowserAPIClient()
+    return _client
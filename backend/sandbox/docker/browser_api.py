@@ -1,21 +1,36 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Body
-from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from playwright.async_api import async_playwright, Browser, BrowserContext, ElementHandle, Page, Request
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import asyncio
 import json
 import logging
-import base64
+import hashlib
 from dataclasses import dataclass, field
 from datetime import datetime
 import os
 import random
 from functools import cached_property
 import traceback
+import weakref
 import pytesseract
 from PIL import Image
 import io
 
+# After an action the page counts as settled once its DOM has been quiet for
+# BROWSER_SETTLE_QUIET_MS and no document/XHR/fetch request is in flight,
+# waiting BROWSER_SETTLE_TIMEOUT seconds at most
+BROWSER_SETTLE_QUIET_MS = int(os.getenv("BROWSER_SETTLE_QUIET_MS", "200"))
+BROWSER_SETTLE_TIMEOUT = float(os.getenv("BROWSER_SETTLE_TIMEOUT", "5"))
+# Requests older than this are treated as long polling and don't hold up settling
+BROWSER_SETTLE_REQUEST_MAX_AGE = 3.0
+SETTLE_REQUEST_TYPES = {"document", "xhr", "fetch"}
+# When the browser state after an action includes a screenshot: "always",
+# "changed" (only when the page changed since the last one) or "never".
+# OCR runs only when asked for, see the /automation/screenshot endpoint.
+BROWSER_STATE_SCREENSHOT = os.getenv("BROWSER_STATE_SCREENSHOT", "changed")
+BROWSER_STATE_OCR = os.getenv("BROWSER_STATE_OCR", "false").lower() == "true"
+
 #######################################################
 # Action model definitions
 #######################################################
@@ -75,6 +90,9 @@ class DoneAction(BaseModel):
     success: bool = True
     text: str = ""
 
+class ScreenshotAction(BaseModel):
+    ocr: bool = False
+
 #######################################################
 # DOM Structure Models
 #######################################################
@@ -246,6 +264,253 @@ class DOMState:
     pixels_above: int = 0
     pixels_below: int = 0
 
+#######################################################
+# Incremental DOM tracking
+#######################################################
+
+# Installed into each document on first use. A MutationObserver records which
+# interactive elements changed, so a snapshot only re-reads text, attributes and
+# computed style of those, and only reports elements whose data or position
+# changed since the previous snapshot. Elements keep their index for as long as
+# they stay in the document; new elements get the next free index.
+DOM_TRACKER_JS = """
+(() => {
+    if (window.__domTracker) return window.__domTracker;
+
+    const SELECTOR = 'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])';
+    // Attribute changes that can change the style of every element below
+    const SUBTREE_ATTRIBUTES = new Set(['class', 'style', 'hidden']);
+    // Attribute changes that can make an element start or stop matching SELECTOR
+    const CANDIDATE_ATTRIBUTES = new Set(['role', 'tabindex']);
+
+    const tracker = {
+        doc: Math.random().toString(36).slice(2),
+        generation: 0,
+        lastChange: performance.now(),
+        list: [],
+        rescan: true,
+        allDirty: false,
+        dirty: new Set(),
+        records: new WeakMap(),
+        byIndex: new Map(),
+        nextIndex: 0,
+    };
+
+    const changed = () => {
+        tracker.generation += 1;
+        tracker.lastChange = performance.now();
+    };
+    const markEnclosing = (node) => {
+        const el = node.nodeType === Node.ELEMENT_NODE ? node : node.parentElement;
+        const candidate = el && el.closest(SELECTOR);
+        if (candidate) tracker.dirty.add(candidate);
+    };
+
+    new MutationObserver((mutations) => {
+        changed();
+        for (const m of mutations) {
+            if (m.type === 'childList') {
+                for (const node of [...m.addedNodes, ...m.removedNodes]) {
+                    if (node.nodeType !== Node.ELEMENT_NODE) continue;
+                    tracker.rescan = true;
+                    // New stylesheets can change the visibility of anything
+                    if (node.tagName === 'STYLE' || node.tagName === 'LINK') tracker.allDirty = true;
+                }
+                markEnclosing(m.target);
+            } else if (m.type === 'characterData') {
+                markEnclosing(m.target);
+            } else if (SUBTREE_ATTRIBUTES.has(m.attributeName)) {
+                if (m.target.matches(SELECTOR)) tracker.dirty.add(m.target);
+                for (const el of m.target.querySelectorAll(SELECTOR)) tracker.dirty.add(el);
+            } else {
+                if (CANDIDATE_ATTRIBUTES.has(m.attributeName)) tracker.rescan = true;
+                markEnclosing(m.target);
+            }
+        }
+    }).observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+
+    // Typing changes input values without touching the DOM; scrolling moves
+    // elements without it, and smooth scrolling takes a while
+    for (const type of ['input', 'change']) {
+        document.addEventListener(type, (e) => { changed(); markEnclosing(e.target); }, true);
+    }
+    window.addEventListener('scroll', changed, { capture: true, passive: true });
+
+    const read = (el, rec) => {
+        const style = window.getComputedStyle(el);
+        rec.shown = style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0';
+        rec.tagName = el.tagName.toLowerCase();
+        rec.text = el.innerText || el.value || '';
+        rec.attributes = {};
+        for (const attr of el.attributes) rec.attributes[attr.name] = attr.value;
+        rec.version = (rec.version || 0) + 1;
+    };
+
+    tracker.snapshot = (knownDoc) => {
+        const full = knownDoc !== tracker.doc;
+        if (tracker.rescan) {
+            tracker.list = Array.from(document.querySelectorAll(SELECTOR));
+            tracker.rescan = false;
+            const present = new Set(tracker.list);
+            for (const [index, el] of tracker.byIndex) {
+                if (!present.has(el)) {
+                    tracker.byIndex.delete(index);
+                    tracker.records.delete(el);
+                }
+            }
+        }
+        if (document.activeElement) tracker.dirty.add(document.activeElement);
+
+        const scrollX = window.scrollX, scrollY = window.scrollY;
+        const order = [], changedElements = [];
+        let reread = 0;
+        for (const el of tracker.list) {
+            let rec = tracker.records.get(el);
+            if (!rec) {
+                rec = { index: 0 };
+                tracker.records.set(el, rec);
+            }
+            if (!rec.version || tracker.allDirty || tracker.dirty.has(el)) {
+                read(el, rec);
+                reread += 1;
+            }
+            if (!rec.shown) continue;
+            const rect = el.getBoundingClientRect();
+            if (rect.width <= 0 || rect.height <= 0) continue;
+            if (!rec.index) {
+                rec.index = ++tracker.nextIndex;
+                tracker.byIndex.set(rec.index, el);
+            }
+            order.push(rec.index);
+
+            const x = rect.left + scrollX, y = rect.top + scrollY;
+            const key = `${rec.version}:${x}:${y}:${rect.width}:${rect.height}`;
+            if (full || rec.sent !== key) {
+                rec.sent = key;
+                changedElements.push({
+                    index: rec.index, tagName: rec.tagName, text: rec.text, attributes: rec.attributes,
+                    x: x, y: y, width: rect.width, height: rect.height,
+                });
+            }
+        }
+        tracker.dirty.clear();
+        tracker.allDirty = false;
+
+        const body = document.body, html = document.documentElement;
+        return {
+            doc: tracker.doc,
+            full: full,
+            generation: tracker.generation,
+            order: order,
+            changed: changedElements,
+            reread: reread,
+            scrollX: scrollX,
+            scrollY: scrollY,
+            viewportWidth: window.innerWidth,
+            viewportHeight: window.innerHeight,
+            pageHeight: Math.max(
+                body ? body.scrollHeight : 0, body ? body.offsetHeight : 0,
+                html.clientHeight, html.scrollHeight, html.offsetHeight
+            ),
+            // Canvas and video change without DOM mutations
+            hasMedia: document.querySelector('canvas, video') !== null,
+        };
+    };
+
+    tracker.element = (index) => {
+        const el = tracker.byIndex.get(index);
+        return el && el.isConnected ? el : null;
+    };
+
+    tracker.settle = ({ quietMs, timeoutMs }) => new Promise((resolve) => {
+        const start = performance.now();
+        const check = () => {
+            const now = performance.now();
+            const quiet = now - tracker.lastChange;
+            if (quiet >= quietMs || now - start >= timeoutMs) {
+                resolve({ settled: quiet >= quietMs, waitedMs: Math.round(now - start) });
+            } else {
+                setTimeout(check, Math.min(quietMs - quiet, timeoutMs - (now - start)));
+            }
+        };
+        // Start after the next frame, by which time events from the action
+        // (scroll, layout) have been dispatched; rAF doesn't run in hidden tabs
+        let begun = false;
+        const begin = () => { if (!begun) { begun = true; check(); } };
+        requestAnimationFrame(() => setTimeout(begin, 0));
+        setTimeout(begin, 100);
+    });
+
+    return window.__domTracker = tracker;
+})()
+"""
+
+DOM_SNAPSHOT_JS = f"(knownDoc) => {DOM_TRACKER_JS.strip()}.snapshot(knownDoc)"
+DOM_SETTLE_JS = f"(options) => {DOM_TRACKER_JS.strip()}.settle(options)"
+DOM_ELEMENT_JS = "(index) => window.__domTracker ? window.__domTracker.element(index) : null"
+
+
+@dataclass
+class DOMSnapshot:
+    """Interactive elements of a page as of the last snapshot from its DOM tracker"""
+    doc: Optional[str] = None
+    generation: int = 0
+    nodes: Dict[int, DOMElementNode] = field(default_factory=dict)
+    scroll_x: float = 0
+    scroll_y: float = 0
+    viewport_width: int = 0
+    viewport_height: int = 0
+    page_height: int = 0
+    has_media: bool = False
+    # What the page looked like when the last screenshot was taken, and that screenshot
+    screenshot_key: Optional[tuple] = None
+    screenshot: Dict[str, Any] = field(default_factory=dict)
+
+    def apply(self, result: Dict[str, Any]) -> bool:
+        """Merge a tracker snapshot; False if it refers to elements this side never got"""
+        if result['full'] or result['doc'] != self.doc:
+            self.nodes = {}
+        self.doc = result['doc']
+        self.generation = result['generation']
+        self.scroll_x = result['scrollX']
+        self.scroll_y = result['scrollY']
+        self.viewport_width = result['viewportWidth']
+        self.viewport_height = result['viewportHeight']
+        self.page_height = result['pageHeight']
+        self.has_media = result['hasMedia']
+
+        for el in result['changed']:
+            node = DOMElementNode(
+                is_visible=True,
+                tag_name=el['tagName'],
+                attributes=el['attributes'],
+                is_interactive=True,
+                highlight_index=el['index'],
+                page_coordinates=CoordinateSet(x=el['x'], y=el['y'], width=el['width'], height=el['height'])
+            )
+            if el['text']:
+                text_node = DOMTextNode(is_visible=True, text=el['text'])
+                text_node.parent = node
+                node.children.append(text_node)
+            self.nodes[el['index']] = node
+
+        if any(index not in self.nodes for index in result['order']):
+            self.doc = None
+            return False
+        # Document order; elements that went away or were hidden drop out
+        self.nodes = {index: self.nodes[index] for index in result['order']}
+
+        for node in self.nodes.values():
+            coords = node.page_coordinates
+            x, y = coords.x - self.scroll_x, coords.y - self.scroll_y
+            node.viewport_coordinates = CoordinateSet(x=x, y=y, width=coords.width, height=coords.height)
+            node.is_in_viewport = (
+                x >= 0 and y >= 0 and
+                x + coords.width <= self.viewport_width and
+                y + coords.height <= self.viewport_height
+            )
+        return True
+
 #######################################################
 # Browser Action Result Model
 #######################################################
@@ -259,7 +524,12 @@ class BrowserActionResult(BaseModel):
     url: Optional[str] = None
     title: Optional[str] = None
     elements: Optional[str] = None  # Formatted string of clickable elements
-    screenshot_base64: Optional[str] = None
+    # Screenshot written to screenshot_path under its content hash; the backend
+    # downloads the file, so no image data travels in the JSON response
+    screenshot_path: Optional[str] = None
+    screenshot_sha256: Optional[str] = None
+    screenshot_width: Optional[int] = None
+    screenshot_height: Optional[int] = None
     pixels_above: int = 0
     pixels_below: int = 0
     content: Optional[str] = None
@@ -289,6 +559,11 @@ class BrowserAutomation:
         self.include_attributes = ["id", "href", "src", "alt", "aria-label", "placeholder", "name", "role", "title", "value"]
         self.screenshot_dir = os.path.join(os.getcwd(), "screenshots")
         os.makedirs(self.screenshot_dir, exist_ok=True)
+        self.state_screenshot_dir = os.path.join(self.screenshot_dir, "state")
+        os.makedirs(self.state_screenshot_dir, exist_ok=True)
+        # Per page: the last DOM snapshot, and document/XHR/fetch requests in flight
+        self.dom_snapshots: "weakref.WeakKeyDictionary[Page, DOMSnapshot]" = weakref.WeakKeyDictionary()
+        self.pending_requests: "weakref.WeakKeyDictionary[Page, Dict[Request, float]]" = weakref.WeakKeyDictionary()
         
         # Register routes
         self.router.on_startup.append(self.startup)
@@ -314,6 +589,7 @@ class BrowserAutomation:
         # Content actions
         self.router.post("/automation/extract_content")(self.extract_content)
         self.router.post("/automation/save_pdf")(self.save_pdf)
+        self.router.post("/automation/screenshot")(self.screenshot)
         
         # Scroll actions
         self.router.post("/automation/scroll_down")(self.scroll_down)
@@ -398,137 +674,87 @@ class BrowserAutomation:
         """Get the current active page"""
         if not self.pages:
             raise HTTPException(status_code=500, detail="No browser pages available")
-        return self.pages[self.current_page_index]
-    
+        page = self.pages[self.current_page_index]
+        if page not in self.pending_requests:
+            self.track_requests(page)
+        return page
+
+    def track_requests(self, page: Page):
+        """Keep track of the page's document, XHR and fetch requests for settle detection"""
+        pending: Dict[Request, float] = {}
+        self.pending_requests[page] = pending
+        loop = asyncio.get_running_loop()
+
+        def on_request(request: Request):
+            if request.resource_type in SETTLE_REQUEST_TYPES:
+                pending[request] = loop.time()
+
+        def on_request_done(request: Request):
+            pending.pop(request, None)
+
+        page.on("request", on_request)
+        page.on("requestfinished", on_request_done)
+        page.on("requestfailed", on_request_done)
+
+    def has_pending_requests(self, page: Page) -> bool:
+        pending = self.pending_requests.get(page)
+        if not pending:
+            return False
+        oldest_counted = asyncio.get_running_loop().time() - BROWSER_SETTLE_REQUEST_MAX_AGE
+        return any(started > oldest_counted for started in pending.values())
+
+    async def wait_for_settle(self, page: Page):
+        """Wait until the page has no requests in flight and its DOM has stopped changing"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + BROWSER_SETTLE_TIMEOUT
+        try:
+            await page.wait_for_load_state("domcontentloaded", timeout=BROWSER_SETTLE_TIMEOUT * 1000)
+        except Exception as e:
+            print(f"Warning: DOM content not loaded, proceeding anyway: {e}")
+
+        while loop.time() < deadline:
+            while self.has_pending_requests(page) and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+            remaining_ms = max(0, (deadline - loop.time()) * 1000)
+            try:
+                result = await page.evaluate(DOM_SETTLE_JS, {'quietMs': BROWSER_SETTLE_QUIET_MS, 'timeoutMs': remaining_ms})
+            except Exception as e:
+                # The page navigated while we waited; wait for the new document instead
+                print(f"Settle check interrupted, retrying: {e}")
+                try:
+                    await page.wait_for_load_state("domcontentloaded", timeout=max(remaining_ms, 1))
+                except Exception:
+                    pass
+                continue
+            if result.get('settled') and not self.has_pending_requests(page):
+                print(f"Page settled after {(loop.time() - started) * 1000:.0f} ms")
+                return
+        print(f"Warning: page did not settle within {BROWSER_SETTLE_TIMEOUT}s, proceeding anyway")
+
     async def get_selector_map(self) -> Dict[int, DOMElementNode]:
-        """Get a map of selectable elements on the page"""
-        page = await self.get_current_page()
+        """Get a map of selectable elements on the page
         
-        # Create a selector map for interactive elements
-        selector_map = {}
+        Only elements that changed since the last call are read from the page;
+        unchanged elements keep their node and their index.
+        """
+        page = await self.get_current_page()
+        snapshot = self.dom_snapshots.get(page)
+        if snapshot is None:
+            snapshot = self.dom_snapshots[page] = DOMSnapshot()
         
         try:
-            # More comprehensive JavaScript to find interactive elements
-            elements_js = """
-            (() => {
-                // Helper function to get all attributes as an object
-                function getAttributes(el) {
-                    const attributes = {};
-                    for (const attr of el.attributes) {
-                        attributes[attr.name] = attr.value;
-                    }
-                    return attributes;
-                }
-                
-                // Find all potentially interactive elements
-                const interactiveElements = Array.from(document.querySelectorAll(
-                    'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])'
-                ));
-                
-                // Filter for visible elements
-                const visibleElements = interactiveElements.filter(el => {
-                    const style = window.getComputedStyle(el);
-                    const rect = el.getBoundingClientRect();
-                    return style.display !== 'none' && 
-                           style.visibility !== 'hidden' && 
-                           style.opacity !== '0' &&
-                           rect.width > 0 && 
-                           rect.height > 0;
-                });
-                
-                // Map to our expected structure
-                return visibleElements.map((el, index) => {
-                    const rect = el.getBoundingClientRect();
-                    const isInViewport = rect.top >= 0 && 
-                                      rect.left >= 0 && 
-                                      rect.bottom <= window.innerHeight &&
-                                      rect.right <= window.innerWidth;
-                    
-                    return {
-                        index: index + 1,
-                        tagName: el.tagName.toLowerCase(),
-                        text: el.innerText || el.value || '',
-                        attributes: getAttributes(el),
-                        isVisible: true,
-                        isInteractive: true,
-                        pageCoordinates: {
-                            x: rect.left + window.scrollX,
-                            y: rect.top + window.scrollY,
-                            width: rect.width,
-                            height: rect.height
-                        },
-                        viewportCoordinates: {
-                            x: rect.left,
-                            y: rect.top,
-                            width: rect.width,
-                            height: rect.height
-                        },
-                        isInViewport: isInViewport
-                    };
-                });
-            })();
-            """
-            
-            elements = await page.evaluate(elements_js)
-            print(f"Found {len(elements)} interactive elements in selector map")
-            
-            # Create a root element for the tree
-            root = DOMElementNode(
-                is_visible=True,
-                tag_name="body",
-                is_interactive=False,
-                is_top_element=True
-            )
-            
-            # Create element nodes for each element
-            for idx, el in enumerate(elements):
-                # Create coordinate sets
-                page_coordinates = None
-                viewport_coordinates = None
-                
-                if 'pageCoordinates' in el:
-                    coords = el['pageCoordinates']
-                    page_coordinates = CoordinateSet(
-                        x=coords.get('x', 0),
-                        y=coords.get('y', 0),
-                        width=coords.get('width', 0),
-                        height=coords.get('height', 0)
-                    )
-                
-                if 'viewportCoordinates' in el:
-                    coords = el['viewportCoordinates']
-                    viewport_coordinates = CoordinateSet(
-                        x=coords.get('x', 0),
-                        y=coords.get('y', 0),
-                        width=coords.get('width', 0),
-                        height=coords.get('height', 0)
-                    )
-                
-                # Create the element node
-                element_node = DOMElementNode(
-                    is_visible=el.get('isVisible', True),
-                    tag_name=el.get('tagName', 'div'),
-                    attributes=el.get('attributes', {}),
-                    is_interactive=el.get('isInteractive', True),
-                    is_in_viewport=el.get('isInViewport', False),
-                    highlight_index=el.get('index', idx + 1),
-                    page_coordinates=page_coordinates,
-                    viewport_coordinates=viewport_coordinates
-                )
-                
-                # Add a text node if there's text content
-                if el.get('text'):
-                    text_node = DOMTextNode(is_visible=True, text=el.get('text', ''))
-                    text_node.parent = element_node
-                    element_node.children.append(text_node)
-                
-                selector_map[el.get('index', idx + 1)] = element_node
-                root.children.append(element_node)
-                element_node.parent = root
-                
+            result = await page.evaluate(DOM_SNAPSHOT_JS, snapshot.doc)
+            if not snapshot.apply(result):
+                result = await page.evaluate(DOM_SNAPSHOT_JS, None)
+                snapshot.apply(result)
+            print(f"Found {len(snapshot.nodes)} interactive elements in selector map "
+                  f"({len(result['changed'])} updated, {result['reread']} re-read)")
+            return dict(snapshot.nodes)
         except Exception as e:
             print(f"Error getting selector map: {e}")
             traceback.print_exc()
+            snapshot.doc = None
             # Create a dummy element to avoid breaking tests
             dummy = DOMElementNode(
                 is_visible=True,
@@ -540,15 +766,20 @@ class BrowserAutomation:
             dummy_text = DOMTextNode(is_visible=True, text="Dummy Element")
             dummy_text.parent = dummy
             dummy.children.append(dummy_text)
-            selector_map[1] = dummy
-        
-        return selector_map
+            return {1: dummy}
+
+    async def get_element_handle(self, index: int) -> Optional[ElementHandle]:
+        """Get the element that has the given index in the selector map"""
+        page = await self.get_current_page()
+        handle = await page.evaluate_handle(DOM_ELEMENT_JS, index)
+        return handle.as_element()
     
     async def get_current_dom_state(self) -> DOMState:
         """Get the current DOM state including element tree and selector map"""
         try:
             page = await self.get_current_page()
             selector_map = await self.get_selector_map()
+            snapshot = self.dom_snapshots.get(page, DOMSnapshot())
             
             # Create a root element
             root = DOMElementNode(
@@ -558,11 +789,10 @@ class BrowserAutomation:
                 is_top_element=True
             )
             
-            # Add all elements from selector map as children of root
+            # Nodes are reused across snapshots, so always hang them off the new root
             for element in selector_map.values():
-                if element.parent is None:
-                    element.parent = root
-                    root.children.append(element)
+                element.parent = root
+                root.children.append(element)
             
             # Get basic page info
             url = page.url
@@ -571,41 +801,13 @@ class BrowserAutomation:
             except:
                 title = "Unknown Title"
             
-            # Get more accurate scroll information - fix JavaScript syntax
-            try:
-                scroll_info = await page.evaluate("""
-                () => {
-                    const body = document.body;
-                    const html = document.documentElement;
-                    const totalHeight = Math.max(
-                        body.scrollHeight, body.offsetHeight,
-                        html.clientHeight, html.scrollHeight, html.offsetHeight
-                    );
-                    const scrollY = window.scrollY || window.pageYOffset;
-                    const windowHeight = window.innerHeight;
-                    
-                    return {
-                        pixelsAbove: scrollY,
-                        pixelsBelow: Math.max(0, totalHeight - scrollY - windowHeight),
-                        totalHeight: totalHeight,
-                        viewportHeight: windowHeight
-                    };
-                }
-                """)
-                pixels_above = scroll_info.get('pixelsAbove', 0)
-                pixels_below = scroll_info.get('pixelsBelow', 0)
-            except Exception as e:
-                print(f"Error getting scroll info: {e}")
-                pixels_above = 0
-                pixels_below = 0
-            
             return DOMState(
                 element_tree=root,
                 selector_map=selector_map,
                 url=url,
                 title=title,
-                pixels_above=pixels_above,
-                pixels_below=pixels_below
+                pixels_above=int(snapshot.scroll_y),
+                pixels_below=int(max(0, snapshot.page_height - snapshot.scroll_y - snapshot.viewport_height))
             )
         except Exception as e:
             print(f"Error getting DOM state: {e}")
@@ -633,21 +835,12 @@ class BrowserAutomation:
                 pixels_below=0
             )
     
-    async def take_screenshot(self) -> str:
-        """Take a screenshot and return as base64 encoded string"""
+    async def take_screenshot(self) -> bytes:
+        """Take a screenshot and return the JPEG bytes"""
         try:
             page = await self.get_current_page()
             
-            # Wait for network to be idle and DOM to be stable
-            try:
-                await page.wait_for_load_state("networkidle", timeout=60000)  # Increased timeout to 60s
-            except Exception as e:
-                print(f"Warning: Network idle timeout, proceeding anyway: {e}")
-            
-            # Wait for any animations to complete
-            # await page.wait_for_timeout(1000)  # Wait 1 second for animations
-            
-            # Take screenshot with increased timeout and better options
+            # Callers wait for the page to settle first (see wait_for_settle)
             screenshot_bytes = await page.screenshot(
                 type='jpeg',
                 quality=60,
@@ -656,12 +849,54 @@ class BrowserAutomation:
                 scale='device'  # Use device scale factor
             )
             
-            return base64.b64encode(screenshot_bytes).decode('utf-8')
+            return screenshot_bytes
         except Exception as e:
             print(f"Error taking screenshot: {e}")
             traceback.print_exc()
-            # Return an empty string rather than failing
-            return ""
+            # Return no data rather than failing
+            return b""
+
+    def store_screenshot(self, screenshot: bytes) -> Dict[str, Any]:
+        """Write a screenshot under its content hash and return its path, hash and size"""
+        if not screenshot:
+            return {}
+        try:
+            digest = hashlib.sha256(screenshot).hexdigest()
+            filepath = os.path.join(self.state_screenshot_dir, f"{digest}.jpg")
+            if os.path.exists(filepath):
+                # Same image as an earlier state; keep it from being pruned
+                os.utime(filepath)
+            else:
+                partial_path = f"{filepath}.part"
+                with open(partial_path, "wb") as f:
+                    f.write(screenshot)
+                os.replace(partial_path, filepath)
+                self.prune_screenshots()
+            with Image.open(io.BytesIO(screenshot)) as image:
+                width, height = image.size
+            return {
+                'screenshot_path': filepath,
+                'screenshot_sha256': digest,
+                'screenshot_width': width,
+                'screenshot_height': height
+            }
+        except Exception as e:
+            print(f"Error storing screenshot: {e}")
+            return {}
+
+    def prune_screenshots(self, keep: int = 20):
+        """Delete all but the most recent state screenshots"""
+        try:
+            paths = [
+                os.path.join(self.state_screenshot_dir, name)
+                for name in os.listdir(self.state_screenshot_dir)
+                if name.endswith(".jpg")
+            ]
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for path in paths[keep:]:
+                os.remove(path)
+        except Exception as e:
+            print(f"Error pruning screenshots: {e}")
     
     async def save_screenshot_to_file(self) -> str:
         """Take a screenshot and save to file, returning the path"""
@@ -678,15 +913,13 @@ class BrowserAutomation:
             print(f"Error saving screenshot: {e}")
             return ""
     
-    async def extract_ocr_text_from_screenshot(self, screenshot_base64: str) -> str:
+    async def extract_ocr_text_from_screenshot(self, screenshot: bytes) -> str:
         """Extract text from screenshot using OCR"""
-        if not screenshot_base64:
+        if not screenshot:
             return ""
             
         try:
-            # Decode base64 to image
-            image_bytes = base64.b64decode(screenshot_base64)
-            image = Image.open(io.BytesIO(image_bytes))
+            image = Image.open(io.BytesIO(screenshot))
             
             # Extract text using pytesseract
             ocr_text = pytesseract.image_to_string(image)
@@ -700,17 +933,29 @@ class BrowserAutomation:
             traceback.print_exc()
             return ""
     
-    async def get_updated_browser_state(self, action_name: str) -> tuple:
+    async def get_updated_browser_state(self, action_name: str, screenshot: Optional[bool] = None,
+                                        ocr: Optional[bool] = None) -> tuple:
         """Helper method to get updated browser state after any action
-        Returns a tuple of (dom_state, screenshot, elements, metadata)
+        Returns a tuple of (dom_state, screenshot, elements, metadata), where
+        screenshot describes the stored screenshot file (see store_screenshot)
+        
+        screenshot forces a fresh screenshot (True) or none (False); by default
+        BROWSER_STATE_SCREENSHOT decides. ocr defaults to BROWSER_STATE_OCR and
+        implies a fresh screenshot.
         """
         try:
-            # Wait a moment for any potential async processes to settle
-            await asyncio.sleep(0.5)
+            page = await self.get_current_page()
+            await self.wait_for_settle(page)
             
             # Get updated state
             dom_state = await self.get_current_dom_state()
-            screenshot = await self.take_screenshot()
+            snapshot = self.dom_snapshots.get(page, DOMSnapshot())
+            
+            if ocr is None:
+                ocr = BROWSER_STATE_OCR
+            if screenshot is None:
+                screenshot = True if ocr else None
+            stored_screenshot, screenshot_bytes = await self.capture_state_screenshot(page, snapshot, screenshot)
             
             # Format elements for output
             elements = dom_state.element_tree.clickable_elements_to_string(
@@ -718,7 +963,6 @@ class BrowserAutomation:
             )
             
             # Collect additional metadata
-            page = await self.get_current_page()
             metadata = {}
             
             # Get element count
@@ -742,45 +986,54 @@ class BrowserAutomation:
                 interactive_elements.append(element_info)
             
             metadata['interactive_elements'] = interactive_elements
+            metadata['viewport_width'] = snapshot.viewport_width
+            metadata['viewport_height'] = snapshot.viewport_height
             
-            # Get viewport dimensions - Fix syntax error in JavaScript
-            try:
-                viewport = await page.evaluate("""
-                () => {
-                    return {
-                        width: window.innerWidth,
-                        height: window.innerHeight
-                    };
-                }
-                """)
-                metadata['viewport_width'] = viewport.get('width', 0)
-                metadata['viewport_height'] = viewport.get('height', 0)
-            except Exception as e:
-                print(f"Error getting viewport dimensions: {e}")
-                metadata['viewport_width'] = 0
-                metadata['viewport_height'] = 0
-            
-            # Extract OCR text from screenshot if available
-            ocr_text = ""
-            if screenshot:
-                ocr_text = await self.extract_ocr_text_from_screenshot(screenshot)
-                metadata['ocr_text'] = ocr_text
+            # OCR is slow, so it only runs when asked for
+            if ocr and screenshot_bytes:
+                metadata['ocr_text'] = await self.extract_ocr_text_from_screenshot(screenshot_bytes)
             
             print(f"Got updated state after {action_name}: {len(dom_state.selector_map)} elements")
-            return dom_state, screenshot, elements, metadata
+            return dom_state, stored_screenshot, elements, metadata
         except Exception as e:
             print(f"Error getting updated state after {action_name}: {e}")
             traceback.print_exc()
             # Return empty values in case of error
-            return None, "", "", {}
+            return None, {}, "", {}
+
+    async def capture_state_screenshot(self, page: Page, snapshot: DOMSnapshot,
+                                       force: Optional[bool] = None) -> tuple:
+        """Screenshot for a browser state, reusing the last one if the page hasn't changed
+        Returns (stored screenshot, fresh JPEG bytes or b"" if none was taken)
+        """
+        if force is False or (force is None and BROWSER_STATE_SCREENSHOT == "never"):
+            return {}, b""
+        
+        # Canvas and video can change without the tracker noticing
+        key = (page.url, snapshot.doc, snapshot.generation, snapshot.scroll_x, snapshot.scroll_y)
+        reuse = (
+            force is None
+            and BROWSER_STATE_SCREENSHOT == "changed"
+            and not snapshot.has_media
+            and key == snapshot.screenshot_key
+            and os.path.exists(snapshot.screenshot.get('screenshot_path', ''))
+        )
+        if reuse:
+            return snapshot.screenshot, b""
+        
+        screenshot_bytes = await self.take_screenshot()
+        snapshot.screenshot = self.store_screenshot(screenshot_bytes)
+        snapshot.screenshot_key = key if snapshot.screenshot else None
+        return snapshot.screenshot, screenshot_bytes
 
-    def build_action_result(self, success: bool, message: str, dom_state, screenshot: str, 
+    def build_action_result(self, success: bool, message: str, dom_state, screenshot: Optional[Dict[str, Any]], 
                               elements: str, metadata: dict, error: str = "", content: str = None,
                               fallback_url: str = None) -> BrowserActionResult:
         """Helper method to build a consistent BrowserActionResult"""
         # Ensure elements is never None to avoid display issues
         if elements is None:
             elements = ""
+        screenshot = screenshot or {}
             
         return BrowserActionResult(
             success=success,
@@ -789,7 +1042,10 @@ class BrowserAutomation:
             url=dom_state.url if dom_state else fallback_url or "",
             title=dom_state.title if dom_state else "",
             elements=elements,
-            screenshot_base64=screenshot,
+            screenshot_path=screenshot.get('screenshot_path'),
+            screenshot_sha256=screenshot.get('screenshot_sha256'),
+            screenshot_width=screenshot.get('screenshot_width'),
+            screenshot_height=screenshot.get('screenshot_height'),
             pixels_above=dom_state.pixels_above if dom_state else 0,
             pixels_below=dom_state.pixels_below if dom_state else 0,
             content=content,
@@ -807,7 +1063,6 @@ class BrowserAutomation:
         try:
             page = await self.get_current_page()
             await page.goto(action.url, wait_until="domcontentloaded")
-            await page.wait_for_load_state("networkidle", timeout=10000)
             
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"navigate_to({action.url})")
@@ -974,11 +1229,7 @@ class BrowserAutomation:
             # Perform the click at the specified coordinates
             await page.mouse.click(action.x, action.y)
             
-            # Give time for any navigation or DOM updates to occur
-            await page.wait_for_load_state("networkidle", timeout=5000)
-            
-            await asyncio.sleep(1)
-            # Get updated state after action
+            # Get updated state after action, once navigation or DOM updates have settled
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"click_coordinates({action.x}, {action.y})")
             
             return self.build_action_result(
@@ -1026,9 +1277,8 @@ class BrowserAutomation:
         try:
             page = await self.get_current_page()
             
-            # Get the current state and selector map *before* the click
-            initial_dom_state = await self.get_current_dom_state()
-            selector_map = initial_dom_state.selector_map
+            # Get the selector map *before* the click
+            selector_map = await self.get_selector_map()
             
             if action.index not in selector_map:
                 # Get updated state even if element not found initially
@@ -1046,36 +1296,13 @@ class BrowserAutomation:
             element_to_click = selector_map[action.index]
             print(f"Attempting to click element: {element_to_click}")
 
-            # Construct a more reliable selector using JavaScript evaluation
-            # Find the element based on its properties captured in selector_map
-            js_selector_script = """
-            (targetElementInfo) => {
-                const interactiveElements = Array.from(document.querySelectorAll(
-                    'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])'
-                ));
-                
-                const visibleElements = interactiveElements.filter(el => {
-                    const style = window.getComputedStyle(el);
-                    const rect = el.getBoundingClientRect();
-                    return style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0' && rect.width > 0 && rect.height > 0;
-                });
-
-                if (targetElementInfo.index > 0 && targetElementInfo.index <= visibleElements.length) {
-                    // Return the element at the specified index (1-based)
-                    return visibleElements[targetElementInfo.index - 1];
-                }
-                return null; // Element not found at the expected index
-            }
-            """
-            
-            element_info = {'index': action.index} # Pass the target index to the script
-            
-            target_element_handle = await page.evaluate_handle(js_selector_script, element_info)
+            # Indices belong to elements, so the tracker hands back the element itself
+            target_element_handle = await self.get_element_handle(action.index)
 
             click_success = False
             error_message = ""
 
-            if await target_element_handle.evaluate("node => node !== null"):
+            if target_element_handle is not None:
                 try:
                     # Use Playwright's recommended way: click the handle
                     # Add timeout and wait for element to be stable
@@ -1088,18 +1315,10 @@ class BrowserAutomation:
                     # Optional: Add fallback methods here if needed
                     # e.g., target_element_handle.dispatch_event('click')
             else:
-                 error_message = f"Could not locate the target element handle for index {action.index} using JS script."
+                 error_message = f"Could not locate the target element handle for index {action.index}; it left the page."
                  print(error_message)
 
-
-            # Wait for potential page changes/network activity
-            try:
-                await page.wait_for_load_state("networkidle", timeout=5000)
-            except Exception as wait_error:
-                print(f"Timeout or error waiting for network idle after click: {wait_error}")
-            await asyncio.sleep(1)
-
-            # Get updated state after action
+            # Get updated state after action, once page changes/network activity have settled
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"click_element({action.index})")
 
             return self.build_action_result(
@@ -1140,7 +1359,7 @@ class BrowserAutomation:
                     False,
                     str(e),
                     None, # No DOM state available
-                    "",   # No screenshot
+                    None, # No screenshot
                     "",   # No elements string
                     {},   # Empty metadata
                     error=str(e),
@@ -1165,24 +1384,11 @@ class BrowserAutomation:
                     error=f"Element with index {action.index} not found"
                 )
             
-            # In a real implementation, we would use the selector map to get the element's
-            # properties and use them to find and type into the element
-            element = selector_map[action.index]
-            
-            # Use CSS selector or XPath to locate and type into the element
-            await page.wait_for_timeout(500)  # Small delay before typing
-            
-            # Demo implementation - would use proper selectors in production
-            if element.attributes.get("id"):
-                await page.fill(f"#{element.attributes['id']}", action.text)
-            elif element.attributes.get("class"):
-                class_selector = f".{element.attributes['class'].replace(' ', '.')}"
-                await page.fill(class_selector, action.text)
-            else:
-                # Fallback to xpath
-                await page.fill(f"//{element.tag_name}[{action.index}]", action.text)
+            element = await self.get_element_handle(action.index)
+            if element is None:
+                raise Exception(f"Element with index {action.index} is no longer on the page")
+            await element.fill(action.text)
             
-            await asyncio.sleep(1)
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"input_text({action.index}, '{action.text}')")
             
@@ -1214,7 +1420,6 @@ class BrowserAutomation:
             page = await self.get_current_page()
             await page.keyboard.press(action.keys)
             
-            await asyncio.sleep(1)
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"send_keys({action.keys})")
             
@@ -1295,7 +1500,6 @@ class BrowserAutomation:
             
             # Navigate to the URL
             await new_page.goto(action.url, wait_until="domcontentloaded")
-            await new_page.wait_for_load_state("networkidle", timeout=10000)
             print(f"Navigated to URL in new tab: {action.url}")
             
             # Add to page list and make it current
@@ -1467,7 +1671,36 @@ class BrowserAutomation:
                 error=str(e),
                 content=None
             )
-    
+
+    async def screenshot(self, action: ScreenshotAction = Body(...)):
+        """Take a fresh screenshot of the current page, with OCR text if asked for"""
+        try:
+            dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(
+                "screenshot", screenshot=True, ocr=action.ocr
+            )
+
+            return self.build_action_result(
+                bool(screenshot),
+                "Took a screenshot" if screenshot else "Failed to take a screenshot",
+                dom_state,
+                screenshot,
+                elements,
+                metadata,
+                error="" if screenshot else "Failed to take a screenshot",
+                content=None
+            )
+        except Exception as e:
+            return self.build_action_result(
+                False,
+                str(e),
+                None,
+                "",
+                "",
+                {},
+                error=str(e),
+                content=None
+            )
+
     # Scroll Actions
 
     async def scroll_down(self, action: ScrollAction = Body(...)):
@@ -1481,8 +1714,6 @@ class BrowserAutomation:
                 await page.evaluate("window.scrollBy(0, window.innerHeight);")
                 amount_str = "one page"
             
-            await page.wait_for_timeout(500)  # Wait for scroll to complete
-            
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"scroll_down({amount_str})")
             
@@ -1519,8 +1750,6 @@ class BrowserAutomation:
                 await page.evaluate("window.scrollBy(0, -window.innerHeight);")
                 amount_str = "one page"
             
-            await page.wait_for_timeout(500)  # Wait for scroll to complete
-            
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"scroll_up({amount_str})")
             
@@ -1561,7 +1790,6 @@ class BrowserAutomation:
                 try:
                     if await locator.count() > 0 and await locator.first.is_visible():
                         await locator.first.scroll_into_view_if_needed()
-                        await asyncio.sleep(0.5)  # Wait for scroll to complete
                         found = True
                         break
                 except Exception:
@@ -1618,21 +1846,23 @@ class BrowserAutomation:
             
             # Try to get the options - in a real implementation, we would use appropriate selectors
             try:
+                handle = await self.get_element_handle(index)
+                if handle is None:
+                    raise Exception(f"Element with index {index} is no longer on the page")
                 if element.tag_name.lower() == 'select':
-                    # For <select> elements, get options using JavaScript
-                    options_js = f"""
-                    Array.from(document.querySelectorAll('select')[{index-1}].options)
+                    # For <select> elements, read the options of the element itself
+                    options = await handle.evaluate("""
+                    select => Array.from(select.options)
                         .map((option, index) => ({
                             index: index,
                             text: option.text,
                             value: option.value
-                        }));
-                    """
-                    options = await page.evaluate(options_js)
+                        }))
+                    """)
                 else:
                     # For other dropdown types, try to get options using a more generic approach
                     # Example for custom dropdowns - would need refinement in real implementation
-                    await page.click(f"#{element.attributes.get('id')}") if element.attributes.get('id') else None
+                    await handle.click()
                     await page.wait_for_timeout(500)
                     
                     options_js = """
@@ -1703,30 +1933,24 @@ class BrowserAutomation:
                 )
             
             element = selector_map[index]
+            handle = await self.get_element_handle(index)
+            if handle is None:
+                raise Exception(f"Element with index {index} is no longer on the page")
             
             # Try to select the option - implementation varies by dropdown type
             if element.tag_name.lower() == 'select':
                 # For standard <select> elements
-                selector = f"select option:has-text('{option_text}')"
-                await page.select_option(
-                    f"#{element.attributes.get('id')}" if element.attributes.get('id') else f"//select[{index}]", 
-                    label=option_text
-                )
+                await handle.select_option(label=option_text)
             else:
                 # For custom dropdowns
                 # First click to open the dropdown
-                if element.attributes.get('id'):
-                    await page.click(f"#{element.attributes.get('id')}")
-                else:
-                    await page.click(f"//{element.tag_name}[{index}]")
+                await handle.click()
                 
                 await page.wait_for_timeout(500)
                 
                 # Then try to click the option
                 await page.click(f"text={option_text}")
             
-            await page.wait_for_timeout(500)
-            
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"select_dropdown_option({index}, '{option_text}')")
             
@@ -1885,7 +2109,7 @@ async def test_browser_api():
                 print(f"  [{el['index']}] <{el['tag_name']}> {el.get('text', '')[:30]}")
         
         # Screenshot info
-        print(f"\nScreenshot captured: {'Yes' if result.screenshot_base64 else 'No'}")
+        print(f"\nScreenshot captured: {result.screenshot_path or 'No'}")
         print(f"Viewport size: {result.viewport_width}x{result.viewport_height}")
         
         # Test OCR extraction from screenshot
@@ -0,0 +1,338 @@
+"""
+Streaming downloads of sandbox files with a bounded on-disk cache.
+
+sandbox.fs.download_file returns the whole file as bytes, so serving a large
+file through it holds the entire file in API memory. stream_sandbox_file reads
+the toolbox download endpoint chunk by chunk instead. Files up to
+SANDBOX_FILE_CACHE_MAX_FILE_BYTES are written to a local LRU cache keyed by
+sandbox, path and ETag, so repeated previews and Range requests are served from
+disk. Larger files are streamed straight through.
+
+The cache directory is shared by every API worker process on the host, so all
+its state lives on the filesystem: a file's mtime is its last use, the size
+bound is checked against the files actually on disk, and eviction runs under
+an exclusive lock on the directory. A file being served is held open with a
+shared flock, which eviction won't break.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from daytona_api_client import ApiClient, ToolboxApi
+from daytona_api_client import Configuration as ToolboxConfiguration
+from daytona_sdk import Sandbox
+
+from sandbox.sandbox_io import run_sandbox_io
+from utils.config import config
+from utils.logger import logger
+
+SANDBOX_FILE_CACHE_DIR = os.getenv("SANDBOX_FILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sandbox-file-cache"))
+SANDBOX_FILE_CACHE_MAX_BYTES = int(os.getenv("SANDBOX_FILE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+SANDBOX_FILE_CACHE_MAX_FILE_BYTES = int(os.getenv("SANDBOX_FILE_CACHE_MAX_FILE_BYTES", str(100 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30 * 60
+LOCK_FILE = ".lock"
+PART_SUFFIX = ".part"
+
+
+def file_etag(size: int, mod_time: Any) -> str:
+    """Strong ETag for a sandbox file, derived from its size and modification time."""
+    digest = hashlib.md5(f"{mod_time}-{size}".encode(), usedforsecurity=False).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches the ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into an inclusive (start, end) pair.
+
+    Returns None when there is no usable range (missing, not bytes, or several
+    ranges), in which case the whole file is served.
+
+    Raises:
+        ValueError: If the range is malformed or can't be satisfied
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length <= 0:
+            raise ValueError(f"Unsatisfiable range: {range_header}")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Unsatisfiable range: {range_header}")
+    return start, min(end, size - 1)
+
+
+_toolbox_api: Optional[ToolboxApi] = None
+
+
+def _get_toolbox_api() -> ToolboxApi:
+    """Toolbox API client for streaming downloads, authenticated like the Daytona client."""
+    global _toolbox_api
+    if _toolbox_api is None:
+        api_client = ApiClient(ToolboxConfiguration(host=config.DAYTONA_SERVER_URL))
+        api_client.default_headers["Authorization"] = f"Bearer {config.DAYTONA_API_KEY}"
+        _toolbox_api = ToolboxApi(api_client)
+    return _toolbox_api
+
+
+def _open_download(sandbox: Sandbox, path: str, headers: Dict[str, str]):
+    """Start the toolbox download of a file without reading its body."""
+    path = path.strip()
+    if path == "~" or path.startswith("~/") or not path.startswith("/"):
+        # Relative paths are relative to the sandbox user's home, as in sandbox.fs
+        root = sandbox.get_user_root_dir()
+        path = root if path == "~" else os.path.join(root, path.removeprefix("~/"))
+    return _get_toolbox_api().download_file_without_preload_content(
+        sandbox.id,
+        path=path,
+        _headers=headers,
+        _request_timeout=DOWNLOAD_TIMEOUT,
+    )
+
+
+async def stream_sandbox_file(
+    sandbox: Sandbox,
+    sandbox_id: str,
+    path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """Yield bytes start..end (inclusive) of a sandbox file, one chunk at a time."""
+    headers = {}
+    ranged = start > 0 or end is not None
+    if ranged:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+
+    response = await run_sandbox_io(sandbox_id, _open_download, sandbox, path, headers)
+    complete = False
+    try:
+        if response.status >= 400:
+            raise IOError(f"Failed to download {path} from sandbox {sandbox_id}: HTTP {response.status}")
+        # Skip ahead ourselves if the toolbox ignored the Range header
+        skip = start if ranged and response.status != 206 else 0
+        remaining = None if end is None else end - start + 1
+        while True:
+            chunk = await asyncio.to_thread(response.read, DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                complete = True
+                break
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk, skip = chunk[skip:], 0
+            if remaining is not None:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+            if chunk:
+                yield chunk
+            if remaining == 0:
+                break
+    finally:
+        if not complete:
+            # Don't hand a connection with an unread body back to the pool
+            response.close()
+        response.release_conn()
+
+
+class SandboxFileCache:
+    """LRU cache of downloaded sandbox files on local disk, bounded by total size."""
+
+    def __init__(
+        self,
+        directory: str = SANDBOX_FILE_CACHE_DIR,
+        max_bytes: int = SANDBOX_FILE_CACHE_MAX_BYTES,
+        max_file_bytes: int = SANDBOX_FILE_CACHE_MAX_FILE_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = min(max_file_bytes, max_bytes)
+        # key -> descriptors holding a shared lock on a file being served
+        self._pins: Dict[str, List[int]] = {}
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._bytes_on_disk = 0
+
+    def cacheable(self, size: int) -> bool:
+        return size <= self.max_file_bytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _pin(self, key: str, fd: int):
+        self._pins.setdefault(key, []).append(fd)
+
+    def release(self, key: str):
+        """Unpin a file returned by fetch once it has been served."""
+        fds = self._pins.get(key)
+        if not fds:
+            return
+        os.close(fds.pop())
+        if not fds:
+            del self._pins[key]
+
+    def _open_cached(self, key: str) -> Optional[int]:
+        """Open and share-lock a cached file, or return None if it isn't (or is no longer) cached."""
+        try:
+            fd = os.open(self._path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            # An eviction that won the race has already unlinked it
+            if os.fstat(fd).st_nlink == 0:
+                os.close(fd)
+                return None
+            # The mtime is the file's last use for LRU eviction across processes
+            os.utime(self._path(key))
+        except (BlockingIOError, FileNotFoundError):
+            os.close(fd)
+            return None
+        return fd
+
+    def _evict(self):
+        """Remove least recently used files until the directory fits max_bytes."""
+        lock_fd = os.open(self._path(LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            now = time.time()
+            files = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name == LOCK_FILE:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(PART_SUFFIX):
+                    # Downloads still in flight (here or in another process) count, abandoned ones go
+                    if now - stat.st_mtime > DOWNLOAD_TIMEOUT:
+                        self._remove(entry.path)
+                    else:
+                        total += stat.st_size
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+                total += stat.st_size
+
+            for _, file_path, size in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    fd = os.open(file_path, os.O_RDONLY)
+                except FileNotFoundError:
+                    total -= size
+                    continue
+                try:
+                    # Files being served hold a shared lock and are skipped
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self._remove(file_path)
+                    total -= size
+                    self._evictions += 1
+                except BlockingIOError:
+                    pass
+                finally:
+                    os.close(fd)
+            self._bytes_on_disk = total
+        finally:
+            os.close(lock_fd)
+
+    @staticmethod
+    def _remove(file_path: str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    async def fetch(self, sandbox: Sandbox, sandbox_id: str, path: str, etag: str) -> Tuple[str, str]:
+        """
+        Return (key, local path) of a cached copy of the file, downloading it if needed.
+
+        The file stays pinned until release(key) is called.
+        """
+        key = hashlib.sha256(f"{sandbox_id}:{path}:{etag}".encode()).hexdigest()
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        async with lock:
+            # File system work, including waits on other processes' locks, stays off the event loop
+            fd = await asyncio.to_thread(self._open_cached, key)
+            if fd is not None:
+                self._hits += 1
+                self._pin(key, fd)
+                return key, self._path(key)
+
+            self._misses += 1
+            final_path = self._path(key)
+            part_path = f"{final_path}.{uuid.uuid4().hex}{PART_SUFFIX}"
+            size = 0
+            f = await asyncio.to_thread(self._open_part, part_path)
+            try:
+                async for chunk in stream_sandbox_file(sandbox, sandbox_id, path):
+                    await asyncio.to_thread(f.write, chunk)
+                    size += len(chunk)
+                fd = await asyncio.to_thread(self._commit_part, f, part_path, final_path)
+            except BaseException:
+                await asyncio.to_thread(self._remove, part_path)
+                raise
+            finally:
+                await asyncio.to_thread(f.close)
+
+            self._pin(key, fd)
+            await asyncio.to_thread(self._evict)
+            logger.debug(f"Cached {path} from sandbox {sandbox_id} ({size} bytes)")
+            return key, final_path
+
+    def _open_part(self, part_path: str):
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(part_path, "wb")
+        # Locked before it is renamed into place, so it can't be evicted before it is served
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+        return f
+
+    @staticmethod
+    def _commit_part(f, part_path: str, final_path: str) -> int:
+        """Move a finished download into place; returns a descriptor that keeps its shared lock."""
+        f.flush()
+        os.replace(part_path, final_path)
+        return os.dup(f.fileno())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "pinned": len(self._pins),
+            "bytes": self._bytes_on_disk,
+            "max_bytes": self.max_bytes,
+        }
+
+
+sandbox_file_cache = SandboxFileCache()
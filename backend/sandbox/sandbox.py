@@ -1,8 +1,16 @@
+import asyncio
+import os
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set
+
 from daytona_sdk import Daytona, DaytonaConfig, CreateSandboxFromImageParams, Sandbox, SessionExecuteRequest, Resources, SandboxState
 from dotenv import load_dotenv
 from utils.logger import logger
 from utils.config import config
 from utils.config import Configuration
+from sandbox.sandbox_io import run_sandbox_io
 
 load_dotenv()
 
@@ -31,36 +39,141 @@ else:
 daytona = Daytona(daytona_config)
 logger.debug("Daytona client initialized")
 
+SANDBOX_CACHE_TTL = float(os.getenv("SANDBOX_CACHE_TTL", "30"))
+
+@dataclass
+class CachedSandbox:
+    """A sandbox handle and the state it was last seen in."""
+    sandbox: Sandbox
+    state: SandboxState
+    fetched_at: float
+
+# Process-wide handle cache, so the tools of a run and the file API don't each
+# look the sandbox up again
+_sandbox_cache: Dict[str, CachedSandbox] = {}
+# One lookup/start per sandbox at a time; locks are dropped when nobody holds them
+_sandbox_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_warm_tasks: Set[asyncio.Task] = set()
+_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "starts": 0,
+    "start_errors": 0,
+    "total_start_ms": 0.0,
+    "max_start_ms": 0.0,
+}
+
+def _cached_sandbox(sandbox_id: str) -> Optional[Sandbox]:
+    cached = _sandbox_cache.get(sandbox_id)
+    if cached is None:
+        return None
+    if cached.state != SandboxState.STARTED or time.monotonic() - cached.fetched_at > SANDBOX_CACHE_TTL:
+        return None
+    return cached.sandbox
+
+def invalidate_sandbox(sandbox_id: str):
+    """Drop a sandbox from the handle cache, e.g. after it was stopped or deleted."""
+    _sandbox_cache.pop(sandbox_id, None)
+
+def sandbox_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counts and start latency for the sandbox handle cache."""
+    stats = dict(_cache_stats)
+    stats["avg_start_ms"] = round(stats["total_start_ms"] / stats["starts"], 1) if stats["starts"] else 0.0
+    stats["cached"] = len(_sandbox_cache)
+    return stats
+
 async def get_or_start_sandbox(sandbox_id: str):
     """Retrieve a sandbox by ID, check its state, and start it if needed."""
     
-    logger.info(f"Getting or starting sandbox with ID: {sandbox_id}")
+    sandbox = _cached_sandbox(sandbox_id)
+    if sandbox is not None:
+        _cache_stats["hits"] += 1
+        return sandbox
     
-    try:
-        sandbox = daytona.get(sandbox_id)
+    lock = _sandbox_locks.get(sandbox_id)
+    if lock is None:
+        lock = _sandbox_locks[sandbox_id] = asyncio.Lock()
+    
+    async with lock:
+        # Another caller may have fetched or started it while we waited
+        sandbox = _cached_sandbox(sandbox_id)
+        if sandbox is not None:
+            _cache_stats["hits"] += 1
+            return sandbox
+        _cache_stats["misses"] += 1
         
-        # Check if sandbox needs to be started
-        if sandbox.state == SandboxState.ARCHIVED or sandbox.state == SandboxState.STOPPED:
-            logger.info(f"Sandbox is in {sandbox.state} state. Starting...")
-            try:
-                daytona.start(sandbox)
-                # Wait a moment for the sandbox to initialize
-                # sleep(5)
-                # Refresh sandbox state after starting
-                sandbox = daytona.get(sandbox_id)
-                
-                # Start supervisord in a session when restarting
-                start_supervisord_session(sandbox)
-            except Exception as e:
-                logger.error(f"Error starting sandbox: {e}")
-                raise e
-        
-        logger.info(f"Sandbox {sandbox_id} is ready")
-        return sandbox
+        logger.info(f"Getting or starting sandbox with ID: {sandbox_id}")
         
+        try:
+            sandbox = await run_sandbox_io(sandbox_id, daytona.get, sandbox_id)
+            
+            # Check if sandbox needs to be started
+            if sandbox.state == SandboxState.ARCHIVED or sandbox.state == SandboxState.STOPPED:
+                logger.info(f"Sandbox is in {sandbox.state} state. Starting...")
+                start = time.monotonic()
+                try:
+                    await run_sandbox_io(sandbox_id, daytona.start, sandbox)
+                except Exception as e:
+                    # Another process may have started it first
+                    sandbox = await run_sandbox_io(sandbox_id, daytona.get, sandbox_id)
+                    if sandbox.state not in (SandboxState.STARTING, SandboxState.STARTED):
+                        _cache_stats["start_errors"] += 1
+                        logger.error(f"Error starting sandbox: {e}")
+                        raise e
+                    logger.info(f"Sandbox {sandbox_id} was started elsewhere, waiting for it to be ready")
+                    await _wait_until_ready(sandbox_id, sandbox)
+                else:
+                    try:
+                        # Wait a moment for the sandbox to initialize
+                        # sleep(5)
+                        # Refresh sandbox state after starting
+                        sandbox = await run_sandbox_io(sandbox_id, daytona.get, sandbox_id)
+                        
+                        # Start supervisord in a session when restarting
+                        await run_sandbox_io(sandbox_id, start_supervisord_session, sandbox)
+                    except Exception as e:
+                        _cache_stats["start_errors"] += 1
+                        logger.error(f"Error starting sandbox: {e}")
+                        raise e
+                    
+                    start_ms = (time.monotonic() - start) * 1000
+                    _cache_stats["starts"] += 1
+                    _cache_stats["total_start_ms"] += start_ms
+                    _cache_stats["max_start_ms"] = max(_cache_stats["max_start_ms"], start_ms)
+                    logger.info(f"Sandbox {sandbox_id} started in {start_ms:.0f}ms")
+            elif sandbox.state in (SandboxState.STARTING, SandboxState.STARTED):
+                # Possibly started by another process that hasn't launched
+                # supervisord yet, so don't hand it to tools until it's up
+                await _wait_until_ready(sandbox_id, sandbox)
+            
+            _sandbox_cache[sandbox_id] = CachedSandbox(sandbox=sandbox, state=sandbox.state, fetched_at=time.monotonic())
+            logger.info(f"Sandbox {sandbox_id} is ready")
+            return sandbox
+            
+        except Exception as e:
+            invalidate_sandbox(sandbox_id)
+            logger.error(f"Error retrieving or starting sandbox: {str(e)}")
+            raise e
+
+async def _wait_until_ready(sandbox_id: str, sandbox: Sandbox):
+    """Wait for a sandbox started elsewhere to come up and make sure supervisord runs in it."""
+    if sandbox.state == SandboxState.STARTING:
+        logger.info(f"Sandbox {sandbox_id} is starting, waiting for it to be ready")
+        await run_sandbox_io(sandbox_id, sandbox.wait_for_sandbox_start)
+    await run_sandbox_io(sandbox_id, ensure_supervisord_session, sandbox)
+
+async def _warm_sandbox(sandbox_id: str):
+    try:
+        await get_or_start_sandbox(sandbox_id)
     except Exception as e:
-        logger.error(f"Error retrieving or starting sandbox: {str(e)}")
-        raise e
+        logger.warning(f"Background start of sandbox {sandbox_id} failed: {str(e)}")
+
+def warm_sandbox(sandbox_id: str) -> asyncio.Task:
+    """Fetch the sandbox, starting it if it is stopped or archived, in the background."""
+    task = asyncio.create_task(_warm_sandbox(sandbox_id))
+    _warm_tasks.add(task)
+    task.add_done_callback(_warm_tasks.discard)
+    return task
 
 def start_supervisord_session(sandbox: Sandbox):
     """Start supervisord in a session."""
@@ -79,6 +192,20 @@ def start_supervisord_session(sandbox: Sandbox):
         logger.error(f"Error starting supervisord session: {str(e)}")
         raise e
 
+def ensure_supervisord_session(sandbox: Sandbox):
+    """Start supervisord unless a session for it already exists."""
+    session_id = "supervisord-session"
+    try:
+        sandbox.process.get_session(session_id)
+        return
+    except Exception:
+        pass
+    try:
+        start_supervisord_session(sandbox)
+    except Exception:
+        # Another process may have created the session in the meantime
+        sandbox.process.get_session(session_id)
+
 def create_sandbox(password: str, project_id: str = None):
     """Create a new sandbox with all required services configured and running."""
     
@@ -130,12 +257,13 @@ async def delete_sandbox(sandbox_id: str):
     """Delete a sandbox by its ID."""
     logger.info(f"Deleting sandbox with ID: {sandbox_id}")
     
+    invalidate_sandbox(sandbox_id)
     try:
         # Get the sandbox
-        sandbox = daytona.get(sandbox_id)
+        sandbox = await run_sandbox_io(sandbox_id, daytona.get, sandbox_id)
         
         # Delete the sandbox
-        daytona.delete(sandbox)
+        await run_sandbox_io(sandbox_id, daytona.delete, sandbox)
         
         logger.info(f"Successfully deleted sandbox {sandbox_id}")
         return True
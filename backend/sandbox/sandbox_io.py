@@ -0,0 +1,80 @@
+"""
+Thread-pool offloading for the synchronous Daytona SDK.
+
+Every Daytona call (file transfers, process execution, sandbox lookups) is a
+blocking HTTP request. Calling them directly from async code stalls the event
+loop, and with it every other agent run, Redis heartbeat and parallel tool call
+on the worker. run_sandbox_io runs them on a bounded thread pool instead, with a
+per-sandbox limit so one busy sandbox can't take every thread.
+"""
+
+import asyncio
+import functools
+import os
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+SANDBOX_IO_THREADS = int(os.getenv("SANDBOX_IO_THREADS", "32"))
+SANDBOX_IO_PER_SANDBOX = int(os.getenv("SANDBOX_IO_PER_SANDBOX", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=SANDBOX_IO_THREADS, thread_name_prefix="sandbox-io")
+# Semaphores are dropped once no call is holding or waiting on them
+_limits: "weakref.WeakValueDictionary[Any, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+_stats = {
+    "calls": 0,
+    "errors": 0,
+    "in_flight": 0,
+    "max_in_flight": 0,
+    "total_wait_ms": 0.0,
+    "max_wait_ms": 0.0,
+}
+
+
+def _limit_for(sandbox_id: Optional[str]) -> asyncio.Semaphore:
+    key = (id(asyncio.get_running_loop()), sandbox_id)
+    limit = _limits.get(key)
+    if limit is None:
+        limit = asyncio.Semaphore(SANDBOX_IO_PER_SANDBOX)
+        _limits[key] = limit
+    return limit
+
+
+async def run_sandbox_io(sandbox_id: Optional[str], func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run a blocking sandbox SDK call on the sandbox I/O thread pool.
+
+    Args:
+        sandbox_id: Sandbox the call targets, used for the per-sandbox limit (None for calls not tied to one)
+        func: The blocking callable, e.g. sandbox.fs.download_file
+    """
+    limit = _limit_for(sandbox_id)
+    queued_at = time.monotonic()
+    async with limit:
+        wait_ms = (time.monotonic() - queued_at) * 1000
+        _stats["calls"] += 1
+        _stats["total_wait_ms"] += wait_ms
+        _stats["max_wait_ms"] = max(_stats["max_wait_ms"], wait_ms)
+        _stats["in_flight"] += 1
+        _stats["max_in_flight"] = max(_stats["max_in_flight"], _stats["in_flight"])
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+        except Exception:
+            _stats["errors"] += 1
+            raise
+        finally:
+            _stats["in_flight"] -= 1
+
+
+def sandbox_io_stats() -> Dict[str, Any]:
+    """Counters for the sandbox I/O pool."""
+    stats = dict(_stats)
+    stats["avg_wait_ms"] = round(stats["total_wait_ms"] / stats["calls"], 2) if stats["calls"] else 0.0
+    stats["threads"] = SANDBOX_IO_THREADS
+    stats["per_sandbox_limit"] = SANDBOX_IO_PER_SANDBOX
+    return stats
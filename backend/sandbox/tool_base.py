@@ -1,13 +1,16 @@
 
-from typing import Optional
+from typing import Any, Callable, Optional, TypeVar
 
 from agentpress.thread_manager import ThreadManager
 from agentpress.tool import Tool
 from daytona_sdk import Sandbox
 from sandbox.sandbox import get_or_start_sandbox
+from sandbox.sandbox_io import run_sandbox_io
 from utils.logger import logger
 from utils.files_utils import clean_path
 
+T = TypeVar("T")
+
 class SandboxToolsBase(Tool):
     """Base class for all sandbox tools that provides project-based sandbox access."""
     
@@ -82,6 +85,10 @@ class SandboxToolsBase(Tool):
             raise RuntimeError("Sandbox ID not initialized. Call _ensure_sandbox() first.")
         return self._sandbox_id
 
+    async def _sandbox_call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Run a blocking Daytona SDK call (e.g. self.sandbox.fs.download_file) off the event loop."""
+        return await run_sandbox_io(self._sandbox_id, func, *args, **kwargs)
+
     def clean_path(self, path: str) -> str:
         """Clean and normalize a path to be relative to /workspace."""
         cleaned_path = clean_path(path, self.workspace_path)
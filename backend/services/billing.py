@@ -5,12 +5,14 @@ stripe listen --forward-to localhost:8000/api/billing/webhook
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Request
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, List, Any
 import stripe
+import json
 from datetime import datetime, timezone
 from utils.logger import logger
 from utils.config import config, EnvMode
 from services.supabase import DBConnection
+from services import redis
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel
 from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES
@@ -23,6 +25,16 @@ stripe.api_key = config.STRIPE_SECRET_KEY
 # Token price multiplier
 TOKEN_PRICE_MULTIPLIER = 1.5
 
+# Ignore all token counts before this date
+USAGE_CUTOFF_DATE = datetime(2025, 6, 30, 9, 0, 0, tzinfo=timezone.utc)
+
+# How long a billing check result is reused before Stripe and the usage rollup are read again
+BILLING_STATUS_CACHE_TTL = 30  # seconds
+
+# Threads already looked up for usage recording: thread_id -> (account_id, created_at)
+_thread_usage_info: Dict[str, Tuple[str, datetime]] = {}
+_THREAD_USAGE_INFO_MAX = 10000
+
 # Initialize router
 router = APIRouter(prefix="/billing", tags=["billing"])
 
@@ -235,79 +247,234 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
         logger.error(f"Error getting subscription from Stripe: {str(e)}")
         return None
 
+def _usage_period_start(now: Optional[datetime] = None) -> datetime:
+    """Start of the current billing month, never before the usage cutoff date."""
+    now = now or datetime.now(timezone.utc)
+    return max(datetime(now.year, now.month, 1, tzinfo=timezone.utc), USAGE_CUTOFF_DATE)
+
+
+def _usage_month(now: Optional[datetime] = None) -> str:
+    """Key of the current month in account_monthly_usage."""
+    now = now or datetime.now(timezone.utc)
+    return datetime(now.year, now.month, 1).date().isoformat()
+
+
+def _billing_status_cache_key(user_id: str) -> str:
+    return f"billing_status:{user_id}"
+
+
 async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total agent run minutes for the current month for a user."""
-    start_time = time.time()
-    
-    # Use get_usage_logs to fetch all usage data (it already handles the date filtering and batching)
-    total_cost = 0.0
-    page = 0
-    items_per_page = 1000
-    
-    while True:
-        # Get usage logs for this page
-        usage_result = await get_usage_logs(client, user_id, page, items_per_page)
-        
-        if not usage_result['logs']:
-            break
-        
-        # Sum up the estimated costs from this page
-        for log_entry in usage_result['logs']:
-            total_cost += log_entry['estimated_cost']
-        
-        # If there are no more pages, break
-        if not usage_result['has_more']:
-            break
-            
-        page += 1
-    
-    end_time = time.time()
-    execution_time = end_time - start_time
-    logger.info(f"Calculate monthly usage took {execution_time:.3f} seconds, total cost: {total_cost}")
-    
-    return total_cost
+    """Get the total cost of the current month for a user from the monthly usage rollup.
 
+    The rollup is built from the raw messages the first time it is needed in a
+    month, and incremented by record_usage after that.
+    """
+    result = await client.table('account_monthly_usage') \
+        .select('total_cost, reconciled_at') \
+        .eq('account_id', user_id) \
+        .eq('month', _usage_month()) \
+        .maybe_single() \
+        .execute()
 
-async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: int = 1000) -> Dict:
-    """Get detailed usage logs for a user with pagination."""
-    # Get start of current month in UTC
-    now = datetime.now(timezone.utc)
-    start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
-    
-    # Use fixed cutoff date: June 26, 2025 midnight UTC
-    # Ignore all token counts before this date
-    cutoff_date = datetime(2025, 6, 30, 9, 0, 0, tzinfo=timezone.utc)
-    
-    start_of_month = max(start_of_month, cutoff_date)
-    
-    # First get all threads for this user in batches
+    if result and result.data and result.data.get('reconciled_at'):
+        return float(result.data['total_cost'])
+
+    # No complete rollup for this month yet
+    return await reconcile_monthly_usage(client, user_id)
+
+
+async def _get_usage_thread_ids(client, user_id: str, period_start: datetime) -> List[str]:
+    """Get the IDs of all threads of a user that count towards the current month's usage."""
     batch_size = 1000
     offset = 0
-    all_threads = []
-    
+    thread_ids = []
+
     while True:
         threads_batch = await client.table('threads') \
             .select('thread_id') \
             .eq('account_id', user_id) \
-            .gte('created_at', start_of_month.isoformat()) \
+            .gte('created_at', period_start.isoformat()) \
             .range(offset, offset + batch_size - 1) \
             .execute()
-        
+
         if not threads_batch.data:
             break
-            
-        all_threads.extend(threads_batch.data)
-        
+
+        thread_ids.extend(t['thread_id'] for t in threads_batch.data)
+
         # If we got less than batch_size, we've reached the end
         if len(threads_batch.data) < batch_size:
             break
-            
+
         offset += batch_size
+
+    return thread_ids
+
+
+async def reconcile_monthly_usage(client, user_id: str) -> float:
+    """Recompute a user's usage for the current month from the raw messages and store it in the rollup.
+
+    Used to create the rollup and, from utils/scripts/reconcile_monthly_usage.py,
+    to audit it. Threads are listed once and messages are paged per batch of threads.
+
+    The scan covers messages created before it started and is applied as a
+    delta against the rollup as it was then, so increments recorded while it
+    runs are kept rather than overwritten. Usage is only incremented once a
+    message is persisted, and the scan bound is taken after the snapshot, so
+    every message counted in the snapshot is also in the scan.
+    """
+    start_time = time.time()
+    month = _usage_month(datetime.now(timezone.utc))
+
+    # Create the row first so increments made during the scan land in it
+    await client.table('account_monthly_usage').upsert(
+        {'account_id': user_id, 'month': month},
+        on_conflict='account_id,month',
+        ignore_duplicates=True,
+    ).execute()
+    snapshot = await client.table('account_monthly_usage') \
+        .select('total_cost, prompt_tokens, completion_tokens, response_count, reconciled_at') \
+        .eq('account_id', user_id) \
+        .eq('month', month) \
+        .single() \
+        .execute()
+    snapshot = snapshot.data
+    now = datetime.now(timezone.utc)
+    period_start = _usage_period_start(now)
+
+    thread_ids = await _get_usage_thread_ids(client, user_id, period_start)
+
+    total_cost = 0.0
+    prompt_tokens = 0
+    completion_tokens = 0
+    response_count = 0
+    thread_batch_size = 200
+    items_per_page = 1000
+
+    for i in range(0, len(thread_ids), thread_batch_size):
+        thread_batch = thread_ids[i:i + thread_batch_size]
+        page = 0
+        while True:
+            messages_result = await client.table('messages') \
+                .select('content') \
+                .in_('thread_id', thread_batch) \
+                .eq('type', 'assistant_response_end') \
+                .gte('created_at', period_start.isoformat()) \
+                .lt('created_at', now.isoformat()) \
+                .order('created_at') \
+                .range(page * items_per_page, (page + 1) * items_per_page - 1) \
+                .execute()
+
+            if not messages_result.data:
+                break
+
+            for message in messages_result.data:
+                content = message.get('content') or {}
+                usage = content.get('usage') or {}
+                prompt = usage.get('prompt_tokens') or 0
+                completion = usage.get('completion_tokens') or 0
+                total_cost += calculate_token_cost(prompt, completion, content.get('model', 'unknown'))
+                prompt_tokens += prompt
+                completion_tokens += completion
+                response_count += 1
+
+            if len(messages_result.data) < items_per_page:
+                break
+            page += 1
+
+    result = await client.rpc('apply_account_monthly_usage_reconcile', {
+        'p_account_id': user_id,
+        'p_month': month,
+        'p_expected_reconciled_at': snapshot.get('reconciled_at'),
+        'p_reconciled_at': now.isoformat(),
+        'p_cost': total_cost - float(snapshot.get('total_cost') or 0),
+        'p_prompt_tokens': prompt_tokens - (snapshot.get('prompt_tokens') or 0),
+        'p_completion_tokens': completion_tokens - (snapshot.get('completion_tokens') or 0),
+        'p_response_count': response_count - (snapshot.get('response_count') or 0),
+    }).execute()
+
+    execution_time = time.time() - start_time
+    if result.data is None:
+        # Another reconcile started from the same row and already applied its scan
+        logger.info(f"Monthly usage for {user_id} was reconciled concurrently, skipped after {execution_time:.3f} seconds")
+        current = await client.table('account_monthly_usage') \
+            .select('total_cost') \
+            .eq('account_id', user_id) \
+            .eq('month', month) \
+            .single() \
+            .execute()
+        return float(current.data['total_cost'])
+
+    logger.info(f"Reconciled monthly usage for {user_id} in {execution_time:.3f} seconds, total cost: {result.data}")
+    return float(result.data)
+
+
+async def _get_thread_usage_info(client, thread_id: str) -> Optional[Tuple[str, datetime]]:
+    info = _thread_usage_info.get(thread_id)
+    if info:
+        return info
+
+    thread_result = await client.table('threads').select('account_id, created_at').eq('thread_id', thread_id).execute()
+    if not thread_result.data:
+        return None
+    thread = thread_result.data[0]
+    info = (thread['account_id'], datetime.fromisoformat(thread['created_at']))
+
+    if len(_thread_usage_info) >= _THREAD_USAGE_INFO_MAX:
+        _thread_usage_info.pop(next(iter(_thread_usage_info)))
+    _thread_usage_info[thread_id] = info
+    return info
+
+
+async def record_usage(client, thread_id: str, content: Dict[str, Any]) -> None:
+    """Add the usage of an assistant_response_end message to its account's monthly rollup.
+
+    Follows the same rules as get_usage_logs: only threads created in the
+    current month count. If the month has no rollup yet, the increment is a
+    no-op and the reconcile that creates it counts the message instead.
+    """
+    usage = content.get('usage') or {}
+    prompt_tokens = usage.get('prompt_tokens') or 0
+    completion_tokens = usage.get('completion_tokens') or 0
+    if not prompt_tokens and not completion_tokens:
+        return
+
+    info = await _get_thread_usage_info(client, thread_id)
+    if not info:
+        logger.warning(f"Cannot record usage for unknown thread {thread_id}")
+        return
+    account_id, thread_created_at = info
+
+    now = datetime.now(timezone.utc)
+    if thread_created_at < _usage_period_start(now):
+        return
+
+    cost = calculate_token_cost(prompt_tokens, completion_tokens, content.get('model', 'unknown'))
+    await client.rpc('increment_account_monthly_usage', {
+        'p_account_id': account_id,
+        'p_month': _usage_month(now),
+        'p_cost': cost,
+        'p_prompt_tokens': prompt_tokens,
+        'p_completion_tokens': completion_tokens,
+    }).execute()
+
+    # The next billing check should see the new total
+    try:
+        await redis.delete(_billing_status_cache_key(account_id))
+    except Exception as e:
+        logger.warning(f"Failed to invalidate billing status cache for {account_id}: {str(e)}")
+
+
+async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: int = 1000) -> Dict:
+    """Get detailed usage logs for a user with pagination."""
+    # Start of current month in UTC, never before the usage cutoff date
+    start_of_month = _usage_period_start()
     
-    if not all_threads:
-        return {"logs": [], "has_more": False}
+    # First get all threads for this user
+    thread_ids = await _get_usage_thread_ids(client, user_id, start_of_month)
     
-    thread_ids = [t['thread_id'] for t in all_threads]
+    if not thread_ids:
+        return {"logs": [], "has_more": False}
     
     # Fetch usage messages with pagination, including thread project info
     start_time = time.time()
@@ -510,6 +677,25 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
             "minutes_limit": "no limit"
         }
     
+    # Reuse a recent result; record_usage drops it as soon as usage changes
+    cache_key = _billing_status_cache_key(user_id)
+    try:
+        cached = await redis.get(cache_key)
+        if cached:
+            can_run, message, subscription = json.loads(cached)
+            return can_run, message, subscription
+    except Exception as e:
+        logger.warning(f"Failed to read cached billing status for {user_id}: {str(e)}")
+
+    result = await _compute_billing_status(client, user_id)
+    try:
+        await redis.set(cache_key, json.dumps(result, default=str), ex=BILLING_STATUS_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to cache billing status for {user_id}: {str(e)}")
+    return result
+
+
+async def _compute_billing_status(client, user_id: str) -> Tuple[bool, str, Optional[Dict]]:
     # Get current subscription
     subscription = await get_user_subscription(user_id)
     # print("Current subscription:", subscription)
@@ -18,6 +18,7 @@ from openai import OpenAIError
 import litellm
 from utils.logger import logger
 from utils.config import config
+from services.prompt_cache import apply_cache_breakpoints, is_cacheable_model
 
 # litellm.set_verbose=True
 litellm.modify_params=True
@@ -160,42 +161,18 @@ def prepare_params(
             params["model_id"] = "arn:aws:bedrock:us-west-2:935064898258:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0"
             logger.debug(f"Auto-set model_id for Claude 3.7 Sonnet: {params['model_id']}")
 
-    # Apply Anthropic prompt caching (minimal implementation)
+    # Apply Anthropic prompt caching
     # Check model name *after* potential modifications (like adding bedrock/ prefix)
     effective_model_name = params.get("model", model_name) # Use model from params if set, else original
-    if "claude" in effective_model_name.lower() or "anthropic" in effective_model_name.lower():
-        messages = params["messages"] # Direct reference, modification affects params
-
-        # Ensure messages is a list
-        if not isinstance(messages, list):
-            return params # Return early if messages format is unexpected
-
-        # Apply cache control to the first 4 text blocks across all messages
-        cache_control_count = 0
-        max_cache_control_blocks = 4
-
-        for message in messages:
-            if cache_control_count >= max_cache_control_blocks:
-                break
-                
-            content = message.get("content")
-            
-            if isinstance(content, str):
-                message["content"] = [
-                    {"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}
-                ]
-                cache_control_count += 1
-            elif isinstance(content, list):
-                for item in content:
-                    if cache_control_count >= max_cache_control_blocks:
-                        break
-                    if isinstance(item, dict) and item.get("type") == "text" and "cache_control" not in item:
-                        item["cache_control"] = {"type": "ephemeral"}
-                        cache_control_count += 1
+    if is_cacheable_model(effective_model_name) and isinstance(params["messages"], list):
+        # Breakpoints after the tool schemas, the system prompt and the stable history
+        params["messages"], cached_tools = apply_cache_breakpoints(params["messages"], params.get("tools"))
+        if cached_tools:
+            params["tools"] = cached_tools
 
     # Add reasoning_effort for Anthropic models if enabled
     use_thinking = enable_thinking if enable_thinking is not None else False
-    is_anthropic = "anthropic" in effective_model_name.lower() or "claude" in effective_model_name.lower()
+    is_anthropic = is_cacheable_model(effective_model_name)
 
     if is_anthropic and use_thinking:
         effort_level = reasoning_effort if reasoning_effort else 'low'
@@ -0,0 +1,167 @@
+"""
+Prompt cache planning for Anthropic models.
+
+Anthropic caches the prompt prefix up to each block marked with
+cache_control, and a later request reads the cache only if everything up to
+a breakpoint is byte-identical. Breakpoints are placed where the prompt is
+stable:
+
+- on the last tool schema, so the tool definitions are cached on their own;
+- on the system prompt, which follows the tools in the prompt;
+- at a rolling boundary in the persisted history, which leaves the most
+  recent PROMPT_CACHE_RECENT_MESSAGES messages outside the prefix and only
+  moves in steps of PROMPT_CACHE_HISTORY_STRIDE messages. Anthropic looks
+  back about 20 blocks from a breakpoint for an earlier cache entry, so a
+  boundary that moves by less than that keeps reading the previous prefix
+  while the next one is written.
+
+ThreadManager._compress_messages keeps the compressed form of the messages
+before history_boundary() from one call to the next, so compression only
+changes the prefix when the messages would not fit otherwise.
+The cache token counts of every response are collected by
+record_cache_usage().
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+HISTORY_STRIDE = max(1, int(os.getenv("PROMPT_CACHE_HISTORY_STRIDE", "8")))
+RECENT_MESSAGES = max(0, int(os.getenv("PROMPT_CACHE_RECENT_MESSAGES", "6")))
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def is_cacheable_model(model_name: str) -> bool:
+    model_name = model_name.lower()
+    return "claude" in model_name or "anthropic" in model_name
+
+
+def history_boundary(messages: List[Dict[str, Any]]) -> int:
+    """
+    Number of leading messages covered by the last cache breakpoint.
+
+    The boundary never passes a message that isn't persisted yet (it has no
+    message_id), such as a temporary message, since those change between calls.
+    """
+    start = 1 if messages and messages[0].get("role") == "system" else 0
+    persisted = start
+    while persisted < len(messages) and messages[persisted].get("message_id"):
+        persisted += 1
+
+    stable = len(messages) - start - RECENT_MESSAGES
+    boundary = start + max(0, stable) // HISTORY_STRIDE * HISTORY_STRIDE
+    boundary = min(boundary, persisted)
+    return boundary if boundary > start else start
+
+
+def _with_breakpoint(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of the message with a breakpoint on its last text block; the original is left alone."""
+    content = message.get("content")
+    if isinstance(content, str):
+        if not content:
+            return message
+        return {**message, "content": [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}]}
+    if isinstance(content, list):
+        for i in range(len(content) - 1, -1, -1):
+            block = content[i]
+            if isinstance(block, dict) and block.get("type") == "text" and block.get("text"):
+                content = [*content[:i], {**block, "cache_control": CACHE_CONTROL}, *content[i + 1:]]
+                return {**message, "content": content}
+    return message
+
+
+def apply_cache_breakpoints(
+    messages: List[Dict[str, Any]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[List[Dict[str, Any]]]]:
+    """
+    Return copies of messages and tools with cache breakpoints after the tool
+    schemas, the system prompt and the stable history.
+    """
+    if tools:
+        tools = [*tools[:-1], {**tools[-1], "cache_control": CACHE_CONTROL}]
+
+    messages = list(messages)
+    if messages and messages[0].get("role") == "system":
+        messages[0] = _with_breakpoint(messages[0])
+
+    boundary = history_boundary(messages)
+    if boundary and messages[boundary - 1].get("role") != "system":
+        messages[boundary - 1] = _with_breakpoint(messages[boundary - 1])
+    return messages, tools
+
+
+def _usage_value(usage: Any, name: str) -> int:
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return value if isinstance(value, int) else 0
+
+
+def cache_usage(usage: Any) -> Dict[str, int]:
+    """Cache token counts of a response's usage (a litellm Usage object or dict)."""
+    if not usage:
+        return {"cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+    read = _usage_value(usage, "cache_read_input_tokens")
+    if not read:
+        # litellm also reports cache reads in the OpenAI format
+        details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+        read = _usage_value(details, "cached_tokens") if details else 0
+    return {
+        "cache_read_input_tokens": read,
+        "cache_creation_input_tokens": _usage_value(usage, "cache_creation_input_tokens"),
+    }
+
+
+class PromptCacheStats:
+    """Running totals of prompt cache usage across calls in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.cache_creation_input_tokens = 0
+
+    def record(self, prompt_tokens: int, cache_read: int, cache_creation: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cache_read_input_tokens += cache_read
+            self.cache_creation_input_tokens += cache_creation
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            input_tokens = self.prompt_tokens or 1
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cache_read_input_tokens": self.cache_read_input_tokens,
+                "cache_creation_input_tokens": self.cache_creation_input_tokens,
+                "hit_rate": round(self.cache_read_input_tokens / input_tokens, 3),
+            }
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+def record_cache_usage(usage: Any, model: str, trace=None) -> Dict[str, int]:
+    """Log and trace the cache token counts of one LLM call, and add them to the process totals."""
+    counts = cache_usage(usage)
+    prompt_tokens = _usage_value(usage, "prompt_tokens") if usage else 0
+    read, creation = counts["cache_read_input_tokens"], counts["cache_creation_input_tokens"]
+    prompt_cache_stats.record(prompt_tokens, read, creation)
+
+    if read or creation or is_cacheable_model(model):
+        logger.info(
+            f"Prompt cache for {model}: read {read}, written {creation} of {prompt_tokens} prompt tokens "
+            f"(totals: {prompt_cache_stats.stats()})"
+        )
+        if trace:
+            trace.event(
+                name="prompt_cache_usage",
+                level="DEFAULT",
+                status_message=f"Prompt cache read {read}, written {creation} of {prompt_tokens} prompt tokens",
+                metadata={"model": model, "prompt_tokens": prompt_tokens, **counts},
+            )
+    return counts
@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional, Tuple
 from utils.retry import retry
 
 # Redis client and connection pool
@@ -15,6 +15,9 @@ _init_lock = asyncio.Lock()
 # Constants
 REDIS_KEY_TTL = 3600 * 24  # 24 hour TTL as safety mechanism
 
+# Transport for agent run responses: "list" (RPUSH + PUBLISH "new") or "stream" (XADD/XREAD)
+RESPONSE_TRANSPORT = os.getenv("AGENT_RUN_RESPONSE_TRANSPORT", "list").lower()
+
 
 def initialize():
     """Initialize Redis connection pool and client using environment variables."""
@@ -126,6 +129,18 @@ async def publish(channel: str, message: str):
     return await redis_client.publish(channel, message)
 
 
+async def pipeline(transaction: bool = False):
+    """Create a pipeline that sends queued commands in one round-trip."""
+    redis_client = await get_client()
+    return redis_client.pipeline(transaction=transaction)
+
+
+async def smembers(key: str) -> List[str]:
+    """Get all members of a Redis set."""
+    redis_client = await get_client()
+    return list(await redis_client.smembers(key))
+
+
 async def create_pubsub():
     """Create a Redis pubsub object."""
     redis_client = await get_client()
@@ -151,6 +166,34 @@ async def llen(key: str) -> int:
     return await redis_client.llen(key)
 
 
+# Stream operations
+async def xadd(key: str, fields: Dict[str, Any], id: str = "*") -> str:
+    """Append an entry to a stream and return its ID."""
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields, id=id)
+
+
+async def xrange(key: str, min: str = "-", max: str = "+", count: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+    """Get entries of a stream between two IDs (inclusive, or exclusive with a '(' prefix)."""
+    redis_client = await get_client()
+    return await redis_client.xrange(key, min=min, max=max, count=count)
+
+
+async def xread(key: str, last_id: str, block: Optional[int] = None, count: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+    """Read entries of a single stream added after last_id, optionally blocking for up to `block` ms."""
+    redis_client = await get_client()
+    result = await redis_client.xread({key: last_id}, count=count, block=block)
+    if not result:
+        return []
+    return result[0][1]
+
+
+async def xlen(key: str) -> int:
+    """Get the number of entries in a stream."""
+    redis_client = await get_client()
+    return await redis_client.xlen(key)
+
+
 # Key management
 async def expire(key: str, time: int):
     """Set a key's time to live in seconds."""
@@ -158,6 +201,12 @@ async def expire(key: str, time: int):
     return await redis_client.expire(key, time)
 
 
+async def exists(*keys: str) -> int:
+    """Count how many of the given keys exist."""
+    redis_client = await get_client()
+    return await redis_client.exists(*keys)
+
+
 async def keys(pattern: str) -> List[str]:
     """Get keys matching a pattern."""
     redis_client = await get_client()
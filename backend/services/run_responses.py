@@ -0,0 +1,314 @@
+"""
+Storage and transport for agent run responses in Redis.
+
+Two transports are supported, selected with AGENT_RUN_RESPONSE_TRANSPORT:
+
+- "list" (default): every response is RPUSHed to `agent_run:{id}:responses`
+  and announced with a PUBLISH "new" on `agent_run:{id}:new_response`. Every
+  viewer answers each ping with an LRANGE from its last index.
+- "stream": every response is XADDed to `agent_run:{id}:stream`. Viewers do a
+  blocking XREAD from the last entry ID they saw, so a chunk costs one read per
+  viewer and no notification, and reconnecting clients resume from the entry ID
+  sent as the SSE `id` (Last-Event-ID).
+
+Readers detect the transport from the keys that exist, so runs written with
+either transport can be streamed while the setting is being changed.
+
+The background worker writes through ResponsePublisher, which coalesces
+streamed content chunks for a short window and writes each batch with one
+pipeline and, for the list transport, a single notification. It also feeds a
+ResponseCompactor, which keeps the compacted form persisted to
+`agent_runs.responses` up to date as the run goes, so finishing a run never
+re-reads the full response history.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from services import redis
+from utils.logger import logger
+
+TRANSPORT_LIST = "list"
+TRANSPORT_STREAM = "stream"
+
+# TTL for response lists and streams once a run is over (24 hours)
+RESPONSE_TTL = 3600 * 24
+
+# Coalescing window for streamed chunks, and the buffer size that forces an early flush
+DEFAULT_FLUSH_INTERVAL = int(os.getenv("AGENT_RUN_RESPONSE_FLUSH_MS", 30)) / 1000
+DEFAULT_FLUSH_BYTES = int(os.getenv("AGENT_RUN_RESPONSE_FLUSH_BYTES", 16384))
+# Buffered responses after which publish() waits for a flush instead of queueing more
+DEFAULT_MAX_BUFFERED = 1000
+
+
+def response_list_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:responses"
+
+
+def response_channel(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:new_response"
+
+
+def response_stream_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:stream"
+
+
+def configured_transport() -> str:
+    return TRANSPORT_STREAM if redis.RESPONSE_TRANSPORT == TRANSPORT_STREAM else TRANSPORT_LIST
+
+
+async def detect_transport(agent_run_id: str) -> str:
+    """Transport an existing run was written with, falling back to the configured one."""
+    if await redis.exists(response_stream_key(agent_run_id)):
+        return TRANSPORT_STREAM
+    if await redis.exists(response_list_key(agent_run_id)):
+        return TRANSPORT_LIST
+    return configured_transport()
+
+
+async def append_response(agent_run_id: str, response_json: str, transport: Optional[str] = None) -> None:
+    """Store a serialized response and make it visible to viewers."""
+    transport = transport or configured_transport()
+    if transport == TRANSPORT_STREAM:
+        await redis.xadd(response_stream_key(agent_run_id), {'data': response_json})
+    else:
+        await redis.rpush(response_list_key(agent_run_id), response_json)
+        await redis.publish(response_channel(agent_run_id), "new")
+
+
+async def read_stream_entries(
+    agent_run_id: str,
+    last_id: str = "0",
+    block: Optional[int] = None,
+    count: Optional[int] = None,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Read parsed responses added to a run's stream after last_id, as (entry ID, response) pairs."""
+    entries = await redis.xread(response_stream_key(agent_run_id), last_id, block=block, count=count)
+    return [(entry_id, json.loads(fields['data'])) for entry_id, fields in entries]
+
+
+async def get_all_responses(agent_run_id: str) -> List[Dict[str, Any]]:
+    """Fetch every stored response of a run, whichever transport it was written with."""
+    if await detect_transport(agent_run_id) == TRANSPORT_STREAM:
+        entries = await redis.xrange(response_stream_key(agent_run_id))
+        return [json.loads(fields['data']) for _, fields in entries]
+    return [json.loads(r) for r in await redis.lrange(response_list_key(agent_run_id), 0, -1)]
+
+
+async def expire_responses(agent_run_id: str, ttl: int = RESPONSE_TTL) -> None:
+    """Set the TTL on a run's stored responses (expiring a missing key is a no-op)."""
+    await redis.expire(response_list_key(agent_run_id), ttl)
+    await redis.expire(response_stream_key(agent_run_id), ttl)
+
+
+def _is_tool_call_chunk(response: Dict[str, Any]) -> bool:
+    content = response.get('content')
+    return (
+        response.get('type') == 'status' and response.get('message_id') is None
+        and isinstance(content, str) and '"tool_call_chunk"' in content
+    )
+
+
+class ResponseCompactor:
+    """Incrementally builds the compacted responses of a run for `agent_runs.responses`.
+
+    Consecutive streamed content chunks are merged into a single response, which
+    is dropped again once the saved assistant message it belongs to arrives.
+    Native tool call deltas are dropped as well, since the saved message carries
+    the complete tool calls. Everything else is kept as is, in order.
+    """
+
+    def __init__(self):
+        self._responses: List[Dict[str, Any]] = []
+        self._chunk_head: Optional[Dict[str, Any]] = None
+        self._chunk_parts: List[str] = []
+
+    def add(self, response: Dict[str, Any]) -> None:
+        if is_coalescible(response):
+            if self._chunk_head is None:
+                self._chunk_head = response
+            content = response.get('content')
+            if isinstance(content, str):
+                try:
+                    content = json.loads(content)
+                except json.JSONDecodeError:
+                    content = {'content': content}
+            if isinstance(content, dict) and isinstance(content.get('content'), str):
+                self._chunk_parts.append(content['content'])
+            return
+
+        if _is_tool_call_chunk(response):
+            return
+
+        if response.get('type') == 'assistant':
+            # The saved assistant message supersedes the chunks streamed for it
+            self._chunk_head = None
+            self._chunk_parts = []
+        else:
+            self._close_chunk_run()
+        self._responses.append(response)
+
+    def _close_chunk_run(self) -> None:
+        if self._chunk_head is None:
+            return
+        merged = dict(self._chunk_head)
+        merged['content'] = json.dumps({'role': 'assistant', 'content': ''.join(self._chunk_parts)})
+        self._responses.append(merged)
+        self._chunk_head = None
+        self._chunk_parts = []
+
+    def responses(self) -> List[Dict[str, Any]]:
+        """The compacted responses so far, including a merged trailing chunk run."""
+        self._close_chunk_run()
+        return list(self._responses)
+
+
+def compact_responses(responses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compact a full list of responses, e.g. one read back from Redis."""
+    compactor = ResponseCompactor()
+    for response in responses:
+        compactor.add(response)
+    return compactor.responses()
+
+
+def is_coalescible(response: Dict[str, Any]) -> bool:
+    """Streamed assistant content chunks may wait for a batch; everything else is sent right away."""
+    return response.get('type') == 'assistant' and response.get('message_id') is None
+
+
+class ResponsePublisher:
+    """Buffers the responses of one agent run and writes them to Redis in pipelined batches.
+
+    Content chunks are held for up to `flush_interval` seconds or `flush_bytes`
+    bytes. Any other response (status, tool, saved messages) flushes the buffer
+    together with itself, so ordering is kept and viewers see those events
+    without delay. When writes fall behind, publish() waits for a flush once
+    `max_buffered` responses are queued.
+    """
+
+    def __init__(
+        self,
+        agent_run_id: str,
+        transport: Optional[str] = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        flush_bytes: int = DEFAULT_FLUSH_BYTES,
+        max_buffered: int = DEFAULT_MAX_BUFFERED,
+    ):
+        self.agent_run_id = agent_run_id
+        self.transport = transport or configured_transport()
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_buffered = max_buffered
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self._buffered_since: Optional[float] = None
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        # Metrics
+        self.flushes = 0
+        self.published = 0
+        self.dropped = 0
+        self.max_batch_size = 0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.max_delay_seconds = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def publish(self, response: Dict[str, Any]) -> None:
+        """Queue a response, flushing right away unless it is a content chunk."""
+        response_json = json.dumps(response)
+        if self._buffered_since is None:
+            self._buffered_since = time.monotonic()
+        self._buffer.append(response_json)
+        self._buffer_bytes += len(response_json)
+
+        if not is_coalescible(response) or self._buffer_bytes >= self.flush_bytes or len(self._buffer) >= self.max_buffered:
+            await self.flush()
+            self._drop_overflow()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_after_interval())
+
+    async def _flush_after_interval(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def _write(self, batch: List[str]) -> None:
+        pipe = await redis.pipeline()
+        if self.transport == TRANSPORT_STREAM:
+            stream_key = response_stream_key(self.agent_run_id)
+            for response_json in batch:
+                pipe.xadd(stream_key, {'data': response_json})
+        else:
+            pipe.rpush(response_list_key(self.agent_run_id), *batch)
+            pipe.publish(response_channel(self.agent_run_id), "new")
+        await pipe.execute()
+
+    async def flush(self) -> None:
+        """Write everything buffered in one pipeline. Failed batches stay queued for the next flush."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            batch = self._buffer
+            buffered_since = self._buffered_since
+            self._buffer = []
+            self._buffer_bytes = 0
+            self._buffered_since = None
+
+            start = time.monotonic()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logger.warning(f"Failed to publish {len(batch)} responses for agent run {self.agent_run_id}: {str(e)}")
+                self._buffer = batch + self._buffer
+                self._buffer_bytes = sum(len(r) for r in self._buffer)
+                self._buffered_since = buffered_since
+                return
+
+            end = time.monotonic()
+            self.flushes += 1
+            self.published += len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.total_flush_seconds += end - start
+            self.max_flush_seconds = max(self.max_flush_seconds, end - start)
+            if buffered_since is not None:
+                self.max_delay_seconds = max(self.max_delay_seconds, end - buffered_since)
+
+    def _drop_overflow(self) -> None:
+        """Keep the buffer bounded if Redis is failing: drop the oldest responses beyond max_buffered."""
+        overflow = len(self._buffer) - self.max_buffered
+        if overflow > 0:
+            logger.error(f"Dropping {overflow} unpublished responses for agent run {self.agent_run_id}")
+            del self._buffer[:overflow]
+            self._buffer_bytes = sum(len(r) for r in self._buffer)
+            self.dropped += overflow
+
+    async def close(self) -> None:
+        """Flush what is left and stop the pending timer."""
+        await self.flush()
+        # Nothing left to write, so a pending timer has no work to do
+        if self._timer and not self._timer.done() and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+        if self._buffer:
+            logger.error(f"Dropping {len(self._buffer)} unpublished responses for agent run {self.agent_run_id} on close")
+            self.dropped += len(self._buffer)
+            self._buffer = []
+            self._buffer_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'flushes': self.flushes,
+            'published': self.published,
+            'dropped': self.dropped,
+            'avg_batch_size': round(self.published / self.flushes, 2) if self.flushes else 0,
+            'max_batch_size': self.max_batch_size,
+            'avg_flush_ms': round(self.total_flush_seconds / self.flushes * 1000, 2) if self.flushes else 0,
+            'max_flush_ms': round(self.max_flush_seconds * 1000, 2),
+            'max_delay_ms': round(self.max_delay_seconds * 1000, 2),
+        }
@@ -0,0 +1,12 @@
+-- Migration: Add token_counts column to messages
+-- Caches per-message token counts so context compression does not re-tokenize whole threads
+
+BEGIN;
+
+-- Add token_counts column to messages table
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS token_counts JSONB DEFAULT '{}'::jsonb;
+
+-- Add comment
+COMMENT ON COLUMN messages.token_counts IS 'Token counts of the LLM view of the message: {"hash": content hash, "counts": {model: tokens}}. Ignored when the hash no longer matches the content';
+
+COMMIT;
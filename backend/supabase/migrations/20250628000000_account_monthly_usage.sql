@@ -0,0 +1,62 @@
+BEGIN;
+
+-- Per-account monthly usage rollup, incremented whenever an assistant_response_end
+-- message is written, so billing checks don't have to scan the messages table.
+CREATE TABLE IF NOT EXISTS account_monthly_usage (
+    account_id UUID NOT NULL REFERENCES basejump.accounts(id) ON DELETE CASCADE,
+    month DATE NOT NULL, -- First day of the month (UTC)
+
+    total_cost NUMERIC(14, 6) NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    response_count INTEGER NOT NULL DEFAULT 0,
+
+    reconciled_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+
+    PRIMARY KEY (account_id, month)
+);
+
+ALTER TABLE account_monthly_usage ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY account_monthly_usage_select ON account_monthly_usage
+    FOR SELECT
+    USING (basejump.has_role_on_account(account_id) = true);
+
+-- Atomically add one response's usage to the rollup
+CREATE OR REPLACE FUNCTION increment_account_monthly_usage(
+    p_account_id UUID,
+    p_month DATE,
+    p_cost NUMERIC,
+    p_prompt_tokens BIGINT,
+    p_completion_tokens BIGINT
+)
+RETURNS NUMERIC
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_total NUMERIC;
+BEGIN
+    INSERT INTO account_monthly_usage (account_id, month, total_cost, prompt_tokens, completion_tokens, response_count)
+    VALUES (p_account_id, p_month, p_cost, p_prompt_tokens, p_completion_tokens, 1)
+    ON CONFLICT (account_id, month) DO UPDATE SET
+        total_cost = account_monthly_usage.total_cost + EXCLUDED.total_cost,
+        prompt_tokens = account_monthly_usage.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = account_monthly_usage.completion_tokens + EXCLUDED.completion_tokens,
+        response_count = account_monthly_usage.response_count + 1,
+        updated_at = NOW()
+    RETURNING total_cost INTO v_total;
+
+    RETURN v_total;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION increment_account_monthly_usage FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION increment_account_monthly_usage TO service_role;
+GRANT SELECT ON TABLE account_monthly_usage TO authenticated;
+GRANT ALL PRIVILEGES ON TABLE account_monthly_usage TO service_role;
+
+COMMENT ON TABLE account_monthly_usage IS 'Running monthly LLM cost per account, maintained from assistant_response_end messages and periodically reconciled against them';
+
+COMMIT;
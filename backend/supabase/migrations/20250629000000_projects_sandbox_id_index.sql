@@ -0,0 +1,7 @@
+BEGIN;
+
+-- The sandbox file API resolves the owning project with a filter on sandbox->>'id',
+-- which otherwise scans the projects table on every request
+CREATE INDEX IF NOT EXISTS idx_projects_sandbox_id ON projects ((sandbox->>'id'));
+
+COMMIT;
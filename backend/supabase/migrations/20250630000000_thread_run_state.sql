@@ -0,0 +1,40 @@
+BEGIN;
+
+-- Latest message of a given type in a thread, used by the agent loop
+CREATE INDEX IF NOT EXISTS idx_messages_thread_type_created_at ON messages(thread_id, type, created_at DESC);
+
+-- Everything the agent loop needs about a thread when a run starts, in one round trip
+CREATE OR REPLACE FUNCTION get_thread_run_state(p_thread_id UUID)
+RETURNS JSONB
+SECURITY DEFINER
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'latest_message_type', (
+            SELECT type FROM messages
+            WHERE thread_id = p_thread_id AND type IN ('assistant', 'tool', 'user')
+            ORDER BY created_at DESC LIMIT 1
+        ),
+        'latest_user_message', (
+            SELECT content FROM messages
+            WHERE thread_id = p_thread_id AND type = 'user'
+            ORDER BY created_at DESC LIMIT 1
+        ),
+        'browser_state', (
+            SELECT content FROM messages
+            WHERE thread_id = p_thread_id AND type = 'browser_state'
+            ORDER BY created_at DESC LIMIT 1
+        ),
+        'image_contexts', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('message_id', message_id, 'content', content) ORDER BY created_at)
+            FROM messages
+            WHERE thread_id = p_thread_id AND type = 'image_context'
+        ), '[]'::jsonb)
+    );
+$$;
+
+REVOKE ALL ON FUNCTION get_thread_run_state FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION get_thread_run_state TO service_role;
+
+COMMIT;
@@ -0,0 +1,75 @@
+BEGIN;
+
+-- Tool summary of each agent, derived from configured_mcps and agentpress_tools and
+-- kept up to date by a trigger, so the agent list can filter, sort and paginate by
+-- tools in the database instead of loading every agent of the account
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS tools_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS has_mcp_tools BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS has_agentpress_tools BOOLEAN NOT NULL DEFAULT false;
+-- 'mcp:<name>' for each configured MCP and 'agentpress:<tool>' for each enabled tool
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS tool_keys TEXT[] NOT NULL DEFAULT '{}';
+
+CREATE OR REPLACE FUNCTION agent_enabled_agentpress_tools(p_agentpress_tools JSONB)
+RETURNS TEXT[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT COALESCE(array_agg(tool.key ORDER BY tool.key), '{}')
+    FROM jsonb_each(
+        CASE WHEN jsonb_typeof(p_agentpress_tools) = 'object' THEN p_agentpress_tools ELSE '{}'::jsonb END
+    ) AS tool
+    WHERE jsonb_typeof(tool.value) = 'object' AND tool.value->'enabled' = 'true'::jsonb;
+$$;
+
+CREATE OR REPLACE FUNCTION agent_mcp_names(p_configured_mcps JSONB)
+RETURNS TEXT[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT COALESCE(array_agg(DISTINCT mcp->>'name'), '{}')
+    FROM jsonb_array_elements(
+        CASE WHEN jsonb_typeof(p_configured_mcps) = 'array' THEN p_configured_mcps ELSE '[]'::jsonb END
+    ) AS mcp
+    WHERE jsonb_typeof(mcp) = 'object' AND mcp->>'name' IS NOT NULL;
+$$;
+
+CREATE OR REPLACE FUNCTION update_agent_tool_summary()
+RETURNS TRIGGER AS $$
+DECLARE
+    mcp_count INTEGER;
+    agentpress_tools TEXT[];
+BEGIN
+    mcp_count := CASE
+        WHEN jsonb_typeof(NEW.configured_mcps) = 'array' THEN jsonb_array_length(NEW.configured_mcps)
+        ELSE 0
+    END;
+    agentpress_tools := agent_enabled_agentpress_tools(NEW.agentpress_tools);
+
+    NEW.tools_count := mcp_count + cardinality(agentpress_tools);
+    NEW.has_mcp_tools := mcp_count > 0;
+    NEW.has_agentpress_tools := cardinality(agentpress_tools) > 0;
+    NEW.tool_keys := ARRAY(
+        SELECT 'mcp:' || name FROM unnest(agent_mcp_names(NEW.configured_mcps)) AS name
+        UNION ALL
+        SELECT 'agentpress:' || name FROM unnest(agentpress_tools) AS name
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_agents_tool_summary ON agents;
+CREATE TRIGGER trigger_agents_tool_summary
+    BEFORE INSERT OR UPDATE OF configured_mcps, agentpress_tools ON agents
+    FOR EACH ROW
+    EXECUTE FUNCTION update_agent_tool_summary();
+
+-- Backfill existing agents without touching their updated_at
+ALTER TABLE agents DISABLE TRIGGER trigger_agents_updated_at;
+UPDATE agents SET configured_mcps = configured_mcps;
+ALTER TABLE agents ENABLE TRIGGER trigger_agents_updated_at;
+
+CREATE INDEX IF NOT EXISTS idx_agents_account_tools_count ON agents(account_id, tools_count);
+CREATE INDEX IF NOT EXISTS idx_agents_account_tool_flags ON agents(account_id, has_mcp_tools, has_agentpress_tools);
+CREATE INDEX IF NOT EXISTS idx_agents_tool_keys ON agents USING GIN (tool_keys);
+
+COMMIT;
@@ -0,0 +1,73 @@
+BEGIN;
+
+-- Increments only update an existing rollup. The row for a month is created by
+-- reconcile_monthly_usage, which counts everything spent before it existed.
+CREATE OR REPLACE FUNCTION increment_account_monthly_usage(
+    p_account_id UUID,
+    p_month DATE,
+    p_cost NUMERIC,
+    p_prompt_tokens BIGINT,
+    p_completion_tokens BIGINT
+)
+RETURNS NUMERIC
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_total NUMERIC;
+BEGIN
+    UPDATE account_monthly_usage SET
+        total_cost = total_cost + p_cost,
+        prompt_tokens = prompt_tokens + p_prompt_tokens,
+        completion_tokens = completion_tokens + p_completion_tokens,
+        response_count = response_count + 1,
+        updated_at = NOW()
+    WHERE account_id = p_account_id AND month = p_month
+    RETURNING total_cost INTO v_total;
+
+    RETURN v_total; -- NULL when there is no rollup yet
+END;
+$$;
+
+-- Apply the difference between a reconcile's scan and the rollup it started from.
+-- Increments that land during the scan are kept, and only one of several
+-- concurrent reconciles starting from the same row applies its delta.
+CREATE OR REPLACE FUNCTION apply_account_monthly_usage_reconcile(
+    p_account_id UUID,
+    p_month DATE,
+    p_expected_reconciled_at TIMESTAMPTZ,
+    p_reconciled_at TIMESTAMPTZ,
+    p_cost NUMERIC,
+    p_prompt_tokens BIGINT,
+    p_completion_tokens BIGINT,
+    p_response_count INTEGER
+)
+RETURNS NUMERIC
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_total NUMERIC;
+BEGIN
+    UPDATE account_monthly_usage SET
+        total_cost = total_cost + p_cost,
+        prompt_tokens = prompt_tokens + p_prompt_tokens,
+        completion_tokens = completion_tokens + p_completion_tokens,
+        response_count = response_count + p_response_count,
+        reconciled_at = p_reconciled_at,
+        updated_at = NOW()
+    WHERE account_id = p_account_id AND month = p_month
+      AND reconciled_at IS NOT DISTINCT FROM p_expected_reconciled_at
+    RETURNING total_cost INTO v_total;
+
+    RETURN v_total; -- NULL when another reconcile got there first
+END;
+$$;
+
+REVOKE ALL ON FUNCTION apply_account_monthly_usage_reconcile FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION apply_account_monthly_usage_reconcile TO service_role;
+
+-- Rollups created by the first increment of a month only hold that response; rebuild them
+DELETE FROM account_monthly_usage WHERE reconciled_at IS NULL;
+
+COMMIT;
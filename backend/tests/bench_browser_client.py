@@ -0,0 +1,106 @@
+"""
+Benchmark per-action latency of the browser API client: direct HTTP vs curl via exec.
+
+A stand-in for the in-sandbox browser API runs locally and answers every action
+with a browser-state-sized JSON body. The exec path runs the same curl command
+the client would run in the sandbox, as a local subprocess, plus EXEC_ROUND_TRIP
+of simulated Daytona process.exec API latency (set it to 0 to compare just the
+local mechanics: process spawn and stdout parsing vs a pooled keep-alive
+connection). The direct path talks to the stand-in through a fake preview link.
+
+Run from the backend directory:
+    python -m tests.bench_browser_client
+"""
+
+import asyncio
+import socket
+import statistics
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+
+import uvicorn
+from fastapi import Body, FastAPI
+
+import sandbox.browser_client as browser_client
+from sandbox.browser_client import BrowserAPIClient
+
+ACTIONS = 50
+EXEC_ROUND_TRIP = 0.15
+
+app = FastAPI()
+STATE = {
+    "success": True,
+    "message": "ok",
+    "url": "https://example.com",
+    "title": "Example",
+    "elements": "\n".join(f"[{i}]<a>Link {i}</a>" for i in range(300)),
+    "element_count": 300,
+}
+
+
+@app.post("/api/automation/{action}")
+async def automation(action: str, params: dict = Body(None)):
+    return STATE
+
+
+class _FakeProcess:
+    def __init__(self, port: int):
+        self.port = port
+
+    def exec(self, command: str, timeout: int = 30):
+        time.sleep(EXEC_ROUND_TRIP)
+        command = command.replace(f"localhost:{browser_client.BROWSER_API_PORT}", f"127.0.0.1:{self.port}")
+        completed = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=timeout)
+        return SimpleNamespace(exit_code=completed.returncode, result=completed.stdout)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _measure(client: BrowserAPIClient, sandbox) -> list:
+    timings = []
+    for i in range(ACTIONS):
+        start = time.perf_counter()
+        result = await client.request(sandbox, "bench-sandbox", "scroll_down", {"amount": i})
+        timings.append((time.perf_counter() - start) * 1000)
+        assert result["element_count"] == 300
+    return timings
+
+
+def _summary(timings: list) -> str:
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"p50 {statistics.median(ordered):7.1f} ms | p95 {p95:7.1f} ms | mean {statistics.mean(ordered):7.1f} ms"
+
+
+async def main() -> None:
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    sandbox = SimpleNamespace(
+        get_preview_link=lambda p: SimpleNamespace(url=f"http://127.0.0.1:{port}", token="bench-token"),
+        process=_FakeProcess(port),
+    )
+
+    print(f"{ACTIONS} sequential actions, {len(str(STATE)) // 1024} KB responses, exec round trip {EXEC_ROUND_TRIP * 1000:.0f} ms")
+    for label, direct in (("exec + curl", False), ("direct http", True)):
+        client = BrowserAPIClient(direct=direct)
+        timings = await _measure(client, sandbox)
+        print(f"{label:>12} | {_summary(timings)} | {client.stats()}")
+        await client.close()
+
+    server.should_exit = True
+    thread.join()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Benchmark per-action latency of the in-sandbox browser API's DOM tracker on a large page.
+
+A page with NODES elements, every INTERACTIVE_EVERY-th of them interactive, is
+loaded into headless Chromium. Measured per action:
+
+- full snapshot: every element re-read and sent, as on the first action on a page
+- incremental snapshot: nothing or one element changed since the last snapshot
+- click_element / input_text: the whole action, with and without the settle wait
+
+Screenshots are turned off so only the DOM work is timed. Set
+BROWSER_TEST_EXECUTABLE_PATH to use a Chromium other than Playwright's own.
+
+Run from the backend directory:
+    python -m tests.bench_browser_dom_tracker
+"""
+
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from playwright.async_api import async_playwright
+
+NODES = 10_000
+INTERACTIVE_EVERY = 5
+ACTIONS = 30
+
+
+def _page() -> str:
+    items = []
+    for i in range(NODES):
+        if i % INTERACTIVE_EVERY == 0:
+            items.append(f'<button id="b{i}" onclick="this.dataset.clicks = (+this.dataset.clicks || 0) + 1">Button {i}</button>')
+        elif i % INTERACTIVE_EVERY == 1:
+            items.append(f'<input id="i{i}" placeholder="Field {i}">')
+        else:
+            items.append(f"<span>Text {i}</span>")
+    return f"<html><body><div>{''.join(items)}</div></body></html>"
+
+
+def _summary(timings: list) -> str:
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"p50 {statistics.median(ordered):7.1f} ms | p95 {p95:7.1f} ms | mean {statistics.mean(ordered):7.1f} ms"
+
+
+async def _timed(coro) -> float:
+    start = time.perf_counter()
+    await coro
+    return (time.perf_counter() - start) * 1000
+
+
+async def main() -> None:
+    os.chdir(tempfile.mkdtemp())
+    from sandbox.docker import browser_api
+    browser_api.BROWSER_STATE_SCREENSHOT = "never"
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(executable_path=os.getenv("BROWSER_TEST_EXECUTABLE_PATH"))
+        automation = browser_api.BrowserAutomation()
+        automation.browser = browser
+        automation.browser_context = await browser.new_context(viewport={'width': 1024, 'height': 768})
+        page = await automation.browser_context.new_page()
+        automation.pages.append(page)
+        await page.set_content(_page())
+
+        selector_map = await automation.get_selector_map()
+        print(f"{NODES} nodes, {len(selector_map)} visible interactive elements, {ACTIONS} actions each")
+
+        full = []
+        for _ in range(ACTIONS):
+            await page.evaluate("() => { window.__domTracker.allDirty = true; }")
+            full.append(await _timed(page.evaluate(browser_api.DOM_SNAPSHOT_JS, None)))
+        await automation.get_selector_map()
+        print(f"{'full snapshot':>30} | {_summary(full)}")
+
+        unchanged = [await _timed(automation.get_selector_map()) for _ in range(ACTIONS)]
+        print(f"{'unchanged snapshot':>30} | {_summary(unchanged)}")
+
+        one_changed = []
+        for i in range(ACTIONS):
+            await page.evaluate("(i) => { document.getElementById('b0').textContent = `Button ${i}`; }", i)
+            one_changed.append(await _timed(automation.get_selector_map()))
+        print(f"{'one element changed':>30} | {_summary(one_changed)}")
+
+        settle_time = []
+        wait_for_settle = automation.wait_for_settle
+
+        async def timed_settle(page):
+            settle_time.append(await _timed(wait_for_settle(page)))
+
+        automation.wait_for_settle = timed_settle
+        indices = list(selector_map)
+        for label, action in (
+            ("click_element", lambda i: automation.click_element(browser_api.ClickElementAction(index=indices[i * 2]))),
+            ("input_text", lambda i: automation.input_text(browser_api.InputTextAction(index=indices[i * 2 + 1], text=f"value {i}"))),
+        ):
+            settle_time.clear()
+            timings = []
+            for i in range(ACTIONS):
+                start = time.perf_counter()
+                result = await action(i)
+                timings.append((time.perf_counter() - start) * 1000)
+                assert result.success, result.error
+            without_settle = [total - settle for total, settle in zip(timings, settle_time)]
+            print(f"{label:>30} | {_summary(timings)}")
+            print(f"{label + ' without settle':>30} | {_summary(without_settle)}")
+
+        await browser.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
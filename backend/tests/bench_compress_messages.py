@@ -0,0 +1,70 @@
+"""
+Benchmark per-turn cost of ThreadManager._compress_messages.
+
+Simulates an agent loop on synthetic threads of 100, 500 and 2,000 messages:
+the first turn starts with a cold token cache, every following turn appends one
+new message and compresses again. Also reports a single full litellm
+token_counter pass over the thread as a reference for the old behaviour, which
+did several of those per turn.
+
+Run from the backend directory:
+    python -m tests.bench_compress_messages
+"""
+
+import random
+import time
+
+from litellm import token_counter
+
+from agentpress.thread_manager import ThreadManager
+from agentpress.token_cache import MessageTokenCache
+
+MODEL = "anthropic/claude-sonnet-4-20250514"
+THREAD_SIZES = [100, 500, 2000]
+WARM_TURNS = 5
+
+
+def _make_message(i: int) -> dict:
+    rng = random.Random(i)
+    words = " ".join(f"word{rng.randint(0, 5000)}" for _ in range(rng.randint(40, 400)))
+    role = ["user", "assistant", "assistant"][i % 3]
+    if i % 3 == 2:
+        content = f'{{"tool_execution": {{"function_name": "execute_command", "result": "{words}"}}}}'
+    else:
+        content = words
+    return {"role": role, "content": content, "message_id": f"msg-{i}"}
+
+
+def _bench(size: int) -> None:
+    tm = ThreadManager()
+    tm.token_cache = MessageTokenCache()
+    system = {"role": "system", "content": "You are a helpful agent. " * 200}
+    thread = [_make_message(i) for i in range(size)]
+
+    start = time.perf_counter()
+    token_counter(model=MODEL, messages=[system] + thread)
+    full_count = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tm._compress_messages([system] + thread, MODEL)
+    cold = time.perf_counter() - start
+
+    warm_times = []
+    for turn in range(WARM_TURNS):
+        thread.append(_make_message(size + turn))
+        start = time.perf_counter()
+        tm._compress_messages([system] + thread, MODEL)
+        warm_times.append(time.perf_counter() - start)
+    warm = sum(warm_times) / len(warm_times)
+
+    stats = tm.token_cache.stats()
+    print(
+        f"{size:>6} msgs | full token_counter pass {full_count * 1000:8.1f} ms"
+        f" | cold turn {cold * 1000:8.1f} ms | warm turn {warm * 1000:8.1f} ms"
+        f" | cache hits {stats['hits']} misses {stats['misses']}"
+    )
+
+
+if __name__ == "__main__":
+    for size in THREAD_SIZES:
+        _bench(size)
@@ -0,0 +1,107 @@
+"""
+Benchmark feature flag checks per second: a Redis HGET per check vs the local snapshot.
+
+Checks run against an in-process stand-in for Redis that answers each command
+after REDIS_ROUND_TRIP seconds (a typical same-region round trip; set it to 0
+to compare just the Python overhead). The "hget per check" row is what
+is_enabled used to do; the "snapshot" row is FeatureFlagManager.is_enabled
+after start(), which reads the last loaded values and only touches Redis when
+an invalidation message or the refresh interval says so.
+
+Run from the backend directory:
+    python -m tests.bench_feature_flags
+"""
+
+import asyncio
+import time
+
+from flags import flags
+
+CHECKS = 20_000
+REDIS_ROUND_TRIP = 0.0005
+FLAGS = {f"flag_{i}": i % 2 == 0 for i in range(20)}
+
+
+class _Pipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.fields = []
+
+    def hget(self, key, field):
+        self.fields.append((key, field))
+
+    async def execute(self):
+        await asyncio.sleep(REDIS_ROUND_TRIP)
+        return [self.redis.hashes.get(key, {}).get(field) for key, field in self.fields]
+
+
+class _PubSub:
+    async def subscribe(self, channel):
+        pass
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=0.0):
+        await asyncio.sleep(timeout)
+
+    async def close(self):
+        pass
+
+
+class _Redis:
+    def __init__(self):
+        self.hashes = {f"feature_flag:{key}": {'enabled': str(value).lower()} for key, value in FLAGS.items()}
+
+    async def hget(self, key, field):
+        await asyncio.sleep(REDIS_ROUND_TRIP)
+        return self.hashes.get(key, {}).get(field)
+
+    async def smembers(self, key):
+        await asyncio.sleep(REDIS_ROUND_TRIP)
+        return set(FLAGS)
+
+    def pipeline(self, transaction=False):
+        return _Pipeline(self)
+
+
+async def _hget_per_check(redis_client, key: str) -> bool:
+    enabled = await redis_client.hget(f"feature_flag:{key}", 'enabled')
+    return enabled == 'true' if enabled else False
+
+
+async def _measure(check, checks: int) -> float:
+    keys = list(FLAGS)
+    start = time.perf_counter()
+    for i in range(checks):
+        assert await check(keys[i % len(keys)]) == FLAGS[keys[i % len(keys)]]
+    return checks / (time.perf_counter() - start)
+
+
+async def main() -> None:
+    fake = _Redis()
+
+    async def get_client():
+        return fake
+
+    async def create_pubsub():
+        return _PubSub()
+
+    flags.redis.get_client = get_client
+    flags.redis.create_pubsub = create_pubsub
+
+    manager = flags.FeatureFlagManager()
+    await manager.start()
+
+    # The per-check path is bounded by the round trip, so fewer checks suffice
+    hget_checks = min(CHECKS, 2_000) if REDIS_ROUND_TRIP else CHECKS
+    rows = [
+        ("hget per check", await _measure(lambda key: _hget_per_check(fake, key), hget_checks)),
+        ("snapshot", await _measure(manager.is_enabled, CHECKS)),
+    ]
+    await manager.stop()
+
+    print(f"{len(FLAGS)} flags, redis round trip {REDIS_ROUND_TRIP * 1000:.1f} ms")
+    for label, rate in rows:
+        print(f"{label:>15} | {rate:>12,.0f} checks/s | {1e6 / rate:8.2f} us/check")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
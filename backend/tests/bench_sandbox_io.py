@@ -0,0 +1,95 @@
+"""
+Benchmark parallel sandbox tool calls with and without thread-pool offloading.
+
+Runs N str_replace calls through SandboxFilesTool at once, the way
+_execute_tools_in_parallel does, against a fake sandbox whose SDK methods block
+for SDK_LATENCY seconds each (str_replace makes three of them). With the SDK
+called inline the calls run one after another and the event loop is frozen for
+the whole batch; with run_sandbox_io they overlap up to the per-sandbox limit
+and the loop keeps ticking. The "loop stall" column is the longest gap seen by
+a 10 ms ticker task running alongside.
+
+Run from the backend directory:
+    python -m tests.bench_sandbox_io
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import sandbox.tool_base as tool_base
+from agent.tools.sb_files_tool import SandboxFilesTool
+from sandbox.sandbox_io import SANDBOX_IO_PER_SANDBOX, run_sandbox_io
+
+PARALLEL_CALLS = [1, 4, 8]
+SDK_LATENCY = 0.1
+
+
+class _FakeFs:
+    def __init__(self):
+        self.files = {}
+
+    def get_file_info(self, path):
+        time.sleep(SDK_LATENCY)
+        return SimpleNamespace(is_dir=False, size=len(self.files[path]))
+
+    def download_file(self, path):
+        time.sleep(SDK_LATENCY)
+        return self.files[path]
+
+    def upload_file(self, content, path):
+        time.sleep(SDK_LATENCY)
+        self.files[path] = content
+
+
+async def _inline(sandbox_id, func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+async def _ticker(stop: asyncio.Event) -> float:
+    max_gap = 0.0
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        max_gap = max(max_gap, now - last - 0.01)
+        last = now
+    return max_gap
+
+
+async def _run(parallel: int) -> tuple:
+    fs = _FakeFs()
+    tool = SandboxFilesTool(project_id="bench", thread_manager=None)
+    tool._sandbox = SimpleNamespace(fs=fs)
+    tool._sandbox_id = "bench-sandbox"
+    for i in range(parallel):
+        fs.files[f"/workspace/f{i}.txt"] = b"hello world"
+
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(stop))
+    await asyncio.sleep(0.02)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[tool.str_replace(f"f{i}.txt", "world", "there") for i in range(parallel)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    stall = await ticker
+
+    assert all(result.success for result in results), results
+    return elapsed, stall
+
+
+async def main() -> None:
+    print(f"SDK latency {SDK_LATENCY * 1000:.0f} ms per call, 3 calls per str_replace, per-sandbox limit {SANDBOX_IO_PER_SANDBOX}")
+    for parallel in PARALLEL_CALLS:
+        tool_base.run_sandbox_io = _inline
+        inline_time, inline_stall = await _run(parallel)
+        tool_base.run_sandbox_io = run_sandbox_io
+        offload_time, offload_stall = await _run(parallel)
+        print(
+            f"{parallel:>2} parallel calls | inline {inline_time * 1000:7.1f} ms (loop stall {inline_stall * 1000:6.1f} ms)"
+            f" | offloaded {offload_time * 1000:7.1f} ms (loop stall {offload_stall * 1000:5.1f} ms)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+Load benchmark for the agent run response transports.
+
+Publishes a run of CHUNKS responses while N viewers follow it, once with the
+list transport (RPUSH + PUBLISH "new", one LRANGE per viewer per ping, two
+pubsub connections per viewer) and once with the stream transport (XADD,
+blocking XREAD per viewer, one control pubsub connection per viewer). Redis
+operations are counted server-side from INFO commandstats, so this needs a
+real Redis at REDIS_HOST/REDIS_PORT. Each transport is measured once with a
+write per chunk and once through ResponsePublisher, which batches chunks into
+pipelined writes.
+
+Run from the backend directory:
+    python -m tests.bench_stream_transport
+"""
+
+import asyncio
+import json
+import time
+import uuid
+
+from services import redis
+from services import run_responses
+
+VIEWER_COUNTS = [1, 10, 50]
+CHUNKS = 500
+CHUNK = {"type": "assistant", "content": json.dumps({"role": "assistant", "content": "token "}), "metadata": "{}"}
+DONE = {"type": "status", "status": "completed"}
+
+
+async def _command_counts() -> dict:
+    client = await redis.get_client()
+    stats = await client.info("commandstats")
+    return {name.replace("cmdstat_", ""): value["calls"] for name, value in stats.items()}
+
+
+async def _list_viewer(agent_run_id: str, ready: asyncio.Event) -> int:
+    pubsub_response = await redis.create_pubsub()
+    pubsub_control = await redis.create_pubsub()
+    await pubsub_response.subscribe(run_responses.response_channel(agent_run_id))
+    await pubsub_control.subscribe(f"agent_run:{agent_run_id}:control")
+    ready.set()
+    received = 0
+    try:
+        while True:
+            message = await pubsub_response.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if not message:
+                continue
+            new = await redis.lrange(run_responses.response_list_key(agent_run_id), received, -1)
+            received += len(new)
+            if new and json.loads(new[-1]).get("type") == "status":
+                return received
+    finally:
+        await pubsub_response.aclose()
+        await pubsub_control.aclose()
+
+
+async def _stream_viewer(agent_run_id: str, ready: asyncio.Event) -> int:
+    pubsub_control = await redis.create_pubsub()
+    await pubsub_control.subscribe(f"agent_run:{agent_run_id}:control")
+    ready.set()
+    received = 0
+    last_id = "0"
+    try:
+        while True:
+            entries = await run_responses.read_stream_entries(agent_run_id, last_id, block=1000)
+            await pubsub_control.get_message(ignore_subscribe_messages=True, timeout=0)
+            for entry_id, response in entries:
+                received += 1
+                last_id = entry_id
+                if response.get("type") == "status":
+                    return received
+    finally:
+        await pubsub_control.aclose()
+
+
+async def _bench(transport: str, viewers: int, batched: bool) -> None:
+    agent_run_id = f"bench-{uuid.uuid4()}"
+    viewer = _stream_viewer if transport == run_responses.TRANSPORT_STREAM else _list_viewer
+    ready = [asyncio.Event() for _ in range(viewers)]
+    tasks = [asyncio.create_task(viewer(agent_run_id, event)) for event in ready]
+    await asyncio.gather(*(event.wait() for event in ready))
+
+    before = await _command_counts()
+    start = time.perf_counter()
+    if batched:
+        publisher = run_responses.ResponsePublisher(agent_run_id, transport)
+        for _ in range(CHUNKS):
+            await publisher.publish({**CHUNK, "message_id": None})
+            await asyncio.sleep(0.001)
+        await publisher.publish(DONE)
+        await publisher.close()
+    else:
+        for _ in range(CHUNKS):
+            await run_responses.append_response(agent_run_id, json.dumps(CHUNK), transport)
+            await asyncio.sleep(0.001)
+        await run_responses.append_response(agent_run_id, json.dumps(DONE), transport)
+    received = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    after = await _command_counts()
+
+    ops = {name: after.get(name, 0) - before.get(name, 0) for name in after}
+    ops = {name: count for name, count in ops.items() if count and name not in ("info", "ping")}
+    total = sum(ops.values())
+    breakdown = ", ".join(f"{name} {count / (CHUNKS + 1):.2f}" for name, count in sorted(ops.items()))
+    print(
+        f"{transport:>6}{' batched' if batched else '        '} | {viewers:>3} viewers | {total / (CHUNKS + 1):7.2f} ops/chunk ({breakdown})"
+        f" | {elapsed * 1000:7.1f} ms | all delivered: {all(r == CHUNKS + 1 for r in received)}"
+    )
+    await redis.delete(run_responses.response_list_key(agent_run_id))
+    await redis.delete(run_responses.response_stream_key(agent_run_id))
+
+
+async def main() -> None:
+    await redis.initialize_async()
+    for viewers in VIEWER_COUNTS:
+        for transport in (run_responses.TRANSPORT_LIST, run_responses.TRANSPORT_STREAM):
+            for batched in (False, True):
+                await _bench(transport, viewers, batched)
+    await redis.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Benchmark XML tool call detection over a streamed response.
+
+Feeds synthetic responses of 50 KB, 100 KB and 200 KB, made of prose and many
+<function_calls> blocks, in small deltas, and compares the old per-delta
+approach (`_extract_xml_chunks` over the accumulated buffer plus `str.replace`)
+with StreamingXMLScanner. The old approach grows quadratically with response
+length; the scanner should stay linear (constant time per KB).
+
+Run from the backend directory:
+    python -m tests.bench_xml_scanner
+"""
+
+import random
+import time
+
+from agentpress.response_processor import ResponseProcessor
+from agentpress.tool_registry import ToolRegistry
+from agentpress.xml_stream_scanner import StreamingXMLScanner
+
+SIZES_KB = [50, 100, 200]
+LEGACY_TAGS = [f"tool-{i}" for i in range(40)]
+
+
+def _make_response(size_kb: int) -> str:
+    rng = random.Random(size_kb)
+    parts = []
+    total = 0
+    i = 0
+    while total < size_kb * 1024:
+        prose = " ".join(f"word{rng.randint(0, 999)}" for _ in range(rng.randint(20, 120)))
+        block = (
+            f'<function_calls>\n<invoke name="create_file">\n<parameter name="file_path">f{i}.txt</parameter>\n'
+            f'<parameter name="file_contents">{prose}</parameter>\n</invoke>\n</function_calls>'
+        )
+        parts.extend([prose, block])
+        total += len(prose) + len(block)
+        i += 1
+    return "\n".join(parts)
+
+
+def _deltas(content: str):
+    rng = random.Random(0)
+    pos = 0
+    while pos < len(content):
+        size = rng.randint(2, 8)
+        yield content[pos:pos + size]
+        pos += size
+
+
+def _old(processor: ResponseProcessor, content: str) -> int:
+    current_xml_content = ""
+    found = 0
+    for delta in _deltas(content):
+        current_xml_content += delta
+        for xml_chunk in processor._extract_xml_chunks(current_xml_content):
+            current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+            found += 1
+    return found
+
+
+def _new(content: str) -> int:
+    scanner = StreamingXMLScanner(LEGACY_TAGS)
+    return sum(len(scanner.feed(delta)) for delta in _deltas(content))
+
+
+def main() -> None:
+    registry = ToolRegistry()
+    registry.xml_tools = {tag: {} for tag in LEGACY_TAGS}
+    processor = ResponseProcessor(tool_registry=registry, add_message_callback=None)
+
+    for size_kb in SIZES_KB:
+        content = _make_response(size_kb)
+
+        start = time.perf_counter()
+        old_found = _old(processor, content)
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new_found = _new(content)
+        new_time = time.perf_counter() - start
+
+        print(
+            f"{size_kb:>4} KB | {new_found:>4} blocks (old found {old_found})"
+            f" | old {old_time * 1000:8.1f} ms ({old_time * 1000 / size_kb:6.2f} ms/KB)"
+            f" | scanner {new_time * 1000:7.1f} ms ({new_time * 1000 / size_kb:5.3f} ms/KB)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+Shared in-memory fakes of the Supabase (PostgREST) client and of Redis.
+
+fake_supabase builds a client over plain lists of rows per table that
+supports the query builder calls the backend makes and records what it did;
+fake_redis replaces the services.redis helpers with an in-memory store.
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+
+from services import redis as redis_service
+
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _column(row: Dict[str, Any], column: str) -> Any:
+    # JSON paths as used in filters, e.g. sandbox->>id
+    if '->>' in column:
+        column, key = column.split('->>', 1)
+        return (row.get(column) or {}).get(key)
+    return row.get(column)
+
+
+class FakeQuery:
+    """One query builder chain against a FakeSupabase table."""
+
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.columns: Optional[List[str]] = None
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.ordering: List[tuple] = []
+        self.bounds: Optional[tuple] = None
+        self.one = False
+        self.head = False
+        self.count = None
+        self.operation = 'select'
+        self.values: Any = None
+        self.on_conflict: Optional[str] = None
+        self.ignore_duplicates = False
+
+    def select(self, *columns, count=None, head=None):
+        spec = ", ".join(columns)
+        # Embedded resources and wildcards return whole rows
+        if spec and '*' not in spec and '(' not in spec:
+            self.columns = [column.strip() for column in spec.split(',')]
+        self.count = count
+        self.head = bool(head)
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: _column(row, column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: _column(row, column) in values)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: _column(row, column) is not None and _column(row, column) >= value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: _column(row, column) is not None and _column(row, column) < value)
+        return self
+
+    def filter(self, column, operator, value):
+        assert operator == 'eq', operator
+        return self.eq(column, value)
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def maybe_single(self):
+        self.one = True
+        return self
+
+    def insert(self, values, returning=None, default_to_null=True):
+        self.operation, self.values = 'insert', values
+        return self
+
+    def upsert(self, values, on_conflict=None, ignore_duplicates=False):
+        self.operation, self.values = 'upsert', values
+        self.on_conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, values):
+        self.operation, self.values = 'update', values
+        return self
+
+    def delete(self):
+        self.operation = 'delete'
+        return self
+
+    def _matches(self, row):
+        return all(f(row) for f in self.filters)
+
+    async def execute(self):
+        client = self.client
+        if client.before_execute:
+            client.before_execute(self)
+        rows = client.tables.setdefault(self.table, [])
+
+        if self.operation == 'select':
+            matched = [row for row in rows if self._matches(row)]
+            if self.head:
+                client.counts.append(self.table)
+                return FakeResult([], count=len(matched))
+            client.queries.append(self.table)
+            client.rows_read += len(matched)
+            for column, desc in reversed(self.ordering):
+                matched.sort(key=lambda row: str(row.get(column) or ''), reverse=desc)
+            if self.bounds:
+                matched = matched[self.bounds[0]:self.bounds[1] + 1]
+            if self.columns:
+                matched = [{c: row.get(c) for c in self.columns} for row in matched]
+            else:
+                matched = [dict(row) for row in matched]
+            if self.one:
+                return FakeResult(matched[0]) if matched else None
+            return FakeResult(matched, count=len(matched) if self.count else None)
+
+        client.writes.append((self.table, self.operation, self.values))
+        if self.operation in ('insert', 'upsert'):
+            written = []
+            for values in self.values if isinstance(self.values, list) else [self.values]:
+                existing = None
+                if self.on_conflict:
+                    keys = [key.strip() for key in self.on_conflict.split(',')]
+                    existing = next((row for row in rows if all(row.get(k) == values.get(k) for k in keys)), None)
+                if existing is not None:
+                    if not self.ignore_duplicates:
+                        existing.update(values)
+                        written.append(dict(existing))
+                    continue
+                factory = client.row_factories.get(self.table)
+                row = factory(dict(values), rows) if factory else dict(values)
+                rows.append(row)
+                written.append(dict(row))
+            return FakeResult(written)
+
+        matched = [row for row in rows if self._matches(row)]
+        if self.operation == 'update':
+            for row in matched:
+                row.update(self.values)
+        else:
+            client.tables[self.table] = [row for row in rows if not self._matches(row)]
+        return FakeResult([dict(row) for row in matched])
+
+
+class FakeRpc:
+    def __init__(self, client: "FakeSupabase", name: str, params: Dict[str, Any]):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    async def execute(self):
+        self.client.rpcs.append((self.name, self.params))
+        handler = self.client.rpc_handlers.get(self.name)
+        return FakeResult(handler(self.params) if handler else None)
+
+
+class FakeSupabase:
+    """In-memory stand-in for the async Supabase client.
+
+    Attributes recording what happened: queries (table of every select),
+    counts (table of every head count), rows_read (rows matched by selects),
+    writes ((table, operation, values) of every write) and rpcs.
+    """
+
+    def __init__(
+        self,
+        tables: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+        row_factories: Optional[Dict[str, Callable[[Dict[str, Any], List[Dict[str, Any]]], Dict[str, Any]]]] = None,
+        rpc_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None,
+    ):
+        self.tables = tables if tables is not None else {}
+        # Fill in database defaults for new rows, given the row and the table's rows
+        self.row_factories = row_factories or {}
+        self.rpc_handlers = rpc_handlers or {}
+        self.before_execute: Optional[Callable[[FakeQuery], None]] = None
+        self.queries: List[str] = []
+        self.counts: List[str] = []
+        self.rows_read = 0
+        self.writes: List[tuple] = []
+        self.rpcs: List[tuple] = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def from_(self, name):
+        return FakeQuery(self, name)
+
+    def schema(self, _):
+        return self
+
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+    @property
+    def db(self):
+        """A DBConnection whose client is this fake."""
+        client = self
+
+        class _DB:
+            @property
+            async def client(self):
+                return client
+
+        return _DB()
+
+
+@pytest.fixture
+def fake_supabase():
+    """Factory for FakeSupabase clients: fake_supabase(tables, row_factories=..., rpc_handlers=...)."""
+    return FakeSupabase
+
+
+class FakePipeline:
+    """Queues any FakeRedis command and runs them in order on execute()."""
+
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands: List[tuple] = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        self.redis._check()
+        if self.redis.pipeline_failures:
+            self.redis.pipeline_failures -= 1
+            raise ConnectionError("Redis is down")
+        self.redis.round_trips += 1
+        self.redis.pipelines.append(self.commands)
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakePubSub:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.redis.subscribers.append(self.queue)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=0.0):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.redis.subscribers.remove(self.queue)
+
+
+class FakeRedis:
+    """In-memory Redis with the commands the backend uses.
+
+    round_trips counts direct commands that read state and executed pipelines;
+    pipelines keeps the commands of every executed pipeline. Set down to make
+    every call fail, or pipeline_failures to fail that many pipelines.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        self.sets: Dict[str, set] = {}
+        self.subscribers: List[asyncio.Queue] = []
+        self.pipelines: List[List[tuple]] = []
+        self.round_trips = 0
+        self.down = False
+        self.pipeline_failures = 0
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError("Redis is down")
+
+    async def get(self, key, default=None):
+        self._check()
+        return self.values.get(key, default)
+
+    async def mget(self, *keys):
+        self._check()
+        self.round_trips += 1
+        return [self.values.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, nx=False):
+        self._check()
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def incr(self, key):
+        self._check()
+        self.values[key] = str(int(self.values.get(key, 0)) + 1)
+        return int(self.values[key])
+
+    async def delete(self, *keys):
+        self._check()
+        deleted = 0
+        for key in keys:
+            for store in (self.values, self.hashes, self.sets):
+                if store.pop(key, None) is not None:
+                    deleted += 1
+        return deleted
+
+    async def expire(self, key, ttl):
+        return True
+
+    async def ttl(self, key):
+        return 1800 if key in self.values else -2
+
+    async def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(members)
+
+    async def srem(self, key, *members):
+        self.sets.get(key, set()).difference_update(members)
+
+    async def smembers(self, key):
+        self._check()
+        self.round_trips += 1
+        return set(self.sets.get(key, set()))
+
+    async def rpush(self, key, *values):
+        self.values.setdefault(key, []).extend(values)
+
+    async def xadd(self, key, fields, id="*"):
+        self.values.setdefault(key, []).append(fields)
+
+    async def publish(self, channel, message):
+        for queue in self.subscribers:
+            queue.put_nowait({'type': 'message', 'channel': channel, 'data': message})
+
+    def pipeline(self, transaction=False):
+        self._check()
+        return FakePipeline(self)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """A FakeRedis behind the services.redis helpers every module calls."""
+    fake = FakeRedis()
+
+    async def get_client():
+        fake._check()
+        return fake
+
+    async def pipeline(transaction=False):
+        return fake.pipeline(transaction)
+
+    async def create_pubsub():
+        fake._check()
+        return FakePubSub(fake)
+
+    monkeypatch.setattr(redis_service, "get_client", get_client)
+    monkeypatch.setattr(redis_service, "pipeline", pipeline)
+    monkeypatch.setattr(redis_service, "create_pubsub", create_pubsub)
+    for name in ("get", "set", "delete", "publish", "smembers", "rpush", "expire"):
+        monkeypatch.setattr(redis_service, name, getattr(fake, name))
+    return fake
@@ -0,0 +1,40 @@
+import pytest
+
+from agent import runtime_config
+
+
+def _agent(agent_id, prompt, is_default=False):
+    return {
+        'agent_id': agent_id, 'account_id': 'acc-1', 'name': agent_id, 'is_default': is_default,
+        'current_version_id': f"{agent_id}-v1",
+        'agent_versions': {'system_prompt': prompt, 'configured_mcps': [{'name': 'Exa'}], 'version_name': 'v1'},
+    }
+
+
+@pytest.mark.asyncio
+async def test_run_start_reads_the_cached_config_until_invalidated(fake_redis, fake_supabase):
+    client = fake_supabase({'agents': [_agent('researcher', 'Research things'), _agent('helper', 'Help', is_default=True)]})
+
+    config = await runtime_config.get_agent_config(client, 'acc-1', 'researcher')
+    assert config['system_prompt'] == 'Research things'
+    assert config['configured_mcps'] == [{'name': 'Exa'}]
+    assert (await runtime_config.get_agent_config(client, 'acc-1'))['agent_id'] == 'helper'
+    assert len(client.queries) == 2
+
+    # Later run starts are one Redis round trip each
+    round_trips = fake_redis.round_trips
+    assert await runtime_config.get_agent_config(client, 'acc-1', 'researcher') == config
+    assert await runtime_config.get_agent_config(client, 'acc-1') is not None
+    assert len(client.queries) == 2
+    assert fake_redis.round_trips == round_trips + 2
+
+    # An update makes every cached config of the account stale
+    client.tables['agents'][0]['agent_versions']['system_prompt'] = 'Research more things'
+    await runtime_config.invalidate_agent_configs('acc-1')
+    assert (await runtime_config.get_agent_config(client, 'acc-1', 'researcher'))['system_prompt'] == 'Research more things'
+    assert len(client.queries) == 3
+
+    # Unknown agents are not cached
+    assert await runtime_config.get_agent_config(client, 'acc-1', 'missing') is None
+    assert await runtime_config.get_agent_config(client, 'acc-1', 'missing') is None
+    assert len(client.queries) == 5
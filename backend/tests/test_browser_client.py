@@ -0,0 +1,76 @@
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from sandbox.browser_client import BrowserAPIClient, BrowserAPIError
+
+
+class _FakeSandbox:
+    def __init__(self):
+        self.commands = []
+        self.links = 0
+        self.process = SimpleNamespace(exec=self._exec)
+
+    def get_preview_link(self, port):
+        self.links += 1
+        return SimpleNamespace(url=f"https://{port}-sandbox.example/", token="secret")
+
+    def _exec(self, command, timeout=30):
+        self.commands.append(command)
+        return SimpleNamespace(exit_code=0, result=json.dumps({"success": True, "via": "exec"}))
+
+
+async def _client(handler):
+    client = BrowserAPIClient(direct=True)
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+@pytest.mark.asyncio
+async def test_direct_requests_reuse_the_preview_link():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"success": True, "via": "direct"})
+
+    client = await _client(handler)
+    sandbox = _FakeSandbox()
+    for _ in range(3):
+        result = await client.request(sandbox, "sb-1", "click_element", {"index": 2})
+        assert result["via"] == "direct"
+
+    assert sandbox.links == 1
+    assert sandbox.commands == []
+    assert str(requests[0].url) == "https://8003-sandbox.example/api/automation/click_element"
+    assert requests[0].headers["X-Daytona-Preview-Token"] == "secret"
+    assert json.loads(requests[0].content) == {"index": 2}
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_exec_only_when_the_request_never_arrived():
+    def unreachable(request):
+        raise httpx.ConnectError("connection refused")
+
+    client = await _client(unreachable)
+    sandbox = _FakeSandbox()
+    result = await client.request(sandbox, "sb-1", "input_text", {"index": 1, "text": "it's"})
+
+    assert result["via"] == "exec"
+    # JSON payloads with quotes survive the shell
+    assert """'{"index": 1, "text": "it'"'"'s"}'""" in sandbox.commands[0]
+    # Later actions go straight to exec until the retry window passes
+    await client.request(sandbox, "sb-1", "scroll_down")
+    assert len(sandbox.commands) == 2
+    assert client.stats() == {"direct": 0, "exec": 2, "fallbacks": 1}
+
+    def timed_out(request):
+        raise httpx.ReadTimeout("no response")
+
+    client = await _client(timed_out)
+    sandbox = _FakeSandbox()
+    with pytest.raises(BrowserAPIError):
+        await client.request(sandbox, "sb-1", "click_element", {"index": 2})
+    assert sandbox.commands == []
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+import pytest_asyncio
+
+pytest.importorskip("playwright")
+pytest.importorskip("pytesseract")
+from playwright.async_api import async_playwright
+
+PAGE = """
+<html><body>
+  <div id="list"><button id="first" onclick="document.getElementById('out').textContent = 'clicked'">First</button></div>
+  <input id="name" placeholder="Name">
+  <a id="link" href="#done">Link</a>
+  <span id="out"></span>
+</body></html>
+"""
+
+
+@pytest_asyncio.fixture
+async def automation(tmp_path, monkeypatch):
+    """A BrowserAutomation on a headless Chromium page, skipped where Chromium can't start."""
+    # The module creates its screenshot directories in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    from sandbox.docker import browser_api
+
+    async with async_playwright() as playwright:
+        try:
+            browser = await playwright.chromium.launch(executable_path=os.getenv("BROWSER_TEST_EXECUTABLE_PATH"))
+        except Exception as e:
+            pytest.skip(f"Chromium is not available: {e}")
+        automation = browser_api.BrowserAutomation()
+        automation.browser = browser
+        automation.browser_context = await browser.new_context(viewport={'width': 1024, 'height': 768})
+        page = await automation.browser_context.new_page()
+        automation.pages.append(page)
+        await page.set_content(PAGE)
+        try:
+            yield automation, page, browser_api
+        finally:
+            await browser.close()
+
+
+def _indices(selector_map):
+    return {node.attributes.get('id'): index for index, node in selector_map.items()}
+
+
+@pytest.mark.asyncio
+async def test_indices_survive_mutations_clicks_and_input(automation):
+    automation, page, browser_api = automation
+    before = _indices(await automation.get_selector_map())
+    assert set(before) == {'first', 'name', 'link'}
+
+    # Inserting, removing and hiding other elements leaves existing indices alone
+    await page.evaluate("""() => {
+        const added = document.createElement('button');
+        added.id = 'added';
+        added.textContent = 'Added';
+        document.getElementById('list').prepend(added);
+        document.getElementById('link').style.display = 'none';
+    }""")
+    after = _indices(await automation.get_selector_map())
+    assert after['first'] == before['first'] and after['name'] == before['name']
+    assert 'link' not in after
+    assert after['added'] == max(before.values()) + 1
+
+    # A hidden element comes back under its old index
+    await page.evaluate("() => { document.getElementById('link').style.display = ''; }")
+    assert _indices(await automation.get_selector_map())['link'] == before['link']
+
+    result = await automation.click_element(browser_api.ClickElementAction(index=before['first']))
+    assert result.success, result.error
+    assert await page.text_content('#out') == 'clicked'
+
+    result = await automation.input_text(browser_api.InputTextAction(index=before['name'], text='Ada'))
+    assert result.success, result.error
+    assert await page.input_value('#name') == 'Ada'
+    elements = {element['index']: element for element in result.interactive_elements}
+    assert elements[before['name']]['text'] == 'Ada'
+    assert elements[before['first']]['id'] == 'first'
+
+    # Stale indices are reported instead of acting on whatever now has that index
+    await page.evaluate("() => document.getElementById('added').remove()")
+    result = await automation.click_element(browser_api.ClickElementAction(index=after['added']))
+    assert not result.success
+
+
+@pytest.mark.asyncio
+async def test_settle_waits_for_dom_changes_to_stop(automation):
+    automation, page, browser_api = automation
+    # Keep changing the DOM for a while after the action
+    await page.evaluate("""() => {
+        let left = 5;
+        const tick = () => {
+            document.getElementById('out').textContent = `tick ${left}`;
+            if (--left > 0) setTimeout(tick, 100);
+        };
+        tick();
+    }""")
+    await automation.wait_for_settle(page)
+    assert await page.text_content('#out') == 'tick 1'
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+
+os.environ.setdefault("MCP_CREDENTIAL_ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+from mcp_local import credential_manager as credential_module
+from mcp_local.credential_manager import CredentialManager
+
+
+@pytest.fixture
+def fake_db(monkeypatch, fake_supabase, fake_redis):
+    client = fake_supabase(row_factories={
+        'user_mcp_credentials': lambda row, rows: {
+            'credential_id': f"cred-{row['mcp_qualified_name']}", 'created_at': None, **row
+        },
+    })
+    client.invalidated = []
+
+    async def invalidate_agent_configs(account_id):
+        client.invalidated.append(account_id)
+
+    monkeypatch.setattr(credential_module, "db", client.db)
+    monkeypatch.setattr(credential_module, "invalidate_agent_configs", invalidate_agent_configs)
+    monkeypatch.setattr(credential_module, "LAST_USED_FLUSH_INTERVAL", 3600)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_credentials_are_fetched_in_one_query_and_cached(fake_db):
+    manager = CredentialManager()
+    for name in ("exa", "github", "slack"):
+        await manager.store_credential("acc-1", name, name.title(), {"apiKey": f"{name}-key"})
+    fake_db.writes.clear()
+
+    credentials = await manager.get_credentials("acc-1", ["exa", "github", "slack", "missing"])
+    assert {name: cred.config["apiKey"] for name, cred in credentials.items()} == {
+        "exa": "exa-key", "github": "github-key", "slack": "slack-key"
+    }
+    assert len(fake_db.queries) == 1
+
+    # Served from memory, and callers get their own copy of the config
+    credentials["exa"].config["apiKey"] = "changed"
+    assert (await manager.get_credential("acc-1", "exa")).config["apiKey"] == "exa-key"
+    assert len(fake_db.queries) == 1
+
+    # Storing a credential invalidates the cached one
+    await manager.store_credential("acc-1", "exa", "Exa", {"apiKey": "rotated"})
+    assert (await manager.get_credential("acc-1", "exa")).config["apiKey"] == "rotated"
+    assert len(fake_db.queries) == 2
+    assert fake_db.invalidated[-1] == "acc-1"
+
+    # Every use is recorded with a single last_used_at update
+    assert not [write for write in fake_db.writes if 'last_used_at' in write[2]]
+    await manager.flush_last_used()
+    last_used = [write for write in fake_db.writes if 'last_used_at' in write[2]]
+    assert len(last_used) == 1
+    assert all(row.get('last_used_at') for row in fake_db.tables['user_mcp_credentials'])
+    manager._flusher.cancel()
+
+
+@pytest.mark.asyncio
+async def test_changes_invalidate_the_cache_of_other_processes(fake_db):
+    api, worker = CredentialManager(), CredentialManager()
+    await api.store_credential("acc-1", "exa", "Exa", {"apiKey": "old"})
+    assert (await worker.get_credential("acc-1", "exa")).config["apiKey"] == "old"
+    assert (await worker.get_credential("acc-1", "exa")).config["apiKey"] == "old"
+    selects = len(fake_db.queries)
+
+    await api.store_credential("acc-1", "exa", "Exa", {"apiKey": "rotated"})
+    assert (await worker.get_credential("acc-1", "exa")).config["apiKey"] == "rotated"
+    assert len(fake_db.queries) == selects + 1
+
+    await api.delete_credential("acc-1", "exa")
+    assert await worker.get_credential("acc-1", "exa") is None
+    worker._flusher.cancel()
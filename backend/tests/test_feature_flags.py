@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from flags import flags
+
+
+@pytest.mark.asyncio
+async def test_checks_use_the_snapshot_and_follow_invalidations(fake_redis):
+    writer, reader = flags.FeatureFlagManager(), flags.FeatureFlagManager()
+    await writer.set_flag("knowledge_base", True)
+    await reader.start()
+    try:
+        loaded = fake_redis.round_trips
+        for _ in range(100):
+            assert await reader.is_enabled("knowledge_base")
+        assert not await reader.is_enabled("unknown")
+        assert fake_redis.round_trips == loaded
+
+        # Another process flips the flag; the reader reloads on the invalidation message
+        await writer.set_flag("knowledge_base", False)
+        for _ in range(50):
+            if not await reader.is_enabled("knowledge_base"):
+                break
+            await asyncio.sleep(0.01)
+        assert not await reader.is_enabled("knowledge_base")
+        assert (await reader.get_flag("knowledge_base"))['updated_at'].endswith("+00:00")
+    finally:
+        await reader.stop()
+
+
+@pytest.mark.asyncio
+async def test_last_known_values_survive_a_redis_outage(fake_redis):
+    await flags.FeatureFlagManager().set_flag("custom_agents", True)
+    manager = flags.FeatureFlagManager()
+    await manager.start()
+    try:
+        fake_redis.down = True
+        assert await manager.is_enabled("custom_agents")
+        assert await manager.list_flags() == {"custom_agents": True}
+    finally:
+        await manager.stop()
+
+    # Nothing known yet: disabled, as before
+    manager = flags.FeatureFlagManager()
+    assert not await manager.is_enabled("custom_agents")
+    await manager.stop()
@@ -0,0 +1,158 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import anyio
+import pytest
+
+from mcp_local import session_pool
+from mcp_local.session_pool import MCPSessionPool, TRANSPORT_HTTP
+
+
+class _FakeServer:
+    def __init__(self):
+        self.connects = 0
+        self.calls = 0
+        self.fail_next_call = None
+        self.fail_ping = False
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+class _FakeSession:
+    def __init__(self, server):
+        self.server = server
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def initialize(self):
+        self.server.connects += 1
+
+    async def send_ping(self):
+        if self.server.fail_ping:
+            raise ConnectionError("ping failed")
+
+    async def call_tool(self, name, arguments):
+        self.server.calls += 1
+        if self.server.fail_next_call:
+            error, self.server.fail_next_call = self.server.fail_next_call, None
+            raise error
+        self.server.in_flight += 1
+        self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        await asyncio.sleep(0.01)
+        self.server.in_flight -= 1
+        return {"tool": name, "arguments": arguments}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = _FakeServer()
+
+    @asynccontextmanager
+    async def open_transport(transport, url, headers):
+        yield (None, None, None)
+
+    monkeypatch.setattr(session_pool, "_open_transport", open_transport)
+    monkeypatch.setattr(session_pool, "ClientSession", lambda read, write: _FakeSession(server))
+    return server
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_reused_per_url_and_credentials(server):
+    pool = MCPSessionPool()
+    try:
+        for _ in range(3):
+            await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a?api_key=1", "search", {"q": "x"})
+        await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a?api_key=2", "search", {"q": "x"})
+
+        assert server.connects == 2
+        stats = pool.stats()
+        assert stats["cold_calls"]["count"] == 2
+        assert stats["warm_calls"]["count"] == 2
+        assert "api_key" not in str(stats)
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_only_calls_that_were_never_sent_are_retried(server):
+    pool = MCPSessionPool()
+    try:
+        await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {})
+
+        # The transport was closed before the request went out
+        server.fail_next_call = anyio.ClosedResourceError()
+        assert await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {}) == {"tool": "search", "arguments": {}}
+        assert server.connects == 2
+        assert pool.stats()["reconnects"] == 1
+
+        # The connection dropped after sending: the tool may have run, so it isn't run again
+        server.fail_next_call = ConnectionError("connection reset")
+        calls = server.calls
+        with pytest.raises(ConnectionError):
+            await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "send_email", {})
+        assert server.calls == calls + 1
+        assert pool.stats()["reconnects"] == 1
+        # The dead session is dropped, so the next call connects again
+        await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {})
+        assert server.connects == 3
+
+        # Errors from the server itself are not retried
+        server.fail_next_call = ValueError("bad arguments")
+        with pytest.raises(ValueError):
+            await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {})
+        assert server.connects == 3
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_health_check_and_idle_eviction(server):
+    pool = MCPSessionPool(health_check_after=0, idle_ttl=60)
+    try:
+        await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {})
+        server.fail_ping = True
+        await pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {})
+        assert server.connects == 2
+        assert pool.stats()["health_check_failures"] == 1
+
+        pool.idle_ttl = 0
+        await pool._reap_idle()
+        assert pool.stats()["open_sessions"] == 0
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_session_within_the_limit(server):
+    pool = MCPSessionPool(max_concurrent_calls=2)
+    try:
+        await asyncio.gather(*[
+            pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {"i": i}, scope="run-1")
+            for i in range(6)
+        ])
+        assert server.connects == 1
+        assert server.max_in_flight == 2
+
+        await pool.close_scope("run-1")
+        assert pool.stats()["open_sessions"] == 0
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_is_per_server_across_runs(server):
+    pool = MCPSessionPool(max_concurrent_calls=2)
+    try:
+        await asyncio.gather(*[
+            pool.call_tool(TRANSPORT_HTTP, "https://mcp.example/a", "search", {"i": i}, scope=f"run-{i % 3}")
+            for i in range(6)
+        ])
+        assert server.connects == 3
+        assert server.max_in_flight == 2
+        assert pool._limits == {}
+    finally:
+        await pool.close()
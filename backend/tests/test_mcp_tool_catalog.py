@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from mcp_local.tool_catalog import CatalogTool, ToolCatalogCache, catalog_key, connect_concurrently
+
+
+@pytest.mark.asyncio
+async def test_catalog_is_discovered_once_and_shared_through_redis(fake_redis):
+    discoveries = 0
+
+    async def discover():
+        nonlocal discoveries
+        discoveries += 1
+        await asyncio.sleep(0.01)
+        return [{"name": "search", "description": "Search the web", "input_schema": {"type": "object"}}]
+
+    key = catalog_key("smithery", "exa", {"exaApiKey": "secret"})
+    assert "secret" not in key and key != catalog_key("smithery", "exa", {"exaApiKey": "other"})
+
+    worker = ToolCatalogCache()
+    results = await asyncio.gather(*(worker.get_or_discover(key, discover) for _ in range(5)))
+    assert discoveries == 1
+    assert all(tools == [CatalogTool("search", "Search the web", {"type": "object"})] for tools in results)
+
+    # Another worker registers the tools from the shared copy without connecting
+    other = ToolCatalogCache()
+    assert await other.get_or_discover(key, discover) == results[0]
+    assert discoveries == 1
+    assert other.stats()["redis_hits"] == 1
+
+    await other.invalidate(key)
+    await other.get_or_discover(key, discover)
+    assert discoveries == 2
+
+
+@pytest.mark.asyncio
+async def test_servers_come_up_concurrently_with_partial_success():
+    connected = []
+
+    async def connect(config):
+        await asyncio.sleep(config["delay"])
+        if config.get("error"):
+            raise ConnectionError(config["error"])
+        connected.append(config["name"])
+
+    configs = [
+        {"name": "a", "delay": 0.05},
+        {"name": "b", "delay": 0.05},
+        {"name": "broken", "delay": 0.0, "error": "refused"},
+        {"name": "hung", "delay": 10},
+    ]
+    start = asyncio.get_running_loop().time()
+    failures = await connect_concurrently(configs, connect, lambda config: config["name"], timeout=0.2)
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert sorted(connected) == ["a", "b"]
+    assert set(failures) == {"broken", "hung"}
+    assert isinstance(failures["hung"], TimeoutError)
+    assert elapsed < 0.5
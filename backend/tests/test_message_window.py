@@ -0,0 +1,131 @@
+import pytest
+
+from agentpress.thread_manager import ThreadManager
+
+
+def _with_defaults(row, rows):
+    # message_id and timestamps as the database would assign them
+    stamp = f"2025-01-01T00:{len(rows):02d}:00+00:00"
+    return {**row, 'message_id': f"msg-{len(rows)}", 'created_at': stamp, 'updated_at': stamp}
+
+
+def _row(i, thread_id="t1", is_llm_message=True):
+    return {
+        'message_id': f"msg-{i}",
+        'thread_id': thread_id,
+        'is_llm_message': is_llm_message,
+        'content': {'role': 'user', 'content': f"message {i}"},
+        'created_at': f"2025-01-01T00:{i:02d}:00+00:00",
+        'updated_at': f"2025-01-01T00:{i:02d}:00+00:00",
+    }
+
+
+@pytest.fixture
+def thread_manager(fake_supabase):
+    tm = ThreadManager(write_behind=False)
+    client = fake_supabase({'messages': [_row(i) for i in range(5)]}, row_factories={'messages': _with_defaults})
+    tm.db = client.db
+    return tm, client
+
+
+@pytest.mark.asyncio
+async def test_second_load_only_reads_new_rows(thread_manager):
+    tm, client = thread_manager
+
+    messages = await tm.get_llm_messages("t1")
+    assert [m['message_id'] for m in messages] == [f"msg-{i}" for i in range(5)]
+
+    client.tables['messages'].append(_row(5))
+    client.rows_read = 0
+    messages = await tm.get_llm_messages("t1")
+
+    assert [m['message_id'] for m in messages] == [f"msg-{i}" for i in range(6)]
+    # Only the rows within the overlap of the last one read and the new row are read again
+    assert client.rows_read == 2
+    assert len(client.counts) == 1
+
+
+@pytest.mark.asyncio
+async def test_added_llm_messages_go_straight_into_window(thread_manager):
+    tm, client = thread_manager
+    await tm.get_llm_messages("t1")
+
+    await tm.add_message("t1", "assistant", {'role': 'assistant', 'content': "hi"}, is_llm_message=True)
+    await tm.add_message("t1", "status", {'status_type': 'finish'}, is_llm_message=False)
+
+    window = tm.message_windows["t1"]
+    assert window.messages[-1] == {'role': 'assistant', 'content': "hi", 'message_id': "msg-5"}
+    assert len(window.messages) == 6
+
+    messages = await tm.get_llm_messages("t1")
+    assert len(messages) == 6
+    assert len(client.queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_updated_and_deleted_rows_reload_the_window(thread_manager):
+    tm, client = thread_manager
+    await tm.get_llm_messages("t1")
+
+    client.tables['messages'][4]['content'] = {'role': 'user', 'content': "edited"}
+    client.tables['messages'][4]['updated_at'] = "2025-01-01T00:10:00+00:00"
+    messages = await tm.get_llm_messages("t1")
+    assert messages[4]['content'] == "edited"
+
+    del client.tables['messages'][1]
+    messages = await tm.get_llm_messages("t1")
+    assert [m['message_id'] for m in messages] == ["msg-0", "msg-2", "msg-3", "msg-4"]
+    assert len(client.queries) == 5  # Full load, delta + reload, delta + reload
+
+
+@pytest.mark.asyncio
+async def test_rows_committed_late_or_by_other_writers_are_not_skipped(thread_manager):
+    tm, client = thread_manager
+    await tm.get_llm_messages("t1")
+
+    # Committed after later rows were read, far outside the overlap
+    late = _row(9)
+    late['message_id'] = "msg-late"
+    late['created_at'] = late['updated_at'] = "2025-01-01T00:00:30+00:00"
+    client.tables['messages'].append(late)
+    messages = await tm.get_llm_messages("t1")
+    assert [m['message_id'] for m in messages][:2] == ["msg-0", "msg-late"]
+    assert len(messages) == 6
+
+    # Within the overlap but sorting before the window's last message
+    other = _row(9)
+    other['message_id'] = "msg-other"
+    other['created_at'] = other['updated_at'] = "2025-01-01T00:03:55+00:00"
+    client.tables['messages'].append(other)
+    messages = await tm.get_llm_messages("t1")
+    assert [m['message_id'] for m in messages][-2:] == ["msg-other", "msg-4"]
+
+
+@pytest.mark.asyncio
+async def test_run_state_is_loaded_once_and_kept_current_in_process(fake_supabase):
+    tm = ThreadManager(write_behind=True)
+    run_state = {
+        'latest_message_type': 'user',
+        'latest_user_message': '{"role": "user", "content": "hello"}',
+        'browser_state': {'url': 'https://example.com'},
+        'image_contexts': [{'message_id': 'img-1', 'content': {'base64': 'abc', 'mime_type': 'image/png'}}],
+    }
+    client = fake_supabase(
+        {'messages': [{'message_id': 'img-1', 'thread_id': 't1'}]},
+        rpc_handlers={'get_thread_run_state': lambda params: run_state},
+    )
+    tm.db = client.db
+    tm.message_writer.enqueue = lambda row: {**row, 'message_id': 'msg-new', 'created_at': None}
+
+    state = await tm.load_run_state("t1")
+    assert state.latest_user_message == {'role': 'user', 'content': 'hello'}
+    assert state.take_image_contexts() == [{'base64': 'abc', 'mime_type': 'image/png'}]
+    assert state.take_image_contexts() == []
+    assert client.tables['messages'] == []
+
+    await tm.add_message("t1", "assistant", {'role': 'assistant', 'content': "hi"}, is_llm_message=True)
+    await tm.add_message("t1", "status", {'status_type': 'finish'})
+
+    assert tm.get_run_state("t1") is state
+    assert state.latest_message_type == 'assistant'
+    assert len(client.rpcs) == 1
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from agentpress.message_writer import MessageWriteBehind
+
+
+class _FakeInsert:
+    def __init__(self, db, rows):
+        self.db = db
+        self.rows = rows
+
+    async def execute(self):
+        if self.db.failures:
+            self.db.failures -= 1
+            raise RuntimeError("database unavailable")
+        self.db.batches.append(self.rows)
+
+
+class _FakeTable:
+    def __init__(self, db):
+        self.db = db
+
+    def insert(self, rows, returning=None, default_to_null=True):
+        assert returning == 'minimal'
+        return _FakeInsert(self.db, rows)
+
+
+class _FakeClient:
+    def __init__(self, db):
+        self.db = db
+
+    def table(self, name):
+        assert name == 'messages'
+        return _FakeTable(self.db)
+
+
+class _FakeDB:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+
+    @property
+    async def client(self):
+        return _FakeClient(self)
+
+
+def _status(i):
+    return {'thread_id': 't1', 'type': 'status', 'content': {'i': i}, 'is_llm_message': False, 'metadata': {}}
+
+
+@pytest.mark.asyncio
+async def test_rows_are_returned_immediately_and_flushed_in_one_batch():
+    db = _FakeDB()
+    writer = MessageWriteBehind(db, flush_interval=10)
+
+    rows = [writer.enqueue(_status(i)) for i in range(5)]
+    assert all(row['message_id'] for row in rows)
+    assert db.batches == []
+
+    await writer.close()
+
+    assert len(db.batches) == 1
+    assert [r['content']['i'] for r in db.batches[0]] == [0, 1, 2, 3, 4]
+    created = [r['created_at'] for r in db.batches[0]]
+    assert created == sorted(created) and len(set(created)) == 5
+
+
+@pytest.mark.asyncio
+async def test_timer_flushes_without_explicit_call():
+    db = _FakeDB()
+    writer = MessageWriteBehind(db, flush_interval=0.01)
+    writer.enqueue(_status(0))
+    await asyncio.sleep(0.05)
+    assert len(db.batches) == 1 and writer.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_keeps_order_and_is_written_on_close():
+    db = _FakeDB(failures=1)
+    writer = MessageWriteBehind(db, flush_interval=10)
+    writer.enqueue(_status(0))
+    await writer.flush()
+    assert writer.pending == 1
+
+    writer.enqueue(_status(1))
+    await writer.close()
+
+    assert [r['content']['i'] for batch in db.batches for r in batch] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_full_batch_flush_is_tracked_until_it_finishes():
+    db = _FakeDB()
+    writer = MessageWriteBehind(db, flush_interval=10, max_batch_size=3)
+    for i in range(3):
+        writer.enqueue(_status(i))
+    assert len(writer._flush_tasks) == 1
+
+    await writer.close()
+    assert writer._flush_tasks == set()
+    assert [r['content']['i'] for batch in db.batches for r in batch] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_usage_is_recorded_once_the_response_end_row_is_persisted(monkeypatch):
+    from agentpress import thread_manager as thread_manager_module
+    from agentpress.thread_manager import ThreadManager
+
+    recorded = []
+
+    async def record_usage(client, thread_id, content):
+        recorded.append((thread_id, content['usage']['prompt_tokens']))
+
+    monkeypatch.setattr(thread_manager_module, "record_usage", record_usage)
+    tm = ThreadManager(write_behind=True)
+    tm.db = tm.message_writer.db = _FakeDB()
+    tm.message_writer.flush_interval = 10
+
+    await tm.add_message("t1", "assistant_response_end", {'usage': {'prompt_tokens': 10}})
+    await tm.add_message("t1", "status", {'status_type': 'finish'})
+    assert recorded == []
+
+    await tm.flush_messages()
+    assert recorded == [("t1", 10)]
+
+    # A row that never makes it to the database is never billed
+    from agentpress import message_writer as message_writer_module
+    monkeypatch.setattr(message_writer_module.logger, "error", lambda *args, **kwargs: None)
+    tm.db.failures = 10
+    await tm.add_message("t1", "assistant_response_end", {'usage': {'prompt_tokens': 20}})
+    await tm.flush_messages()
+    assert recorded == [("t1", 10)]
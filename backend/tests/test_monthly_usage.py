@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services import billing
+
+
+def _rollup_row(row, rows):
+    return {'total_cost': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'response_count': 0,
+            'reconciled_at': None, **row}
+
+
+@pytest.fixture
+def client_for(fake_supabase):
+    def _client(tables):
+        client = fake_supabase(tables, row_factories={'account_monthly_usage': _rollup_row})
+
+        def apply_reconcile(params):
+            row = next(row for row in client.tables['account_monthly_usage']
+                       if row['account_id'] == params['p_account_id'] and row['month'] == params['p_month'])
+            if row['reconciled_at'] != params['p_expected_reconciled_at']:
+                return None
+            row['total_cost'] += params['p_cost']
+            row['reconciled_at'] = params['p_reconciled_at']
+            return row['total_cost']
+
+        client.rpc_handlers['apply_account_monthly_usage_reconcile'] = apply_reconcile
+        return client
+    return _client
+
+
+@pytest.fixture(autouse=True)
+def thread_usage_info():
+    billing._thread_usage_info.clear()
+
+
+def _content(prompt, completion):
+    return {'model': 'anthropic/claude-sonnet-4', 'usage': {'prompt_tokens': prompt, 'completion_tokens': completion}}
+
+
+@pytest.mark.asyncio
+async def test_record_usage_increments_rollup_and_invalidates_cache(fake_redis, client_for):
+    created_at = datetime.now(timezone.utc).isoformat()
+    client = client_for({'threads': [{'thread_id': 't1', 'account_id': 'acc-1', 'created_at': created_at}]})
+
+    for content in (_content(1_000_000, 0), _content(0, 1_000_000)):
+        fake_redis.values['billing_status:acc-1'] = 'cached'
+        await billing.record_usage(client, 't1', content)
+        assert 'billing_status:acc-1' not in fake_redis.values
+
+    assert [name for name, _ in client.rpcs] == ['increment_account_monthly_usage'] * 2
+    assert client.rpcs[0][1]['p_cost'] == pytest.approx(3.0 * billing.TOKEN_PRICE_MULTIPLIER)
+    assert client.rpcs[1][1]['p_cost'] == pytest.approx(15.0 * billing.TOKEN_PRICE_MULTIPLIER)
+    assert client.rpcs[0][1]['p_month'] == billing._usage_month()
+    # The thread is looked up once
+    assert client.queries == ['threads']
+
+
+@pytest.mark.asyncio
+async def test_record_usage_ignores_threads_from_previous_months(fake_redis, client_for):
+    created_at = (billing._usage_period_start() - timedelta(days=1)).isoformat()
+    client = client_for({'threads': [{'thread_id': 't-old', 'account_id': 'acc-1', 'created_at': created_at}]})
+
+    await billing.record_usage(client, 't-old', _content(1000, 1000))
+
+    assert client.rpcs == []
+
+
+@pytest.mark.asyncio
+async def test_monthly_usage_reads_the_rollup(client_for):
+    client = client_for({'account_monthly_usage': [{
+        'account_id': 'acc-1', 'month': billing._usage_month(),
+        'total_cost': '12.5', 'reconciled_at': '2025-07-01T00:00:00+00:00',
+    }]})
+
+    assert await billing.calculate_monthly_usage(client, 'acc-1') == 12.5
+    assert client.queries == ['account_monthly_usage']
+
+
+@pytest.mark.asyncio
+async def test_reconcile_keeps_increments_made_during_the_scan(client_for):
+    created_at = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+    message = {'thread_id': 't1', 'type': 'assistant_response_end', 'created_at': created_at,
+               'content': _content(1_000_000, 0)}
+    client = client_for({
+        'account_monthly_usage': [],
+        'threads': [{'thread_id': 't1', 'account_id': 'acc-1', 'created_at': created_at}],
+        'messages': [message, dict(message)],
+    })
+
+    def concurrent_increment(query):
+        # A response recorded while the messages are being scanned
+        if query.table == 'messages':
+            client.tables['account_monthly_usage'][0]['total_cost'] += 100
+            client.before_execute = None
+
+    client.before_execute = concurrent_increment
+    per_million = 3.0 * billing.TOKEN_PRICE_MULTIPLIER
+
+    # A month without a rollup is reconciled from the messages, not started from the first increment
+    assert await billing.calculate_monthly_usage(client, 'acc-1') == pytest.approx(2 * per_million + 100)
+    assert client.rpcs[-1][1]['p_cost'] == pytest.approx(2 * per_million)
+
@@ -0,0 +1,117 @@
+import copy
+import json
+
+from agentpress.thread_manager import ThreadManager
+from services import prompt_cache
+from services.llm import prepare_params
+from services.prompt_cache import apply_cache_breakpoints, cache_usage, history_boundary
+
+MODEL = "anthropic/claude-sonnet-4-20250514"
+
+
+class _CharTokenCache:
+    """Counts a token per 4 characters, so compression thresholds are predictable."""
+
+    def count_message(self, message, model):
+        return len(json.dumps(message.get("content"))) // 4
+
+    def count_messages(self, messages, model):
+        return sum(self.count_message(m, model) for m in messages)
+
+    def stats(self):
+        return {}
+
+
+def _thread(turns, size=200):
+    messages = [{"role": "system", "content": "You are a helpful agent."}]
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": f"turn {i} " + "x" * size, "message_id": f"msg-{i}"})
+    return messages
+
+
+def _breakpoints(messages):
+    return [
+        i for i, m in enumerate(messages)
+        if isinstance(m["content"], list) and any("cache_control" in b for b in m["content"])
+    ]
+
+
+def test_breakpoints_follow_system_tools_and_stable_history():
+    messages = _thread(20)
+    tools = [{"type": "function", "function": {"name": name}} for name in ("a", "b")]
+    original_messages, original_tools = copy.deepcopy(messages), copy.deepcopy(tools)
+
+    params = prepare_params(messages, MODEL, tools=tools)
+    boundary = history_boundary(messages)
+    assert 1 < boundary <= len(messages) - prompt_cache.RECENT_MESSAGES
+    assert (boundary - 1) % prompt_cache.HISTORY_STRIDE == 0
+    assert _breakpoints(params["messages"]) == [0, boundary - 1]
+    assert [("cache_control" in t) for t in params["tools"]] == [False, True]
+
+    # Callers' messages and tool schemas are never modified
+    assert messages == original_messages and tools == original_tools
+
+    # The boundary only moves once a full stride of new messages has been added
+    assert history_boundary(_thread(21)) == boundary
+    assert history_boundary(_thread(20 + prompt_cache.HISTORY_STRIDE)) == boundary + prompt_cache.HISTORY_STRIDE
+
+    # It never covers a message that isn't persisted
+    unsaved = _thread(20)
+    del unsaved[3]["message_id"]
+    assert history_boundary(unsaved) == 3
+
+    # Other providers get no cache markers
+    assert _breakpoints(prepare_params(_thread(20), "gpt-4o")["messages"]) == []
+
+
+def test_compression_keeps_the_cached_prefix_between_calls():
+    tm = ThreadManager()
+    tm.token_cache = _CharTokenCache()
+    messages = _thread(40, size=12000)
+    boundary = history_boundary(messages)
+
+    compressed = tm._compress_messages(copy.deepcopy(messages), MODEL)
+    assert any(len(c["content"]) < len(m["content"]) for c, m in zip(compressed[boundary:], messages[boundary:]))
+
+    # The next turns send the prefix exactly as before
+    for turns in (41, 40 + prompt_cache.HISTORY_STRIDE):
+        assert tm._compress_messages(_thread(turns, size=12000), MODEL)[:boundary] == compressed[:boundary]
+
+
+def test_over_budget_history_is_compressed_not_omitted():
+    tm = ThreadManager()
+    tm.token_cache = _CharTokenCache()
+    budget = 200 * 1000 - 64000 - 28000
+    messages = _thread(120, size=12000)
+    assert tm.token_cache.count_messages(messages, MODEL) > 3 * budget
+
+    for model in (MODEL, "gpt-4o"):
+        compressed = tm._compress_messages(copy.deepcopy(messages), model)
+        assert len(compressed) == len(messages)
+        assert tm.token_cache.count_messages(compressed, model) <= budget
+    assert compressed[1]["content"] != messages[1]["content"]
+
+    # Growing the thread keeps the compressed prefix as it was
+    boundary = history_boundary(messages)
+    first = tm._compress_messages(copy.deepcopy(messages), MODEL)
+    grown = tm._compress_messages(_thread(120 + prompt_cache.HISTORY_STRIDE, size=12000), MODEL)
+    assert len(grown) == len(messages) + prompt_cache.HISTORY_STRIDE
+    assert grown[:boundary] == first[:boundary]
+
+
+def test_middle_out_only_moves_in_steps():
+    tm = ThreadManager()
+    kept = tm._middle_out_messages(list(range(330)))
+    assert len(kept) <= 320 and kept[:160] == list(range(160)) and kept[-1] == 329
+
+    # The next message is appended without shifting what was kept
+    assert tm._middle_out_messages(list(range(331))) == kept + [330]
+
+
+def test_cache_usage_reads_anthropic_and_openai_fields():
+    assert cache_usage({"cache_read_input_tokens": 900, "cache_creation_input_tokens": 100}) == {
+        "cache_read_input_tokens": 900, "cache_creation_input_tokens": 100
+    }
+    assert cache_usage({"prompt_tokens_details": {"cached_tokens": 512}})["cache_read_input_tokens"] == 512
+    assert cache_usage(None) == {"cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
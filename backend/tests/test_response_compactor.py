@@ -0,0 +1,63 @@
+import json
+
+from services.run_responses import ResponseCompactor, compact_responses
+
+
+def _chunk(text):
+    return {
+        'type': 'assistant', 'message_id': None,
+        'content': json.dumps({'role': 'assistant', 'content': text}),
+        'metadata': json.dumps({'stream_status': 'chunk', 'thread_run_id': 'r1'}),
+    }
+
+
+def _saved_assistant(message_id, text):
+    return {
+        'type': 'assistant', 'message_id': message_id,
+        'content': json.dumps({'role': 'assistant', 'content': text}),
+        'metadata': json.dumps({'stream_status': 'complete', 'thread_run_id': 'r1'}),
+    }
+
+
+def _status(status_type):
+    return {'type': 'status', 'message_id': 'm-status', 'content': json.dumps({'status_type': status_type})}
+
+
+def _tool_call_chunk():
+    return {'type': 'status', 'message_id': None, 'content': json.dumps({'role': 'assistant', 'status_type': 'tool_call_chunk', 'tool_call_chunk': {}})}
+
+
+def test_chunks_are_replaced_by_the_saved_message():
+    compactor = ResponseCompactor()
+    compactor.add(_status('thread_run_start'))
+    for word in ["Hel", "lo"]:
+        compactor.add(_chunk(word))
+    compactor.add(_tool_call_chunk())
+    compactor.add(_saved_assistant('m1', "Hello"))
+    compactor.add(_status('finish'))
+
+    assert [r['message_id'] for r in compactor.responses()] == ['m-status', 'm1', 'm-status']
+
+
+def test_unfinished_chunk_run_is_merged_in_order():
+    responses = [_chunk("a"), _chunk("b"), _status('tool_started'), _chunk("c")]
+
+    compacted = compact_responses(responses)
+
+    assert [r['type'] for r in compacted] == ['assistant', 'status', 'assistant']
+    assert json.loads(compacted[0]['content']) == {'role': 'assistant', 'content': "ab"}
+    assert json.loads(compacted[2]['content']) == {'role': 'assistant', 'content': "c"}
+
+
+def test_compacted_blob_is_an_order_of_magnitude_smaller():
+    text = "lorem ipsum dolor sit amet " * 200
+    responses = []
+    for turn in range(20):
+        responses.append(_status('assistant_response_start'))
+        responses.extend(_chunk(text[i:i + 4]) for i in range(0, len(text), 4))
+        responses.append(_saved_assistant(f"m{turn}", text))
+
+    full_size = len(json.dumps(responses))
+    compacted_size = len(json.dumps(compact_responses(responses)))
+
+    assert compacted_size * 10 < full_size
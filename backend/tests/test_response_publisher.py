@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from services import run_responses
+from services.run_responses import ResponsePublisher
+
+
+def _chunk(i):
+    return {'type': 'assistant', 'message_id': None, 'content': f"token {i}"}
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_coalesced_into_one_pipeline(fake_redis):
+    publisher = ResponsePublisher("run-1", transport="list", flush_interval=0.01)
+
+    for i in range(20):
+        await publisher.publish(_chunk(i))
+    assert fake_redis.pipelines == []
+
+    await asyncio.sleep(0.05)
+    (rpush, publish), = fake_redis.pipelines
+    assert rpush[0] == 'rpush'
+    assert len(fake_redis.values[run_responses.response_list_key("run-1")]) == 20
+    assert publish[:2] == ('publish', ("agent_run:run-1:new_response", "new"))
+    await publisher.close()
+    assert publisher.stats()['max_batch_size'] == 20
+
+
+@pytest.mark.asyncio
+async def test_status_flushes_immediately_and_keeps_order(fake_redis):
+    publisher = ResponsePublisher("run-1", transport="stream", flush_interval=10)
+
+    await publisher.publish(_chunk(0))
+    await publisher.publish({'type': 'status', 'status': 'completed'})
+
+    assert len(fake_redis.pipelines) == 1
+    assert [c[0] for c in fake_redis.pipelines[0]] == ['xadd', 'xadd']
+    assert '"token 0"' in fake_redis.pipelines[0][0][1][1]['data']
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_and_buffer_stays_bounded(fake_redis):
+    publisher = ResponsePublisher("run-1", transport="list", flush_interval=10, max_buffered=5)
+
+    fake_redis.pipeline_failures = 3
+    await publisher.publish({'type': 'status', 'status': 'running'})
+    assert publisher.pending == 1
+
+    for i in range(5):
+        await publisher.publish(_chunk(i))
+    # The flush at max_buffered failed too, so the oldest response was dropped
+    assert publisher.pending == 5
+    assert publisher.dropped == 1
+
+    await publisher.close()
+    assert len(fake_redis.pipelines) == 1
+    assert len(fake_redis.values[run_responses.response_list_key("run-1")]) == 5
+    assert publisher.pending == 0
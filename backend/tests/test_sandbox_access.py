@@ -0,0 +1,54 @@
+import pytest
+from fastapi import HTTPException
+
+from sandbox import api as sandbox_api
+
+
+@pytest.fixture
+def client_for(fake_supabase):
+    def _client(roles):
+        return fake_supabase({
+            'projects': [{'project_id': 'p1', 'account_id': 'acc-1', 'is_public': False, 'sandbox': {'id': 'sb-1'}}],
+            'account_user': [
+                {'user_id': user_id, 'account_id': 'acc-1', 'account_role': role} for user_id, role in roles
+            ],
+        })
+    return _client
+
+
+@pytest.mark.asyncio
+async def test_access_is_checked_once_per_user_and_sandbox(fake_redis, client_for):
+    client = client_for([('user-1', 'owner')])
+
+    for _ in range(3):
+        project = await sandbox_api.verify_sandbox_access(client, 'sb-1', 'user-1')
+        assert project['project_id'] == 'p1'
+
+    assert client.queries == ['projects', 'account_user']
+    # The sandbox column (VNC password, preview token) is neither returned nor cached
+    assert 'sandbox' not in project
+    assert all('sandbox' not in value for value in fake_redis.values.values())
+
+
+@pytest.mark.asyncio
+async def test_denied_access_is_not_cached(fake_redis, client_for):
+    client = client_for([('user-2', 'owner')])
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            await sandbox_api.verify_sandbox_access(client, 'sb-1', 'user-1')
+        assert exc.value.status_code == 403
+
+    assert client.queries == ['projects', 'account_user'] * 2
+
+
+@pytest.mark.asyncio
+async def test_invalidation_forces_a_fresh_check(fake_redis, client_for):
+    client = client_for([('user-1', 'member'), ('user-2', 'member')])
+
+    await sandbox_api.verify_sandbox_access(client, 'sb-1', 'user-1')
+    await sandbox_api.verify_sandbox_access(client, 'sb-1', 'user-2')
+    await sandbox_api.invalidate_sandbox_access('sb-1')
+    await sandbox_api.verify_sandbox_access(client, 'sb-1', 'user-1')
+
+    assert client.queries == ['projects', 'account_user'] * 3
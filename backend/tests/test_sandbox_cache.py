@@ -0,0 +1,163 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from sandbox import sandbox as sandbox_module
+from sandbox.sandbox import SandboxState
+
+
+class _FakeProcess:
+    def __init__(self, daytona):
+        self.daytona = daytona
+
+    def get_session(self, session_id):
+        if not self.daytona.supervisord:
+            raise Exception(f"Session {session_id} not found")
+        return SimpleNamespace(session_id=session_id)
+
+
+class _FakeSandbox:
+    def __init__(self, daytona, sandbox_id):
+        self.daytona = daytona
+        self.id = sandbox_id
+        self.state = daytona.state
+        self.process = _FakeProcess(daytona)
+
+    def wait_for_sandbox_start(self):
+        self.daytona.waits += 1
+        self.state = self.daytona.state = SandboxState.STARTED
+
+
+class _FakeDaytona:
+    def __init__(self, state):
+        self.state = state
+        self.supervisord = state == SandboxState.STARTED
+        self.gets = 0
+        self.starts = 0
+        self.waits = 0
+        self.supervisord_starts = 0
+        self.start_error = None
+
+    def get(self, sandbox_id):
+        self.gets += 1
+        time.sleep(0.01)
+        return _FakeSandbox(self, sandbox_id)
+
+    def start(self, sandbox):
+        self.starts += 1
+        time.sleep(0.02)
+        if self.start_error:
+            raise self.start_error
+        self.state = SandboxState.STARTED
+
+
+@pytest.fixture
+def fake_daytona(monkeypatch):
+    def install(state):
+        fake = _FakeDaytona(state)
+
+        def start_supervisord_session(sandbox):
+            fake.supervisord_starts += 1
+            fake.supervisord = True
+
+        monkeypatch.setattr(sandbox_module, "daytona", fake)
+        monkeypatch.setattr(sandbox_module, "start_supervisord_session", start_supervisord_session)
+        return fake
+
+    sandbox_module._sandbox_cache.clear()
+    for key in sandbox_module._cache_stats:
+        sandbox_module._cache_stats[key] = 0
+    yield install
+    sandbox_module._sandbox_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_start_the_sandbox_once(fake_daytona):
+    fake = fake_daytona(SandboxState.STOPPED)
+
+    sandboxes = await asyncio.gather(*[sandbox_module.get_or_start_sandbox("sb-1") for _ in range(10)])
+
+    assert fake.starts == 1
+    assert fake.gets == 2  # Lookup plus refresh after the start
+    assert all(sb.state == SandboxState.STARTED for sb in sandboxes)
+    stats = sandbox_module.sandbox_cache_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 9
+    assert stats["starts"] == 1
+    assert stats["avg_start_ms"] > 0
+
+
+@pytest.mark.asyncio
+async def test_cached_handles_expire_and_are_invalidated(fake_daytona, monkeypatch):
+    fake = fake_daytona(SandboxState.STARTED)
+
+    await sandbox_module.get_or_start_sandbox("sb-1")
+    await sandbox_module.get_or_start_sandbox("sb-1")
+    assert fake.gets == 1
+
+    monkeypatch.setattr(sandbox_module, "SANDBOX_CACHE_TTL", 0)
+    await sandbox_module.get_or_start_sandbox("sb-1")
+    assert fake.gets == 2
+
+    monkeypatch.setattr(sandbox_module, "SANDBOX_CACHE_TTL", 30)
+    sandbox_module.invalidate_sandbox("sb-1")
+    await sandbox_module.get_or_start_sandbox("sb-1")
+    assert fake.gets == 3
+
+
+@pytest.mark.asyncio
+async def test_warm_start_runs_in_the_background(fake_daytona):
+    fake = fake_daytona(SandboxState.ARCHIVED)
+
+    task = sandbox_module.warm_sandbox("sb-1")
+    assert fake.starts == 0
+    await task
+
+    assert fake.starts == 1
+    await sandbox_module.get_or_start_sandbox("sb-1")
+    assert sandbox_module.sandbox_cache_stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sandbox_started_elsewhere_gets_supervisord_before_use(fake_daytona):
+    # Found while another process is still starting it
+    fake = fake_daytona(SandboxState.STARTING)
+    sandbox = await sandbox_module.get_or_start_sandbox("sb-1")
+    assert sandbox.state == SandboxState.STARTED
+    assert (fake.starts, fake.waits, fake.supervisord_starts) == (0, 1, 1)
+
+    # Already up with supervisord running
+    sandbox_module._sandbox_cache.clear()
+    await sandbox_module.get_or_start_sandbox("sb-1")
+    assert fake.supervisord_starts == 1
+
+    # Lost the start race to another process
+    sandbox_module._sandbox_cache.clear()
+    fake = fake_daytona(SandboxState.STOPPED)
+    fake.start_error = Exception("Sandbox is already starting")
+    original_get = fake.get
+
+    def get(sandbox_id):
+        sandbox = original_get(sandbox_id)
+        if fake.starts:
+            sandbox.state = fake.state = SandboxState.STARTING
+        return sandbox
+
+    fake.get = get
+    sandbox = await sandbox_module.get_or_start_sandbox("sb-1")
+    assert sandbox.state == SandboxState.STARTED
+    assert fake.supervisord_starts == 1
+    assert sandbox_module.sandbox_cache_stats()["start_errors"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_start_is_raised(fake_daytona):
+    fake = fake_daytona(SandboxState.STOPPED)
+    fake.start_error = Exception("quota exceeded")
+
+    with pytest.raises(Exception, match="quota exceeded"):
+        await sandbox_module.get_or_start_sandbox("sb-1")
+    assert sandbox_module.sandbox_cache_stats()["start_errors"] == 1
+    assert "sb-1" not in sandbox_module._sandbox_cache
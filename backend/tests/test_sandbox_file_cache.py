@@ -0,0 +1,140 @@
+import asyncio
+import fcntl
+import os
+
+import pytest
+
+from sandbox import file_cache
+from sandbox.file_cache import SandboxFileCache, etag_matches, file_etag, parse_range
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    # Several ranges fall back to the whole file
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+    with pytest.raises(ValueError):
+        parse_range("bytes=abc", 100)
+
+
+def test_etag_follows_size_and_mtime():
+    etag = file_etag(10, "2025-06-29 10:00:00")
+    assert etag == file_etag(10, "2025-06-29 10:00:00")
+    assert etag != file_etag(11, "2025-06-29 10:00:00")
+    assert etag_matches(f'W/{etag}, "other"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+
+
+@pytest.fixture
+def fake_downloads(monkeypatch):
+    downloads = []
+
+    async def stream(sandbox, sandbox_id, path, start=0, end=None):
+        downloads.append(path)
+        content = sandbox[path]
+        for i in range(0, len(content), 4):
+            yield content[i:i + 4]
+
+    monkeypatch.setattr(file_cache, "stream_sandbox_file", stream)
+    return downloads
+
+
+@pytest.mark.asyncio
+async def test_repeated_reads_are_served_from_disk(tmp_path, fake_downloads):
+    cache = SandboxFileCache(directory=str(tmp_path), max_bytes=1000, max_file_bytes=100)
+    files = {"/workspace/a.csv": b"a,b,c\n1,2,3\n"}
+
+    key, path = await cache.fetch(files, "sb-1", "/workspace/a.csv", '"v1"')
+    cache.release(key)
+    key, path = await cache.fetch(files, "sb-1", "/workspace/a.csv", '"v1"')
+    cache.release(key)
+
+    assert fake_downloads == ["/workspace/a.csv"]
+    with open(path, "rb") as f:
+        assert f.read() == files["/workspace/a.csv"]
+    assert cache.stats()["hits"] == 1
+
+    # A new ETag means the file changed
+    await cache.fetch(files, "sb-1", "/workspace/a.csv", '"v2"')
+    assert len(fake_downloads) == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_is_bounded_and_keeps_files_being_served(tmp_path, fake_downloads):
+    cache = SandboxFileCache(directory=str(tmp_path), max_bytes=25, max_file_bytes=10)
+    files = {f"/workspace/{i}.bin": bytes([i]) * 10 for i in range(4)}
+
+    pinned, pinned_path = await cache.fetch(files, "sb-1", "/workspace/0.bin", '"v"')
+    for i in range(1, 4):
+        key, _ = await cache.fetch(files, "sb-1", f"/workspace/{i}.bin", '"v"')
+        cache.release(key)
+
+    assert cache.stats()["bytes"] <= 25
+    assert os.path.exists(pinned_path)
+    assert len(_cached_files(tmp_path)) == 2
+    assert not cache.cacheable(11)
+
+
+@pytest.mark.asyncio
+async def test_worker_processes_share_the_directory_and_its_bound(tmp_path, fake_downloads):
+    # Each API worker process has its own SandboxFileCache over the same directory
+    files = {f"/workspace/{i}.bin": bytes([i]) * 10 for i in range(4)}
+    first = SandboxFileCache(directory=str(tmp_path), max_bytes=25, max_file_bytes=10)
+    second = SandboxFileCache(directory=str(tmp_path), max_bytes=25, max_file_bytes=10)
+
+    # A recent download in flight elsewhere is kept, an abandoned one is cleaned up
+    in_flight, abandoned = tmp_path / "a.1.part", tmp_path / "b.2.part"
+    in_flight.write_bytes(b"")
+    abandoned.write_bytes(b"")
+    os.utime(abandoned, (0, 0))
+
+    pinned, pinned_path = await first.fetch(files, "sb-1", "/workspace/0.bin", '"v"')
+    key, _ = await second.fetch(files, "sb-1", "/workspace/0.bin", '"v"')
+    second.release(key)
+    assert fake_downloads == ["/workspace/0.bin"]
+    assert second.stats()["hits"] == 1
+
+    # Evictions in one process never remove a file another process is serving
+    for i in range(1, 4):
+        key, _ = await second.fetch(files, "sb-1", f"/workspace/{i}.bin", '"v"')
+        second.release(key)
+    assert os.path.exists(pinned_path)
+    assert sum(os.path.getsize(f) for f in _cached_files(tmp_path)) <= 25
+    assert in_flight.exists() and not abandoned.exists()
+    first.release(pinned)
+
+
+def _cached_files(directory):
+    return [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name != file_cache.LOCK_FILE and not name.endswith(file_cache.PART_SUFFIX)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_eviction_in_another_worker_does_not_block_the_event_loop(tmp_path, fake_downloads):
+    cache = SandboxFileCache(directory=str(tmp_path), max_bytes=1000, max_file_bytes=100)
+    files = {"/workspace/a.csv": b"a,b,c\n"}
+
+    # Another worker process holds the eviction lock
+    lock_fd = os.open(os.path.join(tmp_path, file_cache.LOCK_FILE), os.O_RDWR | os.O_CREAT)
+    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+    try:
+        fetch = asyncio.create_task(cache.fetch(files, "sb-1", "/workspace/a.csv", '"v1"'))
+        ticks = 0
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks == 10 and not fetch.done()
+    finally:
+        os.close(lock_fd)
+
+    key, path = await asyncio.wait_for(fetch, timeout=5)
+    cache.release(key)
+    assert os.path.exists(path)
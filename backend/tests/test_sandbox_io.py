@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from sandbox import sandbox_io
+
+
+def _blocking_call(counter, lock, delay=0.05):
+    with lock:
+        counter["running"] += 1
+        counter["max"] = max(counter["max"], counter["running"])
+    time.sleep(delay)
+    with lock:
+        counter["running"] -= 1
+    return threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_calls_run_off_the_loop_within_the_per_sandbox_limit(monkeypatch):
+    monkeypatch.setattr(sandbox_io, "SANDBOX_IO_PER_SANDBOX", 2)
+    counter, lock = {"running": 0, "max": 0}, threading.Lock()
+
+    start = time.monotonic()
+    names = await asyncio.gather(*[
+        sandbox_io.run_sandbox_io("sb-1", _blocking_call, counter, lock) for _ in range(4)
+    ])
+
+    assert all(name.startswith("sandbox-io") for name in names)
+    assert counter["max"] == 2
+    # Two batches of two, not four sequential calls
+    assert time.monotonic() - start < 0.18
+
+
+@pytest.mark.asyncio
+async def test_sandboxes_have_separate_limits(monkeypatch):
+    monkeypatch.setattr(sandbox_io, "SANDBOX_IO_PER_SANDBOX", 1)
+    counter, lock = {"running": 0, "max": 0}, threading.Lock()
+
+    await asyncio.gather(*[
+        sandbox_io.run_sandbox_io(f"sb-{i}", _blocking_call, counter, lock) for i in range(3)
+    ])
+
+    assert counter["max"] == 3
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate():
+    def fail():
+        raise FileNotFoundError("/workspace/missing.txt")
+
+    with pytest.raises(FileNotFoundError):
+        await sandbox_io.run_sandbox_io("sb-1", fail)
+    assert sandbox_io.sandbox_io_stats()["errors"] >= 1
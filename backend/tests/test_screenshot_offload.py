@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import io
+
+import pytest
+from PIL import Image
+
+from agent.tools import sb_browser_tool
+from agent.tools.sb_browser_tool import SandboxBrowserTool
+
+
+def _jpeg(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 16), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def browser_tool(monkeypatch):
+    files = {}
+    uploads = []
+
+    async def upload_image_bytes(image_data, sha256=None, **kwargs):
+        uploads.append(sha256)
+        return f"https://storage.example/{sha256}.jpg"
+
+    monkeypatch.setattr(sb_browser_tool, "upload_image_bytes", upload_image_bytes)
+
+    tool = SandboxBrowserTool.__new__(SandboxBrowserTool)
+    tool._last_screenshot_sha256 = None
+    tool._last_screenshot_url = None
+    tool.downloads = []
+
+    async def sandbox_call(func, path):
+        tool.downloads.append(path)
+        return files[path]
+
+    tool._sandbox_call = sandbox_call
+    tool._sandbox = type("Sandbox", (), {"fs": type("FS", (), {"download_file": None})()})()
+    return tool, files, uploads
+
+
+def _state(files, image):
+    digest = hashlib.sha256(image).hexdigest()
+    path = f"/app/screenshots/state/{digest}.jpg"
+    files[path] = image
+    return {
+        "url": "https://example.com",
+        "screenshot_path": path,
+        "screenshot_sha256": digest,
+        "screenshot_width": 32,
+        "screenshot_height": 16,
+    }
+
+
+@pytest.mark.asyncio
+async def test_identical_consecutive_screenshots_are_uploaded_once(browser_tool):
+    tool, files, uploads = browser_tool
+    first, second = _jpeg("red"), _jpeg("blue")
+
+    results = [_state(files, image) for image in (first, first, second)]
+    for result in results:
+        await tool._offload_screenshot(result)
+
+    assert len(tool.downloads) == 2
+    assert len(uploads) == 2
+    assert results[0]["image_url"] == results[1]["image_url"] != results[2]["image_url"]
+    for result in results:
+        assert "screenshot_path" not in result
+        assert result["screenshot_width"] == 32
+
+
+@pytest.mark.asyncio
+async def test_legacy_base64_screenshot_is_dropped_from_the_result(browser_tool):
+    tool, files, uploads = browser_tool
+    image = _jpeg("green")
+    result = {"url": "https://example.com", "screenshot_base64": base64.b64encode(image).decode()}
+
+    await tool._offload_screenshot(result)
+
+    assert "screenshot_base64" not in result
+    assert result["screenshot_sha256"] == hashlib.sha256(image).hexdigest()
+    assert (result["screenshot_width"], result["screenshot_height"]) == (32, 16)
+    assert result["image_url"].endswith(".jpg")
+    assert tool.downloads == []
@@ -0,0 +1,104 @@
+import pytest
+
+from agentpress.response_processor import ResponseProcessor
+from agentpress.tool import Tool, ToolResult, ToolSchema, SchemaType, openapi_schema, xml_schema
+from agentpress.tool_registry import ToolRegistry
+
+
+class _ShellTool(Tool):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "run_command",
+            "description": "Run a command",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "command": {"type": "string"},
+                    "timeout": {"type": "integer"},
+                    "mode": {"type": "string", "enum": ["blocking", "background"]},
+                },
+                "required": ["command"],
+            },
+        },
+    })
+    @xml_schema(
+        tag_name="run-command",
+        mappings=[
+            {"param_name": "command", "node_type": "content", "path": "."},
+            {"param_name": "timeout", "node_type": "attribute", "path": ".", "required": False},
+        ],
+        example="<run-command>ls</run-command>",
+    )
+    async def run_command(self, command: str, timeout: int = 60, mode: str = "blocking") -> ToolResult:
+        self.calls.append((command, timeout))
+        return self.success_response(f"ran {command}")
+
+
+class _Trace:
+    def event(self, **kwargs):
+        pass
+
+    def span(self, **kwargs):
+        return self
+
+    def end(self, **kwargs):
+        pass
+
+
+def test_dispatch_table_and_payloads_are_built_on_registration():
+    registry = ToolRegistry()
+    assert registry.version == 0 and registry.get_openapi_schemas() == []
+
+    registry.register_tool(_ShellTool)
+    assert registry.version == 1
+    entry = registry.get_function("run_command")
+    assert entry.parameters["required"] == ["command"]
+    assert [s["function"]["name"] for s in registry.get_openapi_schemas()] == ["run_command"]
+    assert dict(registry.get_xml_examples()) == {"run-command": "<run-command>ls</run-command>"}
+    with pytest.raises(TypeError):
+        registry.get_available_functions()["other"] = entry.function
+
+    # Functions added to a registered instance later are dispatchable after register_schemas
+    instance = entry.function.__self__
+
+    async def search(**kwargs):
+        return ToolResult(success=True, output="found")
+
+    instance.search = search
+    schema = ToolSchema(SchemaType.OPENAPI, {"type": "function", "function": {"name": "search", "parameters": {}}})
+    registry.register_schemas(instance, {"search": [schema]})
+    assert registry.version == 2
+    assert registry.get_function("search").accepts_any_arguments
+    assert len(registry.get_openapi_schemas()) == 2
+
+
+@pytest.mark.asyncio
+async def test_invalid_arguments_fail_before_the_tool_runs():
+    registry = ToolRegistry()
+    registry.register_tool(_ShellTool)
+    tool = registry.get_function("run_command").function.__self__
+    processor = ResponseProcessor(registry, add_message_callback=None, trace=_Trace())
+
+    result = await processor._execute_tool({"function_name": "run_command", "arguments": '{"command": "ls", "timeout": 5}'})
+    assert result.success and tool.calls == [("ls", 5)]
+
+    for arguments, problem in [
+        ({"timeout": 5}, "missing required argument 'command'"),
+        ({"command": "ls", "timeout": "5"}, "argument 'timeout' must be of type integer"),
+        ({"command": "ls", "mode": "detached"}, "argument 'mode' must be one of"),
+        ({"command": "ls", "cwd": "/"}, "unexpected argument 'cwd'"),
+    ]:
+        result = await processor._execute_tool({"function_name": "run_command", "arguments": arguments})
+        assert not result.success and problem in result.output
+    assert len(tool.calls) == 1
+
+    # XML calls carry strings, so only argument names are checked
+    result = await processor._execute_tool({
+        "function_name": "run_command", "xml_tag_name": "run-command", "arguments": {"command": "ls", "timeout": "5"}
+    })
+    assert result.success and tool.calls[-1] == ("ls", "5")
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from workflows.deterministic_executor import DeterministicWorkflowExecutor, NodeType, WorkflowContext
+
+
+def _graph(nodes, edges):
+    graph = {
+        node_id: {
+            'type': node_type,
+            'data': {},
+            'incoming_edges': [],
+            'outgoing_edges': [],
+            'dependencies': set(),
+            'dependents': set(),
+        }
+        for node_id, node_type in nodes.items()
+    }
+    for source, target in edges:
+        graph[source]['outgoing_edges'].append({'source': source, 'target': target})
+        graph[target]['incoming_edges'].append({'source': source, 'target': target})
+        graph[target]['dependencies'].add(source)
+        graph[source]['dependents'].add(target)
+    return graph
+
+
+def _executor(durations, outputs=None, **kwargs):
+    executor = DeterministicWorkflowExecutor(db=None, **kwargs)
+    executor.runs = []
+
+    async def execute_node(node_id, node_info, context, workflow, thread_id, project_id):
+        executor.runs.append(node_id)
+        await asyncio.sleep(durations.get(node_id, 0))
+        output = (outputs or {}).get(node_id, lambda: '')()
+        return {'type': 'agent' if node_info['type'] == NodeType.AGENT else 'tool', 'output': output}
+
+    executor._execute_node = execute_node
+    return executor
+
+
+async def _run(executor, graph, workflow=None):
+    context = WorkflowContext(variables={}, node_outputs={}, execution_history=[])
+    workflow = workflow or SimpleNamespace(max_parallel_nodes=None)
+    entry_points = executor._find_entry_points(graph)
+    return [update async for update in executor._execute_graph(graph, entry_points, context, workflow, 't', 'p')]
+
+
+FAN_OUT = _graph(
+    {'input': NodeType.INPUT, 'a': NodeType.MCP, 'b': NodeType.MCP, 'c': NodeType.TOOL, 'agent': NodeType.AGENT},
+    [('input', 'a'), ('input', 'b'), ('input', 'c'), ('a', 'agent'), ('b', 'agent'), ('c', 'agent')],
+)
+
+
+@pytest.mark.asyncio
+async def test_fan_out_branches_run_concurrently():
+    executor = _executor({'a': 0.1, 'b': 0.1, 'c': 0.15})
+
+    started = time.perf_counter()
+    updates = await _run(executor, FAN_OUT)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.25  # Longest branch, not the sum of all three
+    assert executor.runs[0] == 'input' and executor.runs[-1] == 'agent'
+    assert updates[-1]['status'] == 'completed'
+    completed = [u['node_id'] for u in updates if u['type'] == 'node_status' and u['status'] == 'completed']
+    assert completed.index('c') > completed.index('a')  # Streamed as they finish
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limits_per_workflow_and_node_type():
+    executor = _executor({'a': 0.05, 'b': 0.05, 'c': 0.05}, node_type_limits={NodeType.MCP: 1})
+    started = time.perf_counter()
+    await _run(executor, FAN_OUT)
+    assert time.perf_counter() - started >= 0.1  # The two MCP nodes ran one after the other
+
+    executor = _executor({'a': 0.05, 'b': 0.05, 'c': 0.05})
+    started = time.perf_counter()
+    await _run(executor, FAN_OUT, SimpleNamespace(max_parallel_nodes=1))
+    assert time.perf_counter() - started >= 0.15
+
+
+@pytest.mark.asyncio
+async def test_agent_nodes_sharing_the_thread_never_overlap():
+    graph = _graph(
+        {'input': NodeType.INPUT, 'research': NodeType.AGENT, 'outline': NodeType.AGENT},
+        [('input', 'research'), ('input', 'outline')],
+    )
+    executor = _executor({'research': 0.05, 'outline': 0.05}, node_type_limits={NodeType.AGENT: 4})
+    started = time.perf_counter()
+    await _run(executor, graph)
+    assert time.perf_counter() - started >= 0.1
+
+@pytest.mark.asyncio
+async def test_loop_repeats_until_exit_condition_then_releases_next_nodes():
+    graph = _graph(
+        {'input': NodeType.INPUT, 'draft': NodeType.AGENT, 'review': NodeType.AGENT, 'publish': NodeType.TOOL},
+        [('input', 'draft'), ('draft', 'review'), ('review', 'draft'), ('review', 'publish')],
+    )
+    reviews = iter(['needs work', 'needs work', 'DONE'])
+    executor = _executor({}, outputs={'review': lambda: next(reviews)})
+
+    updates = await _run(executor, graph)
+
+    assert executor.runs == ['input'] + ['draft', 'review'] * 3 + ['publish']
+    loop_updates = [u['status'] for u in updates if u['type'] == 'loop_status']
+    assert loop_updates == ['continuing', 'continuing', 'exiting']
+    assert updates[-1]['status'] == 'completed'
+
+
+@pytest.mark.asyncio
+async def test_failed_node_stops_the_workflow():
+    executor = _executor({'a': 0.01, 'b': 0.5})
+    original = executor._execute_node
+
+    async def execute_node(node_id, *args):
+        if node_id == 'a':
+            raise RuntimeError('boom')
+        return await original(node_id, *args)
+
+    executor._execute_node = execute_node
+    started = time.perf_counter()
+    updates = await _run(executor, FAN_OUT)
+
+    assert time.perf_counter() - started < 0.4  # Running branches are cancelled
+    assert updates[-1] == {'type': 'workflow_status', 'status': 'failed', 'error': 'Node a failed: boom'}
+    assert 'agent' not in executor.runs
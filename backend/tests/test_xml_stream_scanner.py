@@ -0,0 +1,43 @@
+import random
+
+from agentpress.xml_stream_scanner import StreamingXMLScanner
+
+FUNCTION_CALLS = (
+    '<function_calls>\n<invoke name="create_file">\n'
+    '<parameter name="file_path">a.txt</parameter>\n</invoke>\n</function_calls>'
+)
+LEGACY = '<create-file file_path="b.txt">has <create-file> inside</create-file> text</create-file>'
+
+
+def _feed_in_pieces(scanner, content, seed):
+    rng = random.Random(seed)
+    blocks = []
+    pos = 0
+    while pos < len(content):
+        size = rng.randint(1, 12)
+        blocks.extend(scanner.feed(content[pos:pos + size]))
+        pos += size
+    return blocks
+
+
+def test_blocks_are_emitted_once_whatever_the_delta_boundaries():
+    content = f"Let me do this. {FUNCTION_CALLS} then {LEGACY} and <create-file-other> ignored {FUNCTION_CALLS}"
+    for seed in range(50):
+        scanner = StreamingXMLScanner(["create-file", "str-replace"])
+        assert _feed_in_pieces(scanner, content, seed) == [FUNCTION_CALLS, LEGACY, FUNCTION_CALLS]
+
+
+def test_incomplete_block_is_held_until_closed():
+    scanner = StreamingXMLScanner(["create-file"])
+    assert scanner.feed("text <function_calls>\n<invoke name=\"x\">") == []
+    assert scanner.feed("</invoke>\n</function_") == []
+    assert scanner.feed("calls> more") == ['<function_calls>\n<invoke name="x"></invoke>\n</function_calls>']
+    assert scanner.feed(" and more") == []
+
+
+def test_long_plain_text_is_not_kept_around():
+    scanner = StreamingXMLScanner(["create-file"])
+    for _ in range(1000):
+        assert scanner.feed("no tool calls here, just prose < and > signs. ") == []
+    assert len(scanner._buffer) < 5000
+    assert scanner.feed(FUNCTION_CALLS) == [FUNCTION_CALLS]
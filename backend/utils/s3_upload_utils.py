@@ -3,8 +3,11 @@ Utility functions for handling image operations.
 """
 
 import base64
+import hashlib
 import uuid
+from collections import OrderedDict
 from datetime import datetime
+from typing import Optional
 from utils.logger import logger
 from services.supabase import DBConnection
 
@@ -48,4 +51,56 @@ async def upload_base64_image(base64_data: str, bucket_name: str = "browser-scre
         
     except Exception as e:
         logger.error(f"Error uploading base64 image: {e}")
-        raise RuntimeError(f"Failed to upload image: {str(e)}") 
\ No newline at end of file
+        raise RuntimeError(f"Failed to upload image: {str(e)}") 
+
+# Content hash -> public URL of screenshots already uploaded by this process
+_uploaded_images: "OrderedDict[str, str]" = OrderedDict()
+_UPLOADED_IMAGES_MAX = 1024
+
+
+async def upload_image_bytes(
+    image_data: bytes,
+    content_type: str = "image/jpeg",
+    bucket_name: str = "browser-screenshots",
+    sha256: Optional[str] = None
+) -> str:
+    """Upload image bytes under their content hash and return the public URL.
+
+    The object name is the SHA-256 of the data, so identical images map to one
+    object and an image that was already uploaded is not sent again.
+
+    Args:
+        image_data (bytes): Raw image data
+        content_type (str): MIME type of the image
+        bucket_name (str): Name of the storage bucket to upload to
+        sha256 (str, optional): Precomputed hex SHA-256 of image_data
+
+    Returns:
+        str: Public URL of the uploaded image
+    """
+    digest = sha256 or hashlib.sha256(image_data).hexdigest()
+    cache_key = f"{bucket_name}/{digest}"
+    if cache_key in _uploaded_images:
+        _uploaded_images.move_to_end(cache_key)
+        return _uploaded_images[cache_key]
+
+    extension = content_type.split('/')[-1].replace('jpeg', 'jpg')
+    filename = f"{digest}.{extension}"
+    try:
+        db = DBConnection()
+        client = await db.client
+        await client.storage.from_(bucket_name).upload(
+            filename,
+            image_data,
+            {"content-type": content_type, "cache-control": "31536000", "upsert": "true"}
+        )
+        public_url = await client.storage.from_(bucket_name).get_public_url(filename)
+    except Exception as e:
+        logger.error(f"Error uploading image {filename}: {e}")
+        raise RuntimeError(f"Failed to upload image: {str(e)}")
+
+    logger.debug(f"Uploaded image to {public_url}")
+    _uploaded_images[cache_key] = public_url
+    if len(_uploaded_images) > _UPLOADED_IMAGES_MAX:
+        _uploaded_images.popitem(last=False)
+    return public_url
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Script to reconcile the monthly usage rollup against the raw messages.
+
+Billing checks read the current month's cost from account_monthly_usage, which
+is incremented as assistant_response_end messages are written. This script
+recomputes the rollup from the messages table for one account, or for every
+account with a rollup this month, and reports any drift it corrects.
+
+Usage:
+    python backend/utils/scripts/reconcile_monthly_usage.py [--account-id <ACCOUNT_ID>] [--min-drift 0.01]
+
+Make sure your environment variables are properly set:
+- SUPABASE_URL
+- SUPABASE_SERVICE_ROLE_KEY
+"""
+
+import asyncio
+import argparse
+from typing import List
+from dotenv import load_dotenv
+
+load_dotenv(".env")
+
+from services.supabase import DBConnection
+from services.billing import reconcile_monthly_usage, _usage_month
+from utils.logger import logger
+
+
+async def get_accounts_with_usage(client) -> List[dict]:
+    """Get every rollup row for the current month."""
+    rows = []
+    batch_size = 1000
+    offset = 0
+    while True:
+        result = await client.table('account_monthly_usage') \
+            .select('account_id, total_cost') \
+            .eq('month', _usage_month()) \
+            .range(offset, offset + batch_size - 1) \
+            .execute()
+        if not result.data:
+            break
+        rows.extend(result.data)
+        if len(result.data) < batch_size:
+            break
+        offset += batch_size
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reconcile monthly usage rollups with the messages table")
+    parser.add_argument("--account-id", help="Only reconcile this account")
+    parser.add_argument("--min-drift", type=float, default=0.01, help="Report accounts whose cost drifted by at least this many dollars")
+    args = parser.parse_args()
+
+    db = DBConnection()
+    try:
+        client = await db.client
+
+        if args.account_id:
+            rows = [{'account_id': args.account_id, 'total_cost': None}]
+        else:
+            rows = await get_accounts_with_usage(client)
+        logger.info(f"Reconciling {len(rows)} accounts for {_usage_month()}")
+
+        drifted = 0
+        for row in rows:
+            account_id = row['account_id']
+            previous = float(row['total_cost']) if row['total_cost'] is not None else None
+            try:
+                actual = await reconcile_monthly_usage(client, account_id)
+            except Exception as e:
+                logger.error(f"Failed to reconcile usage for {account_id}: {e}")
+                continue
+            if previous is None:
+                print(f"{account_id}: ${actual:.4f}")
+            elif abs(actual - previous) >= args.min_drift:
+                drifted += 1
+                print(f"{account_id}: rollup ${previous:.4f} -> ${actual:.4f} (drift {actual - previous:+.4f})")
+
+        print(f"\nReconciled {len(rows)} accounts, {drifted} with drift >= ${args.min_drift}")
+
+    finally:
+        await DBConnection.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -154,7 +154,8 @@ def _map_db_to_workflow_definition(data: dict) -> WorkflowDefinition:
         agent_id=definition.get('agent_id'),
         is_template=False,
         max_execution_time=definition.get('max_execution_time', 3600),
-        max_retries=definition.get('max_retries', 3)
+        max_retries=definition.get('max_retries', 3),
+        max_parallel_nodes=definition.get('max_parallel_nodes')
     )
 
 @router.get("/workflows", response_model=List[WorkflowDefinition])
@@ -222,7 +223,8 @@ async def create_workflow(
                 'triggers': [{'type': 'MANUAL', 'config': {}}],
                 'agent_id': request.agent_id,
                 'max_execution_time': request.max_execution_time,
-                'max_retries': request.max_retries
+                'max_retries': request.max_retries,
+                'max_parallel_nodes': request.max_parallel_nodes
             }
         }
         
@@ -305,6 +307,9 @@ async def update_workflow(
         if request.max_retries is not None:
             current_definition['max_retries'] = request.max_retries
             definition_updated = True
+        if request.max_parallel_nodes is not None:
+            current_definition['max_parallel_nodes'] = request.max_parallel_nodes
+            definition_updated = True
         
         if definition_updated:
             update_data['definition'] = current_definition
@@ -1089,7 +1094,8 @@ async def create_workflow_from_template(
                 'triggers': template_definition.get('triggers', []),
                 'agent_id': template_definition.get('agent_id'),
                 'max_execution_time': template_definition.get('max_execution_time', 3600),
-                'max_retries': template_definition.get('max_retries', 3)
+                'max_retries': template_definition.get('max_retries', 3),
+                'max_parallel_nodes': template_definition.get('max_parallel_nodes')
             }
         }
         
@@ -1,8 +1,10 @@
 import asyncio
+import os
 import uuid
 import json
+from collections import defaultdict
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional, AsyncGenerator, List, Set
+from typing import Dict, Any, Optional, AsyncGenerator, List, Set, Tuple
 from .models import WorkflowDefinition, WorkflowExecution
 from services.supabase import DBConnection
 from utils.logger import logger
@@ -15,6 +17,17 @@ class NodeType(Enum):
     TOOL = "toolConnectionNode"
     MCP = "mcpNode"
 
+# Nodes of one workflow run concurrently up to these limits; a workflow can
+# lower or raise its own limit with max_parallel_nodes. Agent nodes always run
+# one at a time: they all run in the workflow's thread, and concurrent runs on
+# one thread would interleave its history.
+WORKFLOW_MAX_PARALLEL_NODES = int(os.getenv("WORKFLOW_MAX_PARALLEL_NODES", "8"))
+WORKFLOW_NODE_TYPE_LIMITS = {
+    NodeType.AGENT: 1,
+    NodeType.TOOL: int(os.getenv("WORKFLOW_MAX_PARALLEL_TOOL_NODES", "4")),
+    NodeType.MCP: int(os.getenv("WORKFLOW_MAX_PARALLEL_MCP_NODES", "4")),
+}
+
 class NodeStatus(Enum):
     PENDING = "pending"
     RUNNING = "running"
@@ -60,8 +73,16 @@ class WorkflowContext:
 class DeterministicWorkflowExecutor:
     """Executes workflows by following the visual flow deterministically."""
     
-    def __init__(self, db: DBConnection):
+    def __init__(
+        self,
+        db: DBConnection,
+        max_parallel_nodes: int = WORKFLOW_MAX_PARALLEL_NODES,
+        node_type_limits: Optional[Dict[NodeType, int]] = None
+    ):
         self.db = db
+        self.max_parallel_nodes = max_parallel_nodes
+        self.node_type_limits = {**WORKFLOW_NODE_TYPE_LIMITS, **(node_type_limits or {})}
+        self.node_type_limits[NodeType.AGENT] = min(self.node_type_limits[NodeType.AGENT], 1)
     
     async def execute_workflow(
         self,
@@ -392,147 +413,175 @@ class DeterministicWorkflowExecutor:
         thread_id: str,
         project_id: str
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Execute the workflow graph following the visual flow with loop support."""
+        """
+        Execute the workflow graph following the visual flow with loop support.
+
+        Nodes are scheduled topologically: a node becomes ready once all of its
+        dependencies have completed, and ready nodes run concurrently up to the
+        workflow and per node type limits. Edges that close a detected loop are
+        not counted as dependencies; the loop body is re-run from its entry node
+        until its exit condition is met, and only then are the nodes after the
+        loop released.
+        """
         
         detected_loops = self._detect_loops(graph)
         context.active_loops.update(detected_loops)
         
+        back_edges = self._find_back_edges(graph, context.active_loops)
+        in_degree = self._compute_in_degree(graph, back_edges)
+        max_parallel = max(1, getattr(workflow, 'max_parallel_nodes', None) or self.max_parallel_nodes)
+        
         node_status = {node_id: NodeStatus.PENDING for node_id in graph.keys()}
-        execution_queue = list(entry_points)  # Start with entry points
         completed_nodes = set()
+        ready = [node_id for node_id in entry_points if in_degree[node_id] == 0]
+        ready += [node_id for node_id in graph if in_degree[node_id] == 0 and node_id not in entry_points]
+        running: Dict[asyncio.Task, str] = {}
+        running_by_type: Dict[NodeType, int] = defaultdict(int)
+        # Loops whose iteration has ended, waiting for their nodes to drain
+        pending_loop_actions: Dict[str, str] = {}
         
         yield {
             "type": "workflow_progress",
             "message": f"Starting execution with entry points: {entry_points}",
             "total_nodes": len(graph),
             "completed_nodes": 0,
-            "detected_loops": len(detected_loops)
+            "detected_loops": len(detected_loops),
+            "max_parallel_nodes": max_parallel
         }
         
-        while execution_queue and context.current_iteration < context.max_iterations:
-            context.current_iteration += 1
-            current_node_id = execution_queue.pop(0)
-            
-            current_loop = self._get_node_loop(current_node_id, context.active_loops)
-            
-            if current_loop:
-                loop_result = await self._handle_loop_execution(
-                    current_node_id, current_loop, graph, context, workflow, thread_id, project_id
-                )
-                
-                if loop_result['action'] == 'skip':
-                    continue
-                elif loop_result['action'] == 'exit_loop':
-                    self._exit_loop(current_loop, graph, execution_queue, completed_nodes)
-                    continue
-                elif loop_result['action'] == 'restart_loop':
-                    execution_queue.insert(0, current_loop.entry_node)
-                    continue
-            
-            if current_node_id in completed_nodes and not current_loop:
-                continue
-            
-            node_info = graph[current_node_id]
-
-            if not self._are_dependencies_satisfied(node_info['dependencies'], completed_nodes, current_loop):
-                execution_queue.append(current_node_id)
-                continue
-            
-            logger.info(f"Executing node {current_node_id} (type: {node_info['type'].value})")
-            node_status[current_node_id] = NodeStatus.RUNNING
-            
-            yield {
-                "type": "node_status",
-                "node_id": current_node_id,
-                "status": "running",
-                "message": f"Executing {node_info['type'].value} node",
-                "loop_info": {
-                    "in_loop": current_loop is not None,
-                    "loop_id": current_loop.loop_id if current_loop else None,
-                    "iteration": current_loop.current_iteration if current_loop else None
-                } if current_loop else None
-            }
-            
-            try:
-                node_result = await self._execute_node(
-                    current_node_id,
-                    node_info,
-                    context,
-                    workflow,
-                    thread_id,
-                    project_id
-                )
+        try:
+            while ready or running:
+                for current_node_id in list(ready):
+                    if len(running) >= max_parallel or context.current_iteration >= context.max_iterations:
+                        break
+                    node_info = graph[current_node_id]
+                    node_type = node_info['type']
+                    if running_by_type[node_type] >= self.node_type_limits.get(node_type, max_parallel):
+                        continue
+                    
+                    context.current_iteration += 1
+                    ready.remove(current_node_id)
+                    current_loop = self._get_node_loop(current_node_id, context.active_loops)
+                    
+                    logger.info(f"Executing node {current_node_id} (type: {node_type.value})")
+                    node_status[current_node_id] = NodeStatus.RUNNING
+                    running_by_type[node_type] += 1
+                    task = asyncio.create_task(self._execute_node(
+                        current_node_id,
+                        node_info,
+                        context,
+                        workflow,
+                        thread_id,
+                        project_id
+                    ))
+                    running[task] = current_node_id
+                    
+                    yield {
+                        "type": "node_status",
+                        "node_id": current_node_id,
+                        "status": "running",
+                        "message": f"Executing {node_type.value} node",
+                        "loop_info": {
+                            "in_loop": True,
+                            "loop_id": current_loop.loop_id,
+                            "iteration": current_loop.current_iteration
+                        } if current_loop else None
+                    }
                 
-                context.node_outputs[current_node_id] = node_result
-                if not current_loop:
-                    completed_nodes.add(current_node_id)
+                if not running:
+                    break
                 
-                node_status[current_node_id] = NodeStatus.COMPLETED
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
                 
-                yield {
-                    "type": "node_status",
-                    "node_id": current_node_id,
-                    "status": "completed",
-                    "output": node_result,
-                    "message": f"Completed {node_info['type'].value} node"
-                }
-                
-                for dependent_id in node_info['dependents']:
-                    if dependent_id not in execution_queue:
-                        if current_loop and dependent_id == current_loop.entry_node:
-                            current_loop.current_iteration += 1
-                            should_exit = await self._check_loop_exit_condition(
-                                current_loop, context, node_result
-                            )
-                            
-                            if should_exit:
-                                yield {
-                                    "type": "loop_status",
-                                    "loop_id": current_loop.loop_id,
-                                    "status": "exiting",
-                                    "iteration": current_loop.current_iteration,
-                                    "message": "Loop exit condition met"
-                                }
+                # Handle finished nodes in the order they were started
+                for task in [t for t in running if t in done]:
+                    current_node_id = running.pop(task)
+                    node_info = graph[current_node_id]
+                    running_by_type[node_info['type']] -= 1
+                    current_loop = self._get_node_loop(current_node_id, context.active_loops)
+                    
+                    try:
+                        node_result = task.result()
+                    except Exception as e:
+                        logger.error(f"Error executing node {current_node_id}: {e}")
+                        node_status[current_node_id] = NodeStatus.FAILED
+                        
+                        yield {
+                            "type": "node_status",
+                            "node_id": current_node_id,
+                            "status": "failed",
+                            "error": str(e),
+                            "message": f"Failed to execute {node_info['type'].value} node: {str(e)}"
+                        }
+                        
+                        yield {
+                            "type": "workflow_status",
+                            "status": "failed",
+                            "error": f"Node {current_node_id} failed: {str(e)}"
+                        }
+                        return
+                    
+                    context.node_outputs[current_node_id] = node_result
+                    if not current_loop:
+                        completed_nodes.add(current_node_id)
+                    
+                    node_status[current_node_id] = NodeStatus.COMPLETED
+                    
+                    yield {
+                        "type": "node_status",
+                        "node_id": current_node_id,
+                        "status": "completed",
+                        "output": node_result,
+                        "message": f"Completed {node_info['type'].value} node"
+                    }
+                    
+                    for dependent_id in node_info['dependents']:
+                        loop = back_edges.get((current_node_id, dependent_id))
+                        if loop:
+                            if loop.loop_id in pending_loop_actions:
                                 continue
-                            else:
-                                yield {
-                                    "type": "loop_status",
-                                    "loop_id": current_loop.loop_id,
-                                    "status": "continuing",
-                                    "iteration": current_loop.current_iteration,
-                                    "message": f"Loop iteration {current_loop.current_iteration}"
-                                }
-                                execution_queue.insert(0, dependent_id)
+                            loop.current_iteration += 1
+                            should_exit = await self._check_loop_exit_condition(loop, context, node_result)
+                            pending_loop_actions[loop.loop_id] = 'exit' if should_exit else 'restart'
+                            
+                            yield {
+                                "type": "loop_status",
+                                "loop_id": loop.loop_id,
+                                "status": "exiting" if should_exit else "continuing",
+                                "iteration": loop.current_iteration,
+                                "message": "Loop exit condition met" if should_exit else f"Loop iteration {loop.current_iteration}"
+                            }
+                        elif current_loop and dependent_id not in current_loop.loop_nodes:
+                            # Nodes after a loop are released once the loop exits
+                            continue
                         else:
-                            execution_queue.append(dependent_id)
-                
-                yield {
-                    "type": "workflow_progress",
-                    "message": f"Completed node {current_node_id}",
-                    "total_nodes": len(graph),
-                    "completed_nodes": len(completed_nodes)
-                }
-                
-            except Exception as e:
-                logger.error(f"Error executing node {current_node_id}: {e}")
-                node_status[current_node_id] = NodeStatus.FAILED
-                
-                yield {
-                    "type": "node_status",
-                    "node_id": current_node_id,
-                    "status": "failed",
-                    "error": str(e),
-                    "message": f"Failed to execute {node_info['type'].value} node: {str(e)}"
-                }
+                            self._release_dependent(dependent_id, in_degree, ready)
+                    
+                    yield {
+                        "type": "workflow_progress",
+                        "message": f"Completed node {current_node_id}",
+                        "total_nodes": len(graph),
+                        "completed_nodes": len(completed_nodes),
+                        "running_nodes": list(running.values())
+                    }
                 
-                yield {
-                    "type": "workflow_status",
-                    "status": "failed",
-                    "error": f"Node {current_node_id} failed: {str(e)}"
-                }
-                return
-        
-        if context.current_iteration >= context.max_iterations:
+                for loop_id, action in list(pending_loop_actions.items()):
+                    loop = context.active_loops[loop_id]
+                    if any(node_id in loop.loop_nodes for node_id in [*running.values(), *ready]):
+                        continue
+                    del pending_loop_actions[loop_id]
+                    if action == 'restart':
+                        self._restart_loop(loop, graph, back_edges, in_degree, node_status, ready)
+                    else:
+                        for dependent_id in self._exit_loop(loop, graph, completed_nodes):
+                            self._release_dependent(dependent_id, in_degree, ready)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        
+        if context.current_iteration >= context.max_iterations and len(completed_nodes) < len(graph):
             yield {
                 "type": "workflow_status",
                 "status": "failed",
@@ -552,6 +601,37 @@ class DeterministicWorkflowExecutor:
                 "message": f"Workflow completed with {len(completed_nodes)} nodes. Pending: {pending_nodes}"
             }
     
+    def _find_back_edges(
+        self,
+        graph: Dict[str, Dict[str, Any]],
+        active_loops: Dict[str, LoopState]
+    ) -> Dict[Tuple[str, str], LoopState]:
+        """Find the edges that jump back to the entry node of a loop, keyed by (source, target)."""
+        back_edges = {}
+        for loop in active_loops.values():
+            for node_id in loop.loop_nodes:
+                for edge in graph[node_id]['outgoing_edges']:
+                    if edge['target'] == loop.entry_node:
+                        back_edges[(node_id, loop.entry_node)] = loop
+        return back_edges
+
+    def _compute_in_degree(
+        self,
+        graph: Dict[str, Dict[str, Any]],
+        back_edges: Dict[Tuple[str, str], LoopState]
+    ) -> Dict[str, int]:
+        """Count the dependencies of each node, ignoring edges that close a loop."""
+        return {
+            node_id: sum(1 for dep in node_info['dependencies'] if (dep, node_id) not in back_edges)
+            for node_id, node_info in graph.items()
+        }
+
+    def _release_dependent(self, node_id: str, in_degree: Dict[str, int], ready: List[str]):
+        """Mark one dependency of a node as done and queue the node once it has none left."""
+        in_degree[node_id] -= 1
+        if in_degree[node_id] == 0:
+            ready.append(node_id)
+
     def _detect_loops(self, graph: Dict[str, Dict[str, Any]]) -> Dict[str, LoopState]:
         """Detect loops in the workflow graph."""
         loops = {}
@@ -601,27 +681,6 @@ class DeterministicWorkflowExecutor:
                 return loop
         return None
 
-    async def _handle_loop_execution(
-        self,
-        node_id: str,
-        loop_state: LoopState,
-        graph: Dict[str, Dict[str, Any]],
-        context: WorkflowContext,
-        workflow: WorkflowDefinition,
-        thread_id: str,
-        project_id: str
-    ) -> Dict[str, str]:
-        """Handle loop execution logic."""
-        
-        if loop_state.current_iteration >= loop_state.max_iterations:
-            logger.warning(f"Loop {loop_state.loop_id} exceeded max iterations")
-            return {'action': 'exit_loop'}
-        
-        if node_id == loop_state.entry_node and loop_state.current_iteration > 0:
-            return {'action': 'restart_loop'}
-        
-        return {'action': 'continue'}
-
     async def _check_loop_exit_condition(
         self,
         loop_state: LoopState,
@@ -640,44 +699,48 @@ class DeterministicWorkflowExecutor:
         
         return False
 
-    def _exit_loop(
+    def _restart_loop(
         self,
         loop_state: LoopState,
         graph: Dict[str, Dict[str, Any]],
-        execution_queue: List[str],
-        completed_nodes: Set[str]
+        back_edges: Dict[Tuple[str, str], LoopState],
+        in_degree: Dict[str, int],
+        node_status: Dict[str, NodeStatus],
+        ready: List[str]
     ):
-        """Exit a loop and add post-loop nodes to execution queue."""
+        """Reset the loop's nodes for another iteration and queue its entry node."""
         
-        loop_exit_nodes = set()
         for node_id in loop_state.loop_nodes:
-            node_info = graph[node_id]
-            for edge in node_info['outgoing_edges']:
-                target_id = edge['target']
-                if target_id not in loop_state.loop_nodes:
-                    loop_exit_nodes.add(target_id)
-        
-        for node_id in loop_exit_nodes:
-            if node_id not in execution_queue:
-                execution_queue.append(node_id)
+            # Dependencies outside the loop completed before the first iteration
+            in_degree[node_id] = sum(
+                1 for dep in graph[node_id]['dependencies']
+                if dep in loop_state.loop_nodes and (dep, node_id) not in back_edges
+            )
+            node_status[node_id] = NodeStatus.PENDING
         
-        completed_nodes.update(loop_state.loop_nodes)
+        ready.append(loop_state.entry_node)
+        ready.extend(
+            node_id for node_id in loop_state.loop_nodes
+            if in_degree[node_id] == 0 and node_id != loop_state.entry_node
+        )
 
-    def _are_dependencies_satisfied(
-        self, 
-        dependencies: Set[str], 
-        completed_nodes: Set[str], 
-        current_loop: Optional[LoopState] = None
-    ) -> bool:
-        """Check if all dependencies for a node are satisfied, considering loops."""
+    def _exit_loop(
+        self,
+        loop_state: LoopState,
+        graph: Dict[str, Dict[str, Any]],
+        completed_nodes: Set[str]
+    ) -> List[str]:
+        """Exit a loop and return the post-loop nodes it was holding back, once per loop dependency."""
         
-        if current_loop:
-            loop_dependencies = dependencies.intersection(current_loop.loop_nodes)
-            external_dependencies = dependencies - current_loop.loop_nodes
-            
-            return external_dependencies.issubset(completed_nodes)
+        loop_exit_nodes = []
+        for node_id in loop_state.loop_nodes:
+            node_info = graph[node_id]
+            for dependent_id in node_info['dependents']:
+                if dependent_id not in loop_state.loop_nodes:
+                    loop_exit_nodes.append(dependent_id)
         
-        return dependencies.issubset(completed_nodes)
+        completed_nodes.update(loop_state.loop_nodes)
+        return loop_exit_nodes
     
     async def _ensure_workflow_has_flow_data(self, workflow: WorkflowDefinition) -> WorkflowDefinition:
         """Ensure the workflow has nodes and edges data for deterministic execution."""
@@ -1177,18 +1240,19 @@ class DeterministicWorkflowExecutor:
         from agent.run import run_agent
         
         agent_output = []
+        agent_gen = run_agent(
+            thread_id=thread_id,
+            project_id=project_id,
+            stream=True,
+            model_name="anthropic/claude-sonnet-4-20250514",
+            enable_thinking=False,
+            reasoning_effort="low",
+            enable_context_manager=True,
+            agent_config=agent_config,
+            max_iterations=5
+        )
         try:
-            async for response in run_agent(
-                thread_id=thread_id,
-                project_id=project_id,
-                stream=True,
-                model_name="anthropic/claude-sonnet-4-20250514",
-                enable_thinking=False,
-                reasoning_effort="low",
-                enable_context_manager=True,
-                agent_config=agent_config,
-                max_iterations=5
-            ):
+            async for response in agent_gen:
                 if response.get('type') == 'assistant':
                     content = response.get('content', {})
                     if isinstance(content, str):
@@ -1202,6 +1266,9 @@ class DeterministicWorkflowExecutor:
         except Exception as e:
             logger.error(f"Error running agent in node {node_id}: {e}")
             raise
+        finally:
+            # Flushes the run's queued messages before the next node reads the thread
+            await agent_gen.aclose()
         
         return {
             'type': 'agent',
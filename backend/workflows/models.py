@@ -77,6 +77,7 @@ class WorkflowDefinition(BaseModel):
     is_template: bool = False
     max_execution_time: int = 3600
     max_retries: int = 3
+    max_parallel_nodes: Optional[int] = None
 
     nodes: Optional[List['WorkflowNode']] = None
     edges: Optional[List['WorkflowEdge']] = None
@@ -121,6 +122,7 @@ class WorkflowCreateRequest(BaseModel):
     is_template: bool = False
     max_execution_time: int = 3600
     max_retries: int = 3
+    max_parallel_nodes: Optional[int] = None
 
 class WorkflowUpdateRequest(BaseModel):
     name: Optional[str] = None
@@ -130,6 +132,7 @@ class WorkflowUpdateRequest(BaseModel):
     is_template: Optional[bool] = None
     max_execution_time: Optional[int] = None
     max_retries: Optional[int] = None
+    max_parallel_nodes: Optional[int] = None
 
 class WorkflowExecuteRequest(BaseModel):
     variables: Optional[Dict[str, Any]] = None